@@ -219,6 +219,35 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Longest a notifications/poll request may wait for new notifications, in seconds.
+# A waiting request holds its worker, so keep 0 (answer at once, clients re-poll)
+# under sync WSGI workers and raise it only behind async or gevent workers.
+NOTIFICATION_POLL_MAX_WAIT = int(os.environ.get('NOTIFICATION_POLL_MAX_WAIT', 0))
+
+# Tax reminders are delivered to the active user account(s) with this address
+ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL', '')
+
+# Cache
+# Buffered counters, unread notification counts, catalog/storefront validators and
+# rule generations are shared between web workers and cron commands through the
+# cache, so production needs Redis. Without REDIS_URL every process gets its own
+# in-memory cache, which only suits local development and tests (see erp/checks.py).
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -4,3 +4,18 @@ from django.apps import AppConfig
 class ErpConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'erp'
+
+    def ready(self):
+        from . import checks  # noqa: F401
+        # Register catalog, ledger summary, budget actuals, storefront, project rollup, promo, unread-count, workflow trigger, document access, vendor rollup and approval inbox receivers
+        from .services import scan_service  # noqa: F401
+        from .services import ledger_service  # noqa: F401
+        from .services import budget_service  # noqa: F401
+        from .services import storefront_service  # noqa: F401
+        from .services import project_service  # noqa: F401
+        from .services import promo_service  # noqa: F401
+        from .services import notification_service  # noqa: F401
+        from .services import workflow_service  # noqa: F401
+        from .services import document_service  # noqa: F401
+        from .services import procurement_service  # noqa: F401
+        from .services import approval_service  # noqa: F401
@@ -0,0 +1,35 @@
+"""
+System checks for settings the ERP services depend on
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+MESSAGE = 'The default cache is local to each process.'
+HINT = (
+    'Set REDIS_URL. Buffered counters, unread counts and cache invalidation '
+    'are only shared between workers and cron commands through a shared cache.'
+)
+
+
+def cache_is_shared():
+    """Whether the default cache is visible to every worker and cron process"""
+    return settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    if cache_is_shared():
+        return []
+    return [Warning(MESSAGE, hint=HINT, id='erp.W001')]
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache_deploy(app_configs, **kwargs):
+    # manage.py check --deploy: a process-local cache is not a valid production setup
+    if cache_is_shared():
+        return []
+    return [Error(MESSAGE, hint=HINT, id='erp.E001')]
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from erp.services.notification_service import NotificationDispatcher
+
+
+class Command(BaseCommand):
+    help = 'Send pending email, SMS and in-app notifications (run from cron every minute)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--channel',
+            action='append',
+            choices=['EMAIL', 'SMS', 'IN_APP'],
+            help='Only send this channel (repeatable)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Notifications read and written back per batch',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show how many notifications are pending without sending',
+        )
+
+    def handle(self, *args, **options):
+        dispatcher = NotificationDispatcher(batch_size=options['batch_size'])
+        if options['dry_run']:
+            for channel, total in sorted(dispatcher.pending_counts().items()):
+                self.stdout.write(f'{channel}: {total} pending')
+            self.stdout.write(self.style.SUCCESS('Dry run completed'))
+            return
+
+        summary = dispatcher.dispatch(channels=options['channel'])
+        self.stdout.write(
+            self.style.SUCCESS(f"Sent {summary['sent']} notification(s), {summary['failed']} failed")
+        )
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from erp.services.counter_service import counters, flush_all
+
+
+class Command(BaseCommand):
+    help = 'Write buffered view, order and review counters to the database (run from cron every minute)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--counter',
+            choices=sorted(counters),
+            help='Only flush this counter',
+        )
+
+    def handle(self, *args, **options):
+        if options['counter']:
+            results = {options['counter']: counters[options['counter']].flush()}
+        else:
+            results = flush_all()
+
+        for name, rows in results.items():
+            self.stdout.write(f'{name}: {rows} row(s) updated')
+        self.stdout.write(
+            self.style.SUCCESS(f'Flushed {sum(results.values())} counter row(s)')
+        )
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from erp.models import Business
+from erp.services.fulfilment_service import OnlineOrderFulfilment
+
+
+class Command(BaseCommand):
+    help = 'Create sales orders, delivery notes and stock movements for paid online orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--business-id',
+            type=int,
+            help='Only fulfil orders of this business',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Orders converted per transaction',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count the orders waiting for fulfilment without writing anything',
+        )
+
+    def handle(self, *args, **options):
+        businesses = Business.objects.all()
+        if options['business_id']:
+            businesses = businesses.filter(id=options['business_id'])
+
+        total = 0
+        for business in businesses:
+            user = business.users.filter(role='employer').order_by('id').first()
+            if user is None:
+                self.stdout.write(
+                    self.style.WARNING(f'Skipping {business.name}: no employer user to create documents as')
+                )
+                continue
+            fulfilment = OnlineOrderFulfilment(business, user, batch_size=options['batch_size'])
+            summary = fulfilment.run(dry_run=options['dry_run'])
+            if summary['dry_run']:
+                self.stdout.write(f"{business.name}: {summary['orders_pending']} order(s) waiting (dry run)")
+                continue
+            total += summary['orders_fulfilled']
+            self.stdout.write(
+                f"{business.name}: {summary['orders_fulfilled']} order(s) fulfilled, "
+                f"{summary['orders_short']} short of stock"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Fulfilled {total} online order(s)'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from erp.services.approval_service import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Fill the approval inbox from pending vendor bills, budgets, leave, requisitions and workflow steps'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--business-id',
+            type=int,
+            help='Only rebuild the inbox for this business',
+        )
+
+    def handle(self, *args, **options):
+        # items already in the inbox are skipped, so this is safe to re-run
+        with transaction.atomic():
+            added = rebuild(options['business_id'])
+
+        for source_type, rows in added.items():
+            self.stdout.write(f'{source_type}: {rows} row(s) added')
+        self.stdout.write(
+            self.style.SUCCESS(f'Added {sum(added.values())} approval inbox row(s)')
+        )
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from erp.services.document_service import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-user document access list from allowed users, departments and creators'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--business-id',
+            type=int,
+            help='Only rebuild the access list for this business',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rows = rebuild(options['business_id'])
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote {rows} document access row(s)'))
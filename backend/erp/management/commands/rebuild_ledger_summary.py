@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from erp.models import JournalEntryLine, LedgerPeriodSummary
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the monthly account x cost center ledger summary from posted journal lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show how many summary rows would be written without writing them',
+        )
+        parser.add_argument(
+            '--business-id',
+            type=int,
+            help='Only rebuild the summary for this business',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        business_id = options['business_id']
+
+        lines = JournalEntryLine.objects.filter(journal_entry__status='POSTED')
+        summaries = LedgerPeriodSummary.objects.all()
+        if business_id:
+            lines = lines.filter(journal_entry__store__business_id=business_id)
+            summaries = summaries.filter(business_id=business_id)
+
+        rows = list(lines.annotate(period=TruncMonth('journal_entry__date')).values(
+            'journal_entry__store__business_id', 'period', 'account_id', 'cost_center_id',
+        ).annotate(
+            debit_total=Sum('debit'), credit_total=Sum('credit'), lines=Count('id'),
+        ).order_by())
+
+        if dry_run:
+            self.stdout.write(f'Would write {len(rows)} ledger summary row(s)')
+            return
+
+        with transaction.atomic():
+            summaries.delete()
+            LedgerPeriodSummary.objects.bulk_create([
+                LedgerPeriodSummary(
+                    business_id=row['journal_entry__store__business_id'],
+                    period=row['period'],
+                    account_id=row['account_id'],
+                    cost_center_id=row['cost_center_id'],
+                    debit=row['debit_total'] or 0,
+                    credit=row['credit_total'] or 0,
+                    line_count=row['lines'],
+                )
+                for row in rows
+            ], batch_size=1000)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt {len(rows)} ledger summary row(s)')
+        )
@@ -0,0 +1,78 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum, Q, F, DecimalField, ExpressionWrapper
+from django.db.models.functions import TruncWeek
+from erp.models import ProjectTimesheet, ProjectExpense, ProjectCostRollup
+
+
+class Command(BaseCommand):
+    help = 'Recompute timesheet billable amounts and rebuild weekly project cost rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show how many rollup rows would be written without writing them',
+        )
+        parser.add_argument(
+            '--business-id',
+            type=int,
+            help='Only rebuild rollups for projects of this business',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        business_id = options['business_id']
+
+        timesheets = ProjectTimesheet.objects.all()
+        expenses = ProjectExpense.objects.all()
+        rollups = ProjectCostRollup.objects.all()
+        if business_id:
+            timesheets = timesheets.filter(project__business_id=business_id)
+            expenses = expenses.filter(project__business_id=business_id)
+            rollups = rollups.filter(project__business_id=business_id)
+
+        rows = defaultdict(dict)
+        for row in timesheets.annotate(week=TruncWeek('date')).values('project_id', 'week').annotate(
+            timesheet_count=Count('id'),
+            hours=Sum('hours_worked'),
+            billable_hours=Sum('hours_worked', filter=Q(is_billable=True)),
+        ):
+            rows[(row['project_id'], row['week'])].update(
+                timesheet_count=row['timesheet_count'],
+                hours=row['hours'] or Decimal('0'),
+                billable_hours=row['billable_hours'] or Decimal('0'),
+            )
+        for row in expenses.annotate(week=TruncWeek('expense_date')).values('project_id', 'week').annotate(
+            expense_count=Count('id'), total=Sum('amount'),
+        ):
+            rows[(row['project_id'], row['week'])].update(
+                expense_count=row['expense_count'], expenses=row['total'] or Decimal('0'),
+            )
+
+        if dry_run:
+            self.stdout.write(f'Would write {len(rows)} project rollup row(s)')
+            return
+
+        with transaction.atomic():
+            billable = Q(is_billable=True, hourly_rate__isnull=False)
+            timesheets.filter(billable).update(billable_amount=ExpressionWrapper(
+                F('hours_worked') * F('hourly_rate'), output_field=DecimalField(max_digits=12, decimal_places=2)
+            ))
+            timesheets.exclude(billable).update(billable_amount=0)
+            for row in timesheets.annotate(week=TruncWeek('date')).values('project_id', 'week').annotate(
+                total=Sum('billable_amount'),
+            ):
+                rows[(row['project_id'], row['week'])]['billable_amount'] = row['total'] or Decimal('0')
+
+            rollups.delete()
+            ProjectCostRollup.objects.bulk_create([
+                ProjectCostRollup(project_id=project_id, week_start=week_start, **totals)
+                for (project_id, week_start), totals in rows.items()
+            ], batch_size=500)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt {len(rows)} project rollup row(s)')
+        )
@@ -0,0 +1,89 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum, F
+from django.db.models.functions import TruncMonth
+from erp.models_extended import (
+    PurchaseOrder, GoodsReceivedNote, VendorBill, PurchaseOrderPayment, VendorSpendRollup,
+)
+
+
+class Command(BaseCommand):
+    help = 'Rebuild vendor monthly spend rollups from purchase orders, GRNs, bills and payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show how many rollup rows would be written without writing them',
+        )
+        parser.add_argument(
+            '--business-id',
+            type=int,
+            help='Only rebuild rollups for this business',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        business_id = options['business_id']
+
+        def scoped(queryset, business_field='business_id'):
+            if business_id:
+                return queryset.filter(**{business_field: business_id})
+            return queryset
+
+        rows = defaultdict(dict)
+
+        def collect(queryset, vendor_field, month_field, business_field='business_id', **aggregates):
+            values = queryset.annotate(month=TruncMonth(month_field)).values(
+                'month', rollup_vendor=F(vendor_field), rollup_business=F(business_field)
+            ).annotate(**aggregates)
+            for row in values:
+                month = VendorSpendRollup.month_start(row['month'])
+                totals = rows[(row['rollup_vendor'], row['rollup_business'], month)]
+                for field in aggregates:
+                    totals[field] = totals.get(field, 0) + (row[field] or 0)
+
+        collect(
+            scoped(PurchaseOrder.objects.exclude(status='CANCELLED')),
+            'vendor_id', 'order_date',
+            po_count=Count('id'), ordered_amount=Sum('total_amount'),
+        )
+        collect(
+            scoped(GoodsReceivedNote.objects.exclude(status='REJECTED')),
+            'purchase_order__vendor_id', 'receipt_date',
+            grn_count=Count('id'), received_amount=Sum('total_amount'),
+        )
+        collect(
+            scoped(VendorBill.objects.exclude(status__in=['CANCELLED', 'REJECTED'])),
+            'vendor_id', 'bill_date',
+            billed_amount=Sum('total_amount'),
+        )
+        collect(
+            scoped(PurchaseOrderPayment.objects.all(), 'grn__business_id'),
+            'grn__purchase_order__vendor_id', 'payment_date', 'grn__business_id',
+            paid_amount=Sum('amount'),
+        )
+
+        lead_times = scoped(GoodsReceivedNote.objects.exclude(status='REJECTED')).values_list(
+            'purchase_order__vendor_id', 'business_id', 'receipt_date', 'purchase_order__order_date'
+        )
+        for vendor_id, owner_id, receipt_date, order_date in lead_times:
+            totals = rows[(vendor_id, owner_id, VendorSpendRollup.month_start(receipt_date))]
+            totals['lead_time_days_total'] = totals.get('lead_time_days_total', 0) + (receipt_date - order_date).days
+            totals['lead_time_samples'] = totals.get('lead_time_samples', 0) + 1
+
+        if dry_run:
+            self.stdout.write(f'Would write {len(rows)} vendor rollup row(s)')
+            return
+
+        with transaction.atomic():
+            scoped(VendorSpendRollup.objects.all()).delete()
+            VendorSpendRollup.objects.bulk_create([
+                VendorSpendRollup(vendor_id=vendor_id, business_id=owner_id, period=period, **totals)
+                for (vendor_id, owner_id, period), totals in rows.items()
+            ], batch_size=500)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt {len(rows)} vendor rollup row(s)')
+        )
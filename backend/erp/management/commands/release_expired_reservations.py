@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from erp.models_ecommerce import StockReservation
+from erp.services.reservation_service import ReservationService
+
+
+class Command(BaseCommand):
+    help = 'Release cart stock holds whose TTL has expired (run from cron every minute)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show how many holds would be released without releasing them',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of holds released per UPDATE',
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        if options['dry_run']:
+            expired = StockReservation.objects.filter(status='HELD', expires_at__lt=now).count()
+            self.stdout.write(f'Would release {expired} expired hold(s)')
+            return
+
+        released = ReservationService().sweep_expired(now=now, batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Released {released} expired hold(s)')
+        )
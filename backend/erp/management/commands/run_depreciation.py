@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from erp.models import Business
+from erp.services.asset_service import DepreciationRun
+
+
+class Command(BaseCommand):
+    help = 'Run monthly fixed asset depreciation for one or all businesses'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--period',
+            help='Month to depreciate as YYYY-MM (defaults to the current month)',
+        )
+        parser.add_argument(
+            '--business-id',
+            type=int,
+            help='Only run depreciation for this business',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show the charges without writing anything',
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        try:
+            year, month = map(int, (options['period'] or f'{today:%Y-%m}').split('-'))
+        except ValueError:
+            raise CommandError('Period must be in YYYY-MM format')
+
+        businesses = Business.objects.all()
+        if options['business_id']:
+            businesses = businesses.filter(id=options['business_id'])
+
+        for business in businesses:
+            user = business.users.filter(role='employer').order_by('id').first()
+            if user is None:
+                self.stdout.write(
+                    self.style.WARNING(f'Skipping {business.name}: no employer user to post journals as')
+                )
+                continue
+            summary = DepreciationRun(business, user, year, month).run(dry_run=options['dry_run'])
+            self.stdout.write(
+                f"{business.name}: {summary['assets_depreciated']} asset(s), "
+                f"{summary['total_depreciation']} depreciation"
+                f"{' (dry run)' if summary['dry_run'] else ''}"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Depreciation run for {year}-{month:02d} complete'))
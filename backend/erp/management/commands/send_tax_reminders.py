@@ -1,9 +1,18 @@
+from django.conf import settings
+from django.core.mail import send_mail
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils import timezone
-from erp.models import TaxReminder
+from erp.models import TaxReminder, User
+from erp.models_ecommerce import Notification
+from erp.services.notification_service import NotificationDispatcher, queue_message
 from datetime import date
 
 
+# reminder types map onto notification channels
+CHANNELS = {'EMAIL': 'EMAIL', 'SMS': 'SMS', 'SYSTEM': 'IN_APP'}
+
+
 class Command(BaseCommand):
     help = 'Send tax payment reminders'
 
@@ -17,68 +26,100 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         today = date.today()
         dry_run = options['dry_run']
-        
+
         # Get pending reminders for today
-        pending_reminders = TaxReminder.objects.filter(
+        pending_reminders = list(TaxReminder.objects.filter(
             reminder_date=today,
             sent=False
-        ).select_related('tax')
-        
+        ).select_related('tax'))
+
         if not pending_reminders:
             self.stdout.write(
                 self.style.SUCCESS('No tax reminders to send today')
             )
             return
-        
+
         self.stdout.write(
-            f"Found {pending_reminders.count()} reminder(s) to send"
+            f"Found {len(pending_reminders)} reminder(s) to send"
         )
-        
-        sent_count = 0
-        failed_count = 0
-        
-        for reminder in pending_reminders:
-            try:
-                if dry_run:
-                    self.stdout.write(
-                        f"Would send {reminder.reminder_type} reminder for "
-                        f"{reminder.tax.get_type_display()} tax"
-                    )
-                else:
-                    success = reminder.send_reminder()
-                    if success:
-                        sent_count += 1
-                        self.stdout.write(
-                            self.style.SUCCESS(
-                                f"Sent {reminder.reminder_type} reminder for "
-                                f"{reminder.tax.get_type_display()} tax"
-                            )
-                        )
-                    else:
-                        failed_count += 1
-                        self.stdout.write(
-                            self.style.ERROR(
-                                f"Failed to send {reminder.reminder_type} reminder for "
-                                f"{reminder.tax.get_type_display()} tax"
-                            )
-                        )
-            except Exception as e:
-                failed_count += 1
+
+        if dry_run:
+            for reminder in pending_reminders:
                 self.stdout.write(
-                    self.style.ERROR(
-                        f"Error sending reminder {reminder.id}: {str(e)}"
-                    )
+                    f"Would send {reminder.reminder_type} reminder for "
+                    f"{reminder.tax.get_type_display()} tax"
                 )
-        
-        if not dry_run:
             self.stdout.write(
                 self.style.SUCCESS(
-                    f"Reminder sending completed. Sent: {sent_count}, Failed: {failed_count}"
+                    f"Dry run completed. Would send: {len(pending_reminders)} reminders"
                 )
             )
-        else:
+            return
+
+        admin_email = getattr(settings, 'ADMIN_EMAIL', '')
+        if not admin_email:
             self.stdout.write(
-                self.style.SUCCESS(
-                    f"Dry run completed. Would send: {pending_reminders.count()} reminders"
+                self.style.ERROR('ADMIN_EMAIL is not set; reminders are left unsent')
+            )
+            return
+
+        # with an active account on ADMIN_EMAIL the dispatcher delivers on the
+        # reminder's channel; otherwise mail the address directly as before
+        admins = list(User.objects.filter(
+            email__iexact=admin_email, is_active=True
+        ).values_list('id', flat=True))
+        if admins:
+            sent = self.dispatch(pending_reminders, admins)
+        else:
+            sent = self.mail(pending_reminders, admin_email)
+        TaxReminder.objects.filter(id__in=[r.id for r in sent]).update(
+            sent=True, sent_at=timezone.now()
+        )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Reminder sending completed. Sent: {len(sent)}, "
+                f"Failed: {len(pending_reminders) - len(sent)}"
+            )
+        )
+
+    def dispatch(self, reminders, admins):
+        """Queue each reminder for the admin accounts and send only those; returns the delivered ones"""
+        queued = {}
+        with transaction.atomic():
+            for reminder in reminders:
+                queued[reminder] = [n.id for n in queue_message(
+                    admins, CHANNELS[reminder.reminder_type],
+                    self.subject(reminder), reminder.message,
+                )]
+        ids = [i for notification_ids in queued.values() for i in notification_ids]
+        NotificationDispatcher().dispatch(
+            channels={CHANNELS[r.reminder_type] for r in reminders}, ids=ids
+        )
+        delivered = set(Notification.objects.filter(
+            id__in=ids, status='SENT'
+        ).values_list('id', flat=True))
+        return [r for r, notification_ids in queued.items() if delivered.issuperset(notification_ids)]
+
+    def mail(self, reminders, admin_email):
+        """Mail each reminder to the ADMIN_EMAIL address; returns the delivered ones"""
+        sent = []
+        for reminder in reminders:
+            try:
+                send_mail(
+                    subject=self.subject(reminder),
+                    message=reminder.message,
+                    from_email=settings.DEFAULT_FROM_EMAIL,
+                    recipient_list=[admin_email],
                 )
-            ) 
\ No newline at end of file
+            except Exception as e:
+                self.stdout.write(
+                    self.style.ERROR(f"Failed to send reminder {reminder.id}: {str(e)}")
+                )
+                continue
+            sent.append(reminder)
+        return sent
+
+    @staticmethod
+    def subject(reminder):
+        return f"Tax Payment Reminder - {reminder.tax.get_type_display()}"
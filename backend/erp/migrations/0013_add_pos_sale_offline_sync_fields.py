@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-18 23:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("erp", "0012_add_vendor_bill_approval_workflow"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="possale",
+            name="captured_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="When the sale was rung up on the till (offline sales)",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="possale",
+            name="idempotency_key",
+            field=models.CharField(
+                blank=True,
+                help_text="Client-generated key used to dedupe offline sale uploads",
+                max_length=64,
+                null=True,
+                unique=True,
+            ),
+        ),
+    ]
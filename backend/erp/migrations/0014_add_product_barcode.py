@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-18 23:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("erp", "0013_add_pos_sale_offline_sync_fields"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="barcode",
+            field=models.CharField(
+                blank=True,
+                help_text="EAN/UPC or in-store barcode printed on the item",
+                max_length=100,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["barcode"], name="erp_product_barcode_51e0df_idx"
+            ),
+        ),
+    ]
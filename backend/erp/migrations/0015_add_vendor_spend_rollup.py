@@ -0,0 +1,86 @@
+# Generated by Django 5.2.4 on 2026-10-18 23:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("erp", "0014_add_product_barcode"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VendorSpendRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("period", models.DateField(help_text="First day of the month")),
+                ("po_count", models.PositiveIntegerField(default=0)),
+                (
+                    "ordered_amount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=15),
+                ),
+                ("grn_count", models.PositiveIntegerField(default=0)),
+                (
+                    "received_amount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=15),
+                ),
+                (
+                    "billed_amount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=15),
+                ),
+                (
+                    "paid_amount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=15),
+                ),
+                (
+                    "lead_time_days_total",
+                    models.IntegerField(
+                        default=0,
+                        help_text="Sum of order-to-receipt days for GRNs received this month",
+                    ),
+                ),
+                ("lead_time_samples", models.PositiveIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "business",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="vendor_spend_rollups",
+                        to="erp.business",
+                    ),
+                ),
+                (
+                    "vendor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="spend_rollups",
+                        to="erp.vendor",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["vendor", "period"],
+                "indexes": [
+                    models.Index(
+                        fields=["business", "period"],
+                        name="erp_vendors_busines_dbeeff_idx",
+                    ),
+                    models.Index(
+                        fields=["vendor", "period"],
+                        name="erp_vendors_vendor__45d76e_idx",
+                    ),
+                ],
+                "unique_together": {("vendor", "period")},
+            },
+        ),
+    ]
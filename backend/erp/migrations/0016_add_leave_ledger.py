@@ -0,0 +1,108 @@
+# Generated by Django 5.2.4 on 2026-10-18 23:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("erp", "0015_add_vendor_spend_rollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LeaveLedgerEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("year", models.IntegerField()),
+                (
+                    "entry_type",
+                    models.CharField(
+                        choices=[
+                            ("ALLOCATION", "Annual Allocation"),
+                            ("CARRY_FORWARD", "Carried Forward"),
+                            ("USAGE", "Leave Taken"),
+                            ("REVERSAL", "Leave Reversed"),
+                            ("ADJUSTMENT", "Adjustment"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "days",
+                    models.DecimalField(
+                        decimal_places=1,
+                        help_text="Positive credits, negative debits the balance",
+                        max_digits=6,
+                    ),
+                ),
+                ("notes", models.CharField(blank=True, max_length=255)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "allocation",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ledger_entries",
+                        to="erp.leaveallocation",
+                    ),
+                ),
+                (
+                    "application",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="ledger_entries",
+                        to="erp.leaveapplication",
+                    ),
+                ),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="created_leave_ledger_entries",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "employee",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="leave_ledger_entries",
+                        to="erp.employee",
+                    ),
+                ),
+                (
+                    "leave_type",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ledger_entries",
+                        to="erp.leavetype",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["created_at", "id"],
+                "indexes": [
+                    models.Index(
+                        fields=["employee", "year"],
+                        name="erp_leavele_employe_23ad58_idx",
+                    ),
+                    models.Index(
+                        fields=["leave_type", "year"],
+                        name="erp_leavele_leave_t_bd0aff_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,113 @@
+# Generated by Django 5.2.4 on 2026-10-18 23:53
+
+import django.db.models.deletion
+from collections import defaultdict
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncWeek
+
+
+def backfill_project_rollups(apps, schema_editor):
+    """Billable amounts and weekly rollups for timesheets and expenses written before this migration"""
+    ProjectTimesheet = apps.get_model("erp", "ProjectTimesheet")
+    ProjectExpense = apps.get_model("erp", "ProjectExpense")
+    ProjectCostRollup = apps.get_model("erp", "ProjectCostRollup")
+
+    billable = Q(is_billable=True, hourly_rate__isnull=False)
+    ProjectTimesheet.objects.filter(billable).update(billable_amount=ExpressionWrapper(
+        F("hours_worked") * F("hourly_rate"), output_field=DecimalField(max_digits=12, decimal_places=2)
+    ))
+
+    rows = defaultdict(dict)
+    for row in ProjectTimesheet.objects.annotate(week=TruncWeek("date")).values("project_id", "week").annotate(
+        timesheet_count=Count("id"),
+        hours=Sum("hours_worked"),
+        billable_hours=Sum("hours_worked", filter=Q(is_billable=True)),
+        billable_amount=Sum("billable_amount"),
+    ):
+        rows[(row["project_id"], row["week"])].update(
+            timesheet_count=row["timesheet_count"],
+            hours=row["hours"] or Decimal("0"),
+            billable_hours=row["billable_hours"] or Decimal("0"),
+            billable_amount=row["billable_amount"] or Decimal("0"),
+        )
+    for row in ProjectExpense.objects.annotate(week=TruncWeek("expense_date")).values("project_id", "week").annotate(
+        expense_count=Count("id"), total=Sum("amount"),
+    ):
+        rows[(row["project_id"], row["week"])].update(
+            expense_count=row["expense_count"], expenses=row["total"] or Decimal("0"),
+        )
+    ProjectCostRollup.objects.bulk_create([
+        ProjectCostRollup(project_id=project_id, week_start=week_start, **totals)
+        for (project_id, week_start), totals in rows.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("erp", "0016_add_leave_ledger"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="projecttimesheet",
+            name="billable_amount",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=12
+            ),
+        ),
+        migrations.CreateModel(
+            name="ProjectCostRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("week_start", models.DateField(help_text="Monday of the week")),
+                ("timesheet_count", models.IntegerField(default=0)),
+                (
+                    "hours",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                (
+                    "billable_hours",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                (
+                    "billable_amount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=15),
+                ),
+                ("expense_count", models.IntegerField(default=0)),
+                (
+                    "expenses",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=15),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "project",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="cost_rollups",
+                        to="erp.project",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["project", "week_start"],
+                "indexes": [
+                    models.Index(
+                        fields=["week_start"], name="erp_project_week_st_16ada2_idx"
+                    )
+                ],
+                "unique_together": {("project", "week_start")},
+            },
+        ),
+        migrations.RunPython(backfill_project_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,171 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("erp", "0017_add_project_cost_rollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LedgerPeriodSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("period", models.DateField(help_text="First day of the month")),
+                (
+                    "debit",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=15),
+                ),
+                (
+                    "credit",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=15),
+                ),
+                ("line_count", models.IntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "ordering": ["period", "account"],
+            },
+        ),
+        migrations.AddField(
+            model_name="generalledger",
+            name="cost_center",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="ledger_entries",
+                to="erp.costcenter",
+            ),
+        ),
+        migrations.AddField(
+            model_name="generalledger",
+            name="project",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="ledger_entries",
+                to="erp.project",
+            ),
+        ),
+        migrations.AddField(
+            model_name="journalentryline",
+            name="cost_center",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="journal_lines",
+                to="erp.costcenter",
+            ),
+        ),
+        migrations.AddField(
+            model_name="journalentryline",
+            name="project",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="journal_lines",
+                to="erp.project",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="generalledger",
+            index=models.Index(
+                fields=["date", "account", "cost_center"],
+                name="erp_general_date_75b5b1_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="generalledger",
+            index=models.Index(
+                fields=["cost_center", "date"], name="erp_general_cost_ce_b2fa22_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="generalledger",
+            index=models.Index(
+                fields=["project", "date"], name="erp_general_project_c203a1_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="journalentryline",
+            index=models.Index(
+                fields=["account", "cost_center"], name="erp_journal_account_c6e1d6_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="journalentryline",
+            index=models.Index(
+                fields=["cost_center", "account"], name="erp_journal_cost_ce_f11e77_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="journalentryline",
+            index=models.Index(
+                fields=["project", "account"], name="erp_journal_project_d598c4_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="ledgerperiodsummary",
+            name="account",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="period_summaries",
+                to="erp.chartofaccounts",
+            ),
+        ),
+        migrations.AddField(
+            model_name="ledgerperiodsummary",
+            name="business",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="ledger_summaries",
+                to="erp.business",
+            ),
+        ),
+        migrations.AddField(
+            model_name="ledgerperiodsummary",
+            name="cost_center",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="period_summaries",
+                to="erp.costcenter",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="ledgerperiodsummary",
+            index=models.Index(
+                fields=["business", "period"], name="erp_ledgerp_busines_ce13b7_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="ledgerperiodsummary",
+            index=models.Index(
+                fields=["period", "account", "cost_center"],
+                name="erp_ledgerp_period_de126d_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="ledgerperiodsummary",
+            index=models.Index(
+                fields=["cost_center", "period"], name="erp_ledgerp_cost_ce_8d2dc6_idx"
+            ),
+        ),
+    ]
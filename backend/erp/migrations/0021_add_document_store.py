@@ -0,0 +1,184 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:35
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_document_access(apps, schema_editor):
+    """Access lists for documents written before this migration: creator, allowed users and department members"""
+    Document = apps.get_model("erp", "Document")
+    DocumentAccess = apps.get_model("erp", "DocumentAccess")
+    Employee = apps.get_model("erp", "Employee")
+
+    members = {}
+    for department_id, user_id in Employee.objects.filter(
+        department__isnull=False, is_active=True
+    ).values_list("department_id", "user_id"):
+        members.setdefault(department_id, set()).add(user_id)
+    grants = {
+        document_id: {created_by_id}
+        for document_id, created_by_id in Document.objects.values_list("id", "created_by_id")
+    }
+    for document_id, user_id in Document.allowed_users.through.objects.values_list("document_id", "user_id"):
+        grants[document_id].add(user_id)
+    for document_id, department_id in Document.allowed_departments.through.objects.values_list(
+        "document_id", "department_id"
+    ):
+        grants[document_id] |= members.get(department_id, set())
+    DocumentAccess.objects.bulk_create([
+        DocumentAccess(document_id=document_id, user_id=user_id)
+        for document_id, users in grants.items() for user_id in users
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("erp", "0020_add_approval_request"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DocumentBlob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sha256", models.CharField(max_length=64, unique=True)),
+                ("file", models.FileField(upload_to="documents/blobs/")),
+                ("size", models.BigIntegerField()),
+                ("content_type", models.CharField(blank=True, max_length=100)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="document",
+            name="file_size",
+            field=models.BigIntegerField(),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="blob",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="documents",
+                to="erp.documentblob",
+            ),
+        ),
+        migrations.CreateModel(
+            name="DocumentAccess",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "document",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="access_entries",
+                        to="erp.document",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="document_access",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("user", "document")},
+            },
+        ),
+        migrations.CreateModel(
+            name="DocumentUpload",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "upload_id",
+                    models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+                ),
+                ("filename", models.CharField(max_length=255)),
+                ("content_type", models.CharField(blank=True, max_length=100)),
+                ("total_size", models.BigIntegerField()),
+                ("received_size", models.BigIntegerField(default=0)),
+                ("sha256", models.CharField(blank=True, max_length=64)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("UPLOADING", "Uploading"),
+                            ("COMPLETED", "Completed"),
+                            ("ABORTED", "Aborted"),
+                        ],
+                        default="UPLOADING",
+                        max_length=20,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "blob",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="uploads",
+                        to="erp.documentblob",
+                    ),
+                ),
+                (
+                    "business",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="document_uploads",
+                        to="erp.business",
+                    ),
+                ),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="document_uploads",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["status", "updated_at"],
+                        name="erp_documen_status_0adc84_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_document_access, migrations.RunPython.noop),
+    ]
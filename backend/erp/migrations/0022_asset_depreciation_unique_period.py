@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-19 01:08
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("erp", "0021_add_document_store"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="assetdepreciation",
+            name="erp_assetde_asset_i_7203e5_idx",
+        ),
+        migrations.AlterUniqueTogether(
+            name="assetdepreciation",
+            unique_together={("asset", "period_start_date")},
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-19 01:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("erp", "0022_asset_depreciation_unique_period"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="ledgerperiodsummary",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("cost_center__isnull", False)),
+                fields=("business", "period", "account", "cost_center"),
+                name="unique_ledger_summary_cost_center",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="ledgerperiodsummary",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("cost_center__isnull", True)),
+                fields=("business", "period", "account"),
+                name="unique_ledger_summary_unassigned",
+            ),
+        ),
+    ]
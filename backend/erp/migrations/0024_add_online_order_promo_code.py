@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-19 01:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("erp", "0023_ledger_summary_unique_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="onlineorder",
+            name="promo_code",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Redeemed code; its use is given back if the order is cancelled",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="orders",
+                to="erp.promocode",
+            ),
+        ),
+    ]
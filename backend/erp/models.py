@@ -165,6 +165,8 @@ class JournalEntryLine(models.Model):
     description = models.TextField()
     debit = models.DecimalField(max_digits=15, decimal_places=2, default=0)
     credit = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    cost_center = models.ForeignKey('erp.CostCenter', on_delete=models.SET_NULL, null=True, blank=True, related_name='journal_lines')
+    project = models.ForeignKey('Project', on_delete=models.SET_NULL, null=True, blank=True, related_name='journal_lines')
     created_by = models.ForeignKey(User, on_delete=models.PROTECT, default=1)
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -173,6 +175,9 @@ class JournalEntryLine(models.Model):
         indexes = [
             models.Index(fields=['journal_entry']),
             models.Index(fields=['account']),
+            models.Index(fields=['account', 'cost_center']),
+            models.Index(fields=['cost_center', 'account']),
+            models.Index(fields=['project', 'account']),
         ]
     
     def clean(self):
@@ -196,6 +201,8 @@ class GeneralLedger(models.Model):
     reference = models.CharField(max_length=100)
     description = models.TextField()
     running_balance = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    cost_center = models.ForeignKey('erp.CostCenter', on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    project = models.ForeignKey('Project', on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
     created_by = models.ForeignKey(User, on_delete=models.PROTECT, default=1)
     created_at = models.DateTimeField(default=timezone.now)
     
@@ -206,6 +213,9 @@ class GeneralLedger(models.Model):
             models.Index(fields=['account']),
             models.Index(fields=['date', 'account']),
             models.Index(fields=['journal_entry']),
+            models.Index(fields=['date', 'account', 'cost_center']),
+            models.Index(fields=['cost_center', 'date']),
+            models.Index(fields=['project', 'date']),
         ]
     
     def clean(self):
@@ -237,6 +247,73 @@ class GeneralLedger(models.Model):
     def __str__(self):
         return f"{self.date} - {self.account.code}"
 
+class LedgerPeriodSummary(models.Model):
+    """Posted debits and credits per month, account and cost center, maintained on posting and journal edits"""
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='ledger_summaries')
+    period = models.DateField(help_text='First day of the month')
+    account = models.ForeignKey(ChartOfAccounts, on_delete=models.CASCADE, related_name='period_summaries')
+    cost_center = models.ForeignKey('erp.CostCenter', on_delete=models.CASCADE, null=True, blank=True, related_name='period_summaries')
+    debit = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    credit = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    line_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['period', 'account']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['business', 'period', 'account', 'cost_center'],
+                condition=models.Q(cost_center__isnull=False),
+                name='unique_ledger_summary_cost_center',
+            ),
+            models.UniqueConstraint(
+                fields=['business', 'period', 'account'],
+                condition=models.Q(cost_center__isnull=True),
+                name='unique_ledger_summary_unassigned',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['business', 'period']),
+            models.Index(fields=['period', 'account', 'cost_center']),
+            models.Index(fields=['cost_center', 'period']),
+        ]
+    
+    @staticmethod
+    def period_of(value):
+        if isinstance(value, str):
+            value = timezone.datetime.strptime(value[:10], '%Y-%m-%d').date()
+        return value.replace(day=1)
+    
+    @classmethod
+    def apply(cls, business_id, entries, sign=1):
+        """
+        Add [(date, account_id, cost_center_id, debit, credit)] to the monthly
+        rows, one UPDATE per key; sign=-1 takes the lines back out.
+        """
+        grouped = {}
+        for on_date, account_id, cost_center_id, debit, credit in entries:
+            totals = grouped.setdefault((cls.period_of(on_date), account_id, cost_center_id), [0, 0, 0])
+            totals[0] += sign * debit
+            totals[1] += sign * credit
+            totals[2] += sign
+        for (period, account_id, cost_center_id), (debit, credit, count) in grouped.items():
+            key = {'business_id': business_id, 'period': period, 'account_id': account_id, 'cost_center_id': cost_center_id}
+            changes = {
+                'debit': F('debit') + debit,
+                'credit': F('credit') + credit,
+                'line_count': F('line_count') + count,
+                'updated_at': timezone.now(),
+            }
+            if cls.objects.filter(**key).update(**changes):
+                continue
+            _, created = cls.objects.get_or_create(defaults={'debit': debit, 'credit': credit, 'line_count': count}, **key)
+            if not created:
+                # another posting created the row between the UPDATE and the insert
+                cls.objects.filter(**key).update(**changes)
+    
+    def __str__(self):
+        return f"{self.period:%Y-%m} - {self.account_id} - {self.cost_center_id or 'unassigned'}"
+
 # ==================== BANKING MODELS ====================
 class BankAccount(models.Model):
     store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='bank_accounts')
@@ -394,6 +471,7 @@ class Product(models.Model):
     store = models.ForeignKey(Store, on_delete=models.SET_NULL, null=True, blank=True, related_name='products', help_text='Store this product belongs to (optional for multi-store scenarios)')
     name = models.CharField(max_length=100)
     sku = models.CharField(max_length=50, unique=True)
+    barcode = models.CharField(max_length=100, blank=True, help_text='EAN/UPC or in-store barcode printed on the item')
     description = models.TextField(blank=True)
     category = models.CharField(max_length=50, blank=True, default="General")
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -408,6 +486,7 @@ class Product(models.Model):
         indexes = [
             models.Index(fields=['business']),
             models.Index(fields=['sku']),
+            models.Index(fields=['barcode']),
             models.Index(fields=['category']),
             models.Index(fields=['is_active']),
         ]
@@ -607,6 +686,8 @@ class POSSale(models.Model):
         ('REFUNDED', 'Refunded'),
         ('CANCELLED', 'Cancelled'),
     ], default='COMPLETED')
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True, help_text='Client-generated key used to dedupe offline sale uploads')
+    captured_at = models.DateTimeField(null=True, blank=True, help_text='When the sale was rung up on the till (offline sales)')
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -959,6 +1040,18 @@ class ProjectExpense(models.Model):
         if self.approved_by and self.approved_by.business != self.project.business:
             raise ValidationError("Approver must belong to the same business")
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._rollup_contribution = instance.rollup_contribution()
+        return instance
+    
+    def rollup_contribution(self):
+        """(project_id, date, deltas) this expense adds to the weekly project rollups"""
+        if not self.project_id or not self.expense_date or self.amount is None:
+            return None
+        return (self.project_id, self.expense_date, {'expense_count': 1, 'expenses': Decimal(str(self.amount))})
+    
     def __str__(self):
         return f"{self.description} - ${self.amount} ({self.project.name})"
 
@@ -974,6 +1067,7 @@ class ProjectTimesheet(models.Model):
     description = models.TextField(blank=True)
     is_billable = models.BooleanField(default=True)
     hourly_rate = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+    billable_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -999,17 +1093,98 @@ class ProjectTimesheet(models.Model):
             if end_datetime < start_datetime:  # Handle overnight work
                 end_datetime += timezone.timedelta(days=1)
             duration = end_datetime - start_datetime
-            self.hours_worked = Decimal(str(duration.total_seconds() / 3600))
+            self.hours_worked = Decimal(str(round(duration.total_seconds() / 3600, 2)))
+        self.billable_amount = self.calculate_billable_amount()
         super().save(*args, **kwargs)
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._rollup_contribution = instance.rollup_contribution()
+        return instance
+    
+    def calculate_billable_amount(self):
+        if not self.is_billable or not self.hourly_rate or not self.hours_worked:
+            return Decimal('0')
+        return (Decimal(str(self.hours_worked)) * Decimal(str(self.hourly_rate))).quantize(Decimal('0.01'))
+    
+    def rollup_contribution(self):
+        """(project_id, date, deltas) this timesheet adds to the weekly project rollups"""
+        if not self.project_id or not self.date or self.hours_worked is None:
+            return None
+        hours = Decimal(str(self.hours_worked))
+        return (self.project_id, self.date, {
+            'timesheet_count': 1,
+            'hours': hours,
+            'billable_hours': hours if self.is_billable else Decimal('0'),
+            'billable_amount': Decimal(str(self.billable_amount or 0)),
+        })
+    
     def __str__(self):
         return f"{self.employee.full_name} - {self.project.name} ({self.date})"
+
+
+class ProjectCostRollup(models.Model):
+    """Per-project weekly hours, billing and expense totals, maintained by the project_service receivers"""
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='cost_rollups')
+    week_start = models.DateField(help_text='Monday of the week')
     
-    @property
-    def billable_amount(self):
-        if self.is_billable and self.hourly_rate:
-            return self.hours_worked * self.hourly_rate
-        return Decimal('0.00')
+    timesheet_count = models.IntegerField(default=0)
+    hours = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    billable_hours = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    billable_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    expense_count = models.IntegerField(default=0)
+    expenses = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['project', 'week_start']
+        ordering = ['project', 'week_start']
+        indexes = [
+            models.Index(fields=['week_start']),
+        ]
+    
+    @staticmethod
+    def week_of(value):
+        if isinstance(value, str):
+            value = timezone.datetime.strptime(value[:10], '%Y-%m-%d').date()
+        return value - timezone.timedelta(days=value.weekday())
+    
+    @classmethod
+    def apply(cls, entries):
+        """Add [(project_id, date, {field: delta})] to the weekly rows with one upsert per project-week"""
+        grouped = {}
+        for project_id, on_date, deltas in entries:
+            totals = grouped.setdefault((project_id, cls.week_of(on_date)), {})
+            for field, value in deltas.items():
+                totals[field] = totals.get(field, 0) + value
+        for (project_id, week_start), totals in grouped.items():
+            totals = {field: value for field, value in totals.items() if value}
+            if not totals:
+                continue
+            # removals only touch existing rows, so a cascade that already dropped the project's rows adds none back
+            if any(value > 0 for value in totals.values()):
+                cls.objects.get_or_create(project_id=project_id, week_start=week_start)
+            cls.objects.filter(project_id=project_id, week_start=week_start).update(
+                updated_at=timezone.now(),
+                **{field: F(field) + value for field, value in totals.items()}
+            )
+    
+    @classmethod
+    def replace_contribution(cls, old, new):
+        """Swap a row's previous contribution for its current one"""
+        entries = []
+        if old:
+            project_id, on_date, deltas = old
+            entries.append((project_id, on_date, {field: -value for field, value in deltas.items()}))
+        if new:
+            entries.append(new)
+        if entries:
+            cls.apply(entries)
+    
+    def __str__(self):
+        return f"{self.project_id} - week of {self.week_start}"
 
 # ==================== ZIMBABWE-SPECIFIC COMPLIANCE MODELS ====================
 
@@ -1376,9 +1551,22 @@ class StockRecord(models.Model):
             models.Index(fields=['warehouse']),
         ]
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_reserved_quantity = instance.__dict__.get('reserved_quantity')
+        return instance
+    
     def save(self, *args, **kwargs):
-        self.available_quantity = self.quantity - self.reserved_quantity
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            if self.pk and getattr(self, '_loaded_reserved_quantity', None) == self.reserved_quantity:
+                # holds move reserved_quantity in place; keep the locked row's value unless this copy changed it
+                current = StockRecord.objects.select_for_update().filter(pk=self.pk).values_list('reserved_quantity', flat=True).first()
+                if current is not None:
+                    self.reserved_quantity = current
+            self.available_quantity = self.quantity - self.reserved_quantity
+            super().save(*args, **kwargs)
+        self._loaded_reserved_quantity = self.reserved_quantity
     
     def __str__(self):
         return f"{self.item.name} @ {self.warehouse.name}: {self.quantity}"
@@ -1417,19 +1605,24 @@ class StockMovement(models.Model):
         self.total_cost = self.quantity * self.unit_cost
         super().save(*args, **kwargs)
         
-        # Update stock record
-        stock_record, created = StockRecord.objects.get_or_create(
+        # Update stock record in place so concurrent holds and movements are kept
+        StockRecord.objects.get_or_create(
             item=self.item,
             warehouse=self.warehouse,
             defaults={'quantity': 0}
         )
         
         if self.movement_type in ['IN', 'ADJUSTMENT']:
-            stock_record.quantity += self.quantity
+            delta = self.quantity
         elif self.movement_type in ['OUT', 'DAMAGE', 'EXPIRED']:
-            stock_record.quantity -= self.quantity
-        
-        stock_record.save()
+            delta = -self.quantity
+        else:
+            return
+        StockRecord.objects.filter(item=self.item, warehouse=self.warehouse).update(
+            quantity=F('quantity') + delta,
+            available_quantity=F('available_quantity') + delta,
+            last_updated=timezone.now(),
+        )
     
     def __str__(self):
         return f"{self.get_movement_type_display()} - {self.item.name} ({self.quantity})"
@@ -6,7 +6,7 @@ from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 from decimal import Decimal
-from .models import Business, Store, User, Product, Customer, Currency
+from .models import Business, Store, User, Product, Customer, Currency, StockRecord
 from .models_extended import SalesOrder
 
 # ==================== E-COMMERCE ====================
@@ -202,6 +202,7 @@ class OnlineOrder(models.Model):
     shipping_cost = models.DecimalField(max_digits=15, decimal_places=2, default=0)
     discount_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
     total_amount = models.DecimalField(max_digits=15, decimal_places=2)
+    promo_code = models.ForeignKey('PromoCode', on_delete=models.SET_NULL, null=True, blank=True, related_name='orders', help_text='Redeemed code; its use is given back if the order is cancelled')
     
     currency = models.ForeignKey(Currency, on_delete=models.PROTECT)
     
@@ -307,6 +308,40 @@ class ShoppingCartItem(models.Model):
         return f"{self.cart.session_id} - {self.website_product.web_title}"
 
 
+class StockReservation(models.Model):
+    """Stock held for a cart or online order against a warehouse stock record"""
+    STATUS_CHOICES = [
+        ('HELD', 'Held'),
+        ('CONVERTED', 'Converted to Movement'),
+        ('RELEASED', 'Released'),
+        ('EXPIRED', 'Expired'),
+    ]
+    
+    stock_record = models.ForeignKey(StockRecord, on_delete=models.CASCADE, related_name='reservations')
+    website_product = models.ForeignKey(WebsiteProduct, on_delete=models.CASCADE, related_name='reservations')
+    cart = models.ForeignKey(ShoppingCart, on_delete=models.SET_NULL, null=True, blank=True, related_name='reservations')
+    order = models.ForeignKey(OnlineOrder, on_delete=models.SET_NULL, null=True, blank=True, related_name='reservations')
+    
+    quantity = models.DecimalField(max_digits=15, decimal_places=2)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='HELD')
+    expires_at = models.DateTimeField(null=True, blank=True, help_text='Held stock is released after this time; order holds do not expire')
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+            models.Index(fields=['cart', 'status']),
+            models.Index(fields=['order', 'status']),
+            models.Index(fields=['stock_record', 'status']),
+        ]
+    
+    def __str__(self):
+        return f"{self.website_product.web_title} x {self.quantity} ({self.status})"
+
+
 class PromoCode(models.Model):
     """Promotional Discount Codes"""
     DISCOUNT_TYPE_CHOICES = [
@@ -497,6 +532,50 @@ class WorkflowStepExecution(models.Model):
         return f"{self.instance} - {self.step.name} - {self.status}"
 
 
+class ApprovalRequest(models.Model):
+    """Approval inbox: one row per assignee for anything waiting on an approval, across modules"""
+    SOURCE_TYPE_CHOICES = [
+        ('VENDOR_BILL', 'Vendor Bill'),
+        ('BUDGET', 'Budget'),
+        ('LEAVE', 'Leave Application'),
+        ('REQUISITION', 'Purchase Requisition'),
+        ('WORKFLOW', 'Workflow Step'),
+    ]
+
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('APPROVED', 'Approved'),
+        ('REJECTED', 'Rejected'),
+        ('CANCELLED', 'Cancelled'),
+    ]
+
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='approval_requests')
+    assignee = models.ForeignKey(User, on_delete=models.CASCADE, related_name='approval_inbox')
+
+    # What is waiting (denormalized so the inbox never joins the source tables)
+    source_type = models.CharField(max_length=20, choices=SOURCE_TYPE_CHOICES)
+    source_id = models.IntegerField()
+    title = models.CharField(max_length=200)
+    amount = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='approval_requests')
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    actioned_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='actioned_approval_requests')
+    actioned_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['assignee', 'status', 'created_at']),
+            models.Index(fields=['source_type', 'source_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.title} - {self.assignee} - {self.status}"
+
+
 # ==================== ZIMBABWE PAYMENT INTEGRATIONS ====================
 
 class PaymentGateway(models.Model):
@@ -727,6 +806,7 @@ class Notification(models.Model):
     """Notification Log"""
     STATUS_CHOICES = [
         ('PENDING', 'Pending'),
+        ('SENDING', 'Sending'),
         ('SENT', 'Sent'),
         ('FAILED', 'Failed'),
         ('READ', 'Read'),
@@ -747,6 +827,7 @@ class Notification(models.Model):
     
     sent_at = models.DateTimeField(null=True, blank=True)
     read_at = models.DateTimeField(null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)  # when a dispatcher took the row for sending
     
     error_message = models.TextField(blank=True)
     
@@ -6,7 +6,10 @@ from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
+from datetime import datetime
 from decimal import Decimal
+from contextlib import contextmanager
+import threading
 from .models import (
     Business, Store, User, Product, Employee, Customer, 
     ChartOfAccounts, Currency, Department
@@ -260,7 +263,61 @@ class VendorQuotationItem(models.Model):
         return f"{self.quotation.quotation_number} - {self.rfq_item.description}"
 
 
-class PurchaseOrder(models.Model):
+class VendorRollupMixin:
+    """
+    Keeps a document's contribution to VendorSpendRollup in step with its row.
+    The rollup fields are snapshotted when the row is loaded; each save reverses
+    the snapshotted contribution and adds the current one, and deleting the row
+    reverses it (post_delete receivers in services/procurement_service.py).
+    """
+    rollup_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(field in field_names for field in cls.rollup_fields):
+            instance._rollup_snapshot = instance.rollup_values()
+        return instance
+
+    def rollup_values(self):
+        return {field: getattr(self, field) for field in self.rollup_fields}
+
+    def rollup_entry(self, values):
+        """(vendor_id, business_id, date, {field: delta}) for a snapshot, or None if it adds nothing"""
+        raise NotImplementedError
+
+    @staticmethod
+    def reversed_entry(entry):
+        vendor_id, business_id, on_date, deltas = entry
+        return vendor_id, business_id, on_date, {field: -value for field, value in deltas.items()}
+
+    def sync_rollup(self, adding):
+        """Record the difference between the snapshotted and the current contribution"""
+        current = self.rollup_values()
+        previous = getattr(self, '_rollup_snapshot', None)
+        if previous is None and not adding:
+            # Loaded with deferred rollup fields: nothing to diff against
+            return
+        if previous != current:
+            entries = []
+            old_entry = self.rollup_entry(previous) if previous is not None else None
+            if old_entry:
+                entries.append(self.reversed_entry(old_entry))
+            new_entry = self.rollup_entry(current)
+            if new_entry:
+                entries.append(new_entry)
+            VendorSpendRollup.record_many(entries)
+        self._rollup_snapshot = current
+
+    def reverse_rollup(self):
+        previous = getattr(self, '_rollup_snapshot', None)
+        entry = self.rollup_entry(previous) if previous is not None else None
+        if entry:
+            VendorSpendRollup.record_many([self.reversed_entry(entry)])
+        self._rollup_snapshot = None
+
+
+class PurchaseOrder(VendorRollupMixin, models.Model):
     """Purchase Order"""
     STATUS_CHOICES = [
         ('DRAFT', 'Draft'),
@@ -321,6 +378,21 @@ class PurchaseOrder(models.Model):
             models.Index(fields=['vendor']),
         ]
     
+    rollup_fields = ('vendor_id', 'business_id', 'order_date', 'status', 'total_amount')
+
+    def rollup_entry(self, values):
+        if values['status'] == 'CANCELLED':
+            return None
+        return (
+            values['vendor_id'], values['business_id'], values['order_date'],
+            {'po_count': 1, 'ordered_amount': Decimal(str(values['total_amount'] or 0))},
+        )
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        self.sync_rollup(adding)
+
     def __str__(self):
         return f"{self.po_number} - {self.vendor.name}"
 
@@ -358,7 +430,7 @@ class PurchaseOrderItem(models.Model):
         return f"{self.purchase_order.po_number} - {product_name}"
 
 
-class GoodsReceivedNote(models.Model):
+class GoodsReceivedNote(VendorRollupMixin, models.Model):
     """GRN - Goods Receipt"""
     STATUS_CHOICES = [
         ('DRAFT', 'Draft'),
@@ -405,6 +477,28 @@ class GoodsReceivedNote(models.Model):
             models.Index(fields=['purchase_order']),
         ]
     
+    rollup_fields = ('purchase_order_id', 'business_id', 'receipt_date', 'status', 'total_amount')
+
+    def rollup_entry(self, values):
+        if values['status'] == 'REJECTED':
+            return None
+        po = self.purchase_order if self.purchase_order_id == values['purchase_order_id'] else (
+            PurchaseOrder.objects.only('vendor_id', 'order_date').get(id=values['purchase_order_id'])
+        )
+        receipt_date = values['receipt_date']
+        if isinstance(receipt_date, str):
+            receipt_date = datetime.strptime(receipt_date, '%Y-%m-%d').date()
+        deltas = {'grn_count': 1, 'received_amount': Decimal(str(values['total_amount'] or 0))}
+        if po.order_date and receipt_date:
+            deltas['lead_time_days_total'] = (receipt_date - po.order_date).days
+            deltas['lead_time_samples'] = 1
+        return po.vendor_id, values['business_id'], receipt_date, deltas
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        self.sync_rollup(adding)
+
     def __str__(self):
         return f"{self.grn_number} - PO: {self.purchase_order.po_number}"
 
@@ -440,7 +534,7 @@ class PurchaseOrderPayment(models.Model):
         return f"{self.grn.grn_number} - {self.get_payment_method_display()} - ${self.amount}"
 
 
-class VendorBill(models.Model):
+class VendorBill(VendorRollupMixin, models.Model):
     """Vendor Bill generated from Purchase Orders / GRNs - Industry standard audit trail"""
 
     STATUS_CHOICES = [
@@ -506,6 +600,16 @@ class VendorBill(models.Model):
             models.Index(fields=['payment_status']),
         ]
 
+    rollup_fields = ('vendor_id', 'business_id', 'bill_date', 'status', 'total_amount')
+
+    def rollup_entry(self, values):
+        if values['status'] in ('CANCELLED', 'REJECTED'):
+            return None
+        return (
+            values['vendor_id'], values['business_id'], values['bill_date'],
+            {'billed_amount': Decimal(str(values['total_amount'] or 0))},
+        )
+
     def save(self, *args, **kwargs):
         # Auto-calculate balance
         self.balance = self.total_amount - self.paid_amount
@@ -518,12 +622,62 @@ class VendorBill(models.Model):
         elif self.paid_amount == 0:
             self.payment_status = 'UNPAID'
         
+        adding = self._state.adding
         super().save(*args, **kwargs)
+        self.sync_rollup(adding)
+
+    def recalculate_totals(self):
+        """Recompute subtotal/tax/total from the bill lines with one aggregate query"""
+        totals = self.items.aggregate(subtotal=models.Sum('total_price'), tax=models.Sum('tax_amount'))
+        self.subtotal = totals['subtotal'] or Decimal('0')
+        self.tax_amount = totals['tax'] or Decimal('0')
+        self.total_amount = self.subtotal + self.tax_amount - Decimal(str(self.discount_amount or 0))
+        self.save(update_fields=['subtotal', 'tax_amount', 'total_amount', 'balance', 'payment_status', 'updated_at'])
+
+    def add_items(self, items):
+        """Bulk insert unsaved VendorBillItem rows and write the bill totals once"""
+        for item in items:
+            item.vendor_bill = self
+            item.calculate_totals()
+        VendorBillItem.objects.bulk_create(items)
+        _schedule_bill_totals(self)
+        return items
 
     def __str__(self):
         return f"Vendor Bill {self.bill_number or self.id}"
 
 
+_deferred_bill_totals = threading.local()
+
+
+@contextmanager
+def defer_bill_totals():
+    """
+    Batch context for vendor bill line writes.
+    VendorBillItem saves inside the block only record their bill; each
+    affected bill's totals are recomputed once when the block exits.
+    """
+    if getattr(_deferred_bill_totals, 'bills', None) is not None:
+        yield
+        return
+    _deferred_bill_totals.bills = {}
+    try:
+        yield
+        bills = _deferred_bill_totals.bills
+    finally:
+        _deferred_bill_totals.bills = None
+    for bill in bills.values():
+        bill.recalculate_totals()
+
+
+def _schedule_bill_totals(bill):
+    pending = getattr(_deferred_bill_totals, 'bills', None)
+    if pending is not None:
+        pending.setdefault(bill.pk, bill)
+    else:
+        bill.recalculate_totals()
+
+
 class VendorBillItem(models.Model):
     """Line items in Vendor Bill - for detailed audit trail"""
     vendor_bill = models.ForeignKey(VendorBill, on_delete=models.CASCADE, related_name='items')
@@ -550,22 +704,20 @@ class VendorBillItem(models.Model):
             models.Index(fields=['product']),
         ]
     
-    def save(self, *args, **kwargs):
-        # Auto-calculate totals
-        from decimal import Decimal
+    def calculate_totals(self):
+        """Compute the line total and tax from quantity, price and tax rate"""
         self.total_price = Decimal(str(self.quantity)) * Decimal(str(self.unit_price))
         tax_rate_decimal = Decimal(str(self.tax_rate or 0))
         self.tax_amount = self.total_price * (tax_rate_decimal / Decimal('100'))
+
+    def save(self, *args, **kwargs):
+        # Auto-calculate totals
+        self.calculate_totals()
         super().save(*args, **kwargs)
         
         # Update bill totals (only if vendor_bill exists and is saved)
         if self.vendor_bill and self.vendor_bill.pk:
-            self.vendor_bill.subtotal = sum(Decimal(str(item.total_price)) for item in self.vendor_bill.items.all())
-            self.vendor_bill.tax_amount = sum(Decimal(str(item.tax_amount)) for item in self.vendor_bill.items.all())
-            discount = Decimal(str(self.vendor_bill.discount_amount or 0))
-            self.vendor_bill.total_amount = self.vendor_bill.subtotal + self.vendor_bill.tax_amount - discount
-            self.vendor_bill.balance = self.vendor_bill.total_amount - Decimal(str(self.vendor_bill.paid_amount or 0))
-            self.vendor_bill.save(update_fields=['subtotal', 'tax_amount', 'total_amount', 'balance'])
+            _schedule_bill_totals(self.vendor_bill)
     
     def __str__(self):
         return f"{self.vendor_bill.bill_number} - {self.description}" 
@@ -598,6 +750,68 @@ class GoodsReceivedNoteItem(models.Model):
         return f"{self.grn.grn_number} - {self.po_item.product.name}"
 
 
+class VendorSpendRollup(models.Model):
+    """Per-vendor monthly purchasing totals, maintained by the PO, GRN, bill and payment write paths"""
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='vendor_spend_rollups')
+    vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, related_name='spend_rollups')
+    period = models.DateField(help_text='First day of the month')
+
+    po_count = models.PositiveIntegerField(default=0)
+    ordered_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    grn_count = models.PositiveIntegerField(default=0)
+    received_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    billed_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    paid_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    lead_time_days_total = models.IntegerField(default=0, help_text='Sum of order-to-receipt days for GRNs received this month')
+    lead_time_samples = models.PositiveIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['vendor', 'period']
+        ordering = ['vendor', 'period']
+        indexes = [
+            models.Index(fields=['business', 'period']),
+            models.Index(fields=['vendor', 'period']),
+        ]
+
+    @staticmethod
+    def month_start(value):
+        if hasattr(value, 'date') and callable(value.date):
+            value = value.date()
+        return value.replace(day=1)
+
+    @classmethod
+    def record(cls, vendor_id, business_id, on_date, **deltas):
+        """Add deltas (e.g. po_count=1, ordered_amount=Decimal('10')) to the vendor's month row"""
+        cls.record_many([(vendor_id, business_id, on_date, deltas)])
+
+    @classmethod
+    def record_many(cls, entries):
+        """Apply [(vendor_id, business_id, date, {field: delta})] with one upsert per vendor-month"""
+        grouped = {}
+        for vendor_id, business_id, on_date, deltas in entries:
+            if not vendor_id or not business_id:
+                continue
+            key = (vendor_id, business_id, cls.month_start(on_date))
+            totals = grouped.setdefault(key, {})
+            for field, value in deltas.items():
+                if value:
+                    totals[field] = totals.get(field, 0) + value
+        for (vendor_id, business_id, period), totals in grouped.items():
+            totals = {field: value for field, value in totals.items() if value}
+            if not totals:
+                continue
+            cls.objects.get_or_create(vendor_id=vendor_id, period=period, defaults={'business_id': business_id})
+            cls.objects.filter(vendor_id=vendor_id, period=period).update(
+                updated_at=timezone.now(),
+                **{field: models.F(field) + value for field, value in totals.items()}
+            )
+
+    def __str__(self):
+        return f"{self.vendor.name} - {self.period:%Y-%m}"
+
+
 # ==================== ADVANCED CRM ====================
 
 class Lead(models.Model):
@@ -1154,9 +1368,7 @@ class AssetDepreciation(models.Model):
     
     class Meta:
         ordering = ['-period_start_date']
-        indexes = [
-            models.Index(fields=['asset', 'period_start_date']),
-        ]
+        unique_together = ['asset', 'period_start_date']
     
     def __str__(self):
         return f"{self.asset.asset_number} - {self.period_start_date} to {self.period_end_date}"
@@ -7,6 +7,7 @@ from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator, FileExtensionValidator
 from django.utils import timezone
 from decimal import Decimal
+import uuid
 from .models import Business, Store, User, Employee, Department
 from .models_extended import Vendor, PurchaseOrder, SalesOrder
 
@@ -78,6 +79,40 @@ class LeaveAllocation(models.Model):
         return f"{self.employee.full_name} - {self.leave_type.name} - {self.year}"
 
 
+class LeaveLedgerEntry(models.Model):
+    """Append-only movements behind each leave allocation balance"""
+    ENTRY_TYPE_CHOICES = [
+        ('ALLOCATION', 'Annual Allocation'),
+        ('CARRY_FORWARD', 'Carried Forward'),
+        ('USAGE', 'Leave Taken'),
+        ('REVERSAL', 'Leave Reversed'),
+        ('ADJUSTMENT', 'Adjustment'),
+    ]
+
+    allocation = models.ForeignKey(LeaveAllocation, on_delete=models.CASCADE, related_name='ledger_entries')
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='leave_ledger_entries')
+    leave_type = models.ForeignKey(LeaveType, on_delete=models.CASCADE, related_name='ledger_entries')
+    year = models.IntegerField()
+
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPE_CHOICES)
+    days = models.DecimalField(max_digits=6, decimal_places=1, help_text='Positive credits, negative debits the balance')
+    application = models.ForeignKey('LeaveApplication', on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    notes = models.CharField(max_length=255, blank=True)
+
+    created_by = models.ForeignKey(User, on_delete=models.PROTECT, related_name='created_leave_ledger_entries')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['employee', 'year']),
+            models.Index(fields=['leave_type', 'year']),
+        ]
+
+    def __str__(self):
+        return f"{self.employee_id} - {self.entry_type} {self.days} ({self.year})"
+
+
 class LeaveApplication(models.Model):
     """Employee Leave Applications"""
     STATUS_CHOICES = [
@@ -446,6 +481,19 @@ class DocumentCategory(models.Model):
         return self.name
 
 
+class DocumentBlob(models.Model):
+    """Stored file content, addressed by its SHA-256 so identical uploads are kept once"""
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='documents/blobs/')
+    size = models.BigIntegerField()  # in bytes
+    content_type = models.CharField(max_length=100, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.sha256
+
+
 class Document(models.Model):
     """Document Management System"""
     STATUS_CHOICES = [
@@ -462,7 +510,8 @@ class Document(models.Model):
     category = models.ForeignKey(DocumentCategory, on_delete=models.SET_NULL, null=True)
     
     file = models.FileField(upload_to='documents/%Y/%m/')
-    file_size = models.IntegerField()  # in bytes
+    blob = models.ForeignKey(DocumentBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='documents')
+    file_size = models.BigIntegerField()  # in bytes
     file_type = models.CharField(max_length=50)
     
     # Version Control
@@ -496,6 +545,51 @@ class Document(models.Model):
         return f"{self.document_number} - {self.title}"
 
 
+class DocumentAccess(models.Model):
+    """Precomputed per-user access list of non-public documents"""
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='access_entries')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='document_access')
+    
+    class Meta:
+        unique_together = ['user', 'document']
+    
+    def __str__(self):
+        return f"{self.user} - {self.document}"
+
+
+class DocumentUpload(models.Model):
+    """Resumable chunked upload session; chunks are appended until the file is complete"""
+    STATUS_CHOICES = [
+        ('UPLOADING', 'Uploading'),
+        ('COMPLETED', 'Completed'),
+        ('ABORTED', 'Aborted'),
+    ]
+    
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='document_uploads')
+    upload_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    total_size = models.BigIntegerField()
+    received_size = models.BigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)  # expected digest, checked on completion
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='UPLOADING')
+    blob = models.ForeignKey(DocumentBlob, on_delete=models.SET_NULL, null=True, blank=True, related_name='uploads')
+    
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='document_uploads')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.filename} ({self.received_size}/{self.total_size})"
+
+
 class DocumentTemplate(models.Model):
     """Document Templates (Invoices, Contracts, etc.)"""
     TEMPLATE_TYPE_CHOICES = [
@@ -31,7 +31,7 @@ class ChartOfAccountsSerializer(serializers.ModelSerializer):
 class JournalEntryLineSerializer(serializers.ModelSerializer):
     class Meta:
         model = JournalEntryLine
-        fields = ['id', 'journal_entry', 'account', 'description', 'debit', 'credit', 'created_by', 'created_at']
+        fields = ['id', 'journal_entry', 'account', 'description', 'debit', 'credit', 'cost_center', 'project', 'created_by', 'created_at']
 
 class JournalEntrySerializer(serializers.ModelSerializer):
     lines = JournalEntryLineSerializer(many=True, read_only=True)
@@ -55,7 +55,7 @@ class JournalEntrySerializer(serializers.ModelSerializer):
 class GeneralLedgerSerializer(serializers.ModelSerializer):
     class Meta:
         model = GeneralLedger
-        fields = ['id', 'date', 'account', 'journal_entry', 'debit', 'credit', 'reference', 'description', 'running_balance', 'created_by', 'created_at']
+        fields = ['id', 'date', 'account', 'journal_entry', 'debit', 'credit', 'reference', 'description', 'running_balance', 'cost_center', 'project', 'created_by', 'created_at']
 
 class BankAccountSerializer(serializers.ModelSerializer):
     class Meta:
@@ -113,7 +113,7 @@ class MobileMoneyTransactionSerializer(serializers.ModelSerializer):
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ['id', 'business', 'store', 'name', 'sku', 'description', 'category', 'unit_price', 'cost_price', 'quantity_in_stock', 'minimum_stock_level', 'is_active', 'created_at', 'updated_at']
+        fields = ['id', 'business', 'store', 'name', 'sku', 'barcode', 'description', 'category', 'unit_price', 'cost_price', 'quantity_in_stock', 'minimum_stock_level', 'is_active', 'created_at', 'updated_at']
         extra_kwargs = {
             'business': {'required': False, 'allow_null': True},
             'store': {'required': False, 'allow_null': True}
@@ -212,7 +212,7 @@ class POSItemDetailSerializer(serializers.ModelSerializer):
 class POSSaleSerializer(serializers.ModelSerializer):
     class Meta:
         model = POSSale
-        fields = ['id', 'session', 'sale_number', 'customer_name', 'customer_phone', 'subtotal', 'tax_amount', 'discount_amount', 'total_amount', 'payment_method', 'status', 'created_at']
+        fields = ['id', 'session', 'sale_number', 'customer_name', 'customer_phone', 'subtotal', 'tax_amount', 'discount_amount', 'total_amount', 'payment_method', 'status', 'idempotency_key', 'captured_at', 'created_at']
         extra_kwargs = {
             'session': {'required': False, 'allow_null': True}
         }
@@ -430,6 +430,14 @@ class ProjectTimesheetSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at'
         ]
 
+class ProjectCostRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProjectCostRollup
+        fields = [
+            'id', 'project', 'week_start', 'timesheet_count', 'hours', 'billable_hours',
+            'billable_amount', 'expense_count', 'expenses', 'updated_at'
+        ]
+
 # ==================== ZIMBABWE-SPECIFIC SERIALIZERS ====================
 
 class CurrencySerializer(serializers.ModelSerializer):
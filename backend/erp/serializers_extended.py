@@ -1,6 +1,7 @@
 """
 Extended Serializers for ERP Models
 """
+import re
 from rest_framework import serializers
 from .models_extended import *
 from .models_extended_part2 import *
@@ -279,6 +280,12 @@ class PurchaseOrderApprovalSerializer(serializers.Serializer):
     approval_notes = serializers.CharField(required=False, allow_blank=True)
 
 
+class VendorSpendRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = VendorSpendRollup
+        fields = '__all__'
+
+
 class GoodsReceivedNoteItemSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='po_item.product.name', read_only=True)
     
@@ -450,6 +457,12 @@ class LeaveAllocationSerializer(serializers.ModelSerializer):
         read_only_fields = ('created_by', 'created_at', 'updated_at')
 
 
+class LeaveLedgerEntrySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LeaveLedgerEntry
+        fields = '__all__'
+
+
 class LeaveApplicationSerializer(serializers.ModelSerializer):
     employee_name = serializers.CharField(source='employee.full_name', read_only=True)
     leave_type_name = serializers.CharField(source='leave_type.name', read_only=True)
@@ -529,11 +542,38 @@ class DocumentCategorySerializer(serializers.ModelSerializer):
 class DocumentSerializer(serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
     created_by_name = serializers.CharField(source='created_by.get_full_name', read_only=True)
+    upload_id = serializers.UUIDField(write_only=True, required=False)
     
     class Meta:
         model = Document
         fields = '__all__'
-        read_only_fields = ('created_by', 'created_at', 'updated_at')
+        read_only_fields = ('blob', 'file_size', 'created_by', 'created_at', 'updated_at')
+        extra_kwargs = {
+            'file': {'required': False},
+            'file_type': {'required': False},
+        }
+    
+    def validate(self, data):
+        if self.instance is None and not data.get('file') and not data.get('upload_id'):
+            raise serializers.ValidationError(
+                {'file': 'Upload a file or pass the upload_id of a completed chunked upload'}
+            )
+        return data
+
+
+class DocumentUploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DocumentUpload
+        fields = '__all__'
+        read_only_fields = (
+            'business', 'upload_id', 'received_size', 'status', 'blob', 'created_by', 'created_at', 'updated_at'
+        )
+    
+    def validate_sha256(self, value):
+        value = value.lower()
+        if value and not re.fullmatch(r'[0-9a-f]{64}', value):
+            raise serializers.ValidationError('Expected a hex SHA-256 digest')
+        return value
 
 
 class DocumentTemplateSerializer(serializers.ModelSerializer):
@@ -661,7 +701,7 @@ class OnlineOrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = OnlineOrder
         fields = '__all__'
-        read_only_fields = ('created_at', 'updated_at', 'paid_at')
+        read_only_fields = ('created_at', 'updated_at', 'paid_at', 'promo_code')
 
 
 class ShoppingCartItemSerializer(serializers.ModelSerializer):
@@ -683,6 +723,16 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
         read_only_fields = ('created_at', 'updated_at')
 
 
+class StockReservationSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='website_product.web_title', read_only=True)
+    warehouse = serializers.IntegerField(source='stock_record.warehouse_id', read_only=True)
+    
+    class Meta:
+        model = StockReservation
+        fields = '__all__'
+        read_only_fields = ('created_at', 'updated_at')
+
+
 class PromoCodeSerializer(serializers.ModelSerializer):
     class Meta:
         model = PromoCode
@@ -702,6 +752,14 @@ class WorkflowStepSerializer(serializers.ModelSerializer):
     
     def get_approver_names(self, obj):
         return [u.get_full_name() for u in obj.approvers.all()]
+    
+    def validate_condition(self, value):
+        from .services.workflow_service import compile_condition, WorkflowError
+        try:
+            compile_condition(value)
+        except WorkflowError as e:
+            raise serializers.ValidationError(str(e))
+        return value
 
 
 class WorkflowDefinitionSerializer(serializers.ModelSerializer):
@@ -711,6 +769,14 @@ class WorkflowDefinitionSerializer(serializers.ModelSerializer):
         model = WorkflowDefinition
         fields = '__all__'
         read_only_fields = ('created_by', 'created_at', 'updated_at')
+    
+    def validate_trigger_condition(self, value):
+        from .services.workflow_service import compile_condition, WorkflowError
+        try:
+            compile_condition(value)
+        except WorkflowError as e:
+            raise serializers.ValidationError(str(e))
+        return value
 
 
 class WorkflowStepExecutionSerializer(serializers.ModelSerializer):
@@ -724,6 +790,15 @@ class WorkflowStepExecutionSerializer(serializers.ModelSerializer):
         read_only_fields = ('started_at', 'completed_at')
 
 
+class ApprovalRequestSerializer(serializers.ModelSerializer):
+    source_type_display = serializers.CharField(source='get_source_type_display', read_only=True)
+    
+    class Meta:
+        model = ApprovalRequest
+        fields = '__all__'
+        read_only_fields = ('created_at', 'actioned_by', 'actioned_at')
+
+
 class WorkflowInstanceSerializer(serializers.ModelSerializer):
     workflow_name = serializers.CharField(source='workflow.name', read_only=True)
     step_executions = WorkflowStepExecutionSerializer(many=True, read_only=True)
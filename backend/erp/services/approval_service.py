@@ -0,0 +1,198 @@
+"""
+Approval Inbox Service
+Denormalized cross-module approval requests opened and closed by each module's transitions
+"""
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Source status that keeps an item in the inbox, per source type
+PENDING_STATUSES = {
+    'VENDOR_BILL': 'TO_APPROVE',
+    'BUDGET': 'SUBMITTED',
+    'REQUISITION': 'PENDING',
+    'LEAVE': 'PENDING',
+}
+
+# Inbox source type of each source model
+SOURCE_TYPES = {
+    'VendorBill': 'VENDOR_BILL',
+    'Budget': 'BUDGET',
+    'PurchaseRequisition': 'REQUISITION',
+    'LeaveApplication': 'LEAVE',
+    'WorkflowStepExecution': 'WORKFLOW',
+}
+
+
+def default_approvers(business_id, manager_id=None, exclude_id=None):
+    """
+    Who approves a request: the department manager when there is one
+    (and it is not the requester), otherwise the business's employers.
+    """
+    from erp.models import User
+
+    if manager_id and manager_id != exclude_id:
+        return [manager_id]
+    return list(User.objects.filter(business_id=business_id, role='employer', is_active=True).exclude(
+        id=exclude_id
+    ).order_by('id').values_list('id', flat=True))
+
+
+def open_request(source_type, source_id, business_id, assignee_ids, title, amount=None, requested_by_id=None):
+    """Put a source object in its approvers' inboxes; returns the number of rows added"""
+    from erp.models_ecommerce import ApprovalRequest
+
+    return open_requests([
+        ApprovalRequest(
+            business_id=business_id, assignee_id=assignee_id, source_type=source_type, source_id=source_id,
+            title=title[:200], amount=amount, requested_by_id=requested_by_id,
+        )
+        for assignee_id in dict.fromkeys(assignee_ids)
+    ])
+
+
+def open_requests(requests):
+    """Insert unsaved ApprovalRequests in bulk, skipping assignees that already have the item pending"""
+    from erp.models_ecommerce import ApprovalRequest
+
+    if not requests:
+        return 0
+    pending = set(ApprovalRequest.objects.filter(
+        source_type__in={r.source_type for r in requests}, source_id__in={r.source_id for r in requests}, status='PENDING',
+    ).values_list('source_type', 'source_id', 'assignee_id'))
+    fresh = []
+    for request in requests:
+        key = (request.source_type, request.source_id, request.assignee_id)
+        if key not in pending:
+            pending.add(key)
+            fresh.append(request)
+    ApprovalRequest.objects.bulk_create(fresh, batch_size=1000)
+    return len(fresh)
+
+
+def close_requests(source_type, source_ids, status, actioned_by=None):
+    """
+    Resolve every pending inbox row of the source objects, for all of their
+    assignees at once; returns the number of rows closed.
+    """
+    from erp.models_ecommerce import ApprovalRequest
+
+    if not isinstance(source_ids, (list, tuple, set)):
+        source_ids = [source_ids]
+    return ApprovalRequest.objects.filter(
+        source_type=source_type, source_id__in=source_ids, status='PENDING'
+    ).update(status=status, actioned_by=actioned_by, actioned_at=timezone.now())
+
+
+def close_resolved(source_type, source, actioned_by=None):
+    """
+    Close the inbox rows of a source object that has left its pending status
+    through a plain edit; approved and rejected sources keep their outcome,
+    anything else is cancelled. Returns the number of rows closed.
+    """
+    if source.status == PENDING_STATUSES[source_type]:
+        return 0
+    status = source.status if source.status in ('APPROVED', 'REJECTED') else 'CANCELLED'
+    return close_requests(source_type, source.id, status, actioned_by)
+
+
+def reject_workflow_step(execution, actioned_by=None):
+    """
+    Close a rejected workflow step's inbox rows together with those of the
+    other approvers still pending on the same instance (require_all_approvers steps),
+    whose executions are rejected with it; returns the number of rows closed.
+    """
+    from erp.models_ecommerce import WorkflowStepExecution
+
+    siblings = list(WorkflowStepExecution.objects.filter(
+        instance_id=execution.instance_id, status='PENDING'
+    ).exclude(id=execution.id).values_list('id', flat=True))
+    if siblings:
+        WorkflowStepExecution.objects.filter(id__in=siblings).update(status='REJECTED', completed_at=timezone.now())
+    return close_requests('WORKFLOW', [execution.id, *siblings], 'REJECTED', actioned_by)
+
+
+def open_vendor_bill(bill):
+    return open_request(
+        'VENDOR_BILL', bill.id, bill.business_id, default_approvers(bill.business_id, exclude_id=bill.submitted_by_id),
+        f'Vendor bill {bill.bill_number}', bill.total_amount, bill.submitted_by_id,
+    )
+
+
+def open_budget(budget, submitted_by_id=None):
+    return open_request(
+        'BUDGET', budget.id, budget.business_id, default_approvers(budget.business_id, exclude_id=submitted_by_id),
+        f'Budget {budget.budget_number} - {budget.name}', budget.total_budget_amount, submitted_by_id,
+    )
+
+
+def open_requisition(requisition):
+    manager_id = requisition.department.manager_id if requisition.department_id else None
+    return open_request(
+        'REQUISITION', requisition.id, requisition.business_id,
+        default_approvers(requisition.business_id, manager_id, exclude_id=requisition.requested_by_id),
+        f'Requisition {requisition.requisition_number}', requisition.total_amount, requisition.requested_by_id,
+    )
+
+
+def open_leave(application):
+    employee = application.employee
+    manager_id = employee.department.manager_id if employee.department_id else None
+    return open_request(
+        'LEAVE', application.id, employee.business_id,
+        default_approvers(employee.business_id, manager_id, exclude_id=employee.user_id),
+        f'Leave {application.application_number} - {employee.first_name} {employee.last_name}',
+        None, employee.user_id,
+    )
+
+
+def rebuild(business_id=None):
+    """
+    Re-create the pending inbox from the source tables (for existing data or
+    after a repair); returns {source_type: rows added}.
+    """
+    from erp.models_extended import VendorBill, PurchaseRequisition
+    from erp.models_extended_part2 import Budget, LeaveApplication
+    from erp.models_ecommerce import ApprovalRequest, WorkflowStepExecution
+
+    def scoped(queryset, field='business_id'):
+        return queryset.filter(**{field: business_id}) if business_id else queryset
+
+    added = {
+        'VENDOR_BILL': sum(open_vendor_bill(bill) for bill in scoped(VendorBill.objects.filter(status='TO_APPROVE'))),
+        'BUDGET': sum(
+            open_budget(budget, budget.created_by_id) for budget in scoped(Budget.objects.filter(status='SUBMITTED'))
+        ),
+        'REQUISITION': sum(open_requisition(requisition) for requisition in scoped(
+            PurchaseRequisition.objects.filter(status='PENDING').select_related('department')
+        )),
+        'LEAVE': sum(open_leave(application) for application in scoped(
+            LeaveApplication.objects.filter(status='PENDING').select_related('employee__department'),
+            'employee__business_id',
+        )),
+    }
+    executions = scoped(WorkflowStepExecution.objects.filter(
+        status='PENDING', assigned_to__isnull=False
+    ).select_related('instance__workflow', 'step'), 'instance__workflow__business_id')
+    added['WORKFLOW'] = open_requests([
+        ApprovalRequest(
+            business_id=e.instance.workflow.business_id, assignee_id=e.assigned_to_id, source_type='WORKFLOW',
+            source_id=e.id, title=f'{e.instance.workflow.name}: {e.step.name}', requested_by_id=e.instance.created_by_id,
+        )
+        for e in executions
+    ])
+    return added
+
+
+@receiver(post_delete, sender='erp.VendorBill')
+@receiver(post_delete, sender='erp.Budget')
+@receiver(post_delete, sender='erp.PurchaseRequisition')
+@receiver(post_delete, sender='erp.LeaveApplication')
+@receiver(post_delete, sender='erp.WorkflowStepExecution')
+def close_deleted_source(sender, instance, **kwargs):
+    """Deleted sources (directly or by cascade) leave every inbox they were in"""
+    close_requests(SOURCE_TYPES[sender.__name__], instance.id, 'CANCELLED')
+
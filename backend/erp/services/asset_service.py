@@ -0,0 +1,195 @@
+"""
+Fixed Asset Depreciation Service
+Monthly depreciation runs over a business' whole asset register
+"""
+import calendar
+from datetime import date
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Q, OuterRef, Subquery
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+DECLINING_FACTORS = {'DECLINING_BALANCE': Decimal('1'), 'DOUBLE_DECLINING': Decimal('2')}
+
+
+def compute_monthly_depreciation(methods, costs, salvages, lives, book_values):
+    """
+    One month's depreciation for parallel columns of asset data.
+    Straight line spreads (cost - salvage) evenly over the useful life;
+    declining balance applies 1x or 2x the straight-line rate to the
+    current book value. Charges never take an asset below its salvage
+    value. Methods without enough data (units of production) charge 0.
+    """
+    charges = []
+    for method, cost, salvage, life, book in zip(methods, costs, salvages, lives, book_values):
+        remaining = book - salvage
+        if remaining <= 0 or not life or life <= 0:
+            charges.append(Decimal('0'))
+            continue
+        months = Decimal(life * 12)
+        if method == 'STRAIGHT_LINE':
+            charge = (cost - salvage) / months
+        elif method in DECLINING_FACTORS:
+            charge = book * DECLINING_FACTORS[method] / months
+        else:
+            charge = Decimal('0')
+        charges.append(min(charge, remaining).quantize(CENT))
+    return charges
+
+
+class DepreciationRun:
+    """
+    Depreciates every active asset of a business for one calendar month.
+    Charges are computed column-wise for the whole register, written as
+    AssetDepreciation rows with one bulk insert, applied to the asset book
+    values with one UPDATE and posted as one journal entry per category.
+    Assets that already have a record for the month are skipped, so the
+    run can be repeated safely.
+    """
+
+    ACTIVE_STATUSES = ('ACTIVE', 'UNDER_MAINTENANCE')
+
+    def __init__(self, business, user, year, month):
+        self.business = business
+        self.user = user
+        self.period_start = date(year, month, 1)
+        self.period_end = date(year, month, calendar.monthrange(year, month)[1])
+
+    def run(self, dry_run=False):
+        from erp.models_extended import FixedAsset, AssetCategory, AssetDepreciation
+
+        started = timezone.now()
+        with transaction.atomic():
+            # Lock the register before checking for this month's records, so a
+            # concurrent run that held the locks has committed its rows by then
+            locked = list(
+                FixedAsset.objects.select_for_update()
+                .filter(
+                    business=self.business,
+                    status__in=self.ACTIVE_STATUSES,
+                    depreciation_start_date__lte=self.period_end,
+                )
+                .values_list('id', flat=True)
+            )
+            rows = list(
+                FixedAsset.objects.filter(id__in=locked)
+                .exclude(depreciation_records__period_start_date=self.period_start)
+                .values_list(
+                    'id', 'category_id', 'category__depreciation_method', 'purchase_price',
+                    'salvage_value', 'useful_life_years', 'accumulated_depreciation', 'current_book_value',
+                )
+            )
+            already_run = AssetDepreciation.objects.filter(
+                asset__business=self.business, period_start_date=self.period_start
+            ).count()
+            if not rows:
+                return self._summary([], {}, already_run, dry_run, started)
+
+            ids, category_ids, methods, costs, salvages, lives, accumulated, books = zip(*rows)
+            charges = compute_monthly_depreciation(methods, costs, salvages, lives, books)
+
+            by_category = {}
+            for index, charge in enumerate(charges):
+                if charge > 0:
+                    by_category.setdefault(category_ids[index], []).append(index)
+
+            if dry_run:
+                return self._summary(
+                    [(category_id, None, indexes) for category_id, indexes in by_category.items()],
+                    charges, already_run, dry_run, started,
+                )
+
+            categories = {
+                c['id']: c for c in AssetCategory.objects.filter(id__in=by_category).values(
+                    'id', 'name', 'depreciation_expense_account_id',
+                    'accumulated_depreciation_account_id', 'asset_account__store_id',
+                )
+            }
+            posted = []
+            records = []
+            now = timezone.now()
+            for category_id, indexes in by_category.items():
+                entry = self._post_category(categories[category_id], sum(charges[i] for i in indexes), len(indexes))
+                posted.append((category_id, entry, indexes))
+                for i in indexes:
+                    records.append(AssetDepreciation(
+                        asset_id=ids[i],
+                        period_start_date=self.period_start,
+                        period_end_date=self.period_end,
+                        opening_book_value=books[i],
+                        depreciation_amount=charges[i],
+                        accumulated_depreciation=accumulated[i] + charges[i],
+                        closing_book_value=books[i] - charges[i],
+                        journal_entry=entry,
+                        is_posted=True,
+                        posted_by=self.user,
+                        posted_at=now,
+                    ))
+            AssetDepreciation.objects.bulk_create(records, batch_size=2000)
+
+            entry_ids = [entry.id for _, entry, _ in posted]
+            charge = AssetDepreciation.objects.filter(
+                asset=OuterRef('pk'), journal_entry_id__in=entry_ids
+            ).values('depreciation_amount')[:1]
+            FixedAsset.objects.filter(
+                id__in=AssetDepreciation.objects.filter(journal_entry_id__in=entry_ids).values('asset_id')
+            ).update(
+                accumulated_depreciation=F('accumulated_depreciation') + Subquery(charge),
+                current_book_value=F('current_book_value') - Subquery(charge),
+                updated_at=now,
+            )
+            return self._summary(posted, charges, already_run, dry_run, started)
+
+    def _post_category(self, category, amount, asset_count):
+        from erp.models import JournalEntry
+        from erp.services.ledger_service import post_journal_entry
+
+        prefix = f"DEP{self.period_start:%y%m}-{category['id']}"
+        runs = JournalEntry.objects.filter(Q(entry_number=prefix) | Q(entry_number__startswith=f'{prefix}-')).count()
+        entry_number = prefix if not runs else f'{prefix}-{runs + 1}'
+        description = f"Depreciation {self.period_start:%B %Y} - {category['name']} ({asset_count} assets)"
+        return post_journal_entry(
+            category['asset_account__store_id'],
+            entry_number,
+            self.period_end,
+            description,
+            [
+                (category['depreciation_expense_account_id'], amount, 0, description),
+                (category['accumulated_depreciation_account_id'], 0, amount, description),
+            ],
+            self.user,
+            reference=f'DEPRECIATION {self.period_start:%Y-%m}',
+        )
+
+    def _summary(self, posted, charges, already_run, dry_run, started):
+        categories = []
+        total = Decimal('0')
+        assets = 0
+        for category_id, entry, indexes in posted:
+            amount = sum((charges[i] for i in indexes), Decimal('0'))
+            total += amount
+            assets += len(indexes)
+            categories.append({
+                'category': category_id,
+                'assets': len(indexes),
+                'amount': amount,
+                'journal_entry': entry.entry_number if entry else None,
+            })
+        duration = (timezone.now() - started).total_seconds()
+        logger.info(
+            f"Depreciation {self.period_start:%Y-%m} for business {self.business.id}: "
+            f"{assets} assets, {total} total in {duration:.2f}s{' (dry run)' if dry_run else ''}"
+        )
+        return {
+            'period_start': self.period_start,
+            'period_end': self.period_end,
+            'assets_depreciated': assets,
+            'already_depreciated': already_run,
+            'total_depreciation': total,
+            'categories': categories,
+            'dry_run': dry_run,
+        }
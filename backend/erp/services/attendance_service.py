@@ -0,0 +1,280 @@
+"""
+Attendance Ingestion Service
+Bulk upsert of daily attendance from API payloads and clock-device exports
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.utils import timezone
+import logging
+
+from erp.services.import_service import BaseImporter
+
+logger = logging.getLogger(__name__)
+
+HUNDREDTH = Decimal('0.01')
+
+
+def _minutes(value):
+    """Minutes since midnight for a time, or None"""
+    if value is None:
+        return None
+    return value.hour * 60 + value.minute
+
+
+def compute_attendance_metrics(check_ins, check_outs, shift_start, shift_end):
+    """
+    Compute worked, overtime, late and early-departure minutes for parallel
+    lists of check-in/check-out times against one shift window.
+    Works column-wise over the whole batch; a check-out earlier than the
+    check-in is treated as an overnight shift.
+    """
+    start = _minutes(shift_start)
+    end = _minutes(shift_end)
+    shift_length = (end - start) % 1440 or 1440
+
+    ins = [_minutes(t) for t in check_ins]
+    outs = [_minutes(t) for t in check_outs]
+    worked = [
+        (o - i) % 1440 if i is not None and o is not None else 0
+        for i, o in zip(ins, outs)
+    ]
+    return {
+        'worked': worked,
+        'overtime': [max(w - shift_length, 0) for w in worked],
+        'late': [max(i - start, 0) if i is not None else 0 for i in ins],
+        'early': [
+            max(end - o, 0) if o is not None and i is not None and o >= i else 0
+            for i, o in zip(ins, outs)
+        ],
+        'shift_length': shift_length,
+    }
+
+
+class AttendanceImporter(BaseImporter):
+    """
+    Upsert attendance records keyed by (employee, date).
+    Columns: employee_id (staff number) or employee (id), date, check_in,
+    check_out, status, remarks. Clock-device punch logs with a timestamp
+    column (employee_id, timestamp) are collapsed to one check-in/check-out
+    per shift before import: each employee's punches are taken in time
+    order and a shift runs from its first punch up to MAX_SHIFT_HOURS later,
+    so an overnight shift stays on the date it started.
+    """
+
+    required_columns = ('date',)
+    SHIFT_START = time(8, 0)
+    SHIFT_END = time(17, 0)
+    LATE_GRACE_MINUTES = 0
+    MAX_SHIFT_HOURS = 16
+    DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%Y/%m/%d', '%d-%m-%Y')
+    TIME_FORMATS = ('%H:%M:%S', '%H:%M')
+    update_fields = [
+        'check_in_time', 'check_out_time', 'status', 'hours_worked', 'overtime_hours',
+        'is_late', 'late_minutes', 'is_early_departure', 'early_departure_minutes',
+        'remarks', 'updated_at',
+    ]
+
+    def __init__(self, business, user=None, shift_start=None, shift_end=None, **kwargs):
+        super().__init__(business, user=user, **kwargs)
+        self.shift_start = shift_start or self.SHIFT_START
+        self.shift_end = shift_end or self.SHIFT_END
+
+    def load_lookups(self):
+        from erp.models import Employee
+
+        self.employees_by_code = {}
+        self.employee_ids = set()
+        for employee_id, code in Employee.objects.filter(business=self.business).values_list('id', 'employee_id'):
+            self.employees_by_code[code.strip().lower()] = employee_id
+            self.employee_ids.add(employee_id)
+
+    def import_records(self, records):
+        """Import a list of JSON records (dicts) and return a summary report"""
+        def rows():
+            for row_number, record in enumerate(records, start=1):
+                if not isinstance(record, dict):
+                    self.total_rows += 1
+                    self.add_error(row_number, 'Each record must be an object')
+                    continue
+                yield row_number, {
+                    str(key).strip().lower(): '' if value is None else str(value).strip()
+                    for key, value in record.items()
+                }
+
+        return self.import_rows(rows())
+
+    def import_rows(self, rows):
+        return super().import_rows(self._collapse_punches(rows))
+
+    def _collapse_punches(self, rows):
+        """Turn punch-log rows into one check-in/check-out row per employee shift"""
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return
+        if 'timestamp' not in first[1]:
+            yield first
+            yield from rows
+            return
+
+        punches = {}
+        for row_number, row in [first, *rows]:
+            try:
+                stamp = self.parse_datetime(row.get('timestamp'))
+            except ValueError as e:
+                self.add_error(row_number, str(e))
+                continue
+            employee = row.get('employee_id') or row.get('employee', '')
+            punches.setdefault(employee.lower(), []).append((stamp, row_number, employee))
+
+        max_shift = timedelta(hours=self.MAX_SHIFT_HOURS)
+        shifts = {}
+        for employee_punches in punches.values():
+            employee_punches.sort()
+            shift = None
+            for stamp, row_number, employee in employee_punches:
+                if shift is None or stamp - shift['first'] > max_shift:
+                    key = (employee.lower(), stamp.date())
+                    shift = shifts.get(key)
+                    if shift is None:
+                        shift = shifts[key] = {'row': row_number, 'employee': employee, 'first': stamp, 'last': stamp, 'punches': 0}
+                shift['last'] = stamp
+                shift['punches'] += 1
+
+        for (_, on_date), shift in shifts.items():
+            yield shift['row'], {
+                'employee_id': shift['employee'],
+                'date': on_date.isoformat(),
+                'check_in': shift['first'].strftime('%H:%M:%S'),
+                'check_out': shift['last'].strftime('%H:%M:%S') if shift['punches'] > 1 else '',
+            }
+
+    def process_chunk(self, chunk):
+        from erp.models_extended_part2 import AttendanceRecord
+
+        statuses = {choice for choice, _ in AttendanceRecord.STATUS_CHOICES}
+        parsed = []
+        for row_number, row in chunk:
+            try:
+                employee_id = self._resolve_employee(row)
+                on_date = self.parse_date(row.get('date'))
+                key = (employee_id, on_date)
+                if key in self.seen:
+                    raise ValueError(f'Duplicate attendance for {row.get("employee_id") or row.get("employee")} on {on_date}')
+                check_in = self.parse_time(row.get('check_in') or row.get('check_in_time'), 'check_in')
+                check_out = self.parse_time(row.get('check_out') or row.get('check_out_time'), 'check_out')
+                status = row.get('status', '').upper()
+                if status and status not in statuses:
+                    raise ValueError(f"Invalid status '{row.get('status')}'")
+            except ValueError as e:
+                self.add_error(row_number, str(e))
+                continue
+            self.seen.add(key)
+            parsed.append((employee_id, on_date, check_in, check_out, status, row.get('remarks', '')))
+
+        if not parsed:
+            return
+
+        employee_ids, dates, check_ins, check_outs, statuses_given, remarks = zip(*parsed)
+        metrics = compute_attendance_metrics(check_ins, check_outs, self.shift_start, self.shift_end)
+        half_shift = metrics['shift_length'] // 2
+
+        existing = set(AttendanceRecord.objects.filter(
+            employee_id__in=set(employee_ids), date__in=set(dates)
+        ).values_list('employee_id', 'date'))
+
+        now = timezone.now()
+        records = []
+        for index, (employee_id, on_date) in enumerate(zip(employee_ids, dates)):
+            worked = metrics['worked'][index]
+            late = metrics['late'][index]
+            early = metrics['early'][index]
+            status = statuses_given[index]
+            if not status:
+                if check_ins[index] is None:
+                    status = 'ABSENT'
+                elif check_outs[index] is not None and worked < half_shift:
+                    status = 'HALF_DAY'
+                else:
+                    status = 'PRESENT'
+            records.append(AttendanceRecord(
+                employee_id=employee_id,
+                date=on_date,
+                check_in_time=check_ins[index],
+                check_out_time=check_outs[index],
+                status=status,
+                hours_worked=(Decimal(worked) / 60).quantize(HUNDREDTH),
+                overtime_hours=(Decimal(metrics['overtime'][index]) / 60).quantize(HUNDREDTH),
+                is_late=late > self.LATE_GRACE_MINUTES,
+                late_minutes=late,
+                is_early_departure=early > 0,
+                early_departure_minutes=early,
+                remarks=remarks[index],
+                created_by=self.user,
+                updated_at=now,
+            ))
+
+        AttendanceRecord.objects.bulk_create(
+            records,
+            batch_size=self.chunk_size,
+            update_conflicts=True,
+            unique_fields=['employee', 'date'],
+            update_fields=self.update_fields,
+        )
+        updated = sum(1 for key in zip(employee_ids, dates) if key in existing)
+        self.updated += updated
+        self.created += len(records) - updated
+
+    def _resolve_employee(self, row):
+        code = row.get('employee_id', '')
+        if code:
+            employee_id = self.employees_by_code.get(code.lower())
+            if employee_id is None:
+                raise ValueError(f"Unknown employee '{code}'")
+            return employee_id
+        reference = row.get('employee', '')
+        if not reference:
+            raise ValueError('employee_id is required')
+        if reference.isdigit() and int(reference) in self.employee_ids:
+            return int(reference)
+        employee_id = self.employees_by_code.get(reference.lower())
+        if employee_id is None:
+            raise ValueError(f"Unknown employee '{reference}'")
+        return employee_id
+
+    # Field parsers -----------------------------------------------------------
+
+    @classmethod
+    def parse_date(cls, value):
+        value = (value or '').strip()
+        if not value:
+            raise ValueError('date is required')
+        for fmt in cls.DATE_FORMATS:
+            try:
+                return datetime.strptime(value[:10], fmt).date()
+            except ValueError:
+                continue
+        raise ValueError(f"Invalid date '{value}'")
+
+    @classmethod
+    def parse_time(cls, value, field):
+        value = (value or '').strip()
+        if not value:
+            return None
+        if len(value) > 8:
+            value = value.split()[-1]
+        for fmt in cls.TIME_FORMATS:
+            try:
+                return datetime.strptime(value, fmt).time()
+            except ValueError:
+                continue
+        raise ValueError(f"Invalid {field} time '{value}'")
+
+    @classmethod
+    def parse_datetime(cls, value):
+        value = (value or '').strip().replace('T', ' ')
+        if not value or ' ' not in value:
+            raise ValueError(f"Invalid timestamp '{value}'")
+        on_date, at_time = value.split(' ', 1)
+        at_time = cls.parse_time(at_time[:8], 'timestamp')
+        return datetime.combine(cls.parse_date(on_date), at_time)
@@ -0,0 +1,224 @@
+"""
+Budget Actuals Service
+Budget actuals aggregated from posted journal lines, cached per budget
+"""
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+import logging
+
+logger = logging.getLogger(__name__)
+
+CACHE_TIMEOUT = 60 * 60
+GENERATION_KEY = 'budget_actuals_generation:{business_id}'
+ACTUALS_KEY = 'budget_actuals:{budget_id}:{generation}'
+CREDIT_NORMAL_TYPES = ('REVENUE', 'LIABILITY', 'EQUITY')
+MAX_PERCENT = Decimal('999.99')
+
+
+def _generation(business_id):
+    return cache.get(GENERATION_KEY.format(business_id=business_id), 0)
+
+
+def invalidate_business(business_id):
+    """Drop every cached budget actual of a business by bumping its generation"""
+    key = GENERATION_KEY.format(business_id=business_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def invalidate_on_commit(business_id):
+    transaction.on_commit(lambda: invalidate_business(business_id))
+
+
+def _aggregate_actuals(account_ids, cost_center_ids, start_date, end_date):
+    """
+    Net posted movement per account, cost center and month for a date range,
+    read from the monthly ledger summary in one query. Periods are whole
+    months, so a range is widened to the months it touches.
+    Returns {(account_id, cost_center_id): {'total': Decimal, 'months': {'YYYY-MM': Decimal}}}
+    signed so that a normal balance is positive for the account type.
+    """
+    from erp.models import LedgerPeriodSummary
+
+    rows = LedgerPeriodSummary.objects.filter(
+        account_id__in=account_ids,
+        cost_center_id__in=cost_center_ids,
+        period__gte=LedgerPeriodSummary.period_of(start_date),
+        period__lte=end_date,
+    ).values('account_id', 'cost_center_id', 'account__account_type', 'period').annotate(
+        debit=Sum('debit'), credit=Sum('credit'),
+    ).order_by()
+
+    actuals = {}
+    for row in rows:
+        net = (row['debit'] or Decimal('0')) - (row['credit'] or Decimal('0'))
+        if row['account__account_type'] in CREDIT_NORMAL_TYPES:
+            net = -net
+        account = actuals.setdefault((row['account_id'], row['cost_center_id']), {'total': Decimal('0'), 'months': {}})
+        account['total'] += net
+        month = f"{row['period']:%Y-%m}"
+        account['months'][month] = account['months'].get(month, Decimal('0')) + net
+    return actuals
+
+
+def budget_actuals(budget):
+    """
+    Per-account actuals of a budget's cost center for its period, served from
+    cache until the next posting or budget, line or period edit.
+    """
+    key = ACTUALS_KEY.format(budget_id=budget.id, generation=_generation(budget.business_id))
+    actuals = cache.get(key)
+    if actuals is None:
+        actuals = {
+            account_id: totals for (account_id, _), totals in _aggregate_actuals(
+                budget.lines.values('account_id'), [budget.cost_center_id],
+                budget.period.start_date, budget.period.end_date,
+            ).items()
+        }
+        cache.set(key, actuals, CACHE_TIMEOUT)
+    return actuals
+
+
+def variance(budgeted, actual):
+    """(variance, variance_percent) with variance = budgeted - actual"""
+    amount = budgeted - actual
+    if not budgeted:
+        return amount, Decimal('0')
+    percent = (amount / budgeted * 100).quantize(Decimal('0.01'))
+    return amount, max(min(percent, MAX_PERCENT), -MAX_PERCENT)
+
+
+def variance_report(budget, monthly=False):
+    """Budget vs actual per line, using one query for the lines and the cached actuals"""
+    actuals = budget_actuals(budget)
+    lines = []
+    total_budgeted = Decimal('0')
+    total_actual = Decimal('0')
+    for line in budget.lines.values(
+        'id', 'account_id', 'account__code', 'account__name', 'account__account_type', 'budgeted_amount'
+    ).order_by('account__code'):
+        account = actuals.get(line['account_id'], {'total': Decimal('0'), 'months': {}})
+        amount, percent = variance(line['budgeted_amount'], account['total'])
+        total_budgeted += line['budgeted_amount']
+        total_actual += account['total']
+        row = {
+            'id': line['id'],
+            'account': line['account_id'],
+            'account_code': line['account__code'],
+            'account_name': line['account__name'],
+            'account_type': line['account__account_type'],
+            'budgeted_amount': line['budgeted_amount'],
+            'actual_amount': account['total'],
+            'variance_amount': amount,
+            'variance_percent': percent,
+        }
+        if monthly:
+            row['monthly_actuals'] = account['months']
+        lines.append(row)
+    amount, percent = variance(total_budgeted, total_actual)
+    return {
+        'budget_number': budget.budget_number,
+        'period_start': budget.period.start_date,
+        'period_end': budget.period.end_date,
+        'total_budgeted': total_budgeted,
+        'total_actual': total_actual,
+        'total_variance': amount,
+        'variance_percent': percent,
+        'lines': lines,
+    }
+
+
+def recompute_period(period):
+    """
+    Recompute and store actuals and variances for every budget in a period.
+    All budgets share the period's date range, so the actuals for every
+    budgeted account and cost center come from a single aggregate query;
+    lines and budgets are then written with bulk_update.
+    """
+    from erp.models_extended_part2 import Budget, BudgetLine
+
+    lines = list(BudgetLine.objects.filter(budget__period=period).only(
+        'id', 'budget_id', 'account_id', 'budgeted_amount', 'budget__cost_center'
+    ).select_related('budget'))
+    actuals = _aggregate_actuals(
+        {line.account_id for line in lines}, {line.budget.cost_center_id for line in lines},
+        period.start_date, period.end_date,
+    )
+
+    totals = {}
+    for line in lines:
+        key = (line.account_id, line.budget.cost_center_id)
+        line.actual_amount = actuals.get(key, {'total': Decimal('0')})['total']
+        line.variance_amount, line.variance_percent = variance(line.budgeted_amount, line.actual_amount)
+        budget_totals = totals.setdefault(line.budget_id, [Decimal('0'), Decimal('0')])
+        budget_totals[0] += line.budgeted_amount
+        budget_totals[1] += line.actual_amount
+
+    budgets = list(Budget.objects.filter(period=period).only(
+        'id', 'total_budget_amount', 'total_actual_amount', 'variance_amount', 'variance_percent'
+    ))
+    for budget in budgets:
+        budgeted, actual = totals.get(budget.id, (Decimal('0'), Decimal('0')))
+        budget.total_budget_amount = budgeted
+        budget.total_actual_amount = actual
+        budget.variance_amount, budget.variance_percent = variance(budgeted, actual)
+
+    with transaction.atomic():
+        BudgetLine.objects.bulk_update(
+            lines, ['actual_amount', 'variance_amount', 'variance_percent'], batch_size=1000
+        )
+        Budget.objects.bulk_update(
+            budgets, ['total_budget_amount', 'total_actual_amount', 'variance_amount', 'variance_percent'], batch_size=1000
+        )
+    logger.info(f"Recomputed actuals for {len(budgets)} budgets / {len(lines)} lines in period {period.id}")
+    return {'budgets': len(budgets), 'lines': len(lines)}
+
+
+def _store_business_id(store_id):
+    from erp.models import Store
+
+    return Store.objects.filter(id=store_id).values_list('business_id', flat=True).first()
+
+
+@receiver(post_save, sender='erp.JournalEntry')
+@receiver(post_delete, sender='erp.JournalEntry')
+def invalidate_budget_actuals(sender, instance, **kwargs):
+    business_id = _store_business_id(instance.store_id)
+    if business_id:
+        invalidate_on_commit(business_id)
+
+
+@receiver(post_save, sender='erp.JournalEntryLine')
+@receiver(post_delete, sender='erp.JournalEntryLine')
+def invalidate_budget_actuals_for_line(sender, instance, **kwargs):
+    from erp.models import JournalEntry
+
+    store_id = JournalEntry.objects.filter(id=instance.journal_entry_id).values_list('store_id', flat=True).first()
+    business_id = _store_business_id(store_id) if store_id else None
+    if business_id:
+        invalidate_on_commit(business_id)
+
+
+@receiver(post_save, sender='erp.Budget')
+@receiver(post_delete, sender='erp.Budget')
+@receiver(post_save, sender='erp.BudgetPeriod')
+@receiver(post_delete, sender='erp.BudgetPeriod')
+def invalidate_budget_actuals_for_budget(sender, instance, **kwargs):
+    """A budget's cost center or lines, or its period's dates, decide which actuals it reads"""
+    invalidate_on_commit(instance.business_id)
+
+
+@receiver(post_save, sender='erp.BudgetLine')
+@receiver(post_delete, sender='erp.BudgetLine')
+def invalidate_budget_actuals_for_budget_line(sender, instance, **kwargs):
+    from erp.models_extended_part2 import Budget
+
+    business_id = Budget.objects.filter(id=instance.budget_id).values_list('business_id', flat=True).first()
+    if business_id:
+        invalidate_on_commit(business_id)
@@ -0,0 +1,409 @@
+"""
+Document Store Service
+Resumable chunked uploads into SHA-256 addressed blobs, and the precomputed per-user document access list
+"""
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+import hashlib
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+HASH_BLOCK_SIZE = 1024 * 1024
+MAX_UPLOAD_SIZE = 2 * 1024 * 1024 * 1024
+VERSION_SUFFIX = re.compile(r'-V(\d+)$')
+
+
+class DocumentStoreError(Exception):
+    pass
+
+
+def file_sha256(fileobj):
+    """Hex SHA-256 of a file, read in blocks so large scans are never held in memory"""
+    digest = hashlib.sha256()
+    for block in File(fileobj).chunks(HASH_BLOCK_SIZE):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def blob_name(sha256):
+    return f'documents/blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+
+
+def store_blob(fileobj, content_type='', sha256=None):
+    """
+    Blob holding the content of a file, writing the bytes to storage only when
+    no identical content is stored yet. Returns (blob, created).
+    """
+    from erp.models_extended_part2 import DocumentBlob
+
+    fileobj = File(fileobj) if not isinstance(fileobj, File) else fileobj
+    sha256 = sha256 or file_sha256(fileobj)
+    blob = DocumentBlob.objects.filter(sha256=sha256).first()
+    if blob:
+        return blob, False
+
+    fileobj.seek(0)
+    name = default_storage.save(blob_name(sha256), fileobj)
+    try:
+        with transaction.atomic():
+            blob = DocumentBlob.objects.create(
+                sha256=sha256, file=name, size=fileobj.size, content_type=(content_type or '')[:100],
+            )
+    except IntegrityError:
+        # a concurrent upload of the same content got there first
+        default_storage.delete(name)
+        return DocumentBlob.objects.get(sha256=sha256), False
+    logger.info('Stored blob %s (%s bytes)', sha256, blob.size)
+    return blob, True
+
+
+def blob_fields(blob, file_type=''):
+    """Document fields pointing at a blob; the file is shared, not copied"""
+    return {
+        'blob': blob,
+        'file': blob.file.name,
+        'file_size': blob.size,
+        'file_type': (file_type or blob.content_type or 'application/octet-stream')[:50],
+    }
+
+
+def _upload_dir():
+    return getattr(settings, 'DOCUMENT_UPLOAD_TEMP_DIR', None) or os.path.join(
+        settings.MEDIA_ROOT, 'documents', 'uploads'
+    )
+
+
+def part_path(upload):
+    return os.path.join(_upload_dir(), f'{upload.upload_id}.part')
+
+
+def prepare_upload(upload):
+    """
+    Set up a new upload session. When the client sent the digest of content
+    the user can already read (a document on their access list or one of
+    their own completed uploads) the upload completes at once and no bytes
+    need to be sent; any other digest still has to be uploaded and is checked
+    against the bytes on completion, so knowing a hash never grants a blob.
+    """
+    from erp.models_extended_part2 import DocumentBlob, DocumentUpload
+
+    max_size = getattr(settings, 'DOCUMENT_UPLOAD_MAX_SIZE', MAX_UPLOAD_SIZE)
+    if upload.total_size <= 0 or upload.total_size > max_size:
+        raise DocumentStoreError(f'File size must be between 1 and {max_size} bytes')
+
+    if upload.sha256:
+        user = upload.created_by
+        blob = DocumentBlob.objects.filter(sha256=upload.sha256.lower(), size=upload.total_size).filter(
+            Exists(accessible_documents(user).filter(blob=OuterRef('pk')))
+            | Exists(DocumentUpload.objects.filter(blob=OuterRef('pk'), created_by=user, status='COMPLETED'))
+        ).first()
+        if blob:
+            upload.blob = blob
+            upload.status = 'COMPLETED'
+            upload.received_size = upload.total_size
+            upload.save(update_fields=['blob', 'status', 'received_size', 'updated_at'])
+            return upload
+
+    os.makedirs(_upload_dir(), exist_ok=True)
+    open(part_path(upload), 'wb').close()
+    return upload
+
+
+def append_chunk(upload, offset, chunk):
+    """
+    Write a chunk at the given byte offset, which must be the number of bytes
+    already received; a client resumes by reading received_size and sending
+    from there. Returns the updated upload.
+    """
+    from erp.models_extended_part2 import DocumentUpload
+
+    with transaction.atomic():
+        upload = DocumentUpload.objects.select_for_update().get(pk=upload.pk)
+        if upload.status != 'UPLOADING':
+            raise DocumentStoreError(f'Upload is {upload.status.lower()}')
+        if offset != upload.received_size:
+            raise DocumentStoreError(f'Expected a chunk at offset {upload.received_size}')
+        if offset + chunk.size > upload.total_size:
+            raise DocumentStoreError('Chunk runs past the declared file size')
+
+        # bytes past the offset are left over from an interrupted request
+        with open(part_path(upload), 'r+b') as part:
+            part.seek(offset)
+            for block in chunk.chunks(HASH_BLOCK_SIZE):
+                part.write(block)
+            part.truncate()
+
+        upload.received_size = offset + chunk.size
+        upload.save(update_fields=['received_size', 'updated_at'])
+    return upload
+
+
+def complete_upload(upload):
+    """Hash the assembled file and move it into the blob store; returns the blob"""
+    from erp.models_extended_part2 import DocumentUpload
+
+    with transaction.atomic():
+        upload = DocumentUpload.objects.select_for_update().get(pk=upload.pk)
+        if upload.status == 'COMPLETED':
+            return upload.blob
+        if upload.status != 'UPLOADING':
+            raise DocumentStoreError(f'Upload is {upload.status.lower()}')
+        if upload.received_size != upload.total_size:
+            raise DocumentStoreError(f'Only {upload.received_size} of {upload.total_size} bytes received')
+
+        path = part_path(upload)
+        with open(path, 'rb') as part:
+            sha256 = file_sha256(part)
+            if upload.sha256 and upload.sha256.lower() != sha256:
+                raise DocumentStoreError('Uploaded content does not match the declared SHA-256')
+            blob, _ = store_blob(part, upload.content_type, sha256)
+
+        upload.blob = blob
+        upload.status = 'COMPLETED'
+        upload.save(update_fields=['blob', 'status', 'updated_at'])
+        transaction.on_commit(lambda: _remove_part(path))
+    return blob
+
+
+def abort_upload(upload):
+    upload.status = 'ABORTED'
+    upload.save(update_fields=['status', 'updated_at'])
+    _remove_part(part_path(upload))
+    return upload
+
+
+def _remove_part(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def source_blob(user, file=None, upload_id=None):
+    """Blob for a document write: a direct file upload or a completed chunked upload of the user"""
+    from erp.models_extended_part2 import DocumentUpload
+
+    if file is not None:
+        return store_blob(file, getattr(file, 'content_type', ''))[0]
+    if not upload_id:
+        raise DocumentStoreError('Upload a file or pass the upload_id of a completed chunked upload')
+    upload = DocumentUpload.objects.filter(
+        upload_id=upload_id, created_by=user, status='COMPLETED'
+    ).select_related('blob').first()
+    if upload is None:
+        raise DocumentStoreError('Upload not found or not completed')
+    return upload.blob
+
+
+def next_version_number(document_number):
+    """DOC-1 -> DOC-1-V2 -> DOC-1-V3, kept within the 20 character field"""
+    match = VERSION_SUFFIX.search(document_number)
+    base = document_number[:match.start()] if match else document_number
+    suffix = f'-V{int(match.group(1)) + 1 if match else 2}'
+    return base[:20 - len(suffix)] + suffix
+
+
+def create_version(document, blob, user, description=None, version=None, file_type=''):
+    """
+    Add a new latest version of a document with the same access rules. The
+    current row is locked so two concurrent uploads cannot both become latest.
+    """
+    from erp.models_extended_part2 import Document
+
+    with transaction.atomic():
+        current = Document.objects.select_for_update().get(pk=document.pk)
+        if not current.is_latest_version:
+            raise DocumentStoreError('New versions can only be added to the latest version')
+        Document.objects.filter(pk=current.pk).update(is_latest_version=False)
+
+        document_number = next_version_number(current.document_number)
+        new_version = Document.objects.create(
+            business=current.business,
+            document_number=document_number,
+            title=current.title,
+            description=current.description if description is None else description,
+            category=current.category,
+            version=version or f'{document_number.rsplit("-V", 1)[1]}.0',
+            previous_version=current,
+            is_latest_version=True,
+            is_public=current.is_public,
+            tags=current.tags,
+            created_by=user,
+            **blob_fields(blob, file_type),
+        )
+        new_version.allowed_departments.set(current.allowed_departments.all())
+        new_version.allowed_users.set(current.allowed_users.all())
+    return new_version
+
+
+def accessible_documents(user):
+    """Documents of the user's business that are public or on the user's access list"""
+    from erp.models_extended_part2 import Document, DocumentAccess
+
+    return Document.objects.filter(business=user.business_id).filter(
+        Q(is_public=True) | Exists(DocumentAccess.objects.filter(document=OuterRef('pk'), user=user))
+    )
+
+
+def _department_members(department_ids):
+    from erp.models import Employee
+
+    members = {}
+    for department_id, user_id in Employee.objects.filter(
+        department_id__in=department_ids, is_active=True
+    ).values_list('department_id', 'user_id'):
+        members.setdefault(department_id, set()).add(user_id)
+    return members
+
+
+def rebuild_document_access(document_ids):
+    """
+    Recompute the access list of documents from their creator, allowed users
+    and the members of their allowed departments; returns the rows written.
+    """
+    from erp.models_extended_part2 import Document, DocumentAccess
+
+    document_ids = list(document_ids)
+    if not document_ids:
+        return 0
+    grants = {
+        document_id: {created_by_id}
+        for document_id, created_by_id in Document.objects.filter(id__in=document_ids).values_list('id', 'created_by_id')
+    }
+    for document_id, user_id in Document.allowed_users.through.objects.filter(
+        document_id__in=document_ids
+    ).values_list('document_id', 'user_id'):
+        grants[document_id].add(user_id)
+    departments = list(Document.allowed_departments.through.objects.filter(
+        document_id__in=document_ids
+    ).values_list('document_id', 'department_id'))
+    members = _department_members({department_id for _, department_id in departments})
+    for document_id, department_id in departments:
+        grants[document_id] |= members.get(department_id, set())
+
+    DocumentAccess.objects.filter(document_id__in=document_ids).delete()
+    rows = [DocumentAccess(document_id=d, user_id=u) for d, users in grants.items() for u in users]
+    DocumentAccess.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def rebuild_user_access(user_ids):
+    """Recompute the access list rows of users, e.g. after they change department"""
+    from erp.models import Employee
+    from erp.models_extended_part2 import Document, DocumentAccess
+
+    user_ids = list(user_ids)
+    if not user_ids:
+        return 0
+    grants = {user_id: set() for user_id in user_ids}
+    for document_id, user_id in Document.objects.filter(created_by_id__in=user_ids).values_list('id', 'created_by_id'):
+        grants[user_id].add(document_id)
+    for document_id, user_id in Document.allowed_users.through.objects.filter(
+        user_id__in=user_ids
+    ).values_list('document_id', 'user_id'):
+        grants[user_id].add(document_id)
+    departments = {}
+    for user_id, department_id in Employee.objects.filter(
+        user_id__in=user_ids, department__isnull=False, is_active=True
+    ).values_list('user_id', 'department_id'):
+        departments.setdefault(department_id, []).append(user_id)
+    for document_id, department_id in Document.allowed_departments.through.objects.filter(
+        department_id__in=departments
+    ).values_list('document_id', 'department_id'):
+        for user_id in departments[department_id]:
+            grants[user_id].add(document_id)
+
+    DocumentAccess.objects.filter(user_id__in=user_ids).delete()
+    rows = [DocumentAccess(document_id=d, user_id=u) for u, documents in grants.items() for d in documents]
+    DocumentAccess.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def rebuild(business_id=None, batch_size=500):
+    """Recompute the whole access list (or one business's); returns the rows written"""
+    from erp.models_extended_part2 import Document
+
+    documents = Document.objects.order_by('id')
+    if business_id:
+        documents = documents.filter(business_id=business_id)
+    document_ids = list(documents.values_list('id', flat=True))
+    return sum(
+        rebuild_document_access(document_ids[start:start + batch_size])
+        for start in range(0, len(document_ids), batch_size)
+    )
+
+
+@receiver(post_save, sender='erp.Document')
+def grant_creator_access(sender, instance, created, raw=False, **kwargs):
+    from erp.models_extended_part2 import DocumentAccess
+
+    if created and not raw:
+        DocumentAccess.objects.bulk_create(
+            [DocumentAccess(document_id=instance.pk, user_id=instance.created_by_id)], ignore_conflicts=True
+        )
+
+
+@receiver(m2m_changed, sender='erp.Document_allowed_users')
+@receiver(m2m_changed, sender='erp.Document_allowed_departments')
+def sync_document_access(sender, instance, action, reverse, pk_set, **kwargs):
+    from erp.models import Department
+
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        rebuild_document_access([instance.pk])
+    elif action != 'post_clear':
+        rebuild_document_access(pk_set)
+    elif isinstance(instance, Department):
+        rebuild_user_access(_department_members([instance.pk]).get(instance.pk, ()))
+    else:
+        rebuild_user_access([instance.pk])
+
+
+@receiver(post_init, sender='erp.Employee')
+def remember_department(sender, instance, **kwargs):
+    instance._document_department_id = instance.__dict__.get('department_id')
+    instance._document_is_active = instance.__dict__.get('is_active')
+
+
+@receiver(post_save, sender='erp.Employee')
+def sync_employee_access(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    moved = (instance.department_id, instance.is_active) != (
+        instance._document_department_id, instance._document_is_active
+    )
+    if created or moved:
+        rebuild_user_access([instance.user_id])
+    instance._document_department_id = instance.department_id
+    instance._document_is_active = instance.is_active
+
+
+@receiver(post_delete, sender='erp.Employee')
+def revoke_employee_access(sender, instance, **kwargs):
+    from erp.models_extended_part2 import Document
+
+    # rebuilt per document since the user row may be going away with the employee
+    if instance.department_id:
+        rebuild_document_access(Document.allowed_departments.through.objects.filter(
+            department_id=instance.department_id
+        ).values_list('document_id', flat=True))
+
+
+@receiver(pre_delete, sender='erp.Department')
+def remember_department_members(sender, instance, **kwargs):
+    # SET_NULL on employees and the cascade of allowed_departments rows send no signals
+    instance._document_members = _department_members([instance.pk]).get(instance.pk, set())
+
+
+@receiver(post_delete, sender='erp.Department')
+def revoke_department_access(sender, instance, **kwargs):
+    rebuild_user_access(getattr(instance, '_document_members', ()))
@@ -0,0 +1,338 @@
+"""
+Online Order Fulfilment Service
+Converts paid online orders into sales orders, delivery notes and stock movements in bulk
+"""
+from datetime import timedelta
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Case, When, Value, DecimalField
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+QUANTITY_FIELD = DecimalField(max_digits=15, decimal_places=2)
+
+
+class FulfilmentError(Exception):
+    """Raised when online orders cannot be fulfilled"""
+    pass
+
+
+class OnlineOrderFulfilment:
+    """
+    Picks up paid online orders of a business that have no sales order yet
+    and, one batch per transaction, writes their SalesOrders, items,
+    DeliveryNotes and note items with bulk inserts. Stock held for an order
+    and already converted at payment is delivered as is; any remaining
+    quantity is allocated across warehouses in one in-memory pass over the
+    batch's locked stock records and applied with one UPDATE. Orders are
+    claimed with sales_order IS NULL, so re-running (or running twice in
+    parallel) never fulfils an order twice; orders that cannot be covered
+    by stock are left for a later run.
+    """
+
+    ELIGIBLE_STATUSES = ('PAID', 'PROCESSING')
+    DELIVERY_DAYS = 3
+
+    def __init__(self, business, user, batch_size=500):
+        if user is None:
+            raise FulfilmentError('A user is required to create sales orders and stock movements')
+        self.business = business
+        self.user = user
+        self.batch_size = batch_size
+
+    def pending_orders(self):
+        from erp.models_ecommerce import OnlineOrder
+
+        return OnlineOrder.objects.filter(
+            website__business=self.business,
+            payment_status='COMPLETED',
+            status__in=self.ELIGIBLE_STATUSES,
+            sales_order__isnull=True,
+        )
+
+    def run(self, dry_run=False, limit=None):
+        started = timezone.now()
+        summary = {'orders_fulfilled': 0, 'orders_short': 0, 'sales_orders': [], 'batches': 0, 'dry_run': dry_run}
+        if dry_run:
+            summary['orders_pending'] = self.pending_orders().count()
+            return summary
+
+        skipped = set()
+        while limit is None or summary['orders_fulfilled'] < limit:
+            size = self.batch_size if limit is None else min(self.batch_size, limit - summary['orders_fulfilled'])
+            fulfilled, short = self._run_batch(size, skipped)
+            if not fulfilled and not short:
+                break
+            summary['batches'] += 1
+            summary['orders_fulfilled'] += len(fulfilled)
+            summary['orders_short'] += len(short)
+            summary['sales_orders'].extend(fulfilled)
+            skipped.update(short)
+
+        duration = (timezone.now() - started).total_seconds()
+        logger.info(
+            f"Fulfilled {summary['orders_fulfilled']} online orders for business {self.business.id} "
+            f"in {summary['batches']} batches ({summary['orders_short']} short of stock) in {duration:.2f}s"
+        )
+        return summary
+
+    def _run_batch(self, size, skipped):
+        from erp.models_ecommerce import OnlineOrder, OnlineOrderItem, StockReservation
+
+        with transaction.atomic():
+            orders = list(
+                self.pending_orders().exclude(id__in=skipped)
+                .select_for_update(skip_locked=True, of=('self',))
+                .order_by('paid_at', 'id')
+                .values(
+                    'id', 'order_number', 'customer_id', 'guest_email', 'guest_name', 'guest_phone',
+                    'subtotal', 'tax_amount', 'discount_amount', 'shipping_cost', 'total_amount', 'currency_id',
+                    'shipping_address', 'shipping_city', 'shipping_province', 'paid_at', 'created_at',
+                    'estimated_delivery_date',
+                )[:size]
+            )
+            if not orders:
+                return [], []
+            order_ids = [o['id'] for o in orders]
+            items = list(OnlineOrderItem.objects.filter(order_id__in=order_ids).order_by('id').values(
+                'id', 'order_id', 'quantity', 'unit_price', 'discount_amount', 'tax_amount', 'total_price',
+                'website_product__product_id', 'website_product__product__name', 'website_product__product__sku',
+            ))
+            converted = {}
+            for order_id, product_id, quantity in StockReservation.objects.filter(
+                order_id__in=order_ids, status='CONVERTED'
+            ).values_list('order_id', 'website_product__product_id', 'quantity'):
+                key = (order_id, product_id)
+                converted[key] = converted.get(key, Decimal('0')) + quantity
+
+            allocation, short = self._allocate(orders, items, converted)
+            orders = [o for o in orders if o['id'] not in short]
+            if not orders:
+                return [], sorted(short)
+            items = [i for i in items if i['order_id'] not in short]
+
+            customers = self._customers(orders)
+            sales_orders = self._create_sales_orders(orders, customers)
+            so_items = self._create_sales_order_items(items, sales_orders)
+            self._create_delivery_notes(orders, sales_orders, so_items)
+            self._apply_stock(allocation, orders)
+
+            OnlineOrder.objects.filter(id__in=sales_orders).update(
+                sales_order_id=Case(
+                    *[When(id=order_id, then=Value(so.id)) for order_id, so in sales_orders.items()],
+                ),
+                status='PROCESSING',
+                updated_at=timezone.now(),
+            )
+        return [so.order_number for so in sales_orders.values()], sorted(short)
+
+    def _allocate(self, orders, items, converted):
+        """
+        Allocate the quantity not already taken at payment across warehouses,
+        most stocked first, for the whole batch at once.
+        Returns ({order_id: [(record_id, item_id, warehouse_id, unit_cost, quantity)]}, short_order_ids).
+        """
+        from erp.models import StockRecord
+
+        needed = {}
+        for item in items:
+            key = (item['order_id'], item['website_product__product_id'])
+            taken = min(converted.get(key, Decimal('0')), item['quantity'])
+            converted[key] = converted.get(key, Decimal('0')) - taken
+            if item['quantity'] > taken:
+                needed.setdefault(item['order_id'], []).append((item['website_product__product__sku'], item['quantity'] - taken))
+        if not needed:
+            return {}, set()
+
+        skus = {sku for lines in needed.values() for sku, _ in lines}
+        records = {}
+        for record_id, sku, item_id, warehouse_id, available, unit_cost in StockRecord.objects.filter(
+            item__business=self.business, item__sku__in=skus, item__is_active=True,
+            warehouse__is_active=True, available_quantity__gt=0,
+        ).select_for_update(of=('self',)).order_by('-available_quantity', 'id').values_list(
+            'id', 'item__sku', 'item_id', 'warehouse_id', 'available_quantity', 'item__purchase_price',
+        ):
+            records.setdefault(sku, []).append([record_id, item_id, warehouse_id, unit_cost, available])
+
+        allocation = {}
+        short = set()
+        for order in orders:
+            lines = needed.get(order['id'])
+            if not lines:
+                continue
+            picks = []
+            missing = Decimal('0')
+            for sku, quantity in lines:
+                for record in records.get(sku, []):
+                    if not quantity:
+                        break
+                    take = min(quantity, record[4])
+                    if take > 0:
+                        record[4] -= take
+                        quantity -= take
+                        picks.append((record, take))
+                missing += quantity
+            if missing:
+                # give the order's picks back so later orders in the batch can use them
+                for record, take in picks:
+                    record[4] += take
+                short.add(order['id'])
+            else:
+                allocation[order['id']] = [(record[0], record[1], record[2], record[3], take) for record, take in picks]
+        return allocation, short
+
+    def _customers(self, orders):
+        """Customer per order, creating one per guest email in bulk"""
+        from erp.models import Customer
+
+        customers = {o['id']: o['customer_id'] for o in orders if o['customer_id']}
+        guests = {_guest_email(o): o for o in orders if not o['customer_id']}
+        if guests:
+            existing = dict(Customer.objects.filter(business=self.business, email__in=guests).values_list('email', 'id'))
+            missing = [
+                Customer(
+                    business=self.business, name=o['guest_name'] or email, email=email,
+                    phone=o['guest_phone'], address=o['shipping_address'],
+                )
+                for email, o in guests.items() if email not in existing
+            ]
+            Customer.objects.bulk_create(missing)
+            if missing and missing[0].pk is None:
+                existing = dict(Customer.objects.filter(business=self.business, email__in=guests).values_list('email', 'id'))
+            else:
+                existing.update((c.email, c.pk) for c in missing)
+            for o in orders:
+                if not o['customer_id']:
+                    customers[o['id']] = existing[_guest_email(o)]
+        return customers
+
+    def _create_sales_orders(self, orders, customers):
+        from erp.models_extended import SalesOrder
+
+        today = timezone.now().date()
+        sales_orders = {}
+        for o in orders:
+            order_date = (o['paid_at'] or o['created_at']).date()
+            sales_orders[o['id']] = SalesOrder(
+                business=self.business,
+                order_number=f"SO-WEB-{o['id']}",
+                customer_id=customers[o['id']],
+                order_date=order_date,
+                expected_delivery_date=o['estimated_delivery_date'] or today + timedelta(days=self.DELIVERY_DAYS),
+                subtotal=o['subtotal'],
+                tax_amount=o['tax_amount'],
+                discount_amount=o['discount_amount'],
+                shipping_cost=o['shipping_cost'],
+                total_amount=o['total_amount'],
+                currency_id=o['currency_id'],
+                delivery_address=f"{o['shipping_address']}, {o['shipping_city']}, {o['shipping_province']}",
+                delivery_contact_person=o['guest_name'] or '',
+                delivery_contact_phone=o['guest_phone'] or '',
+                payment_terms='Paid online',
+                notes=f"Online order {o['order_number']}",
+                status='CONFIRMED',
+                created_by=self.user,
+            )
+        SalesOrder.objects.bulk_create(sales_orders.values())
+        if any(so.pk is None for so in sales_orders.values()):
+            ids = dict(SalesOrder.objects.filter(
+                order_number__in=[so.order_number for so in sales_orders.values()]
+            ).values_list('order_number', 'id'))
+            for so in sales_orders.values():
+                so.pk = ids[so.order_number]
+        return sales_orders
+
+    def _create_sales_order_items(self, items, sales_orders):
+        from erp.models_extended import SalesOrderItem
+
+        so_items = [
+            SalesOrderItem(
+                sales_order_id=sales_orders[i['order_id']].pk,
+                product_id=i['website_product__product_id'],
+                description=i['website_product__product__name'][:200],
+                quantity_ordered=i['quantity'],
+                unit_price=i['unit_price'],
+                discount_amount=i['discount_amount'],
+                tax_amount=i['tax_amount'],
+                total_amount=i['total_price'],
+            )
+            for i in items
+        ]
+        SalesOrderItem.objects.bulk_create(so_items, batch_size=1000)
+        if so_items and so_items[0].pk is None:
+            # fall back for backends that do not return ids from bulk inserts
+            saved = list(SalesOrderItem.objects.filter(
+                sales_order_id__in=[so.pk for so in sales_orders.values()]
+            ).order_by('id').values_list('id', flat=True))
+            for so_item, pk in zip(so_items, saved):
+                so_item.pk = pk
+        return so_items
+
+    def _create_delivery_notes(self, orders, sales_orders, so_items):
+        from erp.models_extended import DeliveryNote, DeliveryNoteItem
+
+        notes = {
+            o['id']: DeliveryNote(
+                business=self.business,
+                delivery_note_number=f"DN-WEB-{o['id']}",
+                sales_order_id=sales_orders[o['id']].pk,
+                delivery_date=sales_orders[o['id']].expected_delivery_date,
+                notes=f"Online order {o['order_number']}",
+                created_by=self.user,
+            )
+            for o in orders
+        }
+        DeliveryNote.objects.bulk_create(notes.values())
+        if any(note.pk is None for note in notes.values()):
+            ids = dict(DeliveryNote.objects.filter(
+                delivery_note_number__in=[n.delivery_note_number for n in notes.values()]
+            ).values_list('delivery_note_number', 'id'))
+            for note in notes.values():
+                note.pk = ids[note.delivery_note_number]
+        by_sales_order = {so.pk: order_id for order_id, so in sales_orders.items()}
+        DeliveryNoteItem.objects.bulk_create([
+            DeliveryNoteItem(
+                delivery_note_id=notes[by_sales_order[so_item.sales_order_id]].pk,
+                sales_order_item_id=so_item.pk,
+                quantity_delivered=so_item.quantity_ordered,
+            )
+            for so_item in so_items
+        ], batch_size=1000)
+
+    def _apply_stock(self, allocation, orders):
+        """Take allocated stock off the records with one UPDATE and record OUT movements"""
+        from erp.models import StockRecord, StockMovement
+
+        numbers = {o['id']: o['order_number'] for o in orders}
+        totals = {}
+        movements = []
+        for order_id, picks in allocation.items():
+            for record_id, item_id, warehouse_id, unit_cost, quantity in picks:
+                totals[record_id] = totals.get(record_id, Decimal('0')) + quantity
+                movements.append(StockMovement(
+                    item_id=item_id, warehouse_id=warehouse_id, movement_type='OUT', quantity=quantity,
+                    unit_cost=unit_cost, total_cost=quantity * unit_cost,
+                    reference=f'Online order {numbers[order_id]}', notes='Online order fulfilment',
+                    created_by=self.user,
+                ))
+        if not totals:
+            return
+        delta = Case(
+            *[When(id=record_id, then=Value(quantity)) for record_id, quantity in totals.items()],
+            default=Value(Decimal('0')),
+            output_field=QUANTITY_FIELD,
+        )
+        StockRecord.objects.filter(id__in=totals).update(
+            quantity=F('quantity') - delta,
+            available_quantity=F('available_quantity') - delta,
+            last_updated=timezone.now(),
+        )
+        # bulk_create skips StockMovement.save, which would apply the quantity to the record again
+        StockMovement.objects.bulk_create(movements, batch_size=1000)
+
+
+def _guest_email(order):
+    """Email a guest order's customer is filed under; orders without one get their own customer"""
+    return (order['guest_email'] or f"guest-{order['order_number']}@online.invalid").lower()
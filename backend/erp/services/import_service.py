@@ -0,0 +1,470 @@
+"""
+Bulk Import Services
+Chunked CSV/XLSX import for products, customers and opening stock
+"""
+import csv
+import io
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from django.db.models import F, Case, When, Value, DecimalField
+from django.db.models.functions import Lower
+from django.core.validators import validate_email
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 2000
+MAX_REPORTED_ERRORS = 1000
+QUANTITY_FIELD = DecimalField(max_digits=15, decimal_places=2)
+
+
+class ImportFileError(Exception):
+    """Raised when an uploaded import file cannot be read"""
+    pass
+
+
+def iter_import_rows(uploaded_file):
+    """
+    Yield (row_number, row_dict) tuples from a CSV or XLSX upload.
+    Header names are lower-cased and stripped; rows are streamed so that
+    memory stays bounded regardless of file size.
+    """
+    name = (getattr(uploaded_file, 'name', '') or '').lower()
+    if name.endswith('.xlsx') or name.endswith('.xlsm'):
+        return _iter_xlsx_rows(uploaded_file)
+    if name.endswith('.csv') or name.endswith('.txt') or not name:
+        return _iter_csv_rows(uploaded_file)
+    raise ImportFileError('Unsupported file type. Upload a .csv or .xlsx file.')
+
+
+def _normalize_header(header):
+    return [str(h or '').strip().lower().replace(' ', '_') for h in header]
+
+
+def _iter_csv_rows(uploaded_file):
+    uploaded_file.seek(0)
+    stream = io.TextIOWrapper(uploaded_file, encoding='utf-8-sig', newline='')
+    try:
+        reader = csv.reader(stream)
+        try:
+            header = _normalize_header(next(reader))
+        except StopIteration:
+            return
+        for row_number, values in enumerate(reader, start=2):
+            if not any(v.strip() for v in values):
+                continue
+            yield row_number, dict(zip(header, (v.strip() for v in values)))
+    except UnicodeDecodeError:
+        raise ImportFileError(
+            f'Could not read CSV file near row {reader.line_num + 1}: the file is not UTF-8 encoded. '
+            'Save it as "CSV UTF-8" and upload it again.'
+        )
+    except csv.Error as e:
+        raise ImportFileError(f'Could not read CSV file on row {reader.line_num}: {str(e)}')
+    finally:
+        stream.detach()
+
+
+def _iter_xlsx_rows(uploaded_file):
+    from openpyxl import load_workbook
+
+    uploaded_file.seek(0)
+    try:
+        workbook = load_workbook(uploaded_file, read_only=True, data_only=True)
+    except Exception as e:
+        raise ImportFileError(f'Could not read workbook: {str(e)}')
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        try:
+            header = _normalize_header(next(rows))
+        except StopIteration:
+            return
+        for row_number, values in enumerate(rows, start=2):
+            if not any(v not in (None, '') for v in values):
+                continue
+            yield row_number, {
+                key: ('' if value is None else str(value).strip())
+                for key, value in zip(header, values)
+            }
+    finally:
+        workbook.close()
+
+
+def _chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class BaseImporter:
+    """
+    Base class for chunked imports.
+    Subclasses implement process_chunk(), which validates a list of
+    (row_number, row) pairs against preloaded lookups and writes them with
+    bulk_create/bulk_update.
+    """
+
+    required_columns = ()
+
+    def __init__(self, business, user=None, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False):
+        self.business = business
+        self.user = user
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.created = 0
+        self.updated = 0
+        self.total_rows = 0
+        self.error_count = 0
+        self.errors = []
+        self.seen = set()  # keys of rows already imported, across chunks
+
+    def load_lookups(self):
+        """Preload small per-business lookup tables before streaming rows"""
+        pass
+
+    def process_chunk(self, chunk):
+        raise NotImplementedError
+
+    def add_error(self, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'error': message})
+
+    def run(self, uploaded_file):
+        """Import every row of the uploaded file and return a summary report"""
+        return self.import_rows(iter_import_rows(uploaded_file))
+
+    def import_rows(self, rows):
+        """Import an iterable of (row_number, row_dict) pairs and return a summary report"""
+        started = timezone.now()
+        self.load_lookups()
+
+        header_checked = False
+        for chunk in _chunked(rows, self.chunk_size):
+            if not header_checked:
+                missing = [c for c in self.required_columns if c not in chunk[0][1]]
+                if missing:
+                    raise ImportFileError(f"Missing required columns: {', '.join(missing)}")
+                header_checked = True
+
+            self.total_rows += len(chunk)
+            with transaction.atomic():
+                self.process_chunk(chunk)
+                if self.dry_run:
+                    transaction.set_rollback(True)
+
+        duration = (timezone.now() - started).total_seconds()
+        logger.info(
+            f"{self.__class__.__name__} for business {self.business.id}: "
+            f"{self.total_rows} rows, {self.created} created, {self.updated} updated, "
+            f"{self.error_count} errors in {duration:.2f}s"
+        )
+        return self.report()
+
+    def report(self):
+        """Summary of the rows processed so far (also after an unreadable file stopped the import)"""
+        return {
+            'total_rows': self.total_rows,
+            'created': self.created,
+            'updated': self.updated,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'errors_truncated': self.error_count > len(self.errors),
+            'dry_run': self.dry_run,
+        }
+
+    # Field parsers -----------------------------------------------------------
+
+    @staticmethod
+    def parse_decimal(value, field, default=None):
+        if value in (None, ''):
+            if default is None:
+                raise ValueError(f'{field} is required')
+            return default
+        try:
+            result = Decimal(str(value).replace(',', ''))
+        except InvalidOperation:
+            raise ValueError(f'{field} must be a number')
+        if result < 0:
+            raise ValueError(f'{field} cannot be negative')
+        return result
+
+    @staticmethod
+    def parse_int(value, field, default=0):
+        if value in (None, ''):
+            return default
+        try:
+            result = int(Decimal(str(value).replace(',', '')))
+        except (InvalidOperation, ValueError):
+            raise ValueError(f'{field} must be a whole number')
+        if result < 0:
+            raise ValueError(f'{field} cannot be negative')
+        return result
+
+    @staticmethod
+    def parse_bool(value, default=True):
+        if value in (None, ''):
+            return default
+        return str(value).strip().lower() in ['true', '1', 'yes', 'y']
+
+
+class ProductImporter(BaseImporter):
+    """
+    Import products keyed by SKU.
+    Columns: sku, name, barcode, unit_price, cost_price, quantity_in_stock,
+    minimum_stock_level, category, store, description, is_active
+    """
+
+    required_columns = ('sku', 'name', 'unit_price')
+    update_fields = [
+        'name', 'barcode', 'description', 'category', 'unit_price', 'cost_price',
+        'quantity_in_stock', 'minimum_stock_level', 'is_active', 'store', 'updated_at',
+    ]
+
+    def load_lookups(self):
+        from erp.models import Store, ProductCategory
+
+        self.stores = {}
+        for store in Store.objects.filter(business=self.business).only('id', 'name'):
+            self.stores[str(store.id)] = store
+            self.stores[store.name.strip().lower()] = store
+        self.categories = {
+            name.strip().lower(): name
+            for name in ProductCategory.objects.filter(
+                business=self.business, is_active=True
+            ).values_list('name', flat=True)
+        }
+
+    def process_chunk(self, chunk):
+        from erp.models import Product
+
+        skus = {row.get('sku', '') for _, row in chunk if row.get('sku')}
+        existing = {
+            p.sku: p for p in Product.objects.filter(sku__in=skus)
+        }
+
+        to_create, to_update, seen = [], [], self.seen
+        now = timezone.now()
+        for row_number, row in chunk:
+            sku = row.get('sku', '')
+            try:
+                if not sku:
+                    raise ValueError('sku is required')
+                if sku in seen:
+                    raise ValueError(f'Duplicate SKU {sku} in file')
+                name = row.get('name', '')
+                if not name:
+                    raise ValueError('name is required')
+
+                store = None
+                store_key = row.get('store', '').lower()
+                if store_key:
+                    store = self.stores.get(store_key)
+                    if store is None:
+                        raise ValueError(f"Unknown store '{row.get('store')}'")
+
+                category = row.get('category', '') or 'General'
+                category = self.categories.get(category.lower(), category)
+
+                values = {
+                    'name': name[:100],
+                    'barcode': row.get('barcode', '')[:100],
+                    'description': row.get('description', ''),
+                    'category': category[:50],
+                    'unit_price': self.parse_decimal(row.get('unit_price'), 'unit_price'),
+                    'cost_price': self.parse_decimal(row.get('cost_price'), 'cost_price', Decimal('0')),
+                    'quantity_in_stock': self.parse_int(row.get('quantity_in_stock'), 'quantity_in_stock'),
+                    'minimum_stock_level': self.parse_int(row.get('minimum_stock_level'), 'minimum_stock_level'),
+                    'is_active': self.parse_bool(row.get('is_active')),
+                    'store': store,
+                }
+            except ValueError as e:
+                self.add_error(row_number, str(e))
+                continue
+
+            seen.add(sku)
+            product = existing.get(sku)
+            if product is None:
+                to_create.append(Product(business=self.business, sku=sku[:50], **values))
+            elif product.business_id != self.business.id:
+                self.add_error(row_number, f'SKU {sku} belongs to another business')
+            else:
+                for field, value in values.items():
+                    setattr(product, field, value)
+                product.updated_at = now
+                to_update.append(product)
+
+        Product.objects.bulk_create(to_create, batch_size=self.chunk_size)
+        Product.objects.bulk_update(to_update, self.update_fields, batch_size=self.chunk_size)
+        self.created += len(to_create)
+        self.updated += len(to_update)
+
+        # bulk writes skip model signals, so refresh checkout scan indexes explicitly
+        if to_create or to_update:
+            from erp.services.scan_service import invalidate_on_commit
+            invalidate_on_commit(self.business.id)
+
+
+class CustomerImporter(BaseImporter):
+    """
+    Import customers keyed by email within the business.
+    Columns: name, email, phone, address, vat_number, is_active
+    """
+
+    required_columns = ('name', 'email')
+    update_fields = ['name', 'phone', 'address', 'vat_number', 'is_active', 'updated_at']
+
+    def process_chunk(self, chunk):
+        from erp.models import Customer
+
+        emails = {row.get('email', '').lower() for _, row in chunk if row.get('email')}
+        existing = {}
+        for customer in Customer.objects.annotate(email_lower=Lower('email')).filter(
+            business=self.business, email_lower__in=emails
+        ).order_by('id'):
+            existing.setdefault(customer.email_lower, customer)
+
+        to_create, to_update, seen = [], [], self.seen
+        now = timezone.now()
+        for row_number, row in chunk:
+            email = row.get('email', '').lower()
+            try:
+                if not row.get('name'):
+                    raise ValueError('name is required')
+                try:
+                    validate_email(email)
+                except ValidationError:
+                    raise ValueError(f"Invalid email '{row.get('email', '')}'")
+                if email in seen:
+                    raise ValueError(f'Duplicate email {email} in file')
+            except ValueError as e:
+                self.add_error(row_number, str(e))
+                continue
+
+            seen.add(email)
+            values = {
+                'name': row['name'][:255],
+                'phone': row.get('phone', '')[:20],
+                'address': row.get('address', ''),
+                'vat_number': row.get('vat_number', '')[:20],
+                'is_active': self.parse_bool(row.get('is_active')),
+            }
+            customer = existing.get(email)
+            if customer is None:
+                to_create.append(Customer(business=self.business, email=email, **values))
+            else:
+                for field, value in values.items():
+                    setattr(customer, field, value)
+                customer.updated_at = now
+                to_update.append(customer)
+
+        Customer.objects.bulk_create(to_create, batch_size=self.chunk_size)
+        Customer.objects.bulk_update(to_update, self.update_fields, batch_size=self.chunk_size)
+        self.created += len(to_create)
+        self.updated += len(to_update)
+
+
+class OpeningStockImporter(BaseImporter):
+    """
+    Import opening stock balances for inventory items.
+    Columns: sku, warehouse (code or name), quantity, unit_cost
+    Creates one IN movement per row and adds the quantity to the
+    item/warehouse StockRecord in place, so reservations and movements
+    written while the import runs are kept.
+    """
+
+    required_columns = ('sku', 'warehouse', 'quantity')
+    reference = 'OPENING-STOCK'
+
+    def load_lookups(self):
+        from erp.models import Warehouse
+
+        self.warehouses = {}
+        for warehouse in Warehouse.objects.filter(business=self.business, is_active=True).only('id', 'name', 'code'):
+            self.warehouses[warehouse.code.strip().lower()] = warehouse
+            self.warehouses[warehouse.name.strip().lower()] = warehouse
+
+    def process_chunk(self, chunk):
+        from erp.models import InventoryItem, StockRecord, StockMovement
+
+        skus = {row.get('sku', '') for _, row in chunk if row.get('sku')}
+        items = {
+            i.sku: i
+            for i in InventoryItem.objects.filter(business=self.business, sku__in=skus).only('id', 'sku', 'purchase_price')
+        }
+
+        movements = []
+        deltas = {}
+        for row_number, row in chunk:
+            try:
+                item = items.get(row.get('sku', ''))
+                if item is None:
+                    raise ValueError(f"Unknown SKU '{row.get('sku', '')}'")
+                warehouse = self.warehouses.get(row.get('warehouse', '').lower())
+                if warehouse is None:
+                    raise ValueError(f"Unknown warehouse '{row.get('warehouse', '')}'")
+                quantity = self.parse_decimal(row.get('quantity'), 'quantity')
+                unit_cost = self.parse_decimal(row.get('unit_cost'), 'unit_cost', item.purchase_price)
+                key = (item.id, warehouse.id)
+                if key in self.seen:
+                    raise ValueError(f'Duplicate SKU {item.sku} for warehouse {warehouse.code} in file')
+            except ValueError as e:
+                self.add_error(row_number, str(e))
+                continue
+
+            self.seen.add(key)
+
+            movements.append(StockMovement(
+                item=item,
+                warehouse=warehouse,
+                movement_type='IN',
+                quantity=quantity,
+                unit_cost=unit_cost,
+                total_cost=quantity * unit_cost,
+                reference=self.reference,
+                notes='Opening stock import',
+                created_by=self.user,
+            ))
+            deltas[key] = quantity
+
+        if not movements:
+            return
+
+        def record_ids():
+            return {
+                (item_id, warehouse_id): record_id
+                for record_id, item_id, warehouse_id in StockRecord.objects.filter(
+                    item_id__in={k[0] for k in deltas},
+                    warehouse_id__in={k[1] for k in deltas},
+                ).values_list('id', 'item_id', 'warehouse_id')
+                if (item_id, warehouse_id) in deltas
+            }
+
+        existing = record_ids()
+        # empty records first, so every balance moves through the same in-place UPDATE below
+        StockRecord.objects.bulk_create(
+            [StockRecord(item_id=k[0], warehouse_id=k[1]) for k in deltas if k not in existing],
+            batch_size=self.chunk_size, ignore_conflicts=True,
+        )
+        ids = record_ids() if len(existing) < len(deltas) else existing
+        delta = Case(
+            *[When(id=ids[key], then=Value(quantity)) for key, quantity in deltas.items()],
+            default=Value(Decimal('0')),
+            output_field=QUANTITY_FIELD,
+        )
+        StockRecord.objects.filter(id__in=ids.values()).update(
+            quantity=F('quantity') + delta,
+            available_quantity=F('available_quantity') + delta,
+            last_updated=timezone.now(),
+        )
+        # bulk_create skips StockMovement.save, which would apply the quantity to the record again
+        StockMovement.objects.bulk_create(movements, batch_size=self.chunk_size)
+        self.created += len(movements)
+        self.updated += len(existing)
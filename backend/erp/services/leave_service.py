@@ -0,0 +1,182 @@
+"""
+Leave Ledger Service
+Append-only leave movements with atomic balance updates on allocations
+"""
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Sum, Count
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LeaveBalanceError(Exception):
+    """Raised when a leave movement cannot be applied to an allocation"""
+    pass
+
+
+class LeaveLedgerService:
+    """
+    Posts leave movements for a user.
+    Every change to an allocation's used/balance days is written as a
+    LeaveLedgerEntry and applied to the allocation with a single F()
+    UPDATE, so concurrent approvals never overwrite each other.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    def apply_usage(self, application):
+        """Debit an approved application's days from its allocation"""
+        from erp.models_extended_part2 import LeaveAllocation
+
+        days = application.number_of_days
+        year = application.from_date.year
+        allocations = LeaveAllocation.objects.filter(
+            employee_id=application.employee_id, leave_type_id=application.leave_type_id, year=year
+        )
+        with transaction.atomic():
+            if application.leave_type.is_paid:
+                # paid leave may not overdraw the allocation
+                guarded = allocations.filter(balance_days__gte=days)
+            else:
+                # unpaid leave is tracked against a zero allocation without a limit
+                LeaveAllocation.objects.get_or_create(
+                    employee_id=application.employee_id, leave_type_id=application.leave_type_id, year=year,
+                    defaults={'allocated_days': 0, 'balance_days': 0, 'created_by': self.user},
+                )
+                guarded = allocations
+            updated = guarded.update(
+                used_days=F('used_days') + days,
+                balance_days=F('balance_days') - days,
+                updated_at=timezone.now(),
+            )
+            if not updated:
+                allocation = allocations.first()
+                if allocation is None:
+                    raise LeaveBalanceError(f'No {application.leave_type.name} allocation for {year}')
+                raise LeaveBalanceError(
+                    f'Insufficient {application.leave_type.name} balance: {allocation.balance_days} days available, {days} requested'
+                )
+            allocation_id = allocations.values_list('id', flat=True).get()
+            self._post(allocation_id, application.employee_id, application.leave_type_id, year, 'USAGE', -days,
+                       application=application, notes=f'Leave {application.application_number}')
+
+    def reverse_usage(self, application):
+        """Credit back the days of a previously approved application"""
+        from erp.models_extended_part2 import LeaveAllocation
+
+        days = application.number_of_days
+        year = application.from_date.year
+        allocations = LeaveAllocation.objects.filter(
+            employee_id=application.employee_id, leave_type_id=application.leave_type_id, year=year
+        )
+        with transaction.atomic():
+            updated = allocations.update(
+                used_days=F('used_days') - days,
+                balance_days=F('balance_days') + days,
+                updated_at=timezone.now(),
+            )
+            if not updated:
+                raise LeaveBalanceError(f'No {application.leave_type.name} allocation for {year}')
+            allocation_id = allocations.values_list('id', flat=True).get()
+            self._post(allocation_id, application.employee_id, application.leave_type_id, year, 'REVERSAL', days,
+                       application=application, notes=f'Reversal of {application.application_number}')
+
+    def _post(self, allocation_id, employee_id, leave_type_id, year, entry_type, days, application=None, notes=''):
+        from erp.models_extended_part2 import LeaveLedgerEntry
+
+        return LeaveLedgerEntry.objects.create(
+            allocation_id=allocation_id, employee_id=employee_id, leave_type_id=leave_type_id, year=year,
+            entry_type=entry_type, days=days, application=application, notes=notes, created_by=self.user,
+        )
+
+    def allocate_year(self, business, year, leave_type_ids=None):
+        """
+        Create the year's allocations for every active employee and leave type,
+        carrying forward the previous year's balances where the leave type
+        allows it. Employees already allocated for the year are skipped.
+        Returns a summary of what was written.
+        """
+        from erp.models import Employee
+        from erp.models_extended_part2 import LeaveType, LeaveAllocation, LeaveLedgerEntry
+
+        leave_types = LeaveType.objects.filter(business=business, is_active=True)
+        if leave_type_ids:
+            leave_types = leave_types.filter(id__in=leave_type_ids)
+        leave_types = list(leave_types)
+        employee_ids = list(Employee.objects.filter(business=business, is_active=True).values_list('id', flat=True))
+        type_ids = [t.id for t in leave_types]
+
+        existing = set(LeaveAllocation.objects.filter(
+            employee_id__in=employee_ids, leave_type_id__in=type_ids, year=year
+        ).values_list('employee_id', 'leave_type_id'))
+        previous = {
+            (employee_id, leave_type_id): balance
+            for employee_id, leave_type_id, balance in LeaveAllocation.objects.filter(
+                employee_id__in=employee_ids, leave_type_id__in=type_ids, year=year - 1
+            ).values_list('employee_id', 'leave_type_id', 'balance_days')
+        }
+
+        allocations = []
+        for leave_type in leave_types:
+            annual = Decimal(leave_type.annual_allocation_days)
+            for employee_id in employee_ids:
+                if (employee_id, leave_type.id) in existing:
+                    continue
+                carried = Decimal('0')
+                if leave_type.is_carry_forward:
+                    carried = max(previous.get((employee_id, leave_type.id), Decimal('0')), Decimal('0'))
+                    if leave_type.max_carry_forward_days is not None:
+                        carried = min(carried, Decimal(leave_type.max_carry_forward_days))
+                allocations.append(LeaveAllocation(
+                    employee_id=employee_id, leave_type=leave_type, year=year,
+                    allocated_days=annual, carried_forward_days=carried,
+                    balance_days=annual + carried, created_by=self.user,
+                ))
+
+        with transaction.atomic():
+            LeaveAllocation.objects.bulk_create(allocations, batch_size=1000)
+            if allocations and allocations[0].pk is None:
+                ids = dict(((a.employee_id, a.leave_type_id), a.id) for a in LeaveAllocation.objects.filter(
+                    employee_id__in=employee_ids, leave_type_id__in=type_ids, year=year
+                ).only('id', 'employee_id', 'leave_type_id'))
+                for allocation in allocations:
+                    allocation.pk = ids[(allocation.employee_id, allocation.leave_type_id)]
+
+            entries = []
+            for allocation in allocations:
+                entries.append(LeaveLedgerEntry(
+                    allocation_id=allocation.pk, employee_id=allocation.employee_id, leave_type_id=allocation.leave_type_id,
+                    year=year, entry_type='ALLOCATION', days=allocation.allocated_days,
+                    notes=f'{year} allocation', created_by=self.user,
+                ))
+                if allocation.carried_forward_days:
+                    entries.append(LeaveLedgerEntry(
+                        allocation_id=allocation.pk, employee_id=allocation.employee_id, leave_type_id=allocation.leave_type_id,
+                        year=year, entry_type='CARRY_FORWARD', days=allocation.carried_forward_days,
+                        notes=f'Carried forward from {year - 1}', created_by=self.user,
+                    ))
+            LeaveLedgerEntry.objects.bulk_create(entries, batch_size=1000)
+
+        logger.info(f"Allocated {len(allocations)} leave balances for business {business.id}, year {year}")
+        return {
+            'year': year,
+            'allocations_created': len(allocations),
+            'skipped_existing': len(existing),
+            'carried_forward_days': sum((a.carried_forward_days for a in allocations), Decimal('0')),
+        }
+
+
+def department_balances(allocations):
+    """Aggregate an allocation queryset per department and leave type in one query"""
+    return list(allocations.values(
+        'employee__department_id', 'employee__department__name', 'leave_type_id', 'leave_type__name',
+    ).annotate(
+        employees=Count('employee', distinct=True),
+        allocated_days=Sum('allocated_days'),
+        carried_forward_days=Sum('carried_forward_days'),
+        used_days=Sum('used_days'),
+        balance_days=Sum('balance_days'),
+    ).order_by('employee__department__name', 'leave_type__name'))
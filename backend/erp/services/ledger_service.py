@@ -0,0 +1,282 @@
+"""
+Ledger Posting Service
+Posts balanced journal entries and reports cost-center results from the monthly ledger summary
+"""
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Sum, Case, When, Value, DecimalField
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LedgerError(Exception):
+    """Raised when a journal entry cannot be posted"""
+    pass
+
+
+def post_journal_entry(store_id, entry_number, date, description, lines, user, reference='', entry_type='GENERAL'):
+    """
+    Create and post a journal entry in a fixed number of queries.
+    `lines` is a list of (account_id, debit, credit, description) tuples,
+    optionally followed by cost_center_id and project_id; debits must equal
+    credits. Account balances move by debit - credit (the same convention
+    as ChartOfAccounts.update_balance) with one UPDATE, each line gets a
+    GeneralLedger row with its running balance, and the monthly
+    LedgerPeriodSummary rows are bumped for every account and cost center.
+    """
+    from erp.models import JournalEntry, JournalEntryLine, GeneralLedger, ChartOfAccounts, LedgerPeriodSummary, Store
+
+    lines = [_normalize_line(line) for line in lines]
+    total_debits = sum((line[1] for line in lines), Decimal('0'))
+    total_credits = sum((line[2] for line in lines), Decimal('0'))
+    if not lines:
+        raise LedgerError('A journal entry needs at least one line')
+    if total_debits != total_credits:
+        raise LedgerError(f'Journal entry {entry_number} is not balanced: debits {total_debits}, credits {total_credits}')
+
+    deltas = {}
+    for account_id, debit, credit, *_ in lines:
+        deltas[account_id] = deltas.get(account_id, Decimal('0')) + debit - credit
+
+    now = timezone.now()
+    with transaction.atomic():
+        entry = JournalEntry.objects.create(
+            store_id=store_id,
+            entry_number=entry_number,
+            entry_type=entry_type,
+            date=date,
+            reference=reference,
+            description=description,
+            status='POSTED',
+            total_debits=total_debits,
+            total_credits=total_credits,
+            created_by=user,
+            posted_by=user,
+            posted_at=now,
+        )
+        JournalEntryLine.objects.bulk_create([
+            JournalEntryLine(journal_entry=entry, account_id=account_id, description=text,
+                             debit=debit, credit=credit, cost_center_id=cost_center_id,
+                             project_id=project_id, created_by=user)
+            for account_id, debit, credit, text, cost_center_id, project_id in lines
+        ])
+
+        ChartOfAccounts.objects.filter(id__in=deltas).update(current_balance=F('current_balance') + Case(
+            *[When(id=account_id, then=Value(delta)) for account_id, delta in deltas.items()],
+            output_field=DecimalField(max_digits=15, decimal_places=2),
+        ))
+
+        # walk each account back from its new balance so running balances end on it
+        balances = dict(ChartOfAccounts.objects.filter(id__in=deltas).values_list('id', 'current_balance'))
+        running = {account_id: balances[account_id] - delta for account_id, delta in deltas.items()}
+        ledger_rows = []
+        for account_id, debit, credit, text, cost_center_id, project_id in lines:
+            running[account_id] += debit - credit
+            ledger_rows.append(GeneralLedger(
+                date=date, account_id=account_id, journal_entry=entry, debit=debit, credit=credit,
+                reference=reference or entry_number, description=text,
+                running_balance=running[account_id], cost_center_id=cost_center_id,
+                project_id=project_id, created_by=user, created_at=now,
+            ))
+        GeneralLedger.objects.bulk_create(ledger_rows)
+
+        business_id = Store.objects.filter(id=store_id).values_list('business_id', flat=True).get()
+        LedgerPeriodSummary.apply(business_id, [
+            (date, account_id, cost_center_id, debit, credit)
+            for account_id, debit, credit, _, cost_center_id, _ in lines
+        ])
+
+    return entry
+
+
+def _normalize_line(line):
+    account_id, debit, credit, text, *dimensions = line
+    cost_center_id, project_id = (list(dimensions) + [None, None])[:2]
+    return account_id, Decimal(debit), Decimal(credit), text, cost_center_id, project_id
+
+
+def _cost_center_totals(business_id, start_date=None, end_date=None):
+    """
+    Revenue and expense per cost center from the monthly ledger summary, in one query.
+    Returns {cost_center_id: {'code', 'name', 'revenue', 'expenses'}}; lines
+    without a cost center are keyed by None.
+    """
+    from erp.models import LedgerPeriodSummary
+
+    summaries = LedgerPeriodSummary.objects.filter(
+        business_id=business_id, account__account_type__in=('REVENUE', 'EXPENSE'),
+    )
+    if start_date:
+        summaries = summaries.filter(period__gte=LedgerPeriodSummary.period_of(start_date))
+    if end_date:
+        summaries = summaries.filter(period__lte=end_date)
+    rows = summaries.values(
+        'cost_center_id', 'cost_center__code', 'cost_center__name', 'account__account_type',
+    ).annotate(debit=Sum('debit'), credit=Sum('credit')).order_by()
+
+    totals = {}
+    for row in rows:
+        center = totals.setdefault(row['cost_center_id'], {
+            'code': row['cost_center__code'],
+            'name': row['cost_center__name'] or 'Unassigned',
+            'revenue': Decimal('0'),
+            'expenses': Decimal('0'),
+        })
+        net = (row['debit'] or Decimal('0')) - (row['credit'] or Decimal('0'))
+        if row['account__account_type'] == 'REVENUE':
+            center['revenue'] -= net
+        else:
+            center['expenses'] += net
+    return totals
+
+
+def cost_center_profit_and_loss(business_id, start_date=None, end_date=None):
+    """Revenue, expenses and net income per cost center for a date range"""
+    centers = []
+    for cost_center_id, center in sorted(
+        _cost_center_totals(business_id, start_date, end_date).items(),
+        key=lambda item: (item[0] is None, item[1]['code'] or ''),
+    ):
+        centers.append({
+            'cost_center': cost_center_id,
+            'code': center['code'],
+            'name': center['name'],
+            'revenue': center['revenue'],
+            'expenses': center['expenses'],
+            'net_income': center['revenue'] - center['expenses'],
+        })
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'total_revenue': sum((c['revenue'] for c in centers), Decimal('0')),
+        'total_expenses': sum((c['expenses'] for c in centers), Decimal('0')),
+        'net_income': sum((c['net_income'] for c in centers), Decimal('0')),
+        'cost_centers': centers,
+    }
+
+
+def allocate_shared_costs(business_id, start_date=None, end_date=None, basis='expenses'):
+    """
+    Spread expenses posted without a cost center over the cost centers in
+    proportion to their own expenses or revenue (`basis`). The last center
+    absorbs the rounding difference so allocations add up to the pool.
+    """
+    if basis not in ('expenses', 'revenue'):
+        raise LedgerError("Allocation basis must be 'expenses' or 'revenue'")
+    totals = _cost_center_totals(business_id, start_date, end_date)
+    pool = totals.pop(None, {'expenses': Decimal('0')})['expenses']
+    centers = sorted(totals.items(), key=lambda item: item[1]['code'] or '')
+    basis_total = sum((max(center[basis], Decimal('0')) for _, center in centers), Decimal('0'))
+
+    allocations = []
+    remaining = pool
+    for index, (cost_center_id, center) in enumerate(centers):
+        weight = max(center[basis], Decimal('0'))
+        if index == len(centers) - 1:
+            share = remaining if basis_total else Decimal('0')
+        else:
+            share = (pool * weight / basis_total).quantize(Decimal('0.01')) if basis_total else Decimal('0')
+        remaining -= share
+        allocations.append({
+            'cost_center': cost_center_id,
+            'code': center['code'],
+            'name': center['name'],
+            'basis_amount': center[basis],
+            'direct_expenses': center['expenses'],
+            'allocated_expenses': share,
+            'total_expenses': center['expenses'] + share,
+        })
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'basis': basis,
+        'shared_pool': pool,
+        'unallocated': pool - sum((a['allocated_expenses'] for a in allocations), Decimal('0')),
+        'cost_centers': allocations,
+    }
+
+
+# Journal entries and lines written outside post_journal_entry (the journal
+# entry and line endpoints, admin edits) keep the monthly summary in step here.
+
+ENTRY_POSTING_FIELDS = ('status', 'date', 'store_id')
+LINE_SUMMARY_FIELDS = ('journal_entry_id', 'account_id', 'cost_center_id', 'debit', 'credit')
+
+
+def _snapshot(instance, fields):
+    values = tuple(instance.__dict__.get(field) for field in fields)
+    return None if None in values[:2] else values
+
+
+def _posted_entry(journal_entry_id):
+    """(business_id, date) of a posted entry, or None"""
+    from erp.models import JournalEntry
+
+    entry = JournalEntry.objects.filter(id=journal_entry_id, status='POSTED').values('store__business_id', 'date').first()
+    return (entry['store__business_id'], entry['date']) if entry else None
+
+
+def _apply_line(posting, line, sign):
+    from erp.models import LedgerPeriodSummary
+
+    if posting and line:
+        business_id, on_date = posting
+        _, account_id, cost_center_id, debit, credit = line
+        LedgerPeriodSummary.apply(business_id, [(on_date, account_id, cost_center_id, debit or 0, credit or 0)], sign=sign)
+
+
+@receiver(post_init, sender='erp.JournalEntry')
+def remember_entry_posting(sender, instance, **kwargs):
+    instance._summary_posting = _snapshot(instance, ENTRY_POSTING_FIELDS)
+
+
+@receiver(post_save, sender='erp.JournalEntry')
+def sync_entry_summary(sender, instance, created, raw=False, **kwargs):
+    """Move an entry's lines into or out of the summary when it is posted, reversed, re-dated or moved"""
+    from erp.models import JournalEntryLine, LedgerPeriodSummary, Store
+
+    previous, current = instance._summary_posting, _snapshot(instance, ENTRY_POSTING_FIELDS)
+    instance._summary_posting = current
+    if raw or created or previous is None or previous == current:
+        return
+    lines = list(JournalEntryLine.objects.filter(journal_entry_id=instance.id).values_list(
+        'account_id', 'cost_center_id', 'debit', 'credit',
+    ))
+    if not lines:
+        return
+    for (status, on_date, store_id), sign in ((previous, -1), (current, 1)):
+        if status == 'POSTED':
+            business_id = Store.objects.filter(id=store_id).values_list('business_id', flat=True).first()
+            LedgerPeriodSummary.apply(business_id, [
+                (on_date, account_id, cost_center_id, debit, credit)
+                for account_id, cost_center_id, debit, credit in lines
+            ], sign=sign)
+
+
+@receiver(post_init, sender='erp.JournalEntryLine')
+def remember_line_summary(sender, instance, **kwargs):
+    instance._summary_line = _snapshot(instance, LINE_SUMMARY_FIELDS)
+
+
+@receiver(post_save, sender='erp.JournalEntryLine')
+def sync_line_summary(sender, instance, created, raw=False, **kwargs):
+    """Replace a line's previous amounts with its current ones while its entry is posted"""
+    previous, current = instance._summary_line, _snapshot(instance, LINE_SUMMARY_FIELDS)
+    instance._summary_line = current
+    if raw or (previous == current and not created):
+        return
+    if not created:
+        if previous is None:
+            return
+        _apply_line(_posted_entry(previous[0]), previous, -1)
+    _apply_line(_posted_entry(current[0]), current, 1)
+
+
+@receiver(post_delete, sender='erp.JournalEntryLine')
+def remove_line_summary(sender, instance, **kwargs):
+    # the entry row outlives its lines when a cascade deletes both
+    _apply_line(_posted_entry(instance.journal_entry_id), instance._summary_line, -1)
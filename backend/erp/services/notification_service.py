@@ -0,0 +1,517 @@
+"""
+Notification Dispatch Service
+Template rendering, bulk queueing, rate-limited per-channel delivery and cached unread counts of notifications
+"""
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Q, TextField, Value, When
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.template import Context, Engine
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from erp.checks import cache_is_shared
+import logging
+
+logger = logging.getLogger(__name__)
+
+# bodies are plain text (email text part, SMS), so nothing is HTML-escaped
+_engine = Engine(autoescape=False)
+
+UNREAD_STATUSES = ('PENDING', 'SENDING', 'SENT')
+
+
+class NotificationError(Exception):
+    """Raised when a notification cannot be queued or delivered"""
+    pass
+
+
+class TemplateCache:
+    """
+    Compiled NotificationTemplates per process. A template is parsed once
+    and reused until its updated_at changes, so rendering thousands of
+    payslip notifications costs one compile.
+    """
+
+    def __init__(self):
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def get(self, template):
+        entry = self._compiled.get(template.pk)
+        if entry and entry['updated_at'] == template.updated_at:
+            return entry
+        entry = {
+            'updated_at': template.updated_at,
+            'subject': _engine.from_string(template.subject_template),
+            'body': _engine.from_string(template.body_template),
+            'sms': _engine.from_string(template.sms_template) if template.sms_template else None,
+        }
+        with self._lock:
+            self._compiled[template.pk] = entry
+        return entry
+
+    def render(self, template, context):
+        """Returns (subject, message) for the template's channel"""
+        compiled = self.get(template)
+        context = Context(context)
+        body = compiled['sms'] if template.channel == 'SMS' and compiled['sms'] else compiled['body']
+        return compiled['subject'].render(context).strip(), body.render(context).strip()
+
+
+template_cache = TemplateCache()
+
+
+def _recipients(recipient_ids):
+    from erp.models import User
+
+    return {
+        row['id']: row
+        for row in User.objects.filter(id__in=set(recipient_ids), is_active=True).values(
+            'id', 'username', 'first_name', 'last_name', 'email', 'phone'
+        )
+    }
+
+
+def queue_template(template, recipient_ids, context=None, contexts=None):
+    """
+    Render a template for every recipient and store the notifications as
+    PENDING with one bulk insert. `contexts` maps recipient id to values
+    that override the shared `context` for that recipient.
+    Returns the number of notifications queued.
+    """
+    from erp.models_ecommerce import Notification
+
+    if not template.is_active:
+        raise NotificationError(f'Template {template.code} is not active')
+    contexts = contexts or {}
+    notifications = []
+    for user_id, user in _recipients(recipient_ids).items():
+        subject, message = template_cache.render(
+            template, {**(context or {}), 'recipient': user, **contexts.get(user_id, {})}
+        )
+        notifications.append(Notification(
+            template=template, recipient_id=user_id, channel=template.channel, subject=subject[:500],
+            message=message, email_address=user['email'], phone_number=user['phone'],
+        ))
+    Notification.objects.bulk_create(notifications, batch_size=1000)
+    added_on_commit(notifications)
+    return len(notifications)
+
+
+def queue_message(recipient_ids, channel, subject, message):
+    """Queue the same ready-made message for every recipient; returns the queued notifications"""
+    from erp.models_ecommerce import Notification
+
+    notifications = [
+        Notification(
+            recipient_id=user_id, channel=channel, subject=subject[:500], message=message,
+            email_address=user['email'], phone_number=user['phone'],
+        )
+        for user_id, user in _recipients(recipient_ids).items()
+    ]
+    Notification.objects.bulk_create(notifications, batch_size=1000)
+    added_on_commit(notifications)
+    return notifications
+
+
+class UnreadCounter:
+    """
+    Unread (PENDING or SENT) notifications per user, kept in the cache.
+    Inserts increment it and reads decrement it once committed; changes it
+    cannot follow (edits, deletes) drop the key and the next read recounts
+    with one indexed query. The id of each user's newest notification is
+    kept next to it so long-polling clients wait on cache reads only.
+    With Redis (REDIS_URL) every worker sees the same keys; with the
+    per-process fallback cache a worker only notices notifications written
+    by another process once its keys expire, after LOCAL_TIMEOUT.
+    """
+
+    COUNT_KEY = 'notification_unread:{user_id}'
+    LATEST_KEY = 'notification_latest:{user_id}'
+    TIMEOUT = 60 * 60 * 24
+    LOCAL_TIMEOUT = 10
+
+    @property
+    def timeout(self):
+        return self.TIMEOUT if cache_is_shared() else self.LOCAL_TIMEOUT
+
+    def count(self, user_id):
+        from erp.models_ecommerce import Notification
+
+        key = self.COUNT_KEY.format(user_id=user_id)
+        value = cache.get(key)
+        if value is None:
+            value = Notification.objects.filter(recipient_id=user_id, status__in=UNREAD_STATUSES).count()
+            cache.add(key, value, self.timeout)
+        return value
+
+    def latest(self, user_id):
+        from django.db.models import Max
+        from erp.models_ecommerce import Notification
+
+        key = self.LATEST_KEY.format(user_id=user_id)
+        value = cache.get(key)
+        if value is None:
+            value = Notification.objects.filter(recipient_id=user_id).aggregate(latest=Max('id'))['latest'] or 0
+            cache.add(key, value, self.timeout)
+        return value
+
+    def wait_for(self, user_id, after, timeout, interval=1.0):
+        """Block until the user has a notification newer than `after` or `timeout` passes; returns the newest id"""
+        # one check per interval at most, even if the clock or timeout misbehave
+        checks = int(timeout / interval) + 1 if math.isfinite(timeout) and timeout > 0 else 1
+        deadline = time.monotonic() + (timeout if checks > 1 else 0)
+        for _ in range(checks):
+            latest = self.latest(user_id)
+            if latest > after or time.monotonic() >= deadline:
+                return latest
+            time.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+        return self.latest(user_id)
+
+    def added(self, notifications):
+        """Count new notifications, given as (recipient_id, notification_id) pairs"""
+        counts, latest = {}, {}
+        for user_id, pk in notifications:
+            counts[user_id] = counts.get(user_id, 0) + 1
+            latest[user_id] = max(latest.get(user_id, 0), pk or 0)
+        for user_id, count in counts.items():
+            try:
+                cache.incr(self.COUNT_KEY.format(user_id=user_id), count)
+            except ValueError:
+                # not cached: the next read counts from the database
+                pass
+        keys = {self.LATEST_KEY.format(user_id=user_id): pk for user_id, pk in latest.items()}
+        current = cache.get_many(list(keys))
+        cache.set_many({key: max(pk, current.get(key, 0)) for key, pk in keys.items() if pk}, self.timeout)
+        # ids are not returned by every backend's bulk insert; look those up on the next poll
+        cache.delete_many([key for key, pk in keys.items() if not pk])
+
+    def removed(self, user_id, count=1):
+        """Notifications of a user stopped being unread (read or failed)"""
+        key = self.COUNT_KEY.format(user_id=user_id)
+        try:
+            if cache.decr(key, count) < 0:
+                cache.delete(key)
+        except ValueError:
+            pass
+
+    def invalidate(self, user_ids):
+        cache.delete_many([self.COUNT_KEY.format(user_id=user_id) for user_id in user_ids])
+
+
+unread_counter = UnreadCounter()
+
+
+def added_on_commit(notifications):
+    pairs = [(n.recipient_id, n.pk) for n in notifications]
+    if pairs:
+        transaction.on_commit(lambda: unread_counter.added(pairs))
+
+
+def removed_on_commit(user_id, count=1):
+    if count:
+        transaction.on_commit(lambda: unread_counter.removed(user_id, count))
+
+
+@receiver(post_save, sender='erp.Notification')
+def count_saved_notification(sender, instance, created, **kwargs):
+    if created:
+        added_on_commit([instance])
+    else:
+        transaction.on_commit(lambda: unread_counter.invalidate([instance.recipient_id]))
+
+
+@receiver(post_delete, sender='erp.Notification')
+def count_deleted_notification(sender, instance, **kwargs):
+    transaction.on_commit(lambda: unread_counter.invalidate([instance.recipient_id]))
+
+
+class RateLimiter:
+    """
+    At most `per_second` sends per provider, counted in one-second windows
+    in the cache. With Redis (REDIS_URL) every process sending through the
+    provider shares the allowance; with the per-process fallback cache each
+    dispatcher process gets its own.
+    """
+
+    WINDOW_KEY = 'notification_rate:{provider}:{window}'
+
+    def __init__(self, provider, per_second):
+        self.provider = provider
+        self.per_second = per_second
+
+    def wait(self):
+        if not self.per_second:
+            return
+        while True:
+            now = time.time()
+            key = self.WINDOW_KEY.format(provider=self.provider, window=int(now))
+            cache.add(key, 0, 5)
+            try:
+                if cache.incr(key) <= self.per_second:
+                    return
+            except ValueError:
+                # the window expired between add and incr; retry in the next one
+                pass
+            time.sleep(max(int(now) + 1 - time.time(), 0.01))
+
+
+class HttpSmsBackend:
+    """Posts each message to the SMS gateway at settings.SMS_GATEWAY_URL"""
+
+    def __init__(self):
+        self.url = getattr(settings, 'SMS_GATEWAY_URL', '')
+        self.api_key = getattr(settings, 'SMS_GATEWAY_API_KEY', '')
+        self.sender = getattr(settings, 'SMS_SENDER_ID', '')
+        self.session = None
+
+    def open(self):
+        import requests
+
+        if not self.url:
+            raise NotificationError('SMS_GATEWAY_URL is not configured')
+        self.session = requests.Session()
+        if self.api_key:
+            self.session.headers['Authorization'] = f'Bearer {self.api_key}'
+
+    def send(self, phone_number, message):
+        response = self.session.post(
+            self.url, json={'to': phone_number, 'from': self.sender, 'message': message}, timeout=10
+        )
+        response.raise_for_status()
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+
+
+class LocmemSmsBackend:
+    """Keeps sent messages in `outbox`, like Django's locmem email backend; for tests and development"""
+
+    outbox = []
+
+    def open(self):
+        pass
+
+    def send(self, phone_number, message):
+        LocmemSmsBackend.outbox.append({'to': phone_number, 'message': message})
+
+    def close(self):
+        pass
+
+
+class EmailChannel:
+    """Sends a chunk of notifications over one SMTP connection"""
+
+    provider = 'email'
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    def send(self, notifications):
+        from django.core.mail import EmailMessage, get_connection
+
+        results = []
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+            for n in notifications:
+                if not n['email_address']:
+                    results.append((n['id'], 'Recipient has no email address'))
+                    continue
+                self.limiter.wait()
+                try:
+                    EmailMessage(
+                        n['subject'], n['message'], settings.DEFAULT_FROM_EMAIL, [n['email_address']],
+                        connection=connection,
+                    ).send()
+                    results.append((n['id'], None))
+                except Exception as e:
+                    results.append((n['id'], str(e)))
+        except Exception as e:
+            # the connection itself failed: report the rest of the chunk with the error
+            done = {pk for pk, _ in results}
+            results.extend((n['id'], str(e)) for n in notifications if n['id'] not in done)
+        finally:
+            connection.close()
+        return results
+
+
+class SmsChannel:
+    """Sends a chunk of notifications through the configured SMS backend"""
+
+    provider = 'sms'
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    def send(self, notifications):
+        results = []
+        backend = import_string(getattr(settings, 'SMS_BACKEND', 'erp.services.notification_service.HttpSmsBackend'))()
+        try:
+            backend.open()
+            for n in notifications:
+                if not n['phone_number']:
+                    results.append((n['id'], 'Recipient has no phone number'))
+                    continue
+                self.limiter.wait()
+                try:
+                    backend.send(n['phone_number'], n['message'])
+                    results.append((n['id'], None))
+                except Exception as e:
+                    results.append((n['id'], str(e)))
+        except Exception as e:
+            done = {pk for pk, _ in results}
+            results.extend((n['id'], str(e)) for n in notifications if n['id'] not in done)
+        finally:
+            backend.close()
+        return results
+
+
+class NotificationDispatcher:
+    """
+    Delivers PENDING notifications in batches. Each batch is claimed in a
+    short transaction (SELECT ... FOR UPDATE SKIP LOCKED, then marked
+    SENDING with claimed_at), so parallel dispatchers skip each other's rows
+    and no transaction stays open while providers are called. The batch is
+    split into chunks per channel and handed to that channel's thread pool,
+    so slow SMTP or SMS round trips overlap, and each chunk's results are
+    written back as soon as it returns. Only a chunk in flight when a
+    dispatcher dies is left SENDING; it is claimed again after
+    CLAIM_TIMEOUT. IN_APP notifications need no provider and are marked sent
+    with a single UPDATE.
+    Pool sizes and per-provider rates come from settings.NOTIFICATION_WORKERS
+    and settings.NOTIFICATION_RATE_LIMITS (sends per second, 0 = unlimited).
+    """
+
+    CHANNELS = {'EMAIL': EmailChannel, 'SMS': SmsChannel}
+    DEFAULT_WORKERS = {'EMAIL': 4, 'SMS': 2}
+    DEFAULT_RATE_LIMITS = {'email': 20, 'sms': 10}
+    CLAIM_TIMEOUT = timedelta(minutes=15)
+
+    def __init__(self, batch_size=500, chunk_size=50):
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.workers = {**self.DEFAULT_WORKERS, **getattr(settings, 'NOTIFICATION_WORKERS', {})}
+        rates = {**self.DEFAULT_RATE_LIMITS, **getattr(settings, 'NOTIFICATION_RATE_LIMITS', {})}
+        self.channels = {
+            name: channel(RateLimiter(channel.provider, rates.get(channel.provider)))
+            for name, channel in self.CHANNELS.items()
+        }
+
+    def pending_counts(self):
+        from django.db.models import Count
+        from erp.models_ecommerce import Notification
+
+        return dict(Notification.objects.filter(status='PENDING').values('channel').annotate(
+            total=Count('id')
+        ).values_list('channel', 'total'))
+
+    def dispatch(self, channels=None, limit=None, ids=None):
+        """
+        Send pending notifications, optionally only the given ids; returns
+        {'sent': n, 'failed': n, 'batches': n}
+        """
+        channels = set(channels or ['IN_APP', *self.CHANNELS])
+        summary = {'sent': 0, 'failed': 0, 'batches': 0}
+        started = time.monotonic()
+        pools = {name: ThreadPoolExecutor(max_workers=self.workers.get(name, 1)) for name in self.channels if name in channels}
+        try:
+            if 'IN_APP' in channels:
+                summary['sent'] += self._deliver_in_app(ids)
+            while pools and (limit is None or summary['sent'] + summary['failed'] < limit):
+                size = self.batch_size if limit is None else min(self.batch_size, limit - summary['sent'] - summary['failed'])
+                batch = self._claim_batch(set(pools), size, ids)
+                if not batch:
+                    break
+                sent, failed = self._send_batch(batch, pools)
+                summary['sent'] += sent
+                summary['failed'] += failed
+                summary['batches'] += 1
+        finally:
+            for pool in pools.values():
+                pool.shutdown(wait=True)
+        logger.info(
+            f"Dispatched {summary['sent']} notifications ({summary['failed']} failed) "
+            f"in {time.monotonic() - started:.2f}s"
+        )
+        return summary
+
+    def _deliver_in_app(self, ids=None):
+        from erp.models_ecommerce import Notification
+
+        pending = Notification.objects.filter(status='PENDING', channel='IN_APP')
+        if ids is not None:
+            pending = pending.filter(id__in=ids)
+        return pending.update(status='SENT', sent_at=timezone.now())
+
+    def _claim_batch(self, channels, size, ids=None):
+        """Mark the next batch SENDING in a short transaction and return it"""
+        from erp.models_ecommerce import Notification
+
+        now = timezone.now()
+        claimable = Notification.objects.filter(
+            Q(status='PENDING') | Q(status='SENDING', claimed_at__lt=now - self.CLAIM_TIMEOUT), channel__in=channels,
+        )
+        if ids is not None:
+            claimable = claimable.filter(id__in=ids)
+        with transaction.atomic():
+            # rows another dispatcher is claiming are locked until its claim commits
+            batch = list(claimable.select_for_update(skip_locked=True).order_by('id').values(
+                'id', 'recipient_id', 'channel', 'subject', 'message', 'email_address', 'phone_number',
+            )[:size])
+            Notification.objects.filter(id__in=[n['id'] for n in batch]).update(status='SENDING', claimed_at=now)
+        return batch
+
+    def _send_batch(self, batch, pools):
+        by_channel = {}
+        for n in batch:
+            by_channel.setdefault(n['channel'], []).append(n)
+        futures = [
+            pools[name].submit(self.channels[name].send, items[start:start + self.chunk_size])
+            for name, items in by_channel.items()
+            for start in range(0, len(items), self.chunk_size)
+        ]
+        recipients = {n['id']: n['recipient_id'] for n in batch}
+        sent = failed = 0
+        for future in as_completed(futures):
+            chunk_sent, chunk_failed = self._record_results(future.result(), recipients)
+            sent += chunk_sent
+            failed += chunk_failed
+        return sent, failed
+
+    @staticmethod
+    def _record_results(results, recipients):
+        """
+        Write one chunk's [(id, error)] results; rows read while they were
+        being sent stay READ. Returns (sent, failed).
+        """
+        from erp.models_ecommerce import Notification
+
+        delivered = [pk for pk, error in results if not error]
+        errors = {pk: error[:1000] for pk, error in results if error}
+        with transaction.atomic():
+            Notification.objects.filter(id__in=delivered, status='SENDING').update(
+                status='SENT', sent_at=timezone.now(), error_message='',
+            )
+            failed = list(Notification.objects.select_for_update().filter(
+                id__in=errors, status='SENDING'
+            ).values_list('id', flat=True))
+            if failed:
+                Notification.objects.filter(id__in=failed).update(status='FAILED', sent_at=None, error_message=Case(
+                    *[When(id=pk, then=Value(errors[pk])) for pk in failed], output_field=TextField(),
+                ))
+            # failed notifications no longer count as unread
+            per_user = {}
+            for pk in failed:
+                per_user[recipients[pk]] = per_user.get(recipients[pk], 0) + 1
+            for user_id, count in per_user.items():
+                removed_on_commit(user_id, count)
+        return len(delivered), len(failed)
@@ -0,0 +1,434 @@
+"""
+Procurement Posting Services
+Set-based posting of goods receipts and supplier payments
+"""
+import random
+import string
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from django.db.models import F, Q, Case, When, DecimalField, PositiveIntegerField
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class GRNReceiptService:
+    """
+    Post a Goods Received Note into inventory with a fixed number of queries.
+    PO items and their products are loaded in one joined query, missing
+    products are created in bulk, Inventory rows are bulk inserted and stock
+    increments are applied with one grouped UPDATE.
+    """
+
+    def __init__(self, grn):
+        self.grn = grn
+        self._created_products = []
+
+    def add_items(self, lines):
+        """Bulk create GRN lines from request data, validated against the GRN's purchase order"""
+        from erp.models_extended import GoodsReceivedNoteItem
+
+        po_items = self.grn.purchase_order.items.in_bulk()
+        items = []
+        for index, line in enumerate(lines, start=1):
+            po_item = po_items.get(self._to_int(line.get('po_item')))
+            if po_item is None:
+                raise ValidationError({'items': [f'Line {index}: PO item does not belong to purchase order {self.grn.purchase_order.po_number}.']})
+            try:
+                received = Decimal(str(line.get('quantity_received', 0)))
+                accepted = Decimal(str(line.get('quantity_accepted', received)))
+                rejected = Decimal(str(line.get('quantity_rejected', 0)))
+            except (InvalidOperation, ValueError):
+                raise ValidationError({'items': [f'Line {index}: quantities must be numbers.']})
+            items.append(GoodsReceivedNoteItem(
+                grn=self.grn,
+                po_item=po_item,
+                quantity_received=received,
+                quantity_accepted=accepted,
+                quantity_rejected=rejected,
+                quality_status=line.get('quality_status') or 'PENDING',
+                quality_notes=line.get('quality_notes', ''),
+                batch_number=line.get('batch_number', ''),
+                expiry_date=line.get('expiry_date') or None,
+                notes=line.get('notes', ''),
+            ))
+        return GoodsReceivedNoteItem.objects.bulk_create(items)
+
+    @staticmethod
+    def _to_int(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def post(self):
+        """Recompute the GRN total and receive inventory lines into stock"""
+        from erp.models import Inventory, Product
+        from erp.services.scan_service import invalidate_on_commit, adjust_stock_on_commit
+
+        grn = self.grn
+        items = list(grn.items.select_related('po_item__product', 'po_item__purchase_order'))
+
+        total_amount = sum((item.po_item.unit_price * item.quantity_received for item in items), Decimal('0'))
+        grn.total_amount = total_amount
+        grn.save(update_fields=['total_amount', 'updated_at'])
+
+        receivable = [item for item in items if item.po_item.is_inventory_item and item.quantity_received > 0]
+        if not receivable:
+            return grn
+
+        with transaction.atomic():
+            self._create_missing_products(grn, receivable)
+
+            inventory_rows = []
+            deltas = {}
+            for item in receivable:
+                po_item = item.po_item
+                quantity = int(item.quantity_received)
+                inventory_rows.append(Inventory(
+                    product=po_item.product,
+                    quantity=quantity,
+                    unit_cost=po_item.unit_price,
+                    total_cost=po_item.unit_price * item.quantity_received,
+                    transaction_type='PURCHASE',
+                    reference=f'GRN {grn.grn_number}',
+                    notes=f'Received from Purchase Order {po_item.purchase_order.po_number}'
+                ))
+                deltas[po_item.product_id] = deltas.get(po_item.product_id, 0) + quantity
+            Inventory.objects.bulk_create(inventory_rows)
+
+            Product.objects.filter(id__in=deltas).update(
+                quantity_in_stock=Case(
+                    *[When(id=pid, then=F('quantity_in_stock') + qty) for pid, qty in deltas.items()],
+                    default=F('quantity_in_stock'),
+                    output_field=PositiveIntegerField(),
+                ),
+                updated_at=timezone.now(),
+            )
+            adjust_stock_on_commit(deltas)
+            if self._created_products:
+                invalidate_on_commit(grn.business_id)
+
+        logger.info(f"Posted GRN {grn.grn_number}: {len(inventory_rows)} lines into {len(deltas)} products")
+        return grn
+
+    def _create_missing_products(self, grn, items):
+        """Create one product per PO item that is not linked to a product yet"""
+        from erp.models import Product
+        from erp.models_extended import PurchaseOrderItem
+
+        missing = {}
+        for item in items:
+            if item.po_item.product_id is None:
+                missing.setdefault(item.po_item.id, item.po_item)
+        if not missing:
+            return
+
+        skus = self._generate_skus(list(missing.values()))
+        products = Product.objects.bulk_create([
+            Product(
+                business=grn.business,
+                name=po_item.description,
+                sku=sku,
+                description=po_item.description,
+                unit_price=po_item.unit_price,
+                cost_price=po_item.unit_price,
+                quantity_in_stock=0,
+                is_active=True,
+            )
+            for po_item, sku in zip(missing.values(), skus)
+        ])
+        created = dict(zip(missing.keys(), products))
+        for item in items:
+            if item.po_item.product_id is None:
+                item.po_item.product = created[item.po_item.id]
+        PurchaseOrderItem.objects.bulk_update(list(missing.values()), ['product'])
+        self._created_products = products
+
+    @staticmethod
+    def _generate_skus(po_items):
+        """Generate unique random SKUs for new products, checking collisions in one query per round"""
+        from erp.models import Product
+
+        def candidate(description):
+            prefix = description[:3].upper().replace(' ', '')
+            if len(prefix) < 3:
+                prefix = 'PRO'
+            return f"{prefix}-{''.join(random.choices(string.digits, k=6))}"
+
+        skus = [candidate(po_item.description) for po_item in po_items]
+        while True:
+            taken = set(Product.objects.filter(sku__in=skus).values_list('sku', flat=True))
+            seen = set()
+            clashes = []
+            for index, sku in enumerate(skus):
+                if sku in taken or sku in seen:
+                    clashes.append(index)
+                seen.add(sku)
+            if not clashes:
+                return skus
+            for index in clashes:
+                skus[index] = candidate(po_items[index].description)
+
+
+class SettlementError(Exception):
+    """Raised when a GRN payment batch cannot be settled"""
+    pass
+
+
+class GRNSettlementService:
+    """
+    Settle supplier payments against one or many GRNs in a single transaction.
+    All tills/accounts for the batch are resolved and locked up front, debits
+    are grouped per account and applied with one UPDATE per account type, and
+    transactions, payment rows, GRNs and vendor bills are written in bulk.
+    """
+
+    METHODS = {
+        'CASH': ('cash_till', 'cash till'),
+        'MOBILE_MONEY': ('mobile_money_account', 'mobile money account'),
+        'BANK': ('bank_account', 'bank account'),
+    }
+
+    def __init__(self, user):
+        self.user = user
+
+    @staticmethod
+    def _account_models():
+        from erp.models import CashTill, MobileMoneyAccount, BankAccount
+        return {'CASH': CashTill, 'MOBILE_MONEY': MobileMoneyAccount, 'BANK': BankAccount}
+
+    def settle(self, grns, legs):
+        """
+        Apply payment legs to GRNs.
+        grns: GoodsReceivedNote instances (purchase_order selected)
+        legs: list of dicts {'grn': id, 'method': 'CASH', 'amount': 100, 'account_id': optional}
+        """
+        grns = {grn.id: grn for grn in grns}
+        parsed = self._parse_legs(grns, legs)
+        if not parsed:
+            raise SettlementError('No payment methods provided')
+
+        with transaction.atomic():
+            self._lock_grns(grns)
+            self._check_outstanding(grns, parsed)
+            accounts = self._resolve_accounts(grns, parsed)
+            self._apply(grns, parsed, accounts)
+        return list(grns.values())
+
+    @staticmethod
+    def _lock_grns(grns):
+        """Lock the GRNs and reload what concurrent payments may have changed since they were read"""
+        from erp.models_extended import GoodsReceivedNote
+
+        for grn_id, total_amount, paid_amount, payment_status in GoodsReceivedNote.objects.select_for_update().filter(
+            id__in=grns
+        ).order_by('id').values_list('id', 'total_amount', 'paid_amount', 'payment_status'):
+            grn = grns[grn_id]
+            grn.total_amount, grn.paid_amount, grn.payment_status = total_amount, paid_amount, payment_status
+
+    def _parse_legs(self, grns, legs):
+        parsed = []
+        for leg in legs:
+            grn = grns.get(leg.get('grn'))
+            if grn is None:
+                raise SettlementError(f"GRN {leg.get('grn')} not found")
+            try:
+                amount = Decimal(str(leg.get('amount', 0)))
+            except (InvalidOperation, ValueError):
+                raise SettlementError('Invalid payment amount')
+            if amount <= 0:
+                continue
+            method = str(leg.get('method', '')).upper()
+            if method not in self.METHODS:
+                raise SettlementError(f'Unsupported payment method {method}')
+            parsed.append({'grn': grn, 'method': method, 'amount': amount, 'account_id': leg.get('account_id')})
+        return parsed
+
+    @staticmethod
+    def _check_outstanding(grns, legs):
+        totals = {}
+        for leg in legs:
+            totals[leg['grn'].id] = totals.get(leg['grn'].id, Decimal('0')) + leg['amount']
+        for grn_id, total in totals.items():
+            grn = grns[grn_id]
+            outstanding = grn.total_amount - grn.paid_amount
+            if total > outstanding:
+                raise SettlementError(f'Payment amount (${total}) exceeds outstanding amount (${outstanding}) for GRN {grn.grn_number}')
+
+    def _resolve_accounts(self, grns, legs):
+        """
+        Return {(method, account id): account} with every account locked once.
+        Explicit accounts must belong to a store of the leg's GRN business.
+        """
+        from erp.models import Store
+
+        models = self._account_models()
+        business_ids = {grn.business_id for grn in grns.values()}
+        explicit = {}
+        for leg in legs:
+            if leg['account_id']:
+                explicit.setdefault(leg['method'], set()).add(self._to_int(leg['account_id']))
+
+        default_store = {}
+        if any(not leg['account_id'] for leg in legs):
+            for store in Store.objects.filter(business_id__in=business_ids).order_by('business_id', 'id'):
+                default_store.setdefault(store.business_id, store.id)
+
+        resolved = {}
+        for method, model in models.items():
+            method_legs = [leg for leg in legs if leg['method'] == method]
+            if not method_legs:
+                continue
+            store_ids = {default_store.get(leg['grn'].business_id) for leg in method_legs if not leg['account_id']}
+            store_ids.discard(None)
+            queryset = model.objects.select_for_update(of=('self',)).select_related('store').filter(is_active=True).filter(
+                Q(id__in=explicit.get(method, set()) - {None}, store__business_id__in=business_ids) | Q(store_id__in=store_ids)
+            ).order_by('id')
+            by_id, by_store = {}, {}
+            for account in queryset:
+                by_id[account.id] = account
+                by_store.setdefault(account.store_id, account)
+
+            label = self.METHODS[method][1]
+            for leg in method_legs:
+                if leg['account_id']:
+                    account = by_id.get(self._to_int(leg['account_id']))
+                    if account is None or account.store.business_id != leg['grn'].business_id:
+                        raise SettlementError(f"{label} {leg['account_id']} not found in the business of GRN {leg['grn'].grn_number}")
+                else:
+                    account = by_store.get(default_store.get(leg['grn'].business_id))
+                if account is None:
+                    raise SettlementError(f'No {label} found')
+                leg['account'] = account
+                resolved[(method, account.id)] = account
+        return resolved
+
+    @staticmethod
+    def _to_int(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def _apply(self, grns, legs, accounts):
+        from erp.models import MobileMoneyTransaction, BankTransaction
+        from erp.models_extended import PurchaseOrderPayment, VendorBill, PurchaseOrder, GoodsReceivedNote, VendorSpendRollup
+
+        models = self._account_models()
+        debits = {}
+        for leg in legs:
+            key = (leg['method'], leg['account'].id)
+            debits[key] = debits.get(key, Decimal('0')) + leg['amount']
+        for (method, account_id), amount in debits.items():
+            account = accounts[(method, account_id)]
+            if account.current_balance < amount:
+                label = self.METHODS[method][1]
+                raise SettlementError(f'Insufficient {label} balance. Available: ${account.current_balance}, Required: ${amount}')
+
+        for method, model in models.items():
+            method_debits = {aid: amount for (m, aid), amount in debits.items() if m == method}
+            if method_debits:
+                model.objects.filter(id__in=method_debits).update(current_balance=Case(
+                    *[When(id=aid, then=F('current_balance') - amount) for aid, amount in method_debits.items()],
+                    default=F('current_balance'),
+                    output_field=DecimalField(max_digits=15, decimal_places=2),
+                ))
+
+        today = timezone.now().date()
+        mobile_rows, bank_rows, payment_rows = [], [], []
+        for leg in legs:
+            grn, method, amount, account = leg['grn'], leg['method'], leg['amount'], leg['account']
+            if method in ('MOBILE_MONEY', 'BANK'):
+                row_model, rows, field = (
+                    (MobileMoneyTransaction, mobile_rows, 'mobile_account') if method == 'MOBILE_MONEY'
+                    else (BankTransaction, bank_rows, 'bank_account')
+                )
+                rows.append(row_model(
+                    transaction_type='PAYMENT',
+                    amount=amount,
+                    reference=f'GRN {grn.grn_number}',
+                    description=f'Payment for Purchase Order {grn.purchase_order.po_number}',
+                    transaction_date=today,
+                    value_date=today,
+                    status='COMPLETED',
+                    created_by=self.user,
+                    **{field: account}
+                ))
+            payment_rows.append(PurchaseOrderPayment(
+                grn=grn,
+                payment_method=method,
+                amount=amount,
+                created_by=self.user,
+                notes=f'Payment for GRN {grn.grn_number}',
+                **{self.METHODS[method][0]: account}
+            ))
+            grn.paid_amount += amount
+        MobileMoneyTransaction.objects.bulk_create(mobile_rows)
+        BankTransaction.objects.bulk_create(bank_rows)
+        PurchaseOrderPayment.objects.bulk_create(payment_rows)
+
+        paid_grns = {leg['grn'].id: leg['grn'] for leg in legs}
+        for grn in paid_grns.values():
+            if grn.paid_amount >= grn.total_amount:
+                grn.payment_status = 'PAID'
+            elif grn.paid_amount > 0:
+                grn.payment_status = 'PARTIAL'
+            else:
+                grn.payment_status = 'PENDING'
+            grn.updated_at = timezone.now()
+        GoodsReceivedNote.objects.bulk_update(paid_grns.values(), ['paid_amount', 'payment_status', 'updated_at'])
+
+        bills = list(VendorBill.objects.filter(grn_id__in=paid_grns).order_by('grn_id', '-bill_date', '-created_at'))
+        seen = set()
+        updated_bills = []
+        for bill in bills:
+            if bill.grn_id in seen:
+                continue
+            seen.add(bill.grn_id)
+            bill.paid_amount = paid_grns[bill.grn_id].paid_amount
+            bill.balance = bill.total_amount - bill.paid_amount
+            if bill.balance <= 0 and bill.paid_amount > 0:
+                bill.payment_status = 'PAID'
+                bill.status = 'PAID'
+            elif bill.paid_amount > 0:
+                bill.payment_status = 'PARTIAL'
+            else:
+                bill.payment_status = 'UNPAID'
+            bill.updated_at = timezone.now()
+            updated_bills.append(bill)
+        VendorBill.objects.bulk_update(updated_bills, ['paid_amount', 'balance', 'payment_status', 'status', 'updated_at'])
+
+        VendorSpendRollup.record_many([
+            (leg['grn'].purchase_order.vendor_id, leg['grn'].business_id, today, {'paid_amount': leg['amount']})
+            for leg in legs
+        ])
+
+        fully_paid_pos = {grn.purchase_order_id for grn in paid_grns.values() if grn.payment_status == 'PAID'}
+        if fully_paid_pos:
+            PurchaseOrder.objects.filter(id__in=fully_paid_pos).exclude(status='COMPLETED').update(status='BILLED')
+
+        logger.info(f"Settled {len(legs)} payment legs across {len(paid_grns)} GRNs")
+
+
+@receiver(post_delete, sender='erp.PurchaseOrder')
+@receiver(post_delete, sender='erp.GoodsReceivedNote')
+@receiver(post_delete, sender='erp.VendorBill')
+def reverse_vendor_rollup(sender, instance, **kwargs):
+    instance.reverse_rollup()
+
+
+@receiver(post_delete, sender='erp.PurchaseOrderPayment')
+def reverse_vendor_rollup_payment(sender, instance, **kwargs):
+    from erp.models_extended import GoodsReceivedNote, VendorSpendRollup
+
+    grn = GoodsReceivedNote.objects.filter(id=instance.grn_id).values('business_id', 'purchase_order__vendor_id').first()
+    if grn:
+        VendorSpendRollup.record(
+            grn['purchase_order__vendor_id'], grn['business_id'], instance.payment_date,
+            paid_amount=-instance.amount,
+        )
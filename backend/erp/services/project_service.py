@@ -0,0 +1,35 @@
+"""
+Project Cost Rollup Service
+Keeps the weekly project rollups in step with every timesheet and expense write, cascades included
+"""
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender='erp.ProjectTimesheet')
+@receiver(post_save, sender='erp.ProjectExpense')
+def sync_project_rollup(sender, instance, raw=False, **kwargs):
+    """Swap the row's contribution as of its last load or save for the one just written"""
+    from erp.models import ProjectCostRollup
+
+    if raw:
+        return
+    current = instance.rollup_contribution()
+    ProjectCostRollup.replace_contribution(getattr(instance, '_rollup_contribution', None), current)
+    instance._rollup_contribution = current
+
+
+@receiver(post_delete, sender='erp.ProjectTimesheet')
+@receiver(post_delete, sender='erp.ProjectExpense')
+def reverse_project_rollup(sender, instance, **kwargs):
+    """
+    Take a deleted row out of its week, also when it goes with an employee,
+    task or project (the collector loads cascaded rows through from_db).
+    """
+    from erp.models import ProjectCostRollup
+
+    ProjectCostRollup.replace_contribution(getattr(instance, '_rollup_contribution', None), None)
+    instance._rollup_contribution = None
@@ -0,0 +1,240 @@
+"""
+Promo Code Service
+In-memory per-website promo code index with atomic usage redemption
+"""
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from erp.checks import cache_is_shared
+import logging
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+
+
+class PromoError(Exception):
+    """Raised when a promo code cannot be applied or redeemed"""
+    pass
+
+
+class PromoIndex:
+    """
+    In-process hash index of active promo codes per website.
+    Each website's codes are loaded with one query on first use and
+    reloaded when the website's promo generation changes. The generation
+    lives in the default cache, so with Redis (REDIS_URL) edits made by any
+    worker invalidate every process; with the per-process fallback cache
+    other workers only see an edit once their index expires, after
+    LOCAL_MAX_AGE. Evaluation never touches the database; usage counts in
+    the index are advisory and redemption enforces the limit with a
+    conditional UPDATE.
+    """
+
+    MAX_AGE = 300
+    LOCAL_MAX_AGE = 15
+    GENERATION_KEY = 'promo_index_generation:{website_id}'
+    FIELDS = (
+        'id', 'code', 'discount_type', 'discount_value', 'min_order_amount', 'max_discount_amount',
+        'valid_from', 'valid_until', 'usage_limit', 'current_usage',
+    )
+
+    def __init__(self):
+        self._websites = {}
+        self._lock = threading.Lock()
+
+    @property
+    def max_age(self):
+        return self.MAX_AGE if cache_is_shared() else self.LOCAL_MAX_AGE
+
+    def _generation(self, website_id):
+        return cache.get(self.GENERATION_KEY.format(website_id=website_id), 0)
+
+    def _get_index(self, website_id):
+        generation = self._generation(website_id)
+        index = self._websites.get(website_id)
+        if index and index['generation'] == generation and time.monotonic() - index['built_at'] < self.max_age:
+            return index
+        with self._lock:
+            index = self._websites.get(website_id)
+            if index and index['generation'] == generation and time.monotonic() - index['built_at'] < self.max_age:
+                return index
+            index = self._build(website_id, generation)
+            self._websites[website_id] = index
+            return index
+
+    def _build(self, website_id, generation):
+        from erp.models_ecommerce import PromoCode
+
+        codes = {
+            row['code']: row
+            for row in PromoCode.objects.filter(website_id=website_id, is_active=True).values(*self.FIELDS)
+        }
+        return {'generation': generation, 'built_at': time.monotonic(), 'codes': codes}
+
+    def get(self, website_id, code):
+        return self._get_index(website_id)['codes'].get((code or '').strip())
+
+    def evaluate(self, website_id, code, order_amount, now=None):
+        """
+        Check a code against an order amount.
+        Returns {'code', 'valid', 'discount_amount', ...} or {'code', 'valid': False, 'error'}.
+        """
+        now = now or timezone.now()
+        order_amount = _decimal(order_amount)
+        promo = self.get(website_id, code)
+        if promo is None:
+            return {'code': code, 'valid': False, 'error': 'Invalid promo code'}
+        if now < promo['valid_from'] or now > promo['valid_until']:
+            return {'code': code, 'valid': False, 'error': 'Promo code has expired'}
+        if order_amount < promo['min_order_amount']:
+            return {'code': code, 'valid': False, 'error': f"Minimum order amount is {promo['min_order_amount']}"}
+        if promo['usage_limit'] is not None and promo['current_usage'] >= promo['usage_limit']:
+            return {'code': code, 'valid': False, 'error': 'Promo code usage limit reached'}
+        return {
+            'code': code,
+            'valid': True,
+            'promo_code': promo['id'],
+            'discount_amount': discount_for(promo, order_amount),
+            'discount_type': promo['discount_type'],
+            'discount_value': promo['discount_value'],
+        }
+
+    def evaluate_many(self, website_id, codes, order_amount, now=None):
+        """Evaluate several codes against one order amount; the best valid code is reported"""
+        now = now or timezone.now()
+        results = [self.evaluate(website_id, code, order_amount, now) for code in dict.fromkeys(codes)]
+        valid = [r for r in results if r['valid']]
+        best = max(valid, key=lambda r: r['discount_amount'])['code'] if valid else None
+        return {'order_amount': _decimal(order_amount), 'best_code': best, 'results': results}
+
+    def adjust_usage(self, website_id, code, delta):
+        """Keep this process' copy of a code's usage in step with a redemption"""
+        index = self._websites.get(website_id)
+        promo = index['codes'].get(code) if index else None
+        if promo is not None:
+            promo['current_usage'] += delta
+
+    def invalidate_website(self, website_id):
+        key = self.GENERATION_KEY.format(website_id=website_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+        with self._lock:
+            self._websites.pop(website_id, None)
+
+
+promo_index = PromoIndex()
+
+
+def _decimal(value):
+    try:
+        return Decimal(str(value or 0))
+    except InvalidOperation:
+        raise PromoError('order_amount must be a number')
+
+
+def discount_for(promo, order_amount):
+    """Discount a promo dict gives on an order amount, never more than the order itself"""
+    if promo['discount_type'] == 'PERCENTAGE':
+        discount = order_amount * promo['discount_value'] / 100
+        if promo['max_discount_amount']:
+            discount = min(discount, promo['max_discount_amount'])
+    else:
+        discount = promo['discount_value']
+    return min(discount, order_amount).quantize(CENT)
+
+
+def redeem(website_id, code, order_amount, now=None):
+    """
+    Evaluate and consume one use of a code. The usage limit is enforced by
+    a single conditional UPDATE (current_usage < usage_limit), so concurrent
+    checkouts can never exceed it. Raises PromoError when the code does not
+    apply or its last use was taken.
+    """
+    from erp.models_ecommerce import PromoCode
+
+    now = now or timezone.now()
+    result = promo_index.evaluate(website_id, code, order_amount, now)
+    if not result['valid']:
+        raise PromoError(result['error'])
+    updated = PromoCode.objects.filter(
+        id=result['promo_code'], is_active=True, valid_from__lte=now, valid_until__gte=now,
+    ).filter(
+        Q(usage_limit__isnull=True) | Q(current_usage__lt=F('usage_limit'))
+    ).update(current_usage=F('current_usage') + 1)
+    if not updated:
+        # the index was stale: reload it so the next evaluation sees the real usage
+        promo_index.invalidate_website(website_id)
+        raise PromoError('Promo code usage limit reached')
+    transaction.on_commit(lambda: promo_index.adjust_usage(website_id, result['code'], 1))
+    return result
+
+
+def release(website_id, code):
+    """Give back one use of a code, e.g. when the order that redeemed it is cancelled"""
+    from erp.models_ecommerce import PromoCode
+
+    if PromoCode.objects.filter(website_id=website_id, code=code, current_usage__gt=0).update(
+        current_usage=F('current_usage') - 1
+    ):
+        transaction.on_commit(lambda: promo_index.adjust_usage(website_id, code, -1))
+        return True
+    return False
+
+
+def redeem_for_order(order, code, now=None):
+    """
+    Redeem a code against a pending online order: one use is consumed, the
+    discount is written onto the order and the code is kept on it so that
+    cancelling the order gives the use back.
+    """
+    from erp.models_ecommerce import OnlineOrder
+
+    with transaction.atomic():
+        order = OnlineOrder.objects.select_for_update().get(id=order.id)
+        if order.status != 'PENDING' or order.payment_status == 'COMPLETED':
+            raise PromoError('Promo codes can only be applied to pending orders')
+        if order.promo_code_id:
+            raise PromoError('A promo code has already been applied to this order')
+        result = redeem(order.website_id, code, order.subtotal, now)
+        order.total_amount = order.total_amount + order.discount_amount - result['discount_amount']
+        order.discount_amount = result['discount_amount']
+        order.promo_code_id = result['promo_code']
+        order.save(update_fields=['promo_code', 'discount_amount', 'total_amount', 'updated_at'])
+    return result
+
+
+def release_for_order(order):
+    """Give back the use an order's promo code took; a second call for the same order does nothing"""
+    from erp.models_ecommerce import OnlineOrder, PromoCode
+
+    promo_id = order.promo_code_id
+    if not promo_id:
+        return False
+    with transaction.atomic():
+        # detach first so two cancellations cannot both give the use back
+        if not OnlineOrder.objects.filter(id=order.id, promo_code_id=promo_id).update(
+            promo_code=None, updated_at=timezone.now()
+        ):
+            return False
+        order.promo_code_id = None
+        code = PromoCode.objects.filter(id=promo_id).values_list('code', flat=True).first()
+        return release(order.website_id, code)
+
+
+def invalidate_on_commit(website_id):
+    transaction.on_commit(lambda: promo_index.invalidate_website(website_id))
+
+
+@receiver(post_save, sender='erp.PromoCode')
+@receiver(post_delete, sender='erp.PromoCode')
+def invalidate_promo_index(sender, instance, **kwargs):
+    invalidate_on_commit(instance.website_id)
@@ -0,0 +1,246 @@
+"""
+Stock Reservation Service
+Time-limited stock holds for carts and online orders with atomic conditional updates
+"""
+from datetime import timedelta
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Sum, Case, When, Value, DecimalField
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+QUANTITY_FIELD = DecimalField(max_digits=15, decimal_places=2)
+
+
+class ReservationError(Exception):
+    """Raised when stock cannot be reserved"""
+    pass
+
+
+class ReservationService:
+    """
+    Holds website stock against warehouse StockRecords.
+    A hold moves quantity from available to reserved with a conditional
+    UPDATE (... WHERE available_quantity >= n) per stock record, so two
+    checkouts racing for the last units can never both succeed and no
+    table-wide lock is needed. Holds expire after `ttl_minutes` unless they
+    belong to an order; payment converts them into OUT stock movements.
+    Listings are matched to inventory items by SKU within the business.
+    """
+
+    def __init__(self, user=None, ttl_minutes=15):
+        self.user = user
+        self.ttl = timedelta(minutes=ttl_minutes)
+
+    def _stock_records(self, website_product):
+        from erp.models import StockRecord
+
+        product = website_product.product
+        return list(StockRecord.objects.filter(
+            item__business_id=product.business_id, item__sku=product.sku, item__is_active=True,
+            warehouse__is_active=True, available_quantity__gt=0,
+        ).order_by('-available_quantity', 'id').values_list('id', 'available_quantity'))
+
+    def reserve(self, website_product, quantity, cart=None, order=None):
+        """
+        Hold `quantity` of a listing, spread over warehouses with the most
+        available stock first. Raises ReservationError (holding nothing) when
+        the warehouses cannot cover the whole quantity.
+        """
+        from erp.models_ecommerce import StockReservation
+
+        quantity = Decimal(str(quantity))
+        if quantity <= 0:
+            raise ReservationError('Quantity must be positive')
+        expires_at = None if order else timezone.now() + self.ttl
+        with transaction.atomic():
+            remaining = quantity
+            holds = []
+            for record_id, available in self._stock_records(website_product):
+                take = self._take(record_id, min(remaining, available))
+                if not take:
+                    continue
+                holds.append(StockReservation(
+                    stock_record_id=record_id, website_product=website_product, cart=cart, order=order,
+                    quantity=take, expires_at=expires_at,
+                ))
+                remaining -= take
+                if not remaining:
+                    break
+            if remaining:
+                raise ReservationError(
+                    f'Insufficient stock for {website_product.web_title}: {quantity - remaining} of {quantity} available'
+                )
+            return StockReservation.objects.bulk_create(holds)
+
+    def _take(self, record_id, wanted):
+        """Reserve up to `wanted` from one record; returns the quantity actually held"""
+        from erp.models import StockRecord
+
+        records = StockRecord.objects.filter(id=record_id)
+        for _ in range(3):
+            if wanted <= 0:
+                return Decimal('0')
+            if records.filter(available_quantity__gte=wanted).update(
+                reserved_quantity=F('reserved_quantity') + wanted,
+                available_quantity=F('available_quantity') - wanted,
+                last_updated=timezone.now(),
+            ):
+                return wanted
+            # another checkout reserved from this record since it was read; retry with what is left
+            wanted = min(wanted, records.values_list('available_quantity', flat=True).first() or Decimal('0'))
+        return Decimal('0')
+
+    def hold_cart_item(self, cart, website_product, quantity):
+        """Hold stock for a cart line and refresh the TTL of the cart's other holds"""
+        with transaction.atomic():
+            holds = self.reserve(website_product, quantity, cart=cart)
+            cart.reservations.filter(status='HELD').update(expires_at=timezone.now() + self.ttl)
+        return holds
+
+    def reserve_order(self, order, cart=None):
+        """
+        Hold stock for every item of an order. Holds of `cart` for the same
+        listings are moved onto the order first; only the shortfall is
+        reserved anew and cart holds beyond the ordered quantity go back to
+        stock. Order holds do not expire.
+        """
+        from erp.models_ecommerce import StockReservation
+
+        with transaction.atomic():
+            if cart is not None:
+                cart.reservations.filter(status='HELD').update(
+                    cart=None, order=order, expires_at=None, updated_at=timezone.now()
+                )
+            held = dict(StockReservation.objects.filter(order=order, status='HELD').values(
+                'website_product_id'
+            ).annotate(total=Sum('quantity')).values_list('website_product_id', 'total'))
+            for item in order.items.select_related('website_product__product'):
+                shortfall = item.quantity - held.pop(item.website_product_id, Decimal('0'))
+                if shortfall > 0:
+                    self.reserve(item.website_product, shortfall, order=order)
+                elif shortfall < 0:
+                    self._trim(StockReservation.objects.filter(
+                        order=order, status='HELD', website_product_id=item.website_product_id
+                    ), -shortfall)
+            # cart holds for listings the order does not contain go back to stock
+            if held:
+                surplus = StockReservation.objects.filter(order=order, status='HELD', website_product_id__in=held)
+                self.release(surplus)
+        return StockReservation.objects.filter(order=order, status='HELD')
+
+    def _trim(self, reservations, excess):
+        """Return `excess` units of a listing's holds to stock, releasing whole holds first and shrinking the last"""
+        from erp.models_ecommerce import StockReservation
+
+        rows = list(reservations.select_for_update(of=('self',)).order_by('-quantity', 'id').values_list(
+            'id', 'stock_record_id', 'quantity'
+        ))
+        whole, returned = [], []
+        for hold_id, record_id, quantity in rows:
+            if excess <= 0:
+                break
+            if quantity <= excess:
+                whole.append(hold_id)
+                excess -= quantity
+            else:
+                StockReservation.objects.filter(id=hold_id).update(
+                    quantity=F('quantity') - excess, updated_at=timezone.now()
+                )
+                returned.append((hold_id, record_id, excess))
+                excess = Decimal('0')
+        if whole:
+            self.release(StockReservation.objects.filter(id__in=whole))
+        if returned:
+            self._apply(returned, reserved=-1, available=1)
+
+    def release(self, reservations, status='RELEASED'):
+        """Return held stock of a reservation queryset; returns the number of holds released"""
+        from erp.models_ecommerce import StockReservation
+
+        with transaction.atomic():
+            rows = list(reservations.filter(status='HELD').select_for_update(skip_locked=True).values_list(
+                'id', 'stock_record_id', 'quantity'
+            ))
+            if not rows:
+                return 0
+            # claim the holds first so a concurrent release cannot return them twice
+            claimed = StockReservation.objects.filter(id__in=[r[0] for r in rows], status='HELD').update(
+                status=status, updated_at=timezone.now()
+            )
+            if claimed != len(rows):
+                raise ReservationError('Reservations changed while being released, retry')
+            self._apply(rows, reserved=-1, available=1)
+        return len(rows)
+
+    def convert_order(self, order):
+        """Turn an order's holds into OUT stock movements once it is paid"""
+        from erp.models import StockMovement
+        from erp.models_ecommerce import StockReservation
+
+        if self.user is None:
+            raise ReservationError('A user is required to record stock movements')
+        with transaction.atomic():
+            rows = list(StockReservation.objects.filter(order=order, status='HELD').select_for_update(of=('self',)).values_list(
+                'id', 'stock_record_id', 'quantity', 'stock_record__item_id', 'stock_record__warehouse_id',
+                'stock_record__item__purchase_price',
+            ))
+            if not rows:
+                return 0
+            StockReservation.objects.filter(id__in=[r[0] for r in rows]).update(
+                status='CONVERTED', updated_at=timezone.now()
+            )
+            self._apply([r[:3] for r in rows], reserved=-1, quantity=-1)
+            # bulk_create skips StockMovement.save, which would re-apply the quantity to the record
+            StockMovement.objects.bulk_create([
+                StockMovement(
+                    item_id=item_id, warehouse_id=warehouse_id, movement_type='OUT', quantity=quantity,
+                    unit_cost=unit_cost, total_cost=quantity * unit_cost,
+                    reference=f'Online order {order.order_number}', notes='Online order payment',
+                    created_by=self.user,
+                )
+                for _, _, quantity, item_id, warehouse_id, unit_cost in rows
+            ])
+        return len(rows)
+
+    def sweep_expired(self, now=None, batch_size=1000):
+        """Release every expired cart hold in batches; returns the number released"""
+        from erp.models_ecommerce import StockReservation
+
+        now = now or timezone.now()
+        released = 0
+        while True:
+            ids = list(StockReservation.objects.filter(
+                status='HELD', expires_at__lt=now
+            ).order_by('expires_at').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            released += self.release(StockReservation.objects.filter(id__in=ids), status='EXPIRED')
+            if len(ids) < batch_size:
+                break
+        if released:
+            logger.info(f"Released {released} expired stock reservations")
+        return released
+
+    def _apply(self, rows, reserved=0, available=0, quantity=0):
+        """Move held quantities on their stock records with one UPDATE"""
+        from erp.models import StockRecord
+
+        totals = {}
+        for _, record_id, amount in rows:
+            totals[record_id] = totals.get(record_id, Decimal('0')) + amount
+
+        def delta(sign):
+            return Case(
+                *[When(id=record_id, then=Value(amount * sign)) for record_id, amount in totals.items()],
+                default=Value(Decimal('0')),
+                output_field=QUANTITY_FIELD,
+            )
+
+        changes = {'last_updated': timezone.now()}
+        for field, sign in (('reserved_quantity', reserved), ('available_quantity', available), ('quantity', quantity)):
+            if sign:
+                changes[field] = F(field) + delta(sign)
+        StockRecord.objects.filter(id__in=totals).update(**changes)
@@ -0,0 +1,178 @@
+"""
+Checkout Scan Resolution Service
+Maps barcodes, SKUs and service codes to sellable items for a store
+"""
+import threading
+import time
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from erp.checks import cache_is_shared
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ScanIndex:
+    """
+    In-process hash index of scan codes per store.
+    Each store's index is built on first use and rebuilt when the business'
+    catalog generation changes. The generation lives in the default cache,
+    so with Redis (REDIS_URL) product edits made by any worker invalidate
+    every process; with the per-process fallback cache other workers only
+    see an edit once their index expires, after LOCAL_MAX_AGE. Stock
+    figures are kept current locally by POS deductions and are otherwise
+    refreshed when the index expires; checkout still enforces stock
+    against the database.
+    """
+
+    MAX_AGE = 300
+    LOCAL_MAX_AGE = 15
+    GENERATION_KEY = 'scan_index_generation:{business_id}'
+
+    def __init__(self):
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    @property
+    def max_age(self):
+        return self.MAX_AGE if cache_is_shared() else self.LOCAL_MAX_AGE
+
+    def _generation(self, business_id):
+        return cache.get(self.GENERATION_KEY.format(business_id=business_id), 0)
+
+    def lookup(self, store, code):
+        """Return the item dict for a scanned code, or None"""
+        code = (code or '').strip()
+        if not code:
+            return None
+        index = self._get_index(store)
+        item = index['codes'].get(code)
+        if item is None:
+            item = self._lookup_db(store, code)
+            if item is not None:
+                self._add(index, code, item)
+        return item
+
+    def _get_index(self, store):
+        generation = self._generation(store.business_id)
+        index = self._stores.get(store.id)
+        if index and index['generation'] == generation and time.monotonic() - index['built_at'] < self.max_age:
+            return index
+        with self._lock:
+            index = self._stores.get(store.id)
+            if index and index['generation'] == generation and time.monotonic() - index['built_at'] < self.max_age:
+                return index
+            index = self._build(store, generation)
+            self._stores[store.id] = index
+            return index
+
+    def _build(self, store, generation):
+        from erp.models import Product, Service
+
+        started = time.monotonic()
+        index = {
+            'business_id': store.business_id,
+            'generation': generation,
+            'built_at': started,
+            'codes': {},
+            'products': {},
+        }
+        store_filter = Q(business_id=store.business_id, is_active=True) & (Q(store=store) | Q(store__isnull=True))
+        for item_id, name, service_code, price in Service.objects.filter(store_filter).values_list(
+            'id', 'name', 'service_code', 'service_price'
+        ):
+            index['codes'][service_code] = self._service_item(item_id, name, service_code, price)
+        products = Product.objects.filter(store_filter).values_list(
+            'id', 'name', 'sku', 'barcode', 'unit_price', 'quantity_in_stock'
+        )
+        for item_id, name, sku, barcode, price, stock in products:
+            item = self._product_item(item_id, name, sku, barcode, price, stock)
+            index['products'][item_id] = item
+            index['codes'][sku] = item
+            if barcode:
+                index['codes'][barcode] = item
+        logger.info(
+            f"Built scan index for store {store.id}: {len(index['codes'])} codes "
+            f"in {(time.monotonic() - started) * 1000:.1f}ms"
+        )
+        return index
+
+    def _lookup_db(self, store, code):
+        from erp.models import Product, Service
+
+        store_filter = Q(business_id=store.business_id, is_active=True) & (Q(store=store) | Q(store__isnull=True))
+        row = Product.objects.filter(store_filter).filter(Q(barcode=code) | Q(sku=code)).values_list(
+            'id', 'name', 'sku', 'barcode', 'unit_price', 'quantity_in_stock'
+        ).first()
+        if row:
+            return self._product_item(*row)
+        row = Service.objects.filter(store_filter, service_code=code).values_list(
+            'id', 'name', 'service_code', 'service_price'
+        ).first()
+        if row:
+            return self._service_item(*row)
+        return None
+
+    def _add(self, index, code, item):
+        with self._lock:
+            index['codes'][code] = item
+            if item['type'] == 'product':
+                index['products'][item['id']] = item
+
+    @staticmethod
+    def _product_item(item_id, name, sku, barcode, price, stock):
+        return {
+            'type': 'product', 'id': item_id, 'name': name, 'sku': sku,
+            'barcode': barcode, 'price': str(price), 'stock': stock,
+        }
+
+    @staticmethod
+    def _service_item(item_id, name, service_code, price):
+        return {
+            'type': 'service', 'id': item_id, 'name': name,
+            'service_code': service_code, 'price': str(price), 'stock': None,
+        }
+
+    def adjust_stock(self, deltas):
+        """Apply {product_id: quantity_change} to locally cached stock figures"""
+        for index in list(self._stores.values()):
+            for product_id, delta in deltas.items():
+                item = index['products'].get(product_id)
+                if item is not None:
+                    item['stock'] = max((item['stock'] or 0) + delta, 0)
+
+    def invalidate_business(self, business_id):
+        """Drop this process' indexes for a business and bump the cached generation"""
+        key = self.GENERATION_KEY.format(business_id=business_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+        with self._lock:
+            for store_id in [s for s, i in self._stores.items() if i['business_id'] == business_id]:
+                del self._stores[store_id]
+
+
+scan_index = ScanIndex()
+
+
+def invalidate_on_commit(business_id):
+    transaction.on_commit(lambda: scan_index.invalidate_business(business_id))
+
+
+def adjust_stock_on_commit(deltas):
+    from erp.services.storefront_service import products_changed_on_commit
+
+    transaction.on_commit(lambda: scan_index.adjust_stock(deltas))
+    products_changed_on_commit(deltas)
+
+
+@receiver(post_save, sender='erp.Product')
+@receiver(post_delete, sender='erp.Product')
+@receiver(post_save, sender='erp.Service')
+@receiver(post_delete, sender='erp.Service')
+def invalidate_scan_index(sender, instance, **kwargs):
+    invalidate_on_commit(instance.business_id)
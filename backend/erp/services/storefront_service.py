@@ -0,0 +1,257 @@
+"""
+Storefront Catalog Service
+Precomputed, cached public catalog pages per website
+"""
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from erp.checks import cache_is_shared
+from erp.services.counter_service import counters
+import logging
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+
+
+class StorefrontCatalog:
+    """
+    Public catalog pages and product details, built once per website
+    generation and served from the default cache. With Redis (REDIS_URL)
+    a write in any worker bumps the generation for all of them; with the
+    per-process fallback cache entries only live LOCAL_CACHE_TIMEOUT, and
+    validators include the build time, so a lagging worker never confirms
+    a client's copy of a page rebuilt since.
+    Each page carries the effective price (online price or product price
+    less discount_percent), the primary image and an in-stock flag, so a
+    cache hit needs no database access at all. Website, listing and image
+    writes bump the website's generation; product writes and stock
+    movements only do so when a value shown on the storefront changed,
+    which keeps POS and online sales from flushing the cache on every
+    unit sold.
+    """
+
+    CACHE_TIMEOUT = 60 * 15
+    LOCAL_CACHE_TIMEOUT = 30
+    DEFAULT_PAGE_SIZE = 24
+    MAX_PAGE_SIZE = 100
+    GENERATION_KEY = 'storefront_generation:{website_id}'
+    PAGE_KEY = 'storefront_page:{website_id}:{generation}:{featured}:{page_size}:{page}'
+    PRODUCT_KEY = 'storefront_product:{website_id}:{generation}:{slug}'
+    STATE_KEY = 'storefront_state:{product_id}'
+    LISTING_FIELDS = (
+        'id', 'slug', 'web_title', 'short_description', 'is_featured', 'online_price', 'discount_percent',
+        'product_id', 'product__sku', 'product__unit_price', 'product__quantity_in_stock', 'primary_image',
+    )
+
+    @property
+    def timeout(self):
+        return self.CACHE_TIMEOUT if cache_is_shared() else self.LOCAL_CACHE_TIMEOUT
+
+    def generation(self, website_id):
+        return cache.get(self.GENERATION_KEY.format(website_id=website_id), 0)
+
+    def etag(self, website_id, *parts):
+        return '"sf-{}-{}"'.format(website_id, '-'.join(str(p) for p in (self.generation(website_id),) + parts))
+
+    def listing_page(self, website_id, page=1, page_size=DEFAULT_PAGE_SIZE, featured=False):
+        """A catalog page dict, or None when the website is not published"""
+        page_size = max(1, min(int(page_size), self.MAX_PAGE_SIZE))
+        page = max(1, int(page))
+        key = self.PAGE_KEY.format(
+            website_id=website_id, generation=self.generation(website_id),
+            featured=int(bool(featured)), page_size=page_size, page=page,
+        )
+        data = cache.get(key)
+        if data is None:
+            data = self._build_page(website_id, page, page_size, featured)
+            cache.set(key, data, self.timeout)
+        return data or None
+
+    def product_detail(self, website_id, slug):
+        """A single published listing with all its images, or None"""
+        key = self.PRODUCT_KEY.format(website_id=website_id, generation=self.generation(website_id), slug=slug)
+        data = cache.get(key)
+        if data is None:
+            data = self._build_product(website_id, slug)
+            cache.set(key, data, self.timeout)
+        return data or None
+
+    def _listings(self, website_id):
+        from erp.models_ecommerce import WebsiteProduct, ProductImage
+
+        primary_image = ProductImage.objects.filter(website_product=OuterRef('pk')).order_by(
+            '-is_primary', 'display_order', 'id'
+        ).values('image')[:1]
+        return WebsiteProduct.objects.filter(
+            website_id=website_id, website__status='PUBLISHED', is_published=True, product__is_active=True,
+        ).annotate(primary_image=Subquery(primary_image))
+
+    def _build_page(self, website_id, page, page_size, featured):
+        listings = self._listings(website_id)
+        if featured:
+            listings = listings.filter(is_featured=True)
+        offset = (page - 1) * page_size
+        rows = list(listings.order_by('display_order', '-created_at', 'id').values(*self.LISTING_FIELDS)[offset:offset + page_size])
+        if not rows and not self._is_published(website_id):
+            return {}
+        # a short page is the last one, so its size gives the total without a COUNT
+        count = len(rows) + offset if 0 < len(rows) < page_size else listings.count()
+        self._remember_state(rows)
+        return {
+            'website': website_id,
+            'page': page,
+            'page_size': page_size,
+            'count': count,
+            'has_next': offset + len(rows) < count,
+            'last_modified': timezone.now().replace(microsecond=0),
+            'results': [self._item(row) for row in rows],
+        }
+
+    def _build_product(self, website_id, slug):
+        from erp.models_ecommerce import ProductImage
+
+        row = self._listings(website_id).filter(slug=slug).values(
+            *self.LISTING_FIELDS, 'web_description', 'meta_title', 'meta_description', 'product__name',
+        ).first()
+        if row is None:
+            return {}
+        self._remember_state([row])
+        item = self._item(row)
+        item.update({
+            'name': row['product__name'],
+            'description': row['web_description'],
+            'meta_title': row['meta_title'],
+            'meta_description': row['meta_description'],
+            'images': [
+                {'url': self._media_url(image), 'alt_text': alt_text, 'is_primary': is_primary}
+                for image, alt_text, is_primary in ProductImage.objects.filter(website_product_id=row['id']).order_by(
+                    'display_order', 'id'
+                ).values_list('image', 'alt_text', 'is_primary')
+            ],
+            'last_modified': timezone.now().replace(microsecond=0),
+        })
+        return item
+
+    def _is_published(self, website_id):
+        from erp.models_ecommerce import Website
+
+        return Website.objects.filter(id=website_id, status='PUBLISHED').exists()
+
+    @staticmethod
+    def effective_price(online_price, unit_price, discount_percent):
+        price = online_price if online_price is not None else unit_price
+        if discount_percent:
+            price = price * (Decimal('100') - discount_percent) / Decimal('100')
+        return price.quantize(CENT)
+
+    @staticmethod
+    def _media_url(path):
+        return f'{settings.MEDIA_URL}{path}' if path else None
+
+    def _item(self, row):
+        price = row['online_price'] if row['online_price'] is not None else row['product__unit_price']
+        return {
+            'id': row['id'],
+            'slug': row['slug'],
+            'title': row['web_title'],
+            'short_description': row['short_description'],
+            'sku': row['product__sku'],
+            'is_featured': row['is_featured'],
+            'price': price,
+            'discount_percent': row['discount_percent'],
+            'effective_price': self.effective_price(row['online_price'], row['product__unit_price'], row['discount_percent']),
+            'in_stock': row['product__quantity_in_stock'] > 0,
+            'image': self._media_url(row['primary_image']),
+        }
+
+    @staticmethod
+    def _state(unit_price, stock, is_active):
+        return (str(unit_price), stock > 0, is_active)
+
+    def _remember_state(self, rows):
+        cache.set_many({
+            self.STATE_KEY.format(product_id=row['product_id']): self._state(
+                row['product__unit_price'], row['product__quantity_in_stock'], True
+            )
+            for row in rows
+        }, self.timeout)
+
+    def invalidate_website(self, website_id):
+        key = self.GENERATION_KEY.format(website_id=website_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+    def products_changed(self, product_ids):
+        """
+        Invalidate the websites listing any of these products whose price,
+        stock flag or active state differs from what the cached pages show.
+        """
+        from erp.models import Product
+        from erp.models_ecommerce import WebsiteProduct
+
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        cached = cache.get_many([self.STATE_KEY.format(product_id=pid) for pid in product_ids])
+        changed = [
+            product_id for product_id, unit_price, stock, is_active in Product.objects.filter(
+                id__in=product_ids
+            ).values_list('id', 'unit_price', 'quantity_in_stock', 'is_active')
+            if cached.get(self.STATE_KEY.format(product_id=product_id)) != self._state(unit_price, stock, is_active)
+        ]
+        if not changed:
+            return
+        cache.delete_many([self.STATE_KEY.format(product_id=pid) for pid in changed])
+        for website_id in set(WebsiteProduct.objects.filter(product_id__in=changed).values_list('website_id', flat=True)):
+            self.invalidate_website(website_id)
+
+
+storefront_catalog = StorefrontCatalog()
+
+
+# storefront product views are buffered like any other hot counter
+view_counter = counters['website_product.views']
+
+
+def invalidate_website_on_commit(website_id):
+    transaction.on_commit(lambda: storefront_catalog.invalidate_website(website_id))
+
+
+def products_changed_on_commit(product_ids):
+    product_ids = list(product_ids)
+    transaction.on_commit(lambda: storefront_catalog.products_changed(product_ids))
+
+
+@receiver(post_save, sender='erp.Website')
+@receiver(post_delete, sender='erp.Website')
+def invalidate_storefront_for_website(sender, instance, **kwargs):
+    invalidate_website_on_commit(instance.id)
+
+
+@receiver(post_save, sender='erp.WebsiteProduct')
+@receiver(post_delete, sender='erp.WebsiteProduct')
+def invalidate_storefront_for_listing(sender, instance, **kwargs):
+    invalidate_website_on_commit(instance.website_id)
+
+
+@receiver(post_save, sender='erp.ProductImage')
+@receiver(post_delete, sender='erp.ProductImage')
+def invalidate_storefront_for_image(sender, instance, **kwargs):
+    from erp.models_ecommerce import WebsiteProduct
+
+    website_id = WebsiteProduct.objects.filter(id=instance.website_product_id).values_list('website_id', flat=True).first()
+    if website_id:
+        invalidate_website_on_commit(website_id)
+
+
+@receiver(post_save, sender='erp.Product')
+def invalidate_storefront_for_product(sender, instance, **kwargs):
+    products_changed_on_commit([instance.id])
@@ -0,0 +1,382 @@
+"""
+Workflow Trigger Service
+Compiled, cached workflow trigger rules matched and started after commit
+"""
+import json
+import operator
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from erp.checks import cache_is_shared
+import logging
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_INSTANCE_STATUSES = ('PENDING', 'IN_PROGRESS')
+
+# user columns tried in order for the instance's created_by
+CREATOR_FIELDS = ('created_by_id', 'requested_by_id', 'user_id')
+
+
+class WorkflowError(Exception):
+    """Raised when a workflow condition cannot be compiled"""
+    pass
+
+
+def _contains(actual, expected):
+    return actual is not None and expected in actual
+
+
+OPERATORS = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'in': lambda actual, expected: actual in expected,
+    'not_in': lambda actual, expected: actual not in expected,
+    'contains': _contains,
+    'isnull': lambda actual, expected: (actual is None) == bool(expected),
+}
+
+
+def _coerce(actual, expected):
+    """Bring a JSON value to the type of the model value it is compared with"""
+    if expected is None or actual is None or isinstance(expected, (list, tuple, bool)):
+        return expected
+    try:
+        if isinstance(actual, Decimal):
+            return Decimal(str(expected))
+        if isinstance(actual, datetime):
+            return datetime.fromisoformat(expected)
+        if isinstance(actual, date):
+            return date.fromisoformat(expected)
+    except (InvalidOperation, TypeError, ValueError):
+        return expected
+    return expected
+
+
+def _compile_node(node):
+    if isinstance(node, list):
+        return _compile_node({'all': node})
+    if not isinstance(node, dict):
+        raise WorkflowError(f'Condition must be an object, got {node!r}')
+    if 'all' in node or 'any' in node:
+        children = [_compile_node(child) for child in node.get('all', node.get('any'))]
+        combine = all if 'all' in node else any
+        return lambda values: combine(child(values) for child in children)
+    if 'not' in node:
+        child = _compile_node(node['not'])
+        return lambda values: not child(values)
+    if 'field' in node:
+        return _compile_comparison(node['field'], node.get('op', 'eq'), node.get('value'))
+    # shorthand: {"total_amount__gt": 1000, "status": "PENDING"}
+    comparisons = []
+    for key, value in node.items():
+        field, _, op = key.partition('__')
+        comparisons.append(_compile_comparison(field, op or 'eq', value))
+    return lambda values: all(comparison(values) for comparison in comparisons)
+
+
+def _compile_comparison(field, op, expected):
+    compare = OPERATORS.get(op)
+    if compare is None:
+        raise WorkflowError(f'Unknown operator {op!r} for field {field!r}')
+
+    def predicate(values):
+        actual = values.get(field)
+        try:
+            return bool(compare(actual, _coerce(actual, expected)))
+        except TypeError:
+            # e.g. comparing a NULL column with a number never matches
+            return False
+    return predicate
+
+
+def compile_condition(text):
+    """
+    Compile JSON condition text into a predicate over a dict of field values.
+    Empty text matches everything. Accepted forms:
+    {"field": "total_amount", "op": "gt", "value": 1000},
+    {"all": [...]}, {"any": [...]}, {"not": {...}} and the shorthand
+    {"total_amount__gt": 1000, "status": "PENDING"}.
+    Raises WorkflowError for invalid JSON or unknown operators.
+    """
+    if not (text or '').strip():
+        return lambda values: True
+    try:
+        node = json.loads(text)
+    except ValueError as e:
+        raise WorkflowError(f'Invalid condition JSON: {e}')
+    return _compile_node(node)
+
+
+class WorkflowRules:
+    """
+    Active workflow definitions compiled into predicate closures, per
+    business and model. Definitions of a business are loaded with two
+    queries on first use and kept until the rules generation in the cache
+    changes, which every definition or step edit bumps; with Redis
+    (REDIS_URL) that reaches every worker at once, with the per-process
+    fallback cache other workers pick edits up after LOCAL_MAX_AGE. The set
+    of watched model names lets saves of other models return after a set
+    lookup. A definition whose condition does not compile is skipped and
+    logged rather than breaking writes.
+    """
+
+    MAX_AGE = 300
+    LOCAL_MAX_AGE = 15
+    GENERATION_KEY = 'workflow_rules_generation'
+
+    def __init__(self):
+        self._generation = None
+        self._built_at = 0
+        self._models = frozenset()
+        self._businesses = {}
+        self._lock = threading.Lock()
+
+    @property
+    def max_age(self):
+        return self.MAX_AGE if cache_is_shared() else self.LOCAL_MAX_AGE
+
+    def _current(self):
+        generation = cache.get(self.GENERATION_KEY, 0)
+        if generation != self._generation or time.monotonic() - self._built_at >= self.max_age:
+            from erp.models_ecommerce import WorkflowDefinition
+
+            with self._lock:
+                self._models = frozenset(WorkflowDefinition.objects.filter(is_active=True).values_list(
+                    'trigger_model', flat=True
+                ).distinct())
+                self._businesses = {}
+                self._generation = generation
+                self._built_at = time.monotonic()
+
+    def watches(self, model_name, check=True):
+        """
+        Whether any active definition triggers on the model; `check=False`
+        skips the generation read once the rules have been loaded
+        """
+        if check or self._generation is None:
+            self._current()
+        return model_name in self._models
+
+    def for_business(self, business_id, model_name):
+        self._current()
+        if model_name not in self._models:
+            return []
+        compiled = self._businesses.get(business_id)
+        if compiled is None:
+            compiled = self._build(business_id)
+            with self._lock:
+                self._businesses[business_id] = compiled
+        return compiled.get(model_name, [])
+
+    def _build(self, business_id):
+        from erp.models_ecommerce import WorkflowDefinition, WorkflowStep
+
+        definitions = list(WorkflowDefinition.objects.filter(business_id=business_id, is_active=True).values(
+            'id', 'name', 'trigger_type', 'trigger_model', 'trigger_condition', 'created_by_id',
+        ))
+        steps = {}
+        for step in WorkflowStep.objects.filter(workflow_id__in=[d['id'] for d in definitions]).order_by(
+            'workflow_id', 'step_number'
+        ).prefetch_related('approvers'):
+            try:
+                predicate = compile_condition(step.condition)
+            except WorkflowError as e:
+                logger.warning(f"Skipping step {step.id} of workflow {step.workflow_id}: {e}")
+                continue
+            steps.setdefault(step.workflow_id, []).append({
+                'id': step.id, 'name': step.name, 'predicate': predicate, 'action_type': step.action_type,
+                'approver_ids': [user.id for user in step.approvers.all()],
+                'require_all': step.require_all_approvers,
+            })
+
+        compiled = {}
+        for definition in definitions:
+            if definition['trigger_type'] == 'DATE_TRIGGER':
+                # scheduled workflows are not started by saves
+                continue
+            try:
+                predicate = compile_condition(definition['trigger_condition'])
+            except WorkflowError as e:
+                logger.warning(f"Skipping workflow {definition['id']} ({definition['name']}): {e}")
+                continue
+            compiled.setdefault(definition['trigger_model'], []).append({
+                'id': definition['id'], 'name': definition['name'], 'business_id': business_id,
+                'trigger_type': definition['trigger_type'], 'predicate': predicate,
+                'created_by_id': definition['created_by_id'], 'steps': steps.get(definition['id'], []),
+            })
+        return compiled
+
+    def invalidate(self):
+        try:
+            cache.incr(self.GENERATION_KEY)
+        except ValueError:
+            cache.set(self.GENERATION_KEY, 1, None)
+        with self._lock:
+            self._generation = None
+
+
+workflow_rules = WorkflowRules()
+
+
+def match(workflows, values, created):
+    """The compiled workflows a saved row starts"""
+    matched = []
+    for workflow in workflows:
+        trigger_type = workflow['trigger_type']
+        if trigger_type == 'DOCUMENT_CREATED' and not created:
+            continue
+        if trigger_type == 'DOCUMENT_UPDATED' and created:
+            continue
+        if trigger_type == 'STATUS_CHANGE' and (
+            created or 'previous_status' not in values or values.get('status') == values['previous_status']
+        ):
+            continue
+        if workflow['predicate'](values):
+            matched.append(workflow)
+    return matched
+
+
+class WorkflowStarter:
+    """
+    Creates WorkflowInstances for matched saves from the save's on_commit
+    hook, in one transaction with bulk inserts, skipping objects that
+    already have an active instance of the same workflow. Nothing is held
+    in memory between the commit and the insert, so a worker exiting or
+    being recycled cannot drop a match.
+    """
+
+    def start(self, matches):
+        """
+        Bulk-create instances and first-step executions for matches, putting
+        approval steps in their approvers' inboxes; returns the number created.
+        """
+        from erp.models_ecommerce import ApprovalRequest, WorkflowInstance, WorkflowStepExecution
+        from erp.services.approval_service import open_requests
+
+        if not matches:
+            return 0
+        with transaction.atomic():
+            active = set(WorkflowInstance.objects.filter(
+                workflow_id__in={m['workflow']['id'] for m in matches},
+                trigger_object_id__in={m['object_id'] for m in matches},
+                status__in=ACTIVE_INSTANCE_STATUSES,
+            ).values_list('workflow_id', 'trigger_model', 'trigger_object_id'))
+            instances, first_steps, started = [], [], []
+            for m in matches:
+                key = (m['workflow']['id'], m['model'], m['object_id'])
+                if key in active:
+                    continue
+                active.add(key)
+                step = next((s for s in m['workflow']['steps'] if s['predicate'](m['values'])), None)
+                instances.append(WorkflowInstance(
+                    workflow_id=m['workflow']['id'], trigger_model=m['model'], trigger_object_id=m['object_id'],
+                    trigger_data=json.dumps(m['values'], default=str), current_step_id=step['id'] if step else None,
+                    status='IN_PROGRESS' if step else 'COMPLETED', created_by_id=m['created_by_id'],
+                ))
+                first_steps.append(step)
+                started.append(m)
+            WorkflowInstance.objects.bulk_create(instances)
+            executions, workflows = [], []
+            for instance, step, m in zip(instances, first_steps, started):
+                if step is None:
+                    continue
+                assignees = step['approver_ids'] if step['action_type'] == 'APPROVAL' else []
+                if assignees and not step['require_all']:
+                    assignees = assignees[:1]
+                for user_id in assignees or [None]:
+                    executions.append(WorkflowStepExecution(instance_id=instance.pk, step_id=step['id'], assigned_to_id=user_id))
+                    workflows.append((m, step))
+            WorkflowStepExecution.objects.bulk_create(executions)
+            open_requests([
+                ApprovalRequest(
+                    business_id=m['workflow']['business_id'], assignee_id=execution.assigned_to_id,
+                    source_type='WORKFLOW', source_id=execution.pk, title=f"{m['workflow']['name']}: {step['name']}",
+                    requested_by_id=m['created_by_id'],
+                )
+                for execution, (m, step) in zip(executions, workflows) if execution.assigned_to_id
+            ])
+        if instances:
+            logger.info(f"Started {len(instances)} workflow instances")
+        return len(instances)
+
+
+workflow_starter = WorkflowStarter()
+
+
+def _values(instance):
+    values = {field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields}
+    # absent when the status was not seen on load (the column was deferred);
+    # STATUS_CHANGE then stays quiet
+    if hasattr(instance, '_workflow_previous_status'):
+        values['previous_status'] = instance._workflow_previous_status
+    return values
+
+
+@receiver(post_init)
+def remember_workflow_status(sender, instance, **kwargs):
+    # only models some workflow watches pay for this, checked against the local snapshot
+    if (
+        sender._meta.app_label == 'erp' and 'status' in instance.__dict__
+        and workflow_rules.watches(sender.__name__, check=False)
+    ):
+        instance._workflow_previous_status = instance.__dict__['status']
+
+
+@receiver(post_save)
+def match_workflow_triggers(sender, instance, created, raw=False, **kwargs):
+    if raw or sender._meta.app_label != 'erp' or not workflow_rules.watches(sender.__name__):
+        return
+    business_id = getattr(instance, 'business_id', None)
+    if business_id is None:
+        return
+    workflows = workflow_rules.for_business(business_id, sender.__name__)
+    if not workflows:
+        return
+    values = _values(instance)
+    instance._workflow_previous_status = values.get('status')
+    creator = next((values[f] for f in CREATOR_FIELDS if values.get(f)), None)
+
+    def on_commit():
+        matched = match(workflows, values, created)
+        if not matched:
+            return
+        try:
+            workflow_starter.start([
+                {
+                    'workflow': workflow, 'model': sender.__name__, 'object_id': instance.pk,
+                    'values': values, 'created_by_id': creator or workflow['created_by_id'],
+                }
+                for workflow in matched
+            ])
+        except Exception:
+            # the triggering write is already committed; don't fail its request
+            logger.exception(f"Failed to start workflows for {sender.__name__} {instance.pk}")
+    transaction.on_commit(on_commit)
+
+
+def invalidate_on_commit():
+    transaction.on_commit(workflow_rules.invalidate)
+
+
+@receiver(post_save, sender='erp.WorkflowDefinition')
+@receiver(post_delete, sender='erp.WorkflowDefinition')
+@receiver(post_save, sender='erp.WorkflowStep')
+@receiver(post_delete, sender='erp.WorkflowStep')
+def invalidate_workflow_rules(sender, **kwargs):
+    invalidate_on_commit()
+
+
+@receiver(m2m_changed, sender='erp.WorkflowStep_approvers')
+def invalidate_workflow_approvers(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_on_commit()
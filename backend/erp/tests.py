@@ -1,3 +1,5 @@
+from decimal import Decimal
+from io import StringIO
 from django.urls import reverse
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
@@ -79,3 +81,1323 @@ class PayrollTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
 # Add more tests for other endpoints as needed
+
+class BulkImportTests(APITestCase):
+    def setUp(self):
+        from .models import Business, Product
+        self.business = Business.objects.create(name='Import Co')
+        self.user = User.objects.create_user(username='importer', email='importer@example.com', password='pass', role='employer', phone='0770000001', business=self.business)
+        Product.objects.create(business=self.business, name='Old Name', sku='SKU-1', unit_price=1)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_product_csv_import_creates_updates_and_reports_errors(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from .models import Product
+        csv_data = (
+            "sku,name,unit_price,quantity_in_stock\n"
+            "SKU-1,New Name,2.50,4\n"
+            "SKU-2,Widget,3.00,10\n"
+            "SKU-3,,1.00,1\n"
+            "SKU-4,Gadget,abc,1\n"
+        ).encode()
+        upload = SimpleUploadedFile('products.csv', csv_data, content_type='text/csv')
+        response = self.client.post(reverse('product-bulk-import'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual([e['row'] for e in response.data['errors']], [4, 5])
+        self.assertEqual(Product.objects.get(sku='SKU-1').name, 'New Name')
+        self.assertEqual(Product.objects.get(sku='SKU-2').quantity_in_stock, 10)
+
+    def test_customer_import_matches_emails_case_insensitively_and_rejects_unreadable_files(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from .models import Customer
+        Customer.objects.create(business=self.business, name='Old', email='Jane.Doe@Example.com', phone='1', address='-')
+        upload = SimpleUploadedFile('customers.csv', b"name,email\nJane Doe,jane.doe@example.com\n", content_type='text/csv')
+        response = self.client.post(reverse('customer-bulk-import'), {'file': upload}, format='multipart')
+        self.assertEqual((response.data['created'], response.data['updated']), (0, 1))
+        self.assertEqual(list(Customer.objects.values_list('name', flat=True)), ['Jane Doe'])
+
+        upload = SimpleUploadedFile('customers.csv', 'name,email\nRen\xe9,rene@example.com\n'.encode('cp1252'), content_type='text/csv')
+        response = self.client.post(reverse('customer-bulk-import'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('UTF-8', response.data['error'])
+        self.assertEqual(response.data['created'], 0)
+
+    def test_opening_stock_adds_to_balances_in_place_and_rejects_repeated_rows_across_chunks(self):
+        from .models import InventoryItem, StockRecord, Warehouse
+        from .services.import_service import OpeningStockImporter
+        warehouse = Warehouse.objects.create(business=self.business, name='Main', code='MAIN', address='1 Road')
+        kettle = InventoryItem.objects.create(business=self.business, name='Kettle', sku='KTL', purchase_price=20)
+        InventoryItem.objects.create(business=self.business, name='Toaster', sku='TST', purchase_price=30)
+        StockRecord.objects.create(item=kettle, warehouse=warehouse, quantity=5, reserved_quantity=2)
+        rows = [
+            (2, {'sku': 'KTL', 'warehouse': 'main', 'quantity': '10'}),
+            (3, {'sku': 'TST', 'warehouse': 'MAIN', 'quantity': '4', 'unit_cost': '25'}),
+            (4, {'sku': 'KTL', 'warehouse': 'Main', 'quantity': '10'}),
+        ]
+        report = OpeningStockImporter(self.business, self.user, chunk_size=1).import_rows(rows)
+        self.assertEqual((report['created'], report['updated'], [e['row'] for e in report['errors']]), (2, 1, [4]))
+        self.assertEqual(
+            sorted(StockRecord.objects.values_list('item__sku', 'quantity', 'reserved_quantity', 'available_quantity')),
+            [('KTL', Decimal('15'), Decimal('2'), Decimal('13')), ('TST', Decimal('4'), Decimal('0'), Decimal('4'))],
+        )
+
+
+class POSSyncSalesTests(APITestCase):
+    def setUp(self):
+        from django.utils import timezone
+        from .models import Business, Store, Product, CashTill, SaleSession
+        self.business = Business.objects.create(name='Till Co')
+        self.user = User.objects.create_user(username='cashier', email='cashier@example.com', password='pass', role='employer', phone='0770000002', business=self.business)
+        self.store = Store.objects.create(name='Main', address='1 Road', business=self.business, contact_number='1', vat_number='VAT-SYNC')
+        self.product = Product.objects.create(business=self.business, store=self.store, name='Bread', sku='BRD', unit_price=2, quantity_in_stock=5)
+        self.till = CashTill.objects.create(store=self.store, account_name='Till 1', created_by=self.user)
+        self.session = SaleSession.objects.create(cashier=self.user, store=self.store, start_time=timezone.now(), opening_balance=10)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _sale(self, key, captured_at, quantity):
+        return {
+            'idempotency_key': key, 'captured_at': captured_at, 'sale_number': f'OFF-{key}',
+            'payment_method': 'CASH', 'items': [{'product': self.product.id, 'quantity': quantity, 'unit_price': '2.00'}],
+        }
+
+    def test_sync_applies_in_order_and_dedupes_replays(self):
+        url = reverse('pos-sync-sales')
+        sales = [
+            self._sale('b', '2026-01-01T10:05:00Z', 3),
+            self._sale('a', '2026-01-01T10:00:00Z', 2),
+            self._sale('c', '2026-01-01T10:10:00Z', 1),
+        ]
+        response = self.client.post(url, {'sales': sales}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        statuses = {r['idempotency_key']: r['status'] for r in response.data['results']}
+        self.assertEqual(statuses, {'a': 'created', 'b': 'created', 'c': 'rejected'})
+
+        self.product.refresh_from_db()
+        self.session.refresh_from_db()
+        self.till.refresh_from_db()
+        self.assertEqual(self.product.quantity_in_stock, 0)
+        self.assertEqual(self.session.total_transactions, 2)
+        self.assertEqual(self.session.closing_balance, 20)
+        self.assertEqual(self.till.current_balance, 10)
+
+        replay = self.client.post(url, {'sales': sales[:2]}, format='json')
+        self.assertEqual(replay.data['created'], 0)
+        self.assertEqual(replay.data['duplicates'], 2)
+
+    def test_sync_rejects_malformed_entries_and_keys_of_other_businesses(self):
+        from django.utils import timezone
+        from .models import Business, Store, SaleSession
+        other = Business.objects.create(name='Other Co')
+        other_user = User.objects.create_user(username='other', email='other@example.com', password='pass', role='employer', phone='0770000098', business=other)
+        other_store = Store.objects.create(name='Other', address='9 Road', business=other, contact_number='9', vat_number='VAT-OTHER')
+        SaleSession.objects.create(cashier=other_user, store=other_store, start_time=timezone.now(), opening_balance=0)
+        self.product.quantity_in_stock = 50
+        self.product.save()
+        self.client.post(reverse('pos-sync-sales'), {'sales': [self._sale('shared', '2026-01-01T09:00:00Z', 1)]}, format='json')
+
+        self.client.force_authenticate(user=other_user)
+        sales = [
+            'not a sale',
+            self._sale('k' * 65, '2026-01-01T10:00:00Z', 1),
+            dict(self._sale('bad-items', '2026-01-01T10:01:00Z', 1), items=['bread']),
+            dict(self._sale('bad-product', '2026-01-01T10:02:00Z', 1), items=[{'product': [1], 'quantity': 1, 'unit_price': '2'}]),
+            dict(self._sale('shared', '2026-01-01T10:03:00Z', 1), sale_number='OFF-OTHER'),
+        ]
+        response = self.client.post(reverse('pos-sync-sales'), {'sales': sales}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['created'], response.data['duplicates'], response.data['rejected']), (0, 0, 5))
+        self.assertNotIn('sale_id', response.data['results'][-1])
+
+    def test_sync_retries_a_racing_replay_and_fiscalizes_after_commit(self):
+        from unittest import mock
+        from django.db import IntegrityError
+        from .models import FiscalizationLog
+        from .views import POSSyncSalesView
+        sync_entries = POSSyncSalesView._sync_entries
+        calls = []
+
+        def racing_sync(view, *args):
+            # the first attempt loses the race to a concurrent replay of the same key
+            calls.append(1)
+            if len(calls) == 1:
+                raise IntegrityError('UNIQUE constraint failed: erp_possale.idempotency_key')
+            return sync_entries(view, *args)
+
+        with mock.patch.object(POSSyncSalesView, '_sync_entries', racing_sync), \
+                mock.patch('erp.views.fiscalize_sale_with_zimra', return_value={'success': True, 'request_payload': '{}', 'response_payload': '{}'}):
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.client.post(reverse('pos-sync-sales'), {'sales': [self._sale('a', '2026-01-01T10:00:00Z', 2)]}, format='json')
+            self.assertEqual((response.status_code, response.data['created'], len(calls)), (status.HTTP_200_OK, 1, 2))
+            self.assertFalse(FiscalizationLog.objects.exists())
+            for callback in callbacks:
+                callback()
+        self.assertEqual(FiscalizationLog.objects.filter(success=True).count(), 1)
+
+    def test_make_sale_updates_session_and_till_totals(self):
+        data = {
+            'sale_number': 'S-1', 'payment_method': 'CASH', 'subtotal': '0', 'total_amount': '0', 'tax_amount': '1.00',
+            'items': [{'product': self.product.id, 'quantity': 2, 'unit_price': '2.00', 'total_price': '4.00'}],
+        }
+        response = self.client.post(reverse('pos-make-sale'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['total_amount'], '5.00')
+        self.session.refresh_from_db()
+        self.till.refresh_from_db()
+        self.assertEqual(self.session.total_sales, 5)
+        self.assertEqual(self.session.closing_balance, 15)
+        self.assertEqual(self.till.current_balance, 5)
+
+    def test_catalog_snapshot_etag_and_delta(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import Product, Store
+        url = reverse('pos-catalog')
+        Product.objects.filter(id=self.product.id).update(updated_at=timezone.now() - timedelta(hours=1))
+        response = self.client.get(url, {'store': self.store.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['products']['sku'], ['BRD'])
+        version = response.data['version']
+
+        not_modified = self.client.get(url, {'store': self.store.id}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Product.objects.create(business=self.business, name='Milk', sku='MLK', unit_price=1)
+        delta = self.client.get(url, {'store': self.store.id, 'since': version})
+        # rows within DELTA_OVERLAP of the watermark are sent again
+        self.assertEqual(delta.data['products']['sku'], ['BRD', 'MLK'])
+        self.assertEqual(delta.data['product_count'], 2)
+        later = self.client.get(url, {'store': self.store.id, 'since': version + 10 * 60 * 10 ** 6})
+        self.assertEqual(later.data['products']['sku'], ['MLK'])
+
+        # products moved to another store are dropped through the ids-present list
+        other = Store.objects.create(name='Branch', address='2 Road', business=self.business, contact_number='2', vat_number='VAT-BRANCH')
+        Product.objects.filter(id=self.product.id).update(store=other)
+        delta = self.client.get(url, {'store': self.store.id, 'since': version})
+        self.assertNotIn(self.product.id, delta.data['product_ids'])
+        self.assertEqual(len(delta.data['product_ids']), 1)
+        self.assertEqual(self.client.get(url, {'store': 'main'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_scan_resolves_barcode_and_tracks_changes(self):
+        url = reverse('pos-scan')
+        self.product.barcode = '600123'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response = self.client.get(url, {'code': '600123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['id'], response.data['stock']), (self.product.id, 5))
+
+        self.product.unit_price = 3
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response = self.client.get(url, {'code': 'BRD', 'store': self.store.id})
+        self.assertEqual(response.data['price'], '3.00')
+        self.assertEqual(self.client.get(url, {'code': 'nope'}).status_code, status.HTTP_404_NOT_FOUND)
+
+class ProcurementTests(APITestCase):
+    def setUp(self):
+        from datetime import date
+        from .models import Business, Currency
+        from .models_extended import Vendor, PurchaseOrder, PurchaseOrderItem, GoodsReceivedNote, GoodsReceivedNoteItem
+        self.business = Business.objects.create(name='Buyer Co')
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='pass', role='employer', phone='0770000003', business=self.business)
+        self.currency = Currency.objects.create(code='USD', name='US Dollar', symbol='$')
+        self.vendor = Vendor.objects.create(business=self.business, vendor_code='V-1', name='Supplier', currency=self.currency)
+        self.po = PurchaseOrder.objects.create(
+            business=self.business, po_number='PO-1', vendor=self.vendor, order_date=date(2026, 1, 5),
+            expected_delivery_date=date(2026, 1, 10), currency=self.currency, delivery_address='Depot',
+            delivery_contact_person='Tendai', delivery_contact_phone='1', payment_terms='30 days', created_by=self.user,
+        )
+        self.po_items = [
+            PurchaseOrderItem.objects.create(purchase_order=self.po, description=f'Part {i}', quantity_ordered=10, unit_price=5, tax_rate=15)
+            for i in range(3)
+        ]
+        self.grn = GoodsReceivedNote.objects.create(
+            business=self.business, grn_number='GRN-1', purchase_order=self.po, receipt_date=date(2026, 1, 9),
+            received_by=self.user, status='ACCEPTED',
+        )
+        for po_item in self.po_items:
+            GoodsReceivedNoteItem.objects.create(grn=self.grn, po_item=po_item, quantity_received=10, quantity_accepted=10)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_create_bill_writes_lines_in_bulk_and_totals_once(self):
+        with self.assertNumQueries(20):
+            response = self.client.post(reverse('grn-create-bill', args=[self.grn.id]), {'bill_number': 'INV-1'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        bill = response.data['bill']
+        self.assertEqual(len(bill['items']), 3)
+        self.assertEqual(bill['subtotal'], '150.00')
+        self.assertEqual(bill['tax_amount'], '22.50')
+        self.assertEqual(bill['total_amount'], '172.50')
+        self.assertEqual(bill['balance'], '172.50')
+
+    def test_grn_posting_creates_missing_products_and_groups_stock(self):
+        from .models import Product, Inventory
+        from .models_extended import GoodsReceivedNote
+        data = {
+            'grn_number': 'GRN-2', 'business': self.business.id, 'purchase_order': self.po.id, 'receipt_date': '2026-01-12', 'received_by': self.user.id,
+            'items': [{'po_item': item.id, 'quantity_received': 4} for item in self.po_items] + [{'po_item': self.po_items[0].id, 'quantity_received': 1}],
+        }
+        response = self.client.post(reverse('grn-list'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        grn = GoodsReceivedNote.objects.get(grn_number='GRN-2')
+        self.assertEqual(grn.total_amount, 65)
+        products = Product.objects.filter(purchaseorderitem__purchase_order=self.po).distinct()
+        self.assertEqual(sorted(p.quantity_in_stock for p in products), [4, 4, 5])
+        self.assertEqual(Inventory.objects.filter(reference='GRN GRN-2').count(), 4)
+
+    def test_payment_run_groups_debits_per_account(self):
+        from .models import Store, CashTill, BankAccount
+        from .models_extended import GoodsReceivedNote, PurchaseOrderPayment
+        store = Store.objects.create(name='HQ', address='1 Road', business=self.business, contact_number='1', vat_number='VAT-PROC')
+        till = CashTill.objects.create(store=store, account_name='Till', current_balance=100, created_by=self.user)
+        bank = BankAccount.objects.create(store=store, account_name='Ops', account_number='123', bank_name='CBZ', current_balance=500, created_by=self.user)
+        GoodsReceivedNote.objects.filter(id=self.grn.id).update(total_amount=150)
+        grn2 = GoodsReceivedNote.objects.create(
+            business=self.business, grn_number='GRN-3', purchase_order=self.po, receipt_date='2026-01-11',
+            received_by=self.user, status='ACCEPTED', total_amount=80,
+        )
+        payments = [
+            {'grn': self.grn.id, 'method': 'CASH', 'amount': 50},
+            {'grn': self.grn.id, 'method': 'BANK', 'amount': 100, 'account_id': bank.id},
+            {'grn': grn2.id, 'method': 'CASH', 'amount': 30},
+        ]
+        response = self.client.post(reverse('grn-payment-run'), {'payments': payments}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        till.refresh_from_db()
+        bank.refresh_from_db()
+        self.assertEqual((till.current_balance, bank.current_balance), (20, 400))
+        self.assertEqual(GoodsReceivedNote.objects.get(id=self.grn.id).payment_status, 'PAID')
+        self.assertEqual(GoodsReceivedNote.objects.get(id=grn2.id).payment_status, 'PARTIAL')
+        self.assertEqual(PurchaseOrderPayment.objects.count(), 3)
+
+        overdraw = self.client.post(reverse('grn-payment-run'), {'payments': [{'grn': grn2.id, 'method': 'CASH', 'amount': 50}]}, format='json')
+        self.assertEqual(overdraw.status_code, status.HTTP_400_BAD_REQUEST)
+
+        from .models import Business
+        foreign = BankAccount.objects.create(
+            store=Store.objects.create(name='Elsewhere', address='2 Road', business=Business.objects.create(name='Other Co'), contact_number='2', vat_number='VAT-FOREIGN'),
+            account_name='Theirs', account_number='999', bank_name='CBZ', current_balance=500, created_by=self.user,
+        )
+        response = self.client.post(reverse('grn-payment-run'), {'payments': [{'grn': grn2.id, 'method': 'BANK', 'amount': 10, 'account_id': foreign.id}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.current_balance, 500)
+
+    def test_settlement_rechecks_outstanding_after_locking_the_grn(self):
+        from .models import Store, CashTill
+        from .models_extended import GoodsReceivedNote
+        from .services.procurement_service import GRNSettlementService, SettlementError
+        store = Store.objects.create(name='HQ', address='1 Road', business=self.business, contact_number='1', vat_number='VAT-LOCK')
+        CashTill.objects.create(store=store, account_name='Till', current_balance=500, created_by=self.user)
+        GoodsReceivedNote.objects.filter(id=self.grn.id).update(total_amount=100)
+        stale = GoodsReceivedNote.objects.select_related('purchase_order').get(id=self.grn.id)
+        fresh = GoodsReceivedNote.objects.select_related('purchase_order').get(id=self.grn.id)
+
+        GRNSettlementService(self.user).settle([fresh], [{'grn': fresh.id, 'method': 'CASH', 'amount': 60}])
+        with self.assertRaisesMessage(SettlementError, 'exceeds outstanding amount ($40.00)'):
+            GRNSettlementService(self.user).settle([stale], [{'grn': stale.id, 'method': 'CASH', 'amount': 60}])
+        GRNSettlementService(self.user).settle([stale], [{'grn': stale.id, 'method': 'CASH', 'amount': 40}])
+        self.assertEqual(GoodsReceivedNote.objects.values_list('paid_amount', 'payment_status').get(id=self.grn.id), (100, 'PAID'))
+
+    def test_vendor_scorecard_reads_monthly_rollups(self):
+        from django.core.management import call_command
+        call_command('rebuild_vendor_rollups', stdout=StringIO())
+        self.client.post(reverse('grn-create-bill', args=[self.grn.id]), {'bill_number': 'INV-2'}, format='json')
+        response = self.client.get(reverse('vendor-scorecard', args=[self.vendor.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_orders'], 1)
+        self.assertEqual(response.data['average_lead_time_days'], 4)
+        self.assertEqual(response.data['billed_amount'], Decimal('172.50'))
+        self.assertEqual(response.data['outstanding_balance'], Decimal('172.50'))
+        analysis = self.client.get(reverse('purchase-order-vendor-spend'))
+        self.assertEqual(analysis.data['vendors'][0]['billed_amount'], Decimal('172.50'))
+
+    def test_vendor_rollups_reverse_cancelled_rejected_moved_and_deleted_documents(self):
+        from datetime import date
+        from django.core.management import call_command
+        from .models_extended import Vendor, PurchaseOrder, GoodsReceivedNote, VendorBill, VendorSpendRollup
+        fields = ('vendor_id', 'period', 'po_count', 'ordered_amount', 'grn_count', 'received_amount', 'billed_amount', 'lead_time_days_total', 'lead_time_samples')
+
+        def rollups():
+            return {row[:2]: row[2:] for row in VendorSpendRollup.objects.values_list(*fields) if any(row[2:])}
+
+        other_vendor = Vendor.objects.create(business=self.business, vendor_code='V-2', name='Other supplier', currency=self.currency)
+        po_fields = dict(
+            business=self.business, vendor=self.vendor, expected_delivery_date=date(2026, 2, 10), currency=self.currency,
+            delivery_address='Depot', delivery_contact_person='Tendai', delivery_contact_phone='1', payment_terms='30 days', created_by=self.user,
+        )
+        cancelled = PurchaseOrder.objects.create(po_number='PO-2', order_date=date(2026, 2, 3), total_amount=80, **po_fields)
+        deleted = PurchaseOrder.objects.create(po_number='PO-3', order_date=date(2026, 2, 4), total_amount=40, **po_fields)
+        self.assertEqual(rollups()[(self.vendor.id, date(2026, 2, 1))][:2], (2, Decimal('120.00')))
+        cancelled = PurchaseOrder.objects.get(id=cancelled.id)
+        cancelled.status = 'CANCELLED'
+        cancelled.save()
+        PurchaseOrder.objects.get(id=deleted.id).delete()
+
+        self.client.post(reverse('grn-create-bill', args=[self.grn.id]), {'bill_number': 'INV-3'}, format='json')
+        VendorBill.objects.create(
+            business=self.business, purchase_order=self.po, vendor=self.vendor, currency=self.currency,
+            bill_number='INV-4', bill_date=date(2026, 1, 20), total_amount=30, created_by=self.user,
+        )
+        moved = VendorBill.objects.get(bill_number='INV-3')
+        moved.vendor = other_vendor
+        moved.bill_date = date(2026, 3, 2)
+        moved.save()
+        VendorBill.objects.get(bill_number='INV-4').delete()
+        rejected = GoodsReceivedNote.objects.get(id=self.grn.id)
+        rejected.status = 'REJECTED'
+        rejected.save()
+
+        live = rollups()
+        self.assertNotIn((self.vendor.id, date(2026, 2, 1)), live)
+        self.assertEqual(live[(other_vendor.id, date(2026, 3, 1))][4], Decimal('172.50'))
+        call_command('rebuild_vendor_rollups', stdout=StringIO())
+        self.assertEqual(rollups(), live)
+
+
+    def test_workflow_triggers_compile_once_and_start_after_commit(self):
+        from datetime import date
+        from django.core.cache import cache
+        from .models_ecommerce import WorkflowDefinition, WorkflowStep, WorkflowInstance, WorkflowStepExecution
+        from .models_extended import PurchaseRequisition
+        from .services.workflow_service import workflow_rules
+        cache.clear()
+        approver = User.objects.create_user(username='approver', email='approver@example.com', password='pass', role='employer', phone='0770000009', business=self.business)
+        with self.captureOnCommitCallbacks(execute=True):
+            large = WorkflowDefinition.objects.create(
+                business=self.business, name='Large requisitions', description='-', trigger_type='AMOUNT_THRESHOLD',
+                trigger_model='PurchaseRequisition', trigger_condition='{"total_amount__gte": 1000, "status": "PENDING"}', created_by=self.user,
+            )
+            step = WorkflowStep.objects.create(workflow=large, step_number=1, name='Manager', action_type='APPROVAL', action_config='{}')
+            step.approvers.add(approver)
+            WorkflowDefinition.objects.create(
+                business=self.business, name='Rejected', description='-', trigger_type='STATUS_CHANGE',
+                trigger_model='PurchaseRequisition', trigger_condition='{"field": "status", "op": "eq", "value": "REJECTED"}', created_by=self.user,
+            )
+        bad = self.client.post(reverse('workflow-definition-list'), {
+            'name': 'Bad', 'description': '-', 'trigger_type': 'DOCUMENT_CREATED', 'trigger_model': 'PurchaseRequisition',
+            'trigger_condition': '{"total_amount__between": 1}',
+        }, format='json')
+        self.assertEqual(bad.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            small = PurchaseRequisition.objects.create(business=self.business, requisition_number='PR-1', requested_by=self.user, date_required=date(2026, 2, 1), purpose='Pens', status='PENDING', total_amount=50)
+            big = PurchaseRequisition.objects.create(business=self.business, requisition_number='PR-2', requested_by=self.user, date_required=date(2026, 2, 1), purpose='Laptops', status='PENDING', total_amount=2500)
+        with self.assertNumQueries(1):  # only the UPDATE: rules are compiled and cached, no lookups per save
+            with self.captureOnCommitCallbacks(execute=True):
+                small.purpose = 'Blue pens'
+                small.save(update_fields=['purpose'])
+            self.assertEqual(len(workflow_rules.for_business(self.business.id, 'PurchaseRequisition')), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            big.save()  # already has an active instance of the threshold workflow
+            reloaded = PurchaseRequisition.objects.get(id=small.id)
+            reloaded.status = 'REJECTED'
+            reloaded.save()
+
+        closed = PurchaseRequisition.objects.create(business=self.business, requisition_number='PR-3', requested_by=self.user, date_required=date(2026, 2, 1), purpose='Desk', status='PENDING', total_amount=80)
+        # a worker that has not loaded the rules yet loads them on its first instance
+        workflow_rules._generation, workflow_rules._models = None, frozenset()
+        fresh = PurchaseRequisition.objects.get(id=closed.id)
+        fresh.status = 'REJECTED'
+        with self.captureOnCommitCallbacks(execute=True):
+            fresh.save()
+
+        instances = {(i.workflow.name, i.trigger_object_id): i for i in WorkflowInstance.objects.select_related('workflow')}
+        self.assertEqual(set(instances), {('Large requisitions', big.id), ('Rejected', small.id), ('Rejected', closed.id)})
+        started = instances[('Large requisitions', big.id)]
+        self.assertEqual((started.status, started.current_step_id, started.created_by_id), ('IN_PROGRESS', step.id, self.user.id))
+        self.assertEqual(list(WorkflowStepExecution.objects.values_list('instance_id', 'assigned_to_id')), [(started.id, approver.id)])
+
+
+    def test_approval_inbox_collects_pending_items_across_modules(self):
+        from datetime import date
+        from django.core.management import call_command
+        from .models import Department
+        from .models_ecommerce import ApprovalRequest, WorkflowDefinition, WorkflowStep
+        from .models_extended import PurchaseRequisition
+        manager = User.objects.create_user(username='manager', email='manager@example.com', password='pass', role='employer', phone='0770000010', business=self.business)
+        clerk = User.objects.create_user(username='clerk', email='clerk@example.com', password='pass', role='employee', phone='0770000011', business=self.business)
+        stores = Department.objects.create(business=self.business, name='Stores', manager=manager)
+        with self.captureOnCommitCallbacks(execute=True):
+            workflow = WorkflowDefinition.objects.create(
+                business=self.business, name='Big spend', description='-', trigger_type='STATUS_CHANGE',
+                trigger_model='PurchaseRequisition', trigger_condition='{"status": "APPROVED", "total_amount__gt": 100}', created_by=self.user,
+            )
+            WorkflowStep.objects.create(workflow=workflow, step_number=1, name='Finance', action_type='APPROVAL', action_config='{}').approvers.add(self.user)
+
+        self.client.force_authenticate(user=clerk)
+        numbers = iter(range(1, 10))
+        def requisition(department=None):
+            response = self.client.post(reverse('purchase-requisition-list'), {
+                'requisition_number': f'PR-{next(numbers)}', 'date_required': '2026-02-01', 'purpose': 'Stock',
+                'total_amount': '500.00', 'department': department, 'business': self.business.id, 'requested_by': clerk.id,
+            }, format='json')
+            self.assertEqual(self.client.post(reverse('purchase-requisition-submit', args=[response.data['id']])).status_code, status.HTTP_200_OK)
+            return response.data['id']
+        routed, unrouted = requisition(stores.id), requisition()
+        self.assertEqual(
+            sorted(ApprovalRequest.objects.values_list('source_id', 'assignee_id')),
+            sorted([(routed, manager.id), (unrouted, self.user.id), (unrouted, manager.id)]),
+        )
+
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('purchase-requisition-approve', args=[unrouted]))
+        self.assertFalse(ApprovalRequest.objects.filter(source_type='REQUISITION', source_id=unrouted, status='PENDING').exists())
+        self.assertEqual(ApprovalRequest.objects.get(source_type='REQUISITION', source_id=unrouted, assignee=manager).actioned_by, self.user)
+
+        with self.assertNumQueries(1):
+            inbox = self.client.get(reverse('approval-inbox-list')).data
+        self.assertEqual([item['title'] for item in inbox['results']], ['Big spend: Finance'])
+        self.assertEqual(self.client.get(reverse('approval-inbox-summary')).data, {'total': 1, 'by_source': {'WORKFLOW': 1}})
+        self.client.post(reverse('workflow-step-execution-approve', args=[inbox['results'][0]['source_id']]))
+        self.assertEqual(self.client.get(reverse('approval-inbox-summary')).data['total'], 0)
+
+        ApprovalRequest.objects.all().delete()
+        call_command('rebuild_approval_inbox', stdout=StringIO())
+        self.assertEqual(list(ApprovalRequest.objects.values_list('source_id', 'assignee_id')), [(routed, manager.id)])
+
+    def test_approval_inbox_closes_on_edits_deletes_and_require_all_rejects(self):
+        from .models_ecommerce import ApprovalRequest, WorkflowDefinition, WorkflowInstance, WorkflowStep, WorkflowStepExecution
+        from .services.approval_service import rebuild
+        manager = User.objects.create_user(username='manager', email='manager@example.com', password='pass', role='employer', phone='0770000010', business=self.business)
+        clerk = User.objects.create_user(username='clerk', email='clerk@example.com', password='pass', role='employee', phone='0770000011', business=self.business)
+        self.client.force_authenticate(user=clerk)
+        ids = []
+        for number in ('PR-1', 'PR-2'):
+            ids.append(self.client.post(reverse('purchase-requisition-list'), {
+                'requisition_number': number, 'date_required': '2026-02-01', 'purpose': 'Stock', 'total_amount': '50.00',
+                'status': 'PENDING', 'business': self.business.id, 'requested_by': clerk.id,
+            }, format='json').data['id'])
+        self.assertEqual(ApprovalRequest.objects.filter(source_type='REQUISITION', status='PENDING').count(), 4)
+
+        edited, deleted = ids
+        self.client.patch(reverse('purchase-requisition-detail', args=[edited]), {'purpose': 'More stock'}, format='json')
+        self.assertEqual(ApprovalRequest.objects.filter(source_id=edited, status='PENDING').count(), 2)
+        self.client.patch(reverse('purchase-requisition-detail', args=[edited]), {'status': 'CANCELLED'}, format='json')
+        self.assertEqual(set(ApprovalRequest.objects.filter(source_id=edited).values_list('status', 'actioned_by')), {('CANCELLED', clerk.id)})
+        self.assertEqual(self.client.delete(reverse('purchase-requisition-detail', args=[deleted])).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(set(ApprovalRequest.objects.filter(source_id=deleted).values_list('status', flat=True)), {'CANCELLED'})
+
+        workflow = WorkflowDefinition.objects.create(
+            business=self.business, name='Sign-off', description='-', trigger_type='MANUAL', trigger_model='PurchaseRequisition', created_by=self.user,
+        )
+        step = WorkflowStep.objects.create(workflow=workflow, step_number=1, name='Both', action_type='APPROVAL', action_config='{}', require_all_approvers=True)
+        instance = WorkflowInstance.objects.create(workflow=workflow, trigger_model='PurchaseRequisition', trigger_object_id=edited, trigger_data='{}', status='IN_PROGRESS', created_by=self.user)
+        rejected, other = (WorkflowStepExecution.objects.create(instance=instance, step=step, assigned_to=user) for user in (self.user, manager))
+        self.assertEqual(rebuild(self.business.id)['WORKFLOW'], 2)
+        self.client.force_authenticate(user=self.user)
+        self.client.post(reverse('workflow-step-execution-reject', args=[rejected.id]))
+        self.assertEqual(
+            set(ApprovalRequest.objects.filter(source_type='WORKFLOW').values_list('source_id', 'status')),
+            {(rejected.id, 'REJECTED'), (other.id, 'REJECTED')},
+        )
+        other.refresh_from_db()
+        self.assertEqual(other.status, 'REJECTED')
+        self.assertEqual(rebuild(self.business.id)['WORKFLOW'], 0)
+
+
+class HRTests(APITestCase):
+    def setUp(self):
+        from datetime import date
+        from .models import Business
+        self.business = Business.objects.create(name='Staff Co')
+        self.user = User.objects.create_user(username='hr', email='hr@example.com', password='pass', role='employer', phone='0770000004', business=self.business)
+        self.employees = []
+        for i in range(2):
+            staff = User.objects.create_user(username=f'staff{i}', email=f'staff{i}@example.com', password='pass', role='employee', phone=f'077100000{i}', business=self.business)
+            self.employees.append(Employee.objects.create(
+                business=self.business, user=staff, employee_id=f'EMP-{i}', first_name='Staff', last_name=str(i),
+                email=staff.email, phone=staff.phone, position='Clerk', hire_date=date(2025, 1, 1), salary=500,
+            ))
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_bulk_upsert_and_clock_file_import(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from .models_extended_part2 import AttendanceRecord
+        records = [
+            {'employee_id': 'EMP-0', 'date': '2026-03-02', 'check_in': '08:20', 'check_out': '18:00'},
+            {'employee': self.employees[1].id, 'date': '2026-03-02', 'check_in': '08:00', 'check_out': '11:00'},
+            {'employee_id': 'EMP-9', 'date': '2026-03-02', 'check_in': '08:00'},
+            'EMP-1,2026-03-02',
+        ]
+        response = self.client.post(reverse('attendance-record-bulk-create'), {'records': records}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['created'], response.data['error_count']), (2, 2))
+        self.assertEqual(sorted(e['row'] for e in response.data['errors']), [3, 4])
+        first = AttendanceRecord.objects.get(employee=self.employees[0])
+        self.assertEqual((first.hours_worked, first.overtime_hours, first.late_minutes, first.status), (Decimal('9.67'), Decimal('0.67'), 20, 'PRESENT'))
+        self.assertEqual(AttendanceRecord.objects.get(employee=self.employees[1]).status, 'HALF_DAY')
+
+        punches = b'employee_id,timestamp\nEMP-0,2026-03-02 07:55:00\nEMP-0,2026-03-02 12:00:00\nEMP-0,2026-03-02 17:00:00\n'
+        upload = SimpleUploadedFile('clock.csv', punches, content_type='text/csv')
+        response = self.client.post(reverse('attendance-record-import-clock-file'), {'file': upload}, format='multipart')
+        self.assertEqual((response.data['created'], response.data['updated']), (0, 1))
+        first.refresh_from_db()
+        self.assertEqual((first.hours_worked, first.is_late), (Decimal('9.08'), False))
+        self.assertEqual(AttendanceRecord.objects.count(), 2)
+
+        # an overnight shift stays one record on the date it started
+        punches = b'employee_id,timestamp\nEMP-1,2026-03-04 06:00:00\nEMP-1,2026-03-03 22:00:00\nEMP-1,2026-03-04 22:05:00\n'
+        upload = SimpleUploadedFile('clock.csv', punches, content_type='text/csv')
+        response = self.client.post(reverse('attendance-record-import-clock-file'), {'file': upload}, format='multipart')
+        self.assertEqual(response.data['created'], 2)
+        night = AttendanceRecord.objects.get(employee=self.employees[1], date='2026-03-03')
+        self.assertEqual((str(night.check_in_time), str(night.check_out_time), night.hours_worked), ('22:00:00', '06:00:00', Decimal('8.00')))
+        self.assertIsNone(AttendanceRecord.objects.get(employee=self.employees[1], date='2026-03-04').check_out_time)
+
+    def test_leave_ledger_allocation_approval_and_department_balances(self):
+        from .models_extended_part2 import LeaveType, LeaveAllocation, LeaveApplication, LeaveLedgerEntry
+        department = Department.objects.create(name='Ops')
+        Employee.objects.filter(id__in=[e.id for e in self.employees]).update(department=department)
+        annual = LeaveType.objects.create(business=self.business, name='Annual', code='AL', annual_allocation_days=20, is_carry_forward=True, max_carry_forward_days=5)
+        LeaveAllocation.objects.create(employee=self.employees[0], leave_type=annual, year=2025, allocated_days=20, balance_days=8, created_by=self.user)
+
+        response = self.client.post(reverse('leave-allocation-allocate-year'), {'year': 2026}, format='json')
+        self.assertEqual(response.data['allocations_created'], 2)
+        allocation = LeaveAllocation.objects.get(employee=self.employees[0], year=2026)
+        self.assertEqual((allocation.carried_forward_days, allocation.balance_days), (5, 25))
+
+        application = LeaveApplication.objects.create(
+            application_number='LV-1', employee=self.employees[0], leave_type=annual, from_date='2026-04-01',
+            to_date='2026-04-03', number_of_days=3, reason='Rest', status='PENDING', created_by=self.user,
+        )
+        self.assertEqual(self.client.post(reverse('leave-application-approve', args=[application.id])).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.post(reverse('leave-application-approve', args=[application.id])).status_code, status.HTTP_400_BAD_REQUEST)
+        allocation.refresh_from_db()
+        self.assertEqual((allocation.used_days, allocation.balance_days), (3, 22))
+        self.assertEqual(sum(e.days for e in LeaveLedgerEntry.objects.filter(allocation=allocation)), allocation.balance_days)
+
+        greedy = LeaveApplication.objects.create(
+            application_number='LV-2', employee=self.employees[1], leave_type=annual, from_date='2026-05-01',
+            to_date='2026-05-30', number_of_days=30, reason='Travel', status='PENDING', created_by=self.user,
+        )
+        self.assertEqual(self.client.post(reverse('leave-application-approve', args=[greedy.id])).status_code, status.HTTP_400_BAD_REQUEST)
+        greedy.refresh_from_db()
+        self.assertEqual(greedy.status, 'PENDING')
+
+        balances = self.client.get(reverse('leave-allocation-balances'), {'year': 2026, 'department': department.id}).data['balances']
+        self.assertEqual((balances[0]['employees'], balances[0]['balance_days']), (2, Decimal('42.0')))
+
+    def test_project_cost_rollups_follow_timesheet_and_expense_writes(self):
+        from datetime import time
+        from .models import Project, ProjectTimesheet, ProjectExpense, ProjectCostRollup
+        project = Project.objects.create(business=self.business, name='Depot Fit-out', start_date='2026-03-01', end_date='2026-06-30', budget=1000)
+        ProjectTimesheet.objects.create(project=project, employee=self.employees[0], date='2026-03-03', start_time=time(8), end_time=time(12), hourly_rate=25)
+        sheet = ProjectTimesheet.objects.create(project=project, employee=self.employees[1], date='2026-03-04', start_time=time(9), end_time=time(11), is_billable=False)
+        expense = ProjectExpense.objects.create(project=project, description='Paint', amount=120, expense_date='2026-03-05')
+        expense = ProjectExpense.objects.get(id=expense.id)
+        expense.expense_date = '2026-03-10'
+        expense.save()
+        sheet.delete()
+
+        weeks = {r.week_start.isoformat(): r for r in ProjectCostRollup.objects.filter(project=project)}
+        self.assertEqual((weeks['2026-03-02'].hours, weeks['2026-03-02'].billable_amount, weeks['2026-03-02'].expenses), (4, 100, 0))
+        self.assertEqual(weeks['2026-03-09'].expenses, 120)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('project-portfolio'), {'start_date': '2026-03-01', 'end_date': '2026-03-08'})
+        self.assertEqual(response.data[0]['billable_amount'], Decimal('100'))
+        self.assertEqual(response.data[0]['expenses'], Decimal('0'))
+
+        from django.core.management import call_command
+        call_command('rebuild_project_rollups', stdout=StringIO())
+        rebuilt = {r.week_start.isoformat(): (r.hours, r.billable_amount, r.expenses) for r in ProjectCostRollup.objects.filter(project=project)}
+        self.assertEqual(rebuilt, {'2026-03-02': (4, 100, 0), '2026-03-09': (0, 0, 120)})
+
+        # queryset deletes and cascades go through the receivers too
+        Employee.objects.filter(id=self.employees[0].id).delete()
+        self.assertEqual(ProjectCostRollup.objects.values_list('hours', 'billable_amount').get(project=project, week_start='2026-03-02'), (0, 0))
+        Project.objects.filter(id=project.id).delete()
+        self.assertFalse(ProjectCostRollup.objects.exists())
+
+    def test_payslip_notifications_render_once_and_dispatch_per_channel(self):
+        from datetime import date
+        from django.core import mail
+        from django.test import override_settings
+        from .models_ecommerce import Notification, NotificationTemplate
+        from .services.notification_service import NotificationDispatcher, LocmemSmsBackend, queue_message, queue_template, template_cache
+        for employee in self.employees:
+            Payroll.objects.create(employee=employee, period_start=date(2026, 3, 1), period_end=date(2026, 3, 31), gross_salary=500, basic_salary=500, deductions=50, net_salary=450, status='APPROVED')
+        email = NotificationTemplate.objects.create(
+            business=self.business, name='Payslip', code='PAYSLIP', channel='EMAIL',
+            subject_template='Payslip {{ period_end|date:"M Y" }}', body_template='Hi {{ employee_name }}, net pay {{ net_salary }} & thanks',
+        )
+        response = self.client.post(reverse('payroll-notify-payslips'), {'template': email.id, 'period_end': '2026-03-31'}, format='json')
+        self.assertEqual(response.data['queued'], 2)
+        self.assertIs(template_cache.get(email), template_cache.get(email))
+        sms = NotificationTemplate.objects.create(business=self.business, name='Payday', code='PAYDAY', channel='SMS', body_template='-', sms_template='Paid {{ recipient.username }}')
+        queue_template(sms, [e.user_id for e in self.employees])
+        queue_message([self.user.id], 'IN_APP', 'Payroll', 'Payroll approved')
+        Notification.objects.filter(recipient=self.employees[1].user, channel='EMAIL').update(email_address='')
+
+        LocmemSmsBackend.outbox = []
+        with override_settings(SMS_BACKEND='erp.services.notification_service.LocmemSmsBackend', NOTIFICATION_RATE_LIMITS={'email': 0, 'sms': 0}):
+            summary = NotificationDispatcher(batch_size=3).dispatch()
+        self.assertEqual((summary['sent'], summary['failed']), (4, 1))
+        self.assertEqual([(m.subject, m.body) for m in mail.outbox], [('Payslip Mar 2026', 'Hi Staff 0, net pay 450.00 & thanks')])
+        self.assertEqual(sorted(m['message'] for m in LocmemSmsBackend.outbox), ['Paid staff0', 'Paid staff1'])
+        failed = Notification.objects.get(status='FAILED')
+        self.assertEqual((failed.recipient_id, failed.error_message), (self.employees[1].user_id, 'Recipient has no email address'))
+        self.assertFalse(Notification.objects.filter(status='PENDING').exists())
+        self.assertEqual(NotificationDispatcher().dispatch(), {'sent': 0, 'failed': 0, 'batches': 0})
+
+    def test_dispatcher_claims_rows_before_sending_and_reclaims_stale_claims(self):
+        from datetime import timedelta
+        from unittest import mock
+        from django.utils import timezone
+        from .models_ecommerce import Notification
+        from .services.notification_service import NotificationDispatcher, queue_message
+        for subject in ('stale', 'fresh', 'pending', 'other'):
+            queue_message([self.user.id], 'EMAIL', subject, subject)
+        rows = {n.subject: n for n in Notification.objects.all()}
+        Notification.objects.filter(id=rows['stale'].id).update(status='SENDING', claimed_at=timezone.now() - timedelta(hours=1))
+        Notification.objects.filter(id=rows['fresh'].id).update(status='SENDING', claimed_at=timezone.now())
+
+        dispatcher = NotificationDispatcher()
+        send_batch, seen = dispatcher._send_batch, []
+        def claimed_then_sent(batch, pools):
+            # the claim has committed before any provider is called
+            seen.extend(Notification.objects.filter(id__in=[n['id'] for n in batch]).values_list('subject', 'status'))
+            return send_batch(batch, pools)
+        with mock.patch.object(dispatcher, '_send_batch', side_effect=claimed_then_sent), \
+                mock.patch.object(dispatcher.channels['EMAIL'], 'send', side_effect=lambda items: [(n['id'], '') for n in items]):
+            summary = dispatcher.dispatch(channels=['EMAIL'], ids=[rows['stale'].id, rows['fresh'].id, rows['pending'].id])
+        self.assertEqual((summary['sent'], summary['failed']), (2, 0))
+        self.assertEqual(sorted(seen), [('pending', 'SENDING'), ('stale', 'SENDING')])
+        self.assertEqual(
+            dict(Notification.objects.values_list('subject', 'status')),
+            {'stale': 'SENT', 'fresh': 'SENDING', 'pending': 'SENT', 'other': 'PENDING'},
+        )
+
+    def test_tax_reminders_go_to_the_admin_email_and_are_marked_sent_once_delivered(self):
+        from datetime import date
+        from unittest import mock
+        from django.core import mail
+        from django.core.management import call_command
+        from django.test import override_settings
+        from .models import Tax, TaxReminder
+        from .models_ecommerce import Notification
+        from .services.notification_service import EmailChannel
+        tax = Tax.objects.create(type='VAT', amount=100, period_start=date(2026, 1, 1), period_end=date(2026, 1, 31))
+        reminder = TaxReminder.objects.create(tax=tax, reminder_type='EMAIL', reminder_date=date.today(), message='VAT is due')
+        other = Notification.objects.create(recipient=self.user, channel='EMAIL', subject='Other', message='Queued elsewhere', email_address=self.user.email)
+        with override_settings(ADMIN_EMAIL=''):
+            call_command('send_tax_reminders', stdout=StringIO())
+        reminder.refresh_from_db()
+        self.assertFalse(reminder.sent)
+
+        # a failed delivery leaves the reminder for the next run
+        with override_settings(ADMIN_EMAIL=self.user.email.upper(), NOTIFICATION_RATE_LIMITS={'email': 0}), \
+                mock.patch.object(EmailChannel, 'send', side_effect=lambda items: [(n['id'], 'SMTP down') for n in items]):
+            call_command('send_tax_reminders', stdout=StringIO())
+        reminder.refresh_from_db()
+        self.assertFalse(reminder.sent)
+
+        with override_settings(ADMIN_EMAIL=self.user.email.upper(), NOTIFICATION_RATE_LIMITS={'email': 0}):
+            call_command('send_tax_reminders', stdout=StringIO())
+        reminder.refresh_from_db()
+        self.assertTrue(reminder.sent)
+        self.assertEqual([(m.to, m.body) for m in mail.outbox], [([self.user.email], 'VAT is due')])
+        other.refresh_from_db()
+        self.assertEqual(other.status, 'PENDING')
+
+        # without an account on ADMIN_EMAIL the address is mailed directly
+        mail.outbox.clear()
+        reminder.sent = False
+        reminder.save()
+        with override_settings(ADMIN_EMAIL='tax@example.com'):
+            call_command('send_tax_reminders', stdout=StringIO())
+        reminder.refresh_from_db()
+        self.assertTrue(reminder.sent)
+        self.assertEqual([(m.to, m.body) for m in mail.outbox], [(['tax@example.com'], 'VAT is due')])
+
+    def test_unread_count_is_cached_and_long_poll_returns_new_notifications(self):
+        from unittest import mock
+        from django.core.cache import cache
+        from django.test import override_settings
+        from .models_ecommerce import Notification
+        from .services.notification_service import queue_message, unread_counter
+        cache.clear()
+        staff = self.employees[0].user
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_message([staff.id], 'IN_APP', 'Welcome', 'Hello')
+            Notification.objects.create(recipient=staff, channel='IN_APP', subject='Shift', message='Tomorrow')
+        self.client.force_authenticate(user=staff)
+        url = reverse('notification-unread-count')
+        self.assertEqual(self.client.get(url).data['unread_count'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_message([staff.id, self.user.id], 'IN_APP', 'Payroll', 'Approved')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).data['unread_count'], 3)
+
+        poll = self.client.get(reverse('notification-poll'), {'after': 0, 'timeout': 0}).data
+        self.assertEqual([n['subject'] for n in poll['results']], ['Welcome', 'Shift', 'Payroll'])
+        with self.assertNumQueries(0):
+            idle = self.client.get(reverse('notification-poll'), {'after': poll['latest'], 'timeout': 0}).data
+        self.assertEqual((idle['results'], idle['latest']), ([], poll['latest']))
+        with mock.patch.object(unread_counter, 'wait_for', return_value=poll['latest']) as wait_for:
+            self.client.get(reverse('notification-poll'), {'after': poll['latest'], 'timeout': 25})
+            with override_settings(NOTIFICATION_POLL_MAX_WAIT=20):
+                self.client.get(reverse('notification-poll'), {'after': poll['latest'], 'timeout': 25})
+            with override_settings(NOTIFICATION_POLL_MAX_WAIT=20):
+                for timeout in ('nan', 'inf', '-inf'):
+                    response = self.client.get(reverse('notification-poll'), {'after': poll['latest'], 'timeout': timeout})
+                    self.assertEqual(response.status_code, 400)
+        self.assertEqual([c.args[2] for c in wait_for.call_args_list], [0, 20])
+        # the wait itself is bounded in checks whatever timeout it is handed
+        with mock.patch.object(unread_counter, 'latest', return_value=poll['latest']) as latest, \
+                mock.patch('erp.services.notification_service.time.sleep'):
+            for timeout in (float('nan'), float('inf'), 3):
+                unread_counter.wait_for(staff.id, poll['latest'], timeout)
+        self.assertLessEqual(latest.call_count, 1 + 1 + 5)
+
+        first = poll['results'][0]['id']
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('notification-mark-as-read', args=[first]))
+        self.assertEqual(self.client.get(url).data['unread_count'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(reverse('notification-mark-all-read')).data['marked_read'], 2)
+        self.assertEqual(self.client.get(reverse('notification-list')).data['unread_count'], 0)
+        self.assertEqual(Notification.objects.filter(recipient=staff, status='READ').count(), 3)
+
+
+    def test_chunked_uploads_are_deduplicated_and_listed_through_the_access_list(self):
+        import hashlib
+        import tempfile
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.db import connection
+        from django.test import override_settings
+        from django.test.utils import CaptureQueriesContext
+        from .models import Business
+        from .models_extended_part2 import Document, DocumentBlob
+        content = b'scanned contract page ' * 20
+        sha256 = hashlib.sha256(content).hexdigest()
+        stores = Department.objects.create(business=self.business, name='Stores')
+        self.employees[0].department = stores
+        self.employees[0].save()
+
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media), self.captureOnCommitCallbacks(execute=True):
+            upload = self.client.post(reverse('document-upload-list'), {'filename': 'contract.pdf', 'content_type': 'application/pdf', 'total_size': len(content)}, format='json').data
+            chunk_url = reverse('document-upload-chunk', args=[upload['upload_id']])
+            send = lambda offset, size: self.client.post(chunk_url, {'offset': offset, 'chunk': SimpleUploadedFile('part', content[offset:offset + size])})
+            self.assertEqual(send(0, 200).data['received_size'], 200)
+            retried = send(0, 200)
+            self.assertEqual((retried.status_code, retried.data['received_size']), (status.HTTP_400_BAD_REQUEST, 200))
+            self.assertEqual(send(200, 240).data['received_size'], 440)
+            completed = self.client.post(reverse('document-upload-complete', args=[upload['upload_id']])).data
+            self.assertEqual(completed['status'], 'COMPLETED')
+
+            restricted = self.client.post(reverse('document-list'), {
+                'business': self.business.id, 'document_number': 'DOC-1', 'title': 'Supply contract', 'upload_id': upload['upload_id'], 'allowed_departments': [stores.id],
+            }, format='json')
+            self.assertEqual(restricted.status_code, status.HTTP_201_CREATED)
+            self.client.post(reverse('document-list'), {
+                'business': self.business.id, 'document_number': 'DOC-2', 'title': 'Handbook', 'is_public': True, 'file': SimpleUploadedFile('copy.pdf', content, content_type='application/pdf'),
+            })
+            known = self.client.post(reverse('document-upload-list'), {'filename': 'again.pdf', 'total_size': len(content), 'sha256': sha256}, format='json').data
+            self.assertEqual(known['status'], 'COMPLETED')
+            outsider = User.objects.create_user(username='outsider', email='outsider@example.com', password='pass', role='employer', phone='0770000099', business=Business.objects.create(name='Other Co'))
+            self.client.force_authenticate(user=outsider)
+            guessed = self.client.post(reverse('document-upload-list'), {'filename': 'guess.pdf', 'total_size': len(content), 'sha256': sha256}, format='json').data
+            self.assertEqual(guessed['status'], 'UPLOADING')
+            self.client.post(reverse('document-upload-chunk', args=[guessed['upload_id']]), {'offset': 0, 'chunk': SimpleUploadedFile('part', b'x' * len(content))})
+            mismatch = self.client.post(reverse('document-upload-complete', args=[guessed['upload_id']]))
+            self.assertEqual(mismatch.status_code, status.HTTP_400_BAD_REQUEST)
+            self.client.force_authenticate(user=self.user)
+            version = self.client.post(reverse('document-create-version', args=[restricted.data['id']]), {'upload_id': known['upload_id']}, format='json')
+            self.assertEqual((version.data['document_number'], version.data['version']), ('DOC-1-V2', '2.0'))
+
+            blob = DocumentBlob.objects.get()
+            self.assertEqual((blob.sha256, blob.size), (sha256, len(content)))
+            self.assertEqual(set(Document.objects.values_list('blob', flat=True)), {blob.id})
+            with blob.file.open('rb') as stored:
+                self.assertEqual(stored.read(), content)
+
+        def visible(employee):
+            self.client.force_authenticate(user=employee.user)
+            with CaptureQueriesContext(connection) as queries:
+                titles = sorted(item['title'] for item in self.client.get(reverse('document-list')).data['results'])
+            self.assertFalse(any('DISTINCT' in query['sql'] for query in queries.captured_queries))
+            return titles
+        self.assertEqual(visible(self.employees[0]), ['Handbook', 'Supply contract', 'Supply contract'])
+        self.assertEqual(visible(self.employees[1]), ['Handbook'])
+        self.employees[0].department, self.employees[1].department = None, stores
+        self.employees[0].save()
+        self.employees[1].save()
+        self.assertEqual(visible(self.employees[0]), ['Handbook'])
+        self.assertEqual(visible(self.employees[1]), ['Handbook', 'Supply contract', 'Supply contract'])
+        # the department's members lose its documents when it is deleted
+        stores.delete()
+        self.assertEqual(visible(self.employees[1]), ['Handbook'])
+        self.assertEqual(visible(self.employees[0]), ['Handbook'])
+
+
+class FinanceTests(APITestCase):
+    def setUp(self):
+        from .models import Business, Store, ChartOfAccounts
+        self.business = Business.objects.create(name='Ledger Co')
+        self.user = User.objects.create_user(username='accountant', email='accountant@example.com', password='pass', role='employer', phone='0770000005', business=self.business)
+        self.store = Store.objects.create(name='Main', address='1 Road', business=self.business, contact_number='1', vat_number='VAT-FIN')
+        self.accounts = {
+            code: ChartOfAccounts.objects.create(store=self.store, code=code, name=name, account_type=kind)
+            for code, name, kind in [
+                ('1500', 'Equipment', 'ASSET'), ('1590', 'Accumulated Depreciation', 'ASSET'), ('6100', 'Depreciation Expense', 'EXPENSE'),
+            ]
+        }
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_depreciation_run_posts_per_category_and_is_rerunnable(self):
+        from .models import JournalEntry, GeneralLedger
+        from .models_extended import AssetCategory, FixedAsset
+        assets = []
+        for name, method, price, life in [('Laptops', 'STRAIGHT_LINE', 1200, 1), ('Vehicles', 'DOUBLE_DECLINING', 1000, 5)]:
+            category = AssetCategory.objects.create(
+                business=self.business, name=name, depreciation_method=method, asset_account=self.accounts['1500'],
+                accumulated_depreciation_account=self.accounts['1590'], depreciation_expense_account=self.accounts['6100'],
+            )
+            assets.append(FixedAsset.objects.create(
+                business=self.business, asset_number=f'FA-{name}', name=name, category=category, purchase_date='2026-01-01',
+                purchase_price=price, depreciation_start_date='2026-01-01', useful_life_years=life,
+                current_book_value=price, location='HQ', created_by=self.user,
+            ))
+
+        response = self.client.post(reverse('fixed-asset-run-depreciation'), {'year': 2026, 'month': 3}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['assets_depreciated'], response.data['total_depreciation']), (2, Decimal('133.33')))
+        self.assertEqual(JournalEntry.objects.filter(status='POSTED').count(), 2)
+        self.assertEqual(GeneralLedger.objects.count(), 4)
+        laptop = FixedAsset.objects.get(id=assets[0].id)
+        self.assertEqual((laptop.accumulated_depreciation, laptop.current_book_value), (100, 1100))
+        self.accounts['6100'].refresh_from_db()
+        self.assertEqual(self.accounts['6100'].current_balance, Decimal('133.33'))
+
+        rerun = self.client.post(reverse('fixed-asset-run-depreciation'), {'year': 2026, 'month': 3}, format='json')
+        self.assertEqual((rerun.data['assets_depreciated'], rerun.data['already_depreciated']), (0, 2))
+        self.assertEqual(JournalEntry.objects.count(), 2)
+
+    def test_budget_variance_reads_cached_ledger_actuals(self):
+        from django.core.cache import cache
+        from .models_extended_part2 import CostCenter, BudgetPeriod, Budget, BudgetLine
+        from .services.ledger_service import post_journal_entry
+        cache.clear()
+        period = BudgetPeriod.objects.create(business=self.business, name='FY2026', period_type='ANNUAL', start_date='2026-01-01', end_date='2026-12-31', created_by=self.user)
+        center = CostCenter.objects.create(business=self.business, code='OPS', name='Operations')
+        budget = Budget.objects.create(business=self.business, budget_number='B-1', name='Ops', period=period, cost_center=center, created_by=self.user)
+        BudgetLine.objects.create(budget=budget, account=self.accounts['6100'], budgeted_amount=500)
+        expense, accumulated = self.accounts['6100'].id, self.accounts['1590'].id
+
+        def post(number, amount):
+            with self.captureOnCommitCallbacks(execute=True):
+                post_journal_entry(self.store.id, number, '2026-03-31', 'Depreciation', [(expense, amount, 0, 'Dep', center.id), (accumulated, 0, amount, 'Dep', center.id)], self.user)
+
+        post('JE-B1', 200)
+        url = reverse('budget-variance-analysis', args=[budget.id])
+        self.assertEqual(self.client.get(url).data['lines'][0]['actual_amount'], Decimal('200'))
+        with self.assertNumQueries(2):
+            report = self.client.get(url, {'monthly': 1}).data
+        self.assertEqual((report['total_variance'], report['variance_percent']), (Decimal('300'), Decimal('60.00')))
+        self.assertEqual(report['lines'][0]['monthly_actuals'], {'2026-03': Decimal('200')})
+
+        post('JE-B2', 50)
+        self.assertEqual(self.client.get(url).data['total_actual'], Decimal('250'))
+
+        # the cached actuals follow edits to the period, cost center and lines
+        with self.captureOnCommitCallbacks(execute=True):
+            BudgetPeriod.objects.filter(id=period.id).update(start_date='2026-04-01')
+            BudgetPeriod.objects.get(id=period.id).save()
+        self.assertEqual(self.client.get(url).data['total_actual'], Decimal('0'))
+        with self.captureOnCommitCallbacks(execute=True):
+            period.save()
+            budget.cost_center = CostCenter.objects.create(business=self.business, code='ADM', name='Admin')
+            budget.save()
+        self.assertEqual(self.client.get(url).data['total_actual'], Decimal('0'))
+        with self.captureOnCommitCallbacks(execute=True):
+            budget.cost_center = center
+            budget.save()
+            BudgetLine.objects.create(budget=budget, account=self.accounts['1590'], budgeted_amount=0)
+        self.assertEqual(
+            {line['account']: line['actual_amount'] for line in self.client.get(url).data['lines']},
+            {accumulated: Decimal('-250'), expense: Decimal('250')},
+        )
+        BudgetLine.objects.filter(account=self.accounts['1590']).delete()
+        self.client.post(reverse('budget-period-recompute-actuals', args=[period.id]))
+        budget.refresh_from_db()
+        self.assertEqual((budget.total_actual_amount, budget.variance_amount), (250, 250))
+
+    def test_journal_entries_written_through_the_api_reach_the_ledger_summary(self):
+        from django.core.cache import cache
+        from .models import JournalEntry, JournalEntryLine, LedgerPeriodSummary
+        from .models_extended_part2 import CostCenter, BudgetPeriod, Budget, BudgetLine
+        cache.clear()
+        period = BudgetPeriod.objects.create(business=self.business, name='FY2026', period_type='ANNUAL', start_date='2026-01-01', end_date='2026-12-31', created_by=self.user)
+        center = CostCenter.objects.create(business=self.business, code='OPS', name='Operations')
+        budget = Budget.objects.create(business=self.business, budget_number='B-1', name='Ops', period=period, cost_center=center, created_by=self.user)
+        BudgetLine.objects.create(budget=budget, account=self.accounts['6100'], budgeted_amount=500)
+        expense, accumulated = self.accounts['6100'].id, self.accounts['1590'].id
+        url = reverse('budget-variance-analysis', args=[budget.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            entry = self.client.post(reverse('journalentry-list'), {
+                'store': self.store.id, 'entry_number': 'JE-API', 'date': '2026-05-04', 'description': 'Repairs',
+                'status': 'DRAFT', 'total_debits': 200, 'total_credits': 200, 'created_by': self.user.id,
+            }, format='json').data
+            for account, debit, credit in ((expense, 200, 0), (accumulated, 0, 200)):
+                self.client.post(reverse('journalentryline-list'), {
+                    'journal_entry': entry['id'], 'account': account, 'description': 'Repairs', 'debit': debit, 'credit': credit, 'cost_center': center.id,
+                }, format='json')
+        self.assertFalse(LedgerPeriodSummary.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('journalentry-detail', args=[entry['id']]), {'status': 'POSTED'}, format='json')
+        self.assertEqual(self.client.get(url).data['total_actual'], Decimal('200'))
+
+        line = JournalEntryLine.objects.get(journal_entry_id=entry['id'], account_id=expense)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('journalentryline-detail', args=[line.id]), {'debit': 150}, format='json')
+            JournalEntryLine.objects.get(journal_entry_id=entry['id'], account_id=accumulated).delete()
+        self.assertEqual(self.client.get(url).data['total_actual'], Decimal('150'))
+        self.assertEqual(LedgerPeriodSummary.objects.get(account_id=accumulated).line_count, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            JournalEntry.objects.get(id=entry['id']).delete()
+        self.assertEqual(self.client.get(url).data['total_actual'], Decimal('0'))
+
+    def test_cost_center_reports_answer_from_ledger_summary(self):
+        from .models import ChartOfAccounts, GeneralLedger, LedgerPeriodSummary
+        from .models_extended_part2 import CostCenter
+        from .services.ledger_service import post_journal_entry
+        sales = ChartOfAccounts.objects.create(store=self.store, code='4000', name='Sales', account_type='REVENUE')
+        cash, expense = self.accounts['1500'].id, self.accounts['6100'].id
+        ops = CostCenter.objects.create(business=self.business, code='OPS', name='Operations')
+        retail = CostCenter.objects.create(business=self.business, code='RET', name='Retail')
+        post_journal_entry(self.store.id, 'JE-C1', '2026-04-02', 'Sales', [(cash, 900, 0, 'Cash'), (sales.id, 0, 900, 'Sales', retail.id)], self.user)
+        post_journal_entry(self.store.id, 'JE-C2', '2026-04-09', 'Costs', [
+            (expense, 300, 0, 'Ops', ops.id), (expense, 100, 0, 'Retail', retail.id), (expense, 40, 0, 'Rent'), (cash, 0, 440, 'Cash'),
+        ], self.user)
+        post_journal_entry(self.store.id, 'JE-C3', '2026-04-20', 'Costs', [(expense, 60, 0, 'Rent'), (cash, 0, 60, 'Cash')], self.user)
+        self.assertEqual(GeneralLedger.objects.filter(cost_center=ops).count(), 1)
+        self.assertEqual(LedgerPeriodSummary.objects.get(account_id=expense, cost_center=None).line_count, 2)
+
+        params = {'start_date': '2026-04-01', 'end_date': '2026-04-30'}
+        with self.assertNumQueries(1):
+            pnl = self.client.get(reverse('cost-center-profit-and-loss'), params).data
+        centers = {c['code']: (c['revenue'], c['expenses'], c['net_income']) for c in pnl['cost_centers']}
+        self.assertEqual(centers, {'OPS': (0, 300, -300), 'RET': (900, 100, 800), None: (0, 100, -100)})
+        self.assertEqual(pnl['net_income'], Decimal('400'))
+
+        allocation = self.client.get(reverse('cost-center-cost-allocation'), params).data
+        self.assertEqual(allocation['shared_pool'], Decimal('100'))
+        self.assertEqual([(a['code'], a['allocated_expenses']) for a in allocation['cost_centers']], [('OPS', Decimal('75.00')), ('RET', Decimal('25'))])
+        self.assertEqual(self.client.get(reverse('cost-center-cost-allocation'), {'basis': 'headcount'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StorefrontTests(APITestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from .models import Business, Store, Product
+        from .models_ecommerce import Website, WebsiteProduct
+        cache.clear()
+        self.business = Business.objects.create(name='Shop Co')
+        self.user = User.objects.create_user(username='merchant', email='merchant@example.com', password='pass', role='employer', phone='0770000006', business=self.business)
+        self.store = Store.objects.create(name='Main', address='1 Road', business=self.business, contact_number='1', vat_number='VAT-WEB')
+        self.website = Website.objects.create(
+            business=self.business, name='Shop', domain='shop.example.com', status='PUBLISHED',
+            contact_email='shop@example.com', contact_phone='1', address='1 Road', created_by=self.user,
+        )
+        self.product = Product.objects.create(business=self.business, store=self.store, name='Kettle', sku='KTL', unit_price=40, quantity_in_stock=3)
+        self.listing = WebsiteProduct.objects.create(
+            website=self.website, product=self.product, web_title='Kettle', web_description='Boils water',
+            slug='kettle', discount_percent=25,
+        )
+        self.client = APIClient()
+
+    def test_catalog_is_public_cached_and_invalidated_on_visible_changes(self):
+        from .models import Product
+        from .services.scan_service import adjust_stock_on_commit
+        from .services.storefront_service import view_counter
+        url = reverse('storefront-catalog', args=[self.website.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        item = response.data['results'][0]
+        self.assertEqual((item['effective_price'], item['in_stock']), (Decimal('30.00'), True))
+        self.assertIn('public', response['Cache-Control'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).data, response.data)
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # a sale that leaves stock keeps the cached page, selling out invalidates it
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(id=self.product.id).update(quantity_in_stock=1)
+            adjust_stock_on_commit({self.product.id: -2})
+        self.assertEqual(self.client.get(url)['ETag'], response['ETag'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(id=self.product.id).update(quantity_in_stock=0)
+            adjust_stock_on_commit({self.product.id: -1})
+        sold_out = self.client.get(url)
+        self.assertNotEqual(sold_out['ETag'], response['ETag'])
+        self.assertFalse(sold_out.data['results'][0]['in_stock'])
+
+        view_counter.flush()
+        detail = reverse('storefront-product', args=[self.website.id, 'kettle'])
+        for _ in range(3):
+            self.assertEqual(self.client.get(detail).data['effective_price'], Decimal('30.00'))
+        self.listing.refresh_from_db()
+        self.assertEqual((self.listing.views_count, view_counter.pending(self.listing.id)), (0, 3))
+        self.assertEqual(view_counter.flush(), 1)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.views_count, 3)
+        self.assertEqual(self.client.get(reverse('storefront-product', args=[self.website.id, 'missing'])).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_counters_buffer_clicks_and_recover_interrupted_flushes(self):
+        from unittest import mock
+        from django.core.management import call_command
+        from .models import Customer
+        from .models_ecommerce import ProductReview
+        from .services.counter_service import counters, flush_all
+        flush_all()
+        customer = Customer.objects.create(business=self.business, name='Ann', email='ann@example.com', phone='1', address='1 Road')
+        review = ProductReview.objects.create(website_product=self.listing, customer=customer, rating=5, title='Great', review_text='Fast')
+        self.client.force_authenticate(user=self.user)
+        url = reverse('product-review-mark-helpful', args=[review.id])
+        with self.assertNumQueries(2):  # the review and its customer name, no UPDATE
+            self.client.post(url, {'is_helpful': True}, format='json')
+        response = self.client.post(url, {'is_helpful': True}, format='json')
+        self.client.post(url, {'is_helpful': False}, format='json')
+        self.assertEqual(response.data['helpful_count'], 2)
+        for _ in range(4):
+            self.client.post(reverse('website-product-increment-views', args=[self.listing.id]))
+        live = self.client.get(reverse('website-product-live-counts')).data
+        self.assertEqual(live, [{'id': self.listing.id, 'views_count': 4, 'orders_count': 0}])
+
+        helpful = counters['review.helpful']
+        with mock.patch.object(helpful, '_write', side_effect=RuntimeError('db down')):
+            self.assertEqual(helpful.flush(), 0)
+        self.assertEqual((ProductReview.objects.get(id=review.id).helpful_count, helpful.pending(review.id)), (0, 0))
+        helpful.increment(review.id)
+        self.assertEqual(helpful.flush(), 2)
+
+        out = StringIO()
+        call_command('flush_counters', stdout=out)
+        review.refresh_from_db()
+        self.listing.refresh_from_db()
+        self.assertEqual((review.helpful_count, review.not_helpful_count, self.listing.views_count), (3, 1, 4))
+        self.assertEqual(counters['website_product.views'].flush(), 0)
+
+    def test_stock_reservations_never_oversell_and_convert_on_payment(self):
+        from datetime import timedelta
+        from unittest import mock
+        from django.utils import timezone
+        from .models import Currency, InventoryItem, Warehouse, StockRecord, StockMovement
+        from .models_ecommerce import ShoppingCart, OnlineOrder, OnlineOrderItem, StockReservation
+        from .services.reservation_service import ReservationService, ReservationError
+        item = InventoryItem.objects.create(business=self.business, name='Kettle', sku='KTL', purchase_price=20)
+        records = [
+            StockRecord.objects.create(item=item, warehouse=Warehouse.objects.create(business=self.business, name=code, code=code, address='1 Road'), quantity=qty)
+            for code, qty in [('WH-A', 2), ('WH-B', 1)]
+        ]
+        carts = [ShoppingCart.objects.create(session_id=f's{i}', website=self.website) for i in range(6)]
+
+        response = self.client.post(reverse('shopping-cart-add-item', args=[carts[0].id]), {'product_id': self.listing.id, 'quantity': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        short = self.client.post(reverse('shopping-cart-add-item', args=[carts[1].id]), {'product_id': self.listing.id, 'quantity': 2}, format='json')
+        self.assertEqual(short.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(carts[1].items.exists())
+
+        # a checkout that read stock before another one took it must not oversell
+        with mock.patch.object(ReservationService, '_stock_records', return_value=[(records[0].id, Decimal('2'))]):
+            with self.assertRaises(ReservationError):
+                ReservationService().reserve(self.listing, 1, cart=carts[2])
+        accepted = 0
+        for cart in carts[2:]:
+            try:
+                ReservationService().hold_cart_item(cart, self.listing, 1)
+                accepted += 1
+            except ReservationError:
+                pass
+        self.assertEqual(accepted, 1)
+        self.assertEqual(sum(StockRecord.objects.values_list('available_quantity', flat=True)), 0)
+
+        released = ReservationService().sweep_expired(now=timezone.now() + timedelta(minutes=20))
+        self.assertEqual(released, StockReservation.objects.filter(status='EXPIRED').count())
+        self.assertEqual(sorted(StockRecord.objects.values_list('available_quantity', 'reserved_quantity')), [(1, 0), (2, 0)])
+
+        self.client.force_authenticate(user=self.user)
+        currency = Currency.objects.create(code='USD', name='US Dollar', symbol='$')
+        order = OnlineOrder.objects.create(
+            website=self.website, order_number='WEB-1', subtotal=60, total_amount=60, currency=currency,
+            shipping_address='1 Road', shipping_city='Harare', shipping_province='Harare',
+            billing_address='1 Road', billing_city='Harare', billing_province='Harare', payment_method='ECOCASH',
+        )
+        OnlineOrderItem.objects.create(order=order, website_product=self.listing, quantity=3, unit_price=30)
+        self.assertEqual(self.client.post(reverse('online-order-process-payment', args=[order.id])).status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(StockRecord.objects.values_list('quantity', 'reserved_quantity', 'available_quantity')), [(0, 0, 0), (0, 0, 0)])
+        self.assertEqual(StockMovement.objects.filter(movement_type='OUT', reference='Online order WEB-1').count(), 2)
+        self.assertEqual(set(order.reservations.values_list('status', flat=True)), {'CONVERTED'})
+
+    def test_order_takes_only_the_ordered_quantity_from_cart_holds(self):
+        from .models import Currency, InventoryItem, Warehouse, StockRecord
+        from .models_ecommerce import ShoppingCart, OnlineOrder, OnlineOrderItem
+        from .services.reservation_service import ReservationService
+        item = InventoryItem.objects.create(business=self.business, name='Kettle', sku='KTL', purchase_price=20)
+        record = StockRecord.objects.create(item=item, warehouse=Warehouse.objects.create(business=self.business, name='WH-A', code='WH-A', address='1 Road'), quantity=10)
+        cart, other = ShoppingCart.objects.create(session_id='s1', website=self.website), ShoppingCart.objects.create(session_id='s2', website=self.website)
+        add_item = reverse('shopping-cart-add-item', args=[cart.id])
+        for quantity in (3, 2):
+            self.client.post(add_item, {'product_id': self.listing.id, 'quantity': quantity}, format='json')
+        self.client.post(reverse('shopping-cart-add-item', args=[other.id]), {'product_id': self.listing.id, 'quantity': 2}, format='json')
+        record.refresh_from_db()
+        self.assertEqual((record.reserved_quantity, record.available_quantity), (7, 3))
+
+        removed = self.client.post(reverse('shopping-cart-remove-item', args=[other.id]), {'item_id': other.items.get().id}, format='json')
+        self.assertEqual(removed.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(other.reservations.values_list('status', flat=True)), {'RELEASED'})
+
+        currency = Currency.objects.create(code='USD', name='US Dollar', symbol='$')
+        order = OnlineOrder.objects.create(
+            website=self.website, order_number='WEB-2', subtotal=120, total_amount=120, currency=currency,
+            shipping_address='1 Road', shipping_city='Harare', shipping_province='Harare',
+            billing_address='1 Road', billing_city='Harare', billing_province='Harare', payment_method='ECOCASH',
+        )
+        OnlineOrderItem.objects.create(order=order, website_product=self.listing, quantity=4, unit_price=30)
+        holds = ReservationService().reserve_order(order, cart=cart)
+        self.assertEqual(sorted(holds.values_list('quantity', flat=True)), [2, 2])
+        record.refresh_from_db()
+        self.assertEqual((record.reserved_quantity, record.available_quantity), (4, 6))
+
+        # stock movements and saves of a copy read before a hold keep the hold
+        from django.db.models import F
+        from .models import StockMovement
+        stale = StockRecord.objects.get(id=record.id)
+        StockRecord.objects.filter(id=record.id).update(reserved_quantity=F('reserved_quantity') + 1, available_quantity=F('available_quantity') - 1)
+        StockMovement.objects.create(item=item, warehouse=record.warehouse, movement_type='IN', quantity=5, created_by=self.user)
+        stale.quantity = 12
+        stale.save()
+        record.refresh_from_db()
+        self.assertEqual((record.quantity, record.reserved_quantity, record.available_quantity), (12, 5, 7))
+        StockMovement.objects.create(item=item, warehouse=record.warehouse, movement_type='OUT', quantity=2, created_by=self.user)
+        record.refresh_from_db()
+        self.assertEqual((record.quantity, record.reserved_quantity, record.available_quantity), (10, 5, 5))
+
+    def test_promo_codes_evaluate_from_index_and_redeem_atomically(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models_ecommerce import PromoCode, ShoppingCart, ShoppingCartItem
+        from .services.promo_service import promo_index
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            for code, kind, value, limit in [('SAVE10', 'PERCENTAGE', 10, 2), ('FIVE', 'FIXED', 5, None)]:
+                PromoCode.objects.create(
+                    website=self.website, code=code, description=code, discount_type=kind, discount_value=value,
+                    valid_from=now - timedelta(days=1), valid_until=now + timedelta(days=1), usage_limit=limit, created_by=self.user,
+                )
+        self.client.force_authenticate(user=self.user)
+        url = reverse('promo-code-validate-code')
+        self.assertEqual(self.client.post(url, {'website': self.website.id, 'code': 'SAVE10', 'order_amount': 80}, format='json').data['discount_amount'], Decimal('8.00'))
+        with self.assertNumQueries(1):  # only the website scope check, codes come from the index
+            response = self.client.post(url, {'website': self.website.id, 'code': 'SAVE10', 'order_amount': 30}, format='json')
+        self.assertEqual(response.data['discount_amount'], Decimal('3.00'))
+        self.assertEqual(self.client.post(url, {'code': 'NOPE', 'order_amount': 30}, format='json').status_code, status.HTTP_404_NOT_FOUND)
+
+        cart = ShoppingCart.objects.create(session_id='promo', website=self.website)
+        ShoppingCartItem.objects.create(cart=cart, website_product=self.listing, quantity=2)
+        batch = self.client.post(reverse('promo-code-validate-codes'), {'website': self.website.id, 'cart': cart.id, 'codes': ['SAVE10', 'FIVE', 'NOPE']}, format='json').data
+        self.assertEqual((batch['order_amount'], batch['best_code']), (Decimal('60.00'), 'SAVE10'))
+        self.assertEqual([r['valid'] for r in batch['results']], [True, True, False])
+
+        redeem = reverse('promo-code-redeem')
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.client.post(redeem, {'website': self.website.id, 'code': 'SAVE10', 'order_amount': 50}, format='json').status_code, status.HTTP_200_OK)
+        # another worker's index still believes the code has uses left
+        promo_index.get(self.website.id, 'SAVE10')['current_usage'] = 0
+        rejected = self.client.post(redeem, {'website': self.website.id, 'code': 'SAVE10', 'order_amount': 50}, format='json')
+        self.assertEqual(rejected.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(PromoCode.objects.get(code='SAVE10').current_usage, 2)
+        self.assertEqual(self.client.post(url, {'website': self.website.id, 'code': 'SAVE10', 'order_amount': 50}, format='json').data['error'], 'Promo code usage limit reached')
+
+    def test_promo_use_follows_the_order_it_was_redeemed_on(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import Currency
+        from .models_ecommerce import PromoCode, OnlineOrder
+        now = timezone.now()
+        promo = PromoCode.objects.create(
+            website=self.website, code='ONCE', description='ONCE', discount_type='FIXED', discount_value=10,
+            valid_from=now - timedelta(days=1), valid_until=now + timedelta(days=1), usage_limit=1, created_by=self.user,
+        )
+        currency = Currency.objects.create(code='USD', name='US Dollar', symbol='$')
+        orders = [
+            OnlineOrder.objects.create(
+                website=self.website, order_number=f'WEB-P{i}', subtotal=60, total_amount=65, shipping_cost=5, currency=currency,
+                shipping_address='1 Road', shipping_city='Harare', shipping_province='Harare',
+                billing_address='1 Road', billing_city='Harare', billing_province='Harare', payment_method='ECOCASH',
+            )
+            for i in range(2)
+        ]
+        self.client.force_authenticate(user=self.user)
+        redeem = reverse('promo-code-redeem')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(redeem, {'code': 'ONCE', 'order': orders[0].id}, format='json').status_code, status.HTTP_200_OK)
+        orders[0].refresh_from_db()
+        self.assertEqual((orders[0].promo_code_id, orders[0].discount_amount, orders[0].total_amount), (promo.id, 10, 55))
+        self.assertEqual(self.client.post(redeem, {'code': 'ONCE', 'order': orders[1].id}, format='json').data['error'], 'Promo code usage limit reached')
+
+        cancel = reverse('online-order-cancel', args=[orders[0].id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(cancel).status_code, status.HTTP_200_OK)
+            self.client.post(cancel)
+        promo.refresh_from_db()
+        self.assertEqual(promo.current_usage, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(redeem, {'code': 'ONCE', 'order': orders[1].id}, format='json').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.post(redeem, {'code': 'ONCE', 'order': orders[0].id}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_fulfilment_converts_paid_orders_in_bulk_once(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import Currency, Customer, InventoryItem, Warehouse, StockRecord, StockMovement
+        from .models_ecommerce import OnlineOrder, OnlineOrderItem
+        from .models_extended import SalesOrder, DeliveryNoteItem
+        item = InventoryItem.objects.create(business=self.business, name='Kettle', sku='KTL', purchase_price=20)
+        for code in ('WH-A', 'WH-B'):
+            StockRecord.objects.create(item=item, warehouse=Warehouse.objects.create(business=self.business, name=code, code=code, address='1 Road'), quantity=2)
+        currency = Currency.objects.create(code='USD', name='US Dollar', symbol='$')
+        now = timezone.now()
+        for i, quantity in enumerate([3, 2, 1]):
+            order = OnlineOrder.objects.create(
+                website=self.website, order_number=f'WEB-{i}', guest_email='Ann@example.com', guest_name='Ann',
+                subtotal=30 * quantity, total_amount=30 * quantity, currency=currency, status='PAID',
+                payment_status='COMPLETED', paid_at=now + timedelta(minutes=i),
+                shipping_address='1 Road', shipping_city='Harare', shipping_province='Harare',
+                billing_address='1 Road', billing_city='Harare', billing_province='Harare', payment_method='ECOCASH',
+            )
+            OnlineOrderItem.objects.create(order=order, website_product=self.listing, quantity=quantity, unit_price=30)
+
+        self.client.force_authenticate(user=self.user)
+        summary = self.client.post(reverse('online-order-fulfil'), {}, format='json').data
+        # the 2-unit order is short once the first order took 3 of 4 units; the 1-unit order after it still ships
+        self.assertEqual((summary['orders_fulfilled'], summary['orders_short']), (2, 1))
+        self.assertEqual(sorted(summary['sales_orders']), sorted(f'SO-WEB-{o.id}' for o in OnlineOrder.objects.exclude(order_number='WEB-1')))
+        self.assertEqual(sum(StockRecord.objects.values_list('available_quantity', flat=True)), 0)
+        self.assertEqual(StockMovement.objects.filter(movement_type='OUT').count(), 3)
+        self.assertEqual(Customer.objects.filter(business=self.business, email='ann@example.com').count(), 1)
+        self.assertEqual(sorted(DeliveryNoteItem.objects.values_list('quantity_delivered', flat=True)), [1, 3])
+        self.assertFalse(OnlineOrder.objects.get(order_number='WEB-1').sales_order_id)
+
+        again = self.client.post(reverse('online-order-fulfil'), {}, format='json').data
+        self.assertEqual(again['orders_fulfilled'], 0)
+        self.assertEqual(SalesOrder.objects.count(), 2)
+        self.assertEqual(StockMovement.objects.filter(movement_type='OUT').count(), 3)
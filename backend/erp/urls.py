@@ -86,6 +86,9 @@ urlpatterns = [
     path('pos/start-session/', views.POSStartSessionView.as_view(), name='pos-start-session'),
     path('pos/end-session/', views.POSEndSessionView.as_view(), name='pos-end-session'),
     path('pos/make-sale/', views.POSMakeSaleView.as_view(), name='pos-make-sale'),
+    path('pos/sync-sales/', views.POSSyncSalesView.as_view(), name='pos-sync-sales'),
+    path('pos/catalog/', views.POSCatalogView.as_view(), name='pos-catalog'),
+    path('pos/scan/', views.POSScanView.as_view(), name='pos-scan'),
     
     # Accounts Payable & Receivable
     path('accounts-payable/', views.AccountsPayableView.as_view(), name='accounts-payable'),
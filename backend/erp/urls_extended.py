@@ -35,6 +35,7 @@ router.register(r'asset-maintenances', AssetMaintenanceViewSet, basename='asset-
 
 # HR Management
 router.register(r'leave-types', LeaveTypeViewSet, basename='leave-type')
+router.register(r'leave-allocations', LeaveAllocationViewSet, basename='leave-allocation')
 router.register(r'leave-applications', LeaveApplicationViewSet, basename='leave-application')
 router.register(r'attendance-records', AttendanceRecordViewSet, basename='attendance-record')
 router.register(r'performance-reviews', PerformanceReviewViewSet, basename='performance-review')
@@ -45,6 +46,7 @@ router.register(r'training-programs', TrainingProgramViewSet, basename='training
 # Document Management
 router.register(r'document-categories', DocumentCategoryViewSet, basename='document-category')
 router.register(r'documents', DocumentViewSet, basename='document')
+router.register(r'document-uploads', DocumentUploadViewSet, basename='document-upload')
 router.register(r'document-templates', DocumentTemplateViewSet, basename='document-template')
 
 # Zimbabwe Fiscalization
@@ -60,6 +62,7 @@ router.register(r'budgets', BudgetViewSet, basename='budget')
 # E-commerce
 router.register(r'websites', WebsiteViewSet, basename='website')
 router.register(r'website-products', WebsiteProductViewSet, basename='website-product')
+router.register(r'storefront', StorefrontViewSet, basename='storefront')
 router.register(r'product-reviews', ProductReviewViewSet, basename='product-review')
 router.register(r'online-orders', OnlineOrderViewSet, basename='online-order')
 router.register(r'shopping-carts', ShoppingCartViewSet, basename='shopping-cart')
@@ -69,6 +72,7 @@ router.register(r'promo-codes', PromoCodeViewSet, basename='promo-code')
 router.register(r'workflow-definitions', WorkflowDefinitionViewSet, basename='workflow-definition')
 router.register(r'workflow-instances', WorkflowInstanceViewSet, basename='workflow-instance')
 router.register(r'workflow-step-executions', WorkflowStepExecutionViewSet, basename='workflow-step-execution')
+router.register(r'approval-inbox', ApprovalInboxViewSet, basename='approval-inbox')
 
 # Payments
 router.register(r'payment-gateways', PaymentGatewayViewSet, basename='payment-gateway')
@@ -20,9 +20,10 @@ from .permissions import IsAdminOrManager, IsStoreManager, IsAuthenticatedUser,
 from rest_framework.decorators import action
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, timezone as dt_timezone
 from .reports import PayrollReport, LeaveReport, OvertimeReport, EmployeeReport, TaxReport, AttendanceReport, CostAnalysisReport, P14Report, P16Report
 from .export_utils import ReportExporter
+from .services.scan_service import scan_index, adjust_stock_on_commit
 from django.utils import timezone
 from django.db.models import Sum, Count, Q
 from .models import SaleSession, POSSale, POSItem, FiscalizationLog
@@ -51,7 +52,7 @@ def fiscalize_sale_with_zimra(sale):
         }
 
     # Build payload
-    items = list(POSItem.objects.filter(sale=sale).values('product_name', 'quantity', 'unit_price', 'tax_rate'))
+    items = list(POSItem.objects.filter(sale=sale).values('item_name', 'quantity', 'unit_price', 'total_price'))
     request_payload = {
         'business': sale.session.cashier.business_id,
         'sale_id': sale.id,
@@ -665,6 +666,30 @@ class EmployeeViewSet(viewsets.ModelViewSet):
         else:
             serializer.save(business=user.business)
 
+# --- Bulk Import ---
+def _run_bulk_import(request, importer_class):
+    """Run a chunked CSV/XLSX import for the requesting user's business"""
+    from .services.import_service import ImportFileError
+
+    upload = request.FILES.get('file')
+    if not upload:
+        return Response({'error': 'No file uploaded'}, status=status.HTTP_400_BAD_REQUEST)
+
+    business = getattr(request.user, 'business', None)
+    if request.user.role == 'superadmin' and request.data.get('business'):
+        business = Business.objects.filter(id=request.data.get('business')).first()
+    if not business:
+        return Response({'error': 'Business is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    dry_run = str(request.data.get('dry_run', '')).lower() in ['true', '1', 'yes']
+    importer = importer_class(business, user=request.user, dry_run=dry_run)
+    try:
+        report = importer.run(upload)
+    except ImportFileError as e:
+        # chunks imported before the file became unreadable stay committed
+        return Response({'error': str(e), **importer.report()}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(report)
+
 # --- Product Management ---
 class ProductViewSet(viewsets.ModelViewSet):
     queryset = Product.objects.all()
@@ -746,6 +771,12 @@ class ProductViewSet(viewsets.ModelViewSet):
             from rest_framework.exceptions import ValidationError
             raise ValidationError({'business': 'Business is required. Please specify a business or assign one to your user account.'})
 
+    @action(detail=False, methods=['post'])
+    def bulk_import(self, request):
+        """Create or update products from an uploaded CSV/XLSX file"""
+        from .services.import_service import ProductImporter
+        return _run_bulk_import(request, ProductImporter)
+
 # --- Service Management ---
 class ServiceViewSet(viewsets.ModelViewSet):
     queryset = Service.objects.all()
@@ -828,6 +859,40 @@ class PayrollViewSet(viewsets.ModelViewSet):
         else:
             serializer.save(employee__business=user.business)
 
+    @action(detail=False, methods=['post'])
+    def notify_payslips(self, request):
+        """Queue payslip notifications for every employee paid in a period, rendered from a template"""
+        from .models_ecommerce import NotificationTemplate
+        from .services.notification_service import queue_template, NotificationError
+
+        template = NotificationTemplate.objects.filter(
+            id=request.data.get('template'), business=request.user.business
+        ).first()
+        if template is None:
+            return Response({'error': 'Notification template not found'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            period_end = datetime.strptime(request.data.get('period_end', ''), '%Y-%m-%d').date()
+        except ValueError:
+            return Response({'error': 'period_end must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+
+        payslips = self.get_queryset().filter(period_end=period_end, status__in=['APPROVED', 'PAID']).values(
+            'employee__user_id', 'employee__first_name', 'employee__last_name', 'period_start', 'period_end',
+            'gross_salary', 'deductions', 'net_salary',
+        )
+        contexts = {
+            p['employee__user_id']: {
+                'employee_name': f"{p['employee__first_name']} {p['employee__last_name']}",
+                'period_start': p['period_start'], 'period_end': p['period_end'],
+                'gross_salary': p['gross_salary'], 'deductions': p['deductions'], 'net_salary': p['net_salary'],
+            }
+            for p in payslips
+        }
+        try:
+            queued = queue_template(template, contexts, contexts=contexts)
+        except NotificationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'queued': queued})
+
 # --- Inventory Management ---
 class InventoryViewSet(viewsets.ModelViewSet):
     queryset = Inventory.objects.all()
@@ -1236,7 +1301,7 @@ class POSMakeSaleView(APIView):
                     self._apply_inventory_deduction(pos_item, user)
                 created_items.append(pos_item)
 
-            sale = self._synchronize_sale_totals(sale)
+            sale = self._synchronize_sale_totals(sale, created_items)
             self._update_session_totals(active_session, sale)
             self._record_payment(sale, user)
             fiscal_result = self._log_fiscalization(sale)
@@ -1265,8 +1330,9 @@ class POSMakeSaleView(APIView):
         if pos_item.quantity > available_stock:
             raise ValidationError({'inventory': f'Insufficient stock for {product.name}. Available {available_stock}, required {pos_item.quantity}.'})
 
-        Product.objects.filter(id=product.id).update(quantity_in_stock=F('quantity_in_stock') - pos_item.quantity)
+        Product.objects.filter(id=product.id).update(quantity_in_stock=F('quantity_in_stock') - pos_item.quantity, updated_at=timezone.now())
         product.refresh_from_db()
+        adjust_stock_on_commit({product.id: -pos_item.quantity})
 
         try:
             Inventory.objects.create(
@@ -1281,25 +1347,30 @@ class POSMakeSaleView(APIView):
         except Exception as exc:
             logger.warning('Failed to create inventory record for product %s: %s', product.id, exc)
 
-    def _synchronize_sale_totals(self, sale):
-        sale.refresh_from_db()
-        items = sale.items.all()
+    def _synchronize_sale_totals(self, sale, items):
+        # Totals come from the validated basket already in memory; only write when they differ
         subtotal = sum((item.total_price for item in items), Decimal('0'))
-        sale.subtotal = subtotal
-        tax_amount = Decimal(sale.tax_amount or 0)
-        sale.total_amount = subtotal + tax_amount
-        sale.save(update_fields=['subtotal', 'total_amount'])
+        total_amount = subtotal + Decimal(sale.tax_amount or 0)
+        if sale.subtotal != subtotal or sale.total_amount != total_amount:
+            sale.subtotal = subtotal
+            sale.total_amount = total_amount
+            POSSale.objects.filter(id=sale.id).update(subtotal=subtotal, total_amount=total_amount)
         return sale
 
     def _update_session_totals(self, session, sale):
+        # Single UPDATE: closing_balance is derived from the pre-update total_sales in the same statement
         amount = Decimal(sale.total_amount or 0)
         SaleSession.objects.filter(id=session.id).update(
             total_sales=F('total_sales') + amount,
-            total_transactions=F('total_transactions') + 1
+            total_transactions=F('total_transactions') + 1,
+            closing_balance=F('opening_balance') + F('total_sales') + amount,
         )
-        session.refresh_from_db()
-        session.closing_balance = session.opening_balance + session.total_sales
-        session.save(update_fields=['closing_balance'])
+
+    def _credit_store_account(self, model, store, amount):
+        """Credit the store's first active account of the given model in one UPDATE; returns rows updated"""
+        from django.db.models import Subquery
+        account_id = model.objects.filter(store=store, is_active=True).order_by('id').values('id')[:1]
+        return model.objects.filter(id=Subquery(account_id)).update(current_balance=F('current_balance') + amount)
 
     def _record_payment(self, sale, user):
         payment_method = (sale.payment_method or '').upper()
@@ -1314,56 +1385,490 @@ class POSMakeSaleView(APIView):
             return
 
         if payment_method == 'CASH':
-            cash_till = CashTill.objects.filter(store=store, is_active=True).first()
-            if cash_till:
-                CashTill.objects.filter(id=cash_till.id).update(current_balance=F('current_balance') + amount)
+            if not self._credit_store_account(CashTill, store, amount):
+                logger.warning('No cash till found for store %s', store)
+            return
+
+        if payment_method == 'MOBILE_MONEY':
+            account_model, transaction_model, account_field = MobileMoneyAccount, MobileMoneyTransaction, 'mobile_account_id'
+        else:
+            account_model, transaction_model, account_field = BankAccount, BankTransaction, 'bank_account_id'
+
+        account_id = account_model.objects.filter(store=store, is_active=True).order_by('id').values_list('id', flat=True).first()
+        if not account_id:
+            logger.warning('No %s found for store %s', account_model._meta.verbose_name, store)
+            return
+        transaction_model.objects.create(
+            transaction_type='RECEIPT',
+            amount=amount,
+            reference=sale.sale_number,
+            description=f'POS Sale {sale.sale_number}',
+            transaction_date=timezone.now().date(),
+            value_date=timezone.now().date(),
+            status='COMPLETED',
+            created_by=user,
+            **{account_field: account_id}
+        )
+        account_model.objects.filter(id=account_id).update(current_balance=F('current_balance') + amount)
+
+    def _log_fiscalization(self, sale):
+        result = fiscalize_sale_with_zimra(sale)
+        FiscalizationLog.objects.create(
+            sale=sale,
+            fiscal_receipt_number=result.get('fiscal_receipt_number') or '',
+            success=result.get('success'),
+            request_payload=result.get('request_payload'),
+            response_payload=result.get('response_payload')
+        )
+        return result
+
+class POSSyncSalesView(POSMakeSaleView):
+    """
+    Batch upload of sales captured while a till was offline.
+    Each sale carries a client-generated idempotency_key; replays of an
+    already-synced key are reported as duplicates instead of being applied
+    twice. Sales are applied in captured_at order so stock checks see the
+    same sequence the till did.
+    """
+    MAX_BATCH_SIZE = 5000
+    MAX_KEY_LENGTH = POSSale._meta.get_field('idempotency_key').max_length
+
+    def post(self, request):
+        user = request.user
+
+        active_session = SaleSession.objects.filter(cashier=user, is_active=True).select_related('store').first()
+        if not active_session:
+            return Response({'error': 'No active session found'}, status=status.HTTP_400_BAD_REQUEST)
+
+        sales_data = request.data.get('sales') or []
+        if not isinstance(sales_data, list) or not sales_data:
+            return Response({'sales': ['At least one sale is required']}, status=status.HTTP_400_BAD_REQUEST)
+        if len(sales_data) > self.MAX_BATCH_SIZE:
+            return Response({'sales': [f'A batch may contain at most {self.MAX_BATCH_SIZE} sales']}, status=status.HTTP_400_BAD_REQUEST)
+
+        from django.utils.dateparse import parse_datetime
+
+        results = []
+        entries = []
+        for entry in sales_data:
+            if not isinstance(entry, dict):
+                results.append({'idempotency_key': None, 'status': 'rejected', 'errors': {'sale': ['Each sale must be an object']}})
+                continue
+            key = str(entry.get('idempotency_key') or '').strip()
+            captured_at = parse_datetime(str(entry.get('captured_at') or ''))
+            if not key or captured_at is None:
+                results.append({
+                    'idempotency_key': key or None,
+                    'status': 'rejected',
+                    'errors': {'sale': ['idempotency_key and a valid captured_at are required']},
+                })
+                continue
+            if len(key) > self.MAX_KEY_LENGTH:
+                results.append({
+                    'idempotency_key': key,
+                    'status': 'rejected',
+                    'errors': {'idempotency_key': [f'idempotency_key may be at most {self.MAX_KEY_LENGTH} characters']},
+                })
+                continue
+            if timezone.is_naive(captured_at):
+                captured_at = timezone.make_aware(captured_at)
+            entries.append((captured_at, key, entry))
+        entries.sort(key=lambda e: e[0])
+
+        product_ids, service_ids = set(), set()
+        for _, _, entry in entries:
+            for raw_item in self._raw_items(entry):
+                if self._catalog_id(raw_item, 'product'):
+                    product_ids.add(raw_item['product'])
+                elif self._catalog_id(raw_item, 'service'):
+                    service_ids.add(raw_item['service'])
+
+        from django.db import IntegrityError
+
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    accepted, entry_results = self._sync_entries(entries, product_ids, service_ids, active_session, user)
+                break
+            except IntegrityError:
+                # a concurrent replay committed some of these keys first; a retry reports them as duplicates
+                if attempt:
+                    raise
+        results.extend(entry_results)
+
+        sale_ids = {sale.idempotency_key: sale.id for sale, _ in accepted}
+        for result in results:
+            if result['status'] == 'created':
+                result['sale_id'] = sale_ids[result['idempotency_key']]
+
+        return Response({
+            'session': active_session.id,
+            'created': len(accepted),
+            'duplicates': sum(1 for r in results if r['status'] == 'duplicate'),
+            'rejected': sum(1 for r in results if r['status'] == 'rejected'),
+            'results': results,
+        })
+
+    @staticmethod
+    def _raw_items(entry):
+        """The item objects of an entry; malformed items are rejected later by _build_offline_sale"""
+        items = entry.get('items')
+        return [item for item in items if isinstance(item, dict)] if isinstance(items, list) else []
+
+    @staticmethod
+    def _catalog_id(raw_item, field):
+        """A product/service id that can be looked up, or None"""
+        value = raw_item.get(field)
+        return value if isinstance(value, int) and not isinstance(value, bool) and value else None
+
+    def _sync_entries(self, entries, product_ids, service_ids, session, user):
+        """Apply sorted entries inside the caller's transaction; returns (accepted, results)"""
+        products = Product.objects.select_for_update().in_bulk(product_ids)
+        services = Service.objects.in_bulk(service_ids)
+        available = {pid: product.quantity_in_stock or 0 for pid, product in products.items()}
+
+        # read after taking the product locks so a concurrent replay of this batch is seen
+        keys = [key for _, key, _ in entries]
+        sale_numbers = [str(entry.get('sale_number') or '') for _, _, entry in entries]
+        existing_keys, foreign_keys = {}, set()
+        for key, sale_id, business_id in POSSale.objects.filter(idempotency_key__in=keys).values_list(
+            'idempotency_key', 'id', 'session__store__business_id'
+        ):
+            if business_id == session.store.business_id:
+                existing_keys[key] = sale_id
             else:
+                foreign_keys.add(key)
+        taken_numbers = set(POSSale.objects.filter(sale_number__in=sale_numbers).values_list('sale_number', flat=True))
+
+        accepted, results = [], []
+        for captured_at, key, entry in entries:
+            if key in existing_keys:
+                results.append({'idempotency_key': key, 'status': 'duplicate', 'sale_id': existing_keys[key]})
+                continue
+            if key in foreign_keys:
+                # keys are unique across businesses; another tenant's sale is neither reported nor overwritten
+                results.append({'idempotency_key': key, 'status': 'rejected', 'errors': {'idempotency_key': ['idempotency_key is already in use']}})
+                continue
+            try:
+                sale, items = self._build_offline_sale(entry, key, captured_at, session, products, services, available, taken_numbers)
+            except ValidationError as e:
+                results.append({'idempotency_key': key, 'status': 'rejected', 'errors': e.message_dict if hasattr(e, 'error_dict') else {'sale': e.messages}})
+                continue
+            existing_keys[key] = None
+            taken_numbers.add(sale.sale_number)
+            accepted.append((sale, items))
+            results.append({'idempotency_key': key, 'status': 'created', 'sale_number': sale.sale_number})
+
+        if accepted:
+            self._apply_offline_sales(accepted, session, products, user)
+        return accepted, results
+
+    def _build_offline_sale(self, entry, key, captured_at, session, products, services, available, taken_numbers):
+        """Validate one offline sale against the preloaded catalog and build unsaved rows"""
+        sale_number = str(entry.get('sale_number') or '').strip()
+        if not sale_number or len(sale_number) > 20:
+            raise ValidationError({'sale_number': ['A sale_number of at most 20 characters is required']})
+        if sale_number in taken_numbers:
+            raise ValidationError({'sale_number': [f'Sale number {sale_number} already exists']})
+
+        payment_method = str(entry.get('payment_method') or '').upper()
+        if payment_method not in dict(POSSale._meta.get_field('payment_method').choices):
+            raise ValidationError({'payment_method': [f'Invalid payment method {payment_method}']})
+
+        items_data = entry.get('items') or []
+        if not isinstance(items_data, list) or not items_data:
+            raise ValidationError({'items': ['At least one item is required']})
+        if not all(isinstance(raw_item, dict) for raw_item in items_data):
+            raise ValidationError({'items': ['Each item must be an object']})
+
+        try:
+            tax_amount = Decimal(str(entry.get('tax_amount') or 0))
+            discount_amount = Decimal(str(entry.get('discount_amount') or 0))
+        except (ArithmeticError, ValueError):
+            raise ValidationError({'sale': ['tax_amount and discount_amount must be numbers']})
+
+        items = []
+        deductions = {}
+        for raw_item in items_data:
+            product_id, service_id = self._catalog_id(raw_item, 'product'), self._catalog_id(raw_item, 'service')
+            product = products.get(product_id) if product_id else None
+            service = services.get(service_id) if service_id else None
+            if bool(product) == bool(service):
+                raise ValidationError({'items': ['Each item needs exactly one valid product or service']})
+            catalog_item = product or service
+            if catalog_item.business_id != session.store.business_id:
+                raise ValidationError({'items': [f'{catalog_item.name} does not belong to this business']})
+            if product and product.store_id and product.store_id != session.store_id:
+                raise ValidationError({'product': [f'Product {product.name} does not belong to the selected store.']})
+            try:
+                quantity = int(raw_item.get('quantity'))
+                unit_price = Decimal(str(raw_item.get('unit_price')))
+                total_price = raw_item.get('total_price')
+                total_price = Decimal(str(total_price)) if total_price not in (None, '') else unit_price * quantity
+            except (TypeError, ValueError, ArithmeticError):
+                raise ValidationError({'items': ['quantity, unit_price and total_price must be numbers']})
+            if quantity <= 0:
+                raise ValidationError({'items': ['quantity must be positive']})
+            if product:
+                deductions[product.id] = deductions.get(product.id, 0) + quantity
+            items.append(POSItem(
+                product=product,
+                service=service,
+                item_name=raw_item.get('item_name') or catalog_item.name,
+                quantity=quantity,
+                unit_price=unit_price,
+                total_price=total_price,
+            ))
+
+        for product_id, quantity in deductions.items():
+            if quantity > available[product_id]:
+                product = products[product_id]
+                raise ValidationError({'inventory': [f'Insufficient stock for {product.name}. Available {available[product_id]}, required {quantity}.']})
+        for product_id, quantity in deductions.items():
+            available[product_id] -= quantity
+
+        subtotal = sum((item.total_price for item in items), Decimal('0'))
+        sale = POSSale(
+            session=session,
+            sale_number=sale_number,
+            customer_name=entry.get('customer_name') or '',
+            customer_phone=entry.get('customer_phone') or '',
+            subtotal=subtotal,
+            tax_amount=tax_amount,
+            discount_amount=discount_amount,
+            total_amount=subtotal + tax_amount,
+            payment_method=payment_method,
+            idempotency_key=key,
+            captured_at=captured_at,
+        )
+        return sale, items
+
+    def _apply_offline_sales(self, accepted, session, products, user):
+        """Write accepted sales, stock, session totals and payments with grouped statements"""
+        from django.db.models import Case, When, PositiveIntegerField
+
+        sales = POSSale.objects.bulk_create([sale for sale, _ in accepted])
+        all_items = []
+        deductions = {}
+        for sale, items in accepted:
+            for item in items:
+                item.sale = sale
+                all_items.append(item)
+                if item.product_id:
+                    deductions[item.product_id] = deductions.get(item.product_id, 0) + item.quantity
+        POSItem.objects.bulk_create(all_items)
+
+        if deductions:
+            Product.objects.filter(id__in=deductions).update(quantity_in_stock=Case(
+                *[When(id=pid, then=F('quantity_in_stock') - qty) for pid, qty in deductions.items()],
+                default=F('quantity_in_stock'),
+                output_field=PositiveIntegerField(),
+            ), updated_at=timezone.now())
+            adjust_stock_on_commit({pid: -qty for pid, qty in deductions.items()})
+            Inventory.objects.bulk_create([
+                Inventory(
+                    product=products[item.product_id],
+                    quantity=item.quantity,
+                    unit_cost=item.unit_price,
+                    total_cost=item.total_price,
+                    transaction_type='SALE',
+                    reference=f'POS Sale {item.sale.sale_number}',
+                    notes='Automatic inventory deduction from offline POS sale'
+                )
+                for item in all_items if item.product_id
+            ])
+
+        batch_total = sum((Decimal(sale.total_amount or 0) for sale in sales), Decimal('0'))
+        SaleSession.objects.filter(id=session.id).update(
+            total_sales=F('total_sales') + batch_total,
+            total_transactions=F('total_transactions') + len(sales),
+            closing_balance=F('opening_balance') + F('total_sales') + batch_total,
+        )
+
+        self._record_batch_payments(sales, session.store, user)
+        transaction.on_commit(lambda: self._fiscalize_offline_sales(sales))
+
+    def _fiscalize_offline_sales(self, sales):
+        """Fiscalize synced sales after commit, so the ZIMRA round trips run without stock locks held"""
+        logs = []
+        for sale in sales:
+            try:
+                result = fiscalize_sale_with_zimra(sale)
+            except Exception:
+                logger.exception('Fiscalization failed for offline sale %s', sale.sale_number)
+                result = {'success': False, 'request_payload': '', 'response_payload': ''}
+            logs.append(FiscalizationLog(
+                sale=sale,
+                fiscal_receipt_number=result.get('fiscal_receipt_number') or '',
+                success=result.get('success'),
+                request_payload=result.get('request_payload'),
+                response_payload=result.get('response_payload')
+            ))
+        FiscalizationLog.objects.bulk_create(logs)
+
+    def _record_batch_payments(self, sales, store, user):
+        """Post batch receipts with one balance update per till/account"""
+        if not store:
+            logger.warning('Sale session has no store; skipping payment recording')
+            return
+
+        totals = {}
+        for sale in sales:
+            if sale.total_amount > 0:
+                method = (sale.payment_method or '').upper()
+                method = method if method in ('CASH', 'MOBILE_MONEY') else 'BANK'
+                totals.setdefault(method, []).append(sale)
+
+        today = timezone.now().date()
+        if 'CASH' in totals:
+            amount = sum((s.total_amount for s in totals['CASH']), Decimal('0'))
+            if not self._credit_store_account(CashTill, store, amount):
                 logger.warning('No cash till found for store %s', store)
-        elif payment_method == 'MOBILE_MONEY':
+        if 'MOBILE_MONEY' in totals:
             mobile_account = MobileMoneyAccount.objects.filter(store=store, is_active=True).first()
             if mobile_account:
-                MobileMoneyTransaction.objects.create(
-                    mobile_account=mobile_account,
-                    transaction_type='RECEIPT',
-                    amount=amount,
-                    reference=sale.sale_number,
-                    description=f'POS Sale {sale.sale_number}',
-                    transaction_date=timezone.now().date(),
-                    value_date=timezone.now().date(),
-                    status='COMPLETED',
-                    created_by=user
-                )
+                MobileMoneyTransaction.objects.bulk_create([
+                    MobileMoneyTransaction(
+                        mobile_account=mobile_account, transaction_type='RECEIPT', amount=s.total_amount,
+                        reference=s.sale_number, description=f'POS Sale {s.sale_number}',
+                        transaction_date=today, value_date=today, status='COMPLETED', created_by=user
+                    )
+                    for s in totals['MOBILE_MONEY']
+                ])
+                amount = sum((s.total_amount for s in totals['MOBILE_MONEY']), Decimal('0'))
                 MobileMoneyAccount.objects.filter(id=mobile_account.id).update(current_balance=F('current_balance') + amount)
             else:
                 logger.warning('No mobile money account found for store %s', store)
-        else:
+        if 'BANK' in totals:
             bank_account = BankAccount.objects.filter(store=store, is_active=True).first()
             if bank_account:
-                BankTransaction.objects.create(
-                    bank_account=bank_account,
-                    transaction_type='RECEIPT',
-                    amount=amount,
-                    reference=sale.sale_number,
-                    description=f'POS Sale {sale.sale_number}',
-                    transaction_date=timezone.now().date(),
-                    value_date=timezone.now().date(),
-                    status='COMPLETED',
-                    created_by=user
-                )
+                BankTransaction.objects.bulk_create([
+                    BankTransaction(
+                        bank_account=bank_account, transaction_type='RECEIPT', amount=s.total_amount,
+                        reference=s.sale_number, description=f'POS Sale {s.sale_number}',
+                        transaction_date=today, value_date=today, status='COMPLETED', created_by=user
+                    )
+                    for s in totals['BANK']
+                ])
+                amount = sum((s.total_amount for s in totals['BANK']), Decimal('0'))
                 BankAccount.objects.filter(id=bank_account.id).update(current_balance=F('current_balance') + amount)
             else:
                 logger.warning('No bank account found for store %s', store)
 
-    def _log_fiscalization(self, sale):
-        result = fiscalize_sale_with_zimra(sale)
-        FiscalizationLog.objects.create(
-            sale=sale,
-            fiscal_receipt_number=result.get('fiscal_receipt_number'),
-            success=result.get('success'),
-            request_payload=result.get('request_payload'),
-            response_payload=result.get('response_payload')
-        )
-        return result
+class POSCatalogView(APIView):
+    """
+    Compact per-store catalog snapshot for tills.
+    Returns products and services as columnar arrays with a version
+    watermark (latest updated_at in microseconds). Clients send the ETag
+    back in If-None-Match to get a 304 when nothing changed, or pass
+    ?since=<version> to receive only rows changed after that watermark.
+    Deltas overlap the watermark by DELTA_OVERLAP so rows committed late
+    with an older updated_at are not skipped (clients upsert, so repeats
+    are harmless), and carry the ids of every row still in the catalog so
+    clients can drop deleted products and products moved to another store.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    PRODUCT_COLUMNS = ['id', 'name', 'sku', 'barcode', 'unit_price', 'quantity_in_stock', 'is_active']
+    SERVICE_COLUMNS = ['id', 'name', 'service_code', 'service_price', 'is_active']
+
+    EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+    DELTA_OVERLAP = timedelta(minutes=2)
+
+    def get(self, request):
+        from django.db.models import Max
+
+        user = request.user
+        store_id = request.query_params.get('store')
+        if not store_id:
+            return Response({'store': 'Store is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not str(store_id).isdigit():
+            return Response({'store': 'Store must be an id.'}, status=status.HTTP_400_BAD_REQUEST)
+        store = Store.objects.filter(id=store_id).first()
+        if not store:
+            return Response({'store': 'Store not found.'}, status=status.HTTP_400_BAD_REQUEST)
+        if user.role != 'superadmin' and store.business_id != getattr(user, 'business_id', None):
+            return Response({'store': 'Store does not belong to your business.'}, status=status.HTTP_403_FORBIDDEN)
+
+        store_filter = Q(business_id=store.business_id) & (Q(store=store) | Q(store__isnull=True))
+        products = Product.objects.filter(store_filter)
+        services = Service.objects.filter(store_filter)
+
+        product_stats = products.aggregate(latest=Max('updated_at'), count=Count('id'))
+        service_stats = services.aggregate(latest=Max('updated_at'), count=Count('id'))
+        latest = max(filter(None, [product_stats['latest'], service_stats['latest']]), default=None)
+        version = (latest - self.EPOCH) // timedelta(microseconds=1) if latest else 0
+        etag = f'"{store.id}-{version}-{product_stats["count"]}-{service_stats["count"]}"'
+
+        since = request.query_params.get('since')
+        if since:
+            try:
+                since_dt = self.EPOCH + timedelta(microseconds=int(since))
+            except (ValueError, OverflowError):
+                return Response({'since': 'since must be a catalog version.'}, status=status.HTTP_400_BAD_REQUEST)
+            present = {
+                'product_ids': sorted(products.values_list('id', flat=True)),
+                'service_ids': sorted(services.values_list('id', flat=True)),
+            }
+            products = products.filter(updated_at__gt=since_dt - self.DELTA_OVERLAP)
+            services = services.filter(updated_at__gt=since_dt - self.DELTA_OVERLAP)
+        elif request.headers.get('If-None-Match') == etag:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = etag
+            return response
+
+        zimra_config = ZIMRAConfiguration.objects.filter(business_id=store.business_id).only('vat_rate').first()
+        data = {
+            'store': store.id,
+            'version': version,
+            'delta': bool(since),
+            'tax_rate': str(zimra_config.vat_rate) if zimra_config else None,
+            'product_count': product_stats['count'],
+            'service_count': service_stats['count'],
+            'products': self._columns(products.order_by('id').values_list(*self.PRODUCT_COLUMNS), self.PRODUCT_COLUMNS),
+            'services': self._columns(services.order_by('id').values_list(*self.SERVICE_COLUMNS), self.SERVICE_COLUMNS),
+        }
+        if since:
+            data.update(present)
+        response = Response(data)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def _columns(self, rows, columns):
+        rows = list(rows)
+        return {
+            column: [str(v) if isinstance(v, Decimal) else v for v in values]
+            for column, values in zip(columns, zip(*rows) if rows else [[] for _ in columns])
+        }
+
+class POSScanView(APIView):
+    """Resolve a scanned barcode, SKU or service code to a sellable item for a store"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        user = request.user
+        code = request.query_params.get('code')
+        if not code:
+            return Response({'code': 'Code is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        store_id = request.query_params.get('store')
+        if store_id:
+            if not str(store_id).isdigit():
+                return Response({'store': 'Store must be an id.'}, status=status.HTTP_400_BAD_REQUEST)
+            store = Store.objects.filter(id=store_id).first()
+        else:
+            session = SaleSession.objects.filter(cashier=user, is_active=True).select_related('store').first()
+            store = session.store if session else None
+        if not store:
+            return Response({'store': 'Store not found.'}, status=status.HTTP_400_BAD_REQUEST)
+        if user.role != 'superadmin' and store.business_id != getattr(user, 'business_id', None):
+            return Response({'store': 'Store does not belong to your business.'}, status=status.HTTP_403_FORBIDDEN)
+
+        item = scan_index.lookup(store, code)
+        if item is None:
+            return Response({'error': f'No item matches code {code}'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(item)
 
 # ==================== PROJECT MANAGEMENT VIEWS ====================
 class CustomerViewSet(BusinessFilterMixin, viewsets.ModelViewSet):
@@ -1428,6 +1933,12 @@ class CustomerViewSet(BusinessFilterMixin, viewsets.ModelViewSet):
             from rest_framework.exceptions import ValidationError
             raise ValidationError({'business': 'Business is required. Please specify a business or assign one to your user account.'})
 
+    @action(detail=False, methods=['post'])
+    def bulk_import(self, request):
+        """Create or update customers from an uploaded CSV/XLSX file"""
+        from .services.import_service import CustomerImporter
+        return _run_bulk_import(request, CustomerImporter)
+
 class ProjectViewSet(BusinessFilterMixin, viewsets.ModelViewSet):
     queryset = Project.objects.all()
     serializer_class = ProjectSerializer
@@ -1463,6 +1974,52 @@ class ProjectViewSet(BusinessFilterMixin, viewsets.ModelViewSet):
         serializer = ProjectTimesheetSerializer(timesheets, many=True)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    def cost_summary(self, request, pk=None):
+        """Weekly hours, billing and expenses for a project from the cost rollups"""
+        project = self.get_object()
+        rollups = project.cost_rollups.order_by('week_start')
+        totals = rollups.aggregate(
+            hours=Sum('hours'),
+            billable_hours=Sum('billable_hours'),
+            billable_amount=Sum('billable_amount'),
+            expenses=Sum('expenses'),
+        )
+        expenses = totals['expenses'] or 0
+        return Response({
+            'project': project.id,
+            'budget': project.budget,
+            'hours': totals['hours'] or 0,
+            'billable_hours': totals['billable_hours'] or 0,
+            'billable_amount': totals['billable_amount'] or 0,
+            'expenses': expenses,
+            'expense_utilization': round(expenses / project.budget * 100, 2) if project.budget else None,
+            'weeks': ProjectCostRollupSerializer(rollups, many=True).data,
+        })
+
+    @action(detail=False, methods=['get'])
+    def portfolio(self, request):
+        """Hours, billing and expenses for every visible project in one query"""
+        period = Q()
+        try:
+            if request.query_params.get('start_date'):
+                period &= Q(cost_rollups__week_start__gte=datetime.strptime(request.query_params['start_date'], '%Y-%m-%d').date() - timedelta(days=6))
+            if request.query_params.get('end_date'):
+                period &= Q(cost_rollups__week_start__lte=datetime.strptime(request.query_params['end_date'], '%Y-%m-%d').date())
+        except ValueError:
+            return Response({'error': 'Dates must be YYYY-MM-DD'}, status=400)
+
+        projects = self.get_queryset()
+        if request.query_params.get('status'):
+            projects = projects.filter(status=request.query_params['status'])
+        rows = projects.values('id', 'name', 'status', 'budget').annotate(
+            hours=Sum('cost_rollups__hours', filter=period),
+            billable_hours=Sum('cost_rollups__billable_hours', filter=period),
+            billable_amount=Sum('cost_rollups__billable_amount', filter=period),
+            expenses=Sum('cost_rollups__expenses', filter=period),
+        ).order_by('name')
+        return Response(list(rows))
+
     @action(detail=True, methods=['post'])
     def update_progress(self, request, pk=None):
         project = self.get_object()
@@ -1584,7 +2141,8 @@ class ProjectTimesheetViewSet(viewsets.ModelViewSet):
             'project__name'
         ).annotate(
             total_hours=Sum('hours_worked'),
-            total_billable=Sum('hours_worked', filter=models.Q(is_billable=True))
+            total_billable=Sum('hours_worked', filter=models.Q(is_billable=True)),
+            total_billable_amount=Sum('billable_amount')
         )
         
         return Response(list(report))
@@ -1839,6 +2397,12 @@ class InventoryItemViewSet(BusinessFilterMixin, viewsets.ModelViewSet):
         serializer = StockRecordSerializer(stock_records, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'])
+    def import_opening_stock(self, request):
+        """Load opening stock balances per warehouse from an uploaded CSV/XLSX file"""
+        from .services.import_service import OpeningStockImporter
+        return _run_bulk_import(request, OpeningStockImporter)
+
 class StockMovementViewSet(BusinessFilterMixin, viewsets.ModelViewSet):
     """Stock movement tracking"""
     queryset = StockMovement.objects.all()
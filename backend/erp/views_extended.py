@@ -43,9 +43,46 @@ class VendorViewSet(viewsets.ModelViewSet):
         """Get purchase history for a vendor"""
         vendor = self.get_object()
         pos = PurchaseOrder.objects.filter(vendor=vendor).order_by('-order_date')[:10]
+        monthly = VendorSpendRollup.objects.filter(vendor=vendor).order_by('-period')[:24]
         return Response({
-            'total_orders': pos.count(),
-            'recent_orders': PurchaseOrderSerializer(pos, many=True).data
+            'total_orders': VendorSpendRollup.objects.filter(vendor=vendor).aggregate(total=Sum('po_count'))['total'] or 0,
+            'recent_orders': PurchaseOrderSerializer(pos, many=True).data,
+            'monthly': VendorSpendRollupSerializer(monthly, many=True).data,
+        })
+    
+    @action(detail=True, methods=['get'])
+    def scorecard(self, request, pk=None):
+        """Vendor scorecard: lifetime and year-to-date spend, lead time and outstanding balance"""
+        vendor = self.get_object()
+        year_start = timezone.now().date().replace(month=1, day=1)
+        ytd = Q(period__gte=year_start)
+        totals = VendorSpendRollup.objects.filter(vendor=vendor).aggregate(
+            total_orders=Sum('po_count'),
+            ordered=Sum('ordered_amount'),
+            received=Sum('received_amount'),
+            billed=Sum('billed_amount'),
+            paid=Sum('paid_amount'),
+            lead_days=Sum('lead_time_days_total'),
+            lead_samples=Sum('lead_time_samples'),
+            ytd_orders=Sum('po_count', filter=ytd),
+            ytd_billed=Sum('billed_amount', filter=ytd),
+            ytd_paid=Sum('paid_amount', filter=ytd),
+        )
+        billed = totals['billed'] or 0
+        paid = totals['paid'] or 0
+        return Response({
+            'vendor': vendor.id,
+            'vendor_name': vendor.name,
+            'total_orders': totals['total_orders'] or 0,
+            'ordered_amount': totals['ordered'] or 0,
+            'received_amount': totals['received'] or 0,
+            'billed_amount': billed,
+            'paid_amount': paid,
+            'outstanding_balance': billed - paid,
+            'average_lead_time_days': round(totals['lead_days'] / totals['lead_samples'], 1) if totals['lead_samples'] else None,
+            'ytd_orders': totals['ytd_orders'] or 0,
+            'ytd_spend': totals['ytd_billed'] or 0,
+            'ytd_paid': totals['ytd_paid'] or 0,
         })
 
 
@@ -65,11 +102,40 @@ class PurchaseRequisitionViewSet(viewsets.ModelViewSet):
         return PurchaseRequisition.objects.filter(business=user.business)
     
     def perform_create(self, serializer):
-        serializer.save(requested_by=self.request.user, business=self.request.user.business)
+        from .services.approval_service import open_requisition
+        
+        requisition = serializer.save(requested_by=self.request.user, business=self.request.user.business)
+        if requisition.status == 'PENDING':
+            open_requisition(requisition)
+    
+    def perform_update(self, serializer):
+        from .services.approval_service import close_resolved
+        
+        close_resolved('REQUISITION', serializer.save(), self.request.user)
+    
+    @action(detail=True, methods=['post'])
+    def submit(self, request, pk=None):
+        """Submit a draft requisition for approval"""
+        from .services.approval_service import open_requisition
+        
+        requisition = self.get_object()
+        if requisition.status != 'DRAFT':
+            return Response(
+                {'error': 'Only draft requisitions can be submitted'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        requisition.status = 'PENDING'
+        requisition.save()
+        open_requisition(requisition)
+        
+        return Response(PurchaseRequisitionSerializer(requisition).data)
     
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
         """Approve a requisition"""
+        from .services.approval_service import close_requests
+        
         requisition = self.get_object()
         if requisition.status != 'PENDING':
             return Response(
@@ -81,18 +147,22 @@ class PurchaseRequisitionViewSet(viewsets.ModelViewSet):
         requisition.approved_by = request.user
         requisition.approved_at = timezone.now()
         requisition.save()
+        close_requests('REQUISITION', requisition.id, 'APPROVED', request.user)
         
         return Response(PurchaseRequisitionSerializer(requisition).data)
     
     @action(detail=True, methods=['post'])
     def reject(self, request, pk=None):
         """Reject a requisition"""
+        from .services.approval_service import close_requests
+        
         requisition = self.get_object()
         reason = request.data.get('reason', '')
         
         requisition.status = 'REJECTED'
         requisition.rejection_reason = reason
         requisition.save()
+        close_requests('REQUISITION', requisition.id, 'REJECTED', request.user)
         
         return Response(PurchaseRequisitionSerializer(requisition).data)
 
@@ -156,6 +226,8 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
         po = serializer.save(created_by=self.request.user)
         
         # Create purchase order items if provided
+        from decimal import Decimal
+        items_total = Decimal('0')
         items_data = self.request.data.get('items', [])
         if items_data:
             for item_data in items_data:
@@ -172,7 +244,7 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
                     except Product.DoesNotExist:
                         pass
                 
-                PurchaseOrderItem.objects.create(
+                po_item = PurchaseOrderItem.objects.create(
                     purchase_order=po,
                     product=product,
                     description=description,
@@ -180,6 +252,12 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
                     unit_price=item_data.get('unit_price', 0),
                     is_inventory_item=is_inventory_item,
                 )
+                items_total += po_item.total_price + po_item.tax_amount
+        
+        if not po.total_amount and items_total:
+            # Rollups follow total_amount, so a PO posted without one takes its line total
+            po.total_amount = items_total
+            po.save(update_fields=['total_amount', 'updated_at'])
     
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
@@ -190,6 +268,30 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
         po.approved_at = timezone.now()
         po.save()
         return Response(PurchaseOrderSerializer(po).data)
+    
+    @action(detail=False, methods=['get'])
+    def vendor_spend(self, request):
+        """Spend per vendor for a year (defaults to the current year), from the monthly rollups"""
+        try:
+            year = int(request.query_params.get('year', timezone.now().year))
+        except ValueError:
+            return Response({'error': 'Invalid year'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        rollups = VendorSpendRollup.objects.filter(period__year=year)
+        if request.user.role != 'superadmin':
+            rollups = rollups.filter(business=request.user.business)
+        rows = list(rollups.values('vendor_id', 'vendor__name').annotate(
+            orders=Sum('po_count'),
+            ordered_amount=Sum('ordered_amount'),
+            received_amount=Sum('received_amount'),
+            billed_amount=Sum('billed_amount'),
+            paid_amount=Sum('paid_amount'),
+        ).order_by('-billed_amount'))
+        return Response({
+            'year': year,
+            'total_billed': sum((row['billed_amount'] or 0 for row in rows), 0),
+            'vendors': rows,
+        })
 
 
 class VendorBillViewSet(viewsets.ModelViewSet):
@@ -245,38 +347,46 @@ class VendorBillViewSet(viewsets.ModelViewSet):
         
         # Create bill items from GRN items if GRN is provided
         grn = serializer.validated_data.get('grn')
+        items = []
         if grn:
-            for grn_item in grn.items.all():
+            for grn_item in grn.items.select_related('po_item'):
                 po_item = grn_item.po_item
                 if po_item:
-                    VendorBillItem.objects.create(
-                        vendor_bill=bill,
+                    items.append(VendorBillItem(
                         grn_item=grn_item,
                         po_item=po_item,
-                        product=po_item.product,
-                        description=po_item.description or grn_item.po_item.description,
+                        product_id=po_item.product_id,
+                        description=po_item.description,
                         quantity=grn_item.quantity_accepted or grn_item.quantity_received,
                         unit_price=po_item.unit_price,
                         tax_rate=po_item.tax_rate,
                         unit_of_measure=po_item.unit_of_measure,
-                    )
+                    ))
         elif purchase_order:
             # Create bill items from PO items if no GRN
             for po_item in purchase_order.items.all():
-                VendorBillItem.objects.create(
-                    vendor_bill=bill,
+                items.append(VendorBillItem(
                     po_item=po_item,
-                    product=po_item.product,
+                    product_id=po_item.product_id,
                     description=po_item.description,
                     quantity=po_item.quantity_ordered,
                     unit_price=po_item.unit_price,
                     tax_rate=po_item.tax_rate,
                     unit_of_measure=po_item.unit_of_measure,
-                )
+                ))
+        if items:
+            bill.add_items(items)
+
+    def perform_update(self, serializer):
+        from .services.approval_service import close_resolved
+        
+        close_resolved('VENDOR_BILL', serializer.save(), self.request.user)
 
     @action(detail=True, methods=['post'])
     def submit_for_approval(self, request, pk=None):
         """Submit vendor bill for approval - industry standard workflow"""
+        from .services.approval_service import open_vendor_bill
+        
         bill = self.get_object()
         if bill.status != 'DRAFT':
             return Response({'detail': 'Only draft bills can be submitted for approval.'}, status=status.HTTP_400_BAD_REQUEST)
@@ -289,11 +399,14 @@ class VendorBillViewSet(viewsets.ModelViewSet):
         bill.submitted_by = request.user
         bill.submitted_at = timezone.now()
         bill.save(update_fields=['status', 'submitted_by', 'submitted_at', 'updated_at'])
+        open_vendor_bill(bill)
         return Response(self.get_serializer(bill).data)
 
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
         """Approve vendor bill - industry standard approval workflow"""
+        from .services.approval_service import close_requests
+        
         bill = self.get_object()
         if bill.status not in ['DRAFT', 'TO_APPROVE']:
             return Response({'detail': 'Only draft or waiting approval bills can be approved.'}, status=status.HTTP_400_BAD_REQUEST)
@@ -301,6 +414,7 @@ class VendorBillViewSet(viewsets.ModelViewSet):
         bill.approved_by = request.user
         bill.approved_at = timezone.now()
         bill.save(update_fields=['status', 'approved_by', 'approved_at', 'updated_at'])
+        close_requests('VENDOR_BILL', bill.id, 'APPROVED', request.user)
         
         # Update purchase order status to BILLED if all items are billed
         if bill.purchase_order:
@@ -319,6 +433,8 @@ class VendorBillViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def reject(self, request, pk=None):
         """Reject vendor bill - industry standard rejection workflow"""
+        from .services.approval_service import close_requests
+        
         bill = self.get_object()
         if bill.status not in ['DRAFT', 'TO_APPROVE']:
             return Response({'detail': 'Only draft or waiting approval bills can be rejected.'}, status=status.HTTP_400_BAD_REQUEST)
@@ -332,17 +448,21 @@ class VendorBillViewSet(viewsets.ModelViewSet):
         bill.rejected_at = timezone.now()
         bill.rejection_reason = rejection_reason
         bill.save(update_fields=['status', 'rejected_by', 'rejected_at', 'rejection_reason', 'updated_at'])
+        close_requests('VENDOR_BILL', bill.id, 'REJECTED', request.user)
         
         return Response(self.get_serializer(bill).data)
     
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
         """Cancel vendor bill"""
+        from .services.approval_service import close_requests
+        
         bill = self.get_object()
         if bill.status in ['PAID']:
             return Response({'detail': 'Cannot cancel a paid bill.'}, status=status.HTTP_400_BAD_REQUEST)
         bill.status = 'CANCELLED'
         bill.save(update_fields=['status', 'updated_at'])
+        close_requests('VENDOR_BILL', bill.id, 'CANCELLED', request.user)
         return Response(self.get_serializer(bill).data)
 
 
@@ -362,6 +482,28 @@ class VendorBillItemViewSet(viewsets.ModelViewSet):
             return self.queryset
         return self.queryset.filter(vendor_bill__business=user.business)
 
+    @action(detail=False, methods=['post'])
+    def bulk_create(self, request):
+        """Bulk create bill lines; each bill's totals are recomputed once"""
+        from django.db import transaction
+        from .models_extended import defer_bill_totals
+
+        serializer = self.get_serializer(data=request.data.get('items', []), many=True)
+        serializer.is_valid(raise_exception=True)
+
+        items_by_bill = {}
+        for data in serializer.validated_data:
+            bill = data['vendor_bill']
+            if request.user.role != 'superadmin' and bill.business_id != request.user.business_id:
+                raise ValidationError({'vendor_bill': f'Vendor bill {bill.id} does not belong to your business.'})
+            items_by_bill.setdefault(bill.pk, (bill, []))[1].append(VendorBillItem(**data))
+
+        created = []
+        with transaction.atomic(), defer_bill_totals():
+            for bill, items in items_by_bill.values():
+                created.extend(bill.add_items(items))
+        return Response(self.get_serializer(created, many=True).data, status=status.HTTP_201_CREATED)
+
 
 class GoodsReceivedNoteViewSet(viewsets.ModelViewSet):
     queryset = GoodsReceivedNote.objects.all()
@@ -380,68 +522,16 @@ class GoodsReceivedNoteViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         """Create GRN and add items to inventory if they are inventory items"""
-        from .models import Inventory, Product
-        from django.db.models import F
-        import random
-        import string
-        from decimal import Decimal
-        
-        grn = serializer.save(received_by=self.request.user, business=self.request.user.business)
-        
-        # Calculate total amount from PO
-        total_amount = Decimal('0')
-        for item in grn.items.all():
-            po_item = item.po_item
-            total_amount += po_item.unit_price * item.quantity_received
-        
-        grn.total_amount = total_amount
-        grn.save(update_fields=['total_amount'])
+        from django.db import transaction
+        from .services.procurement_service import GRNReceiptService
         
-        # Add items to inventory if they are inventory items
-        for item in grn.items.all():
-            po_item = item.po_item
-            if po_item.is_inventory_item and item.quantity_received > 0:
-                # If product doesn't exist but it's an inventory item, create it
-                product = po_item.product
-                if not product:
-                    business = grn.business
-                    description = po_item.description
-                    
-                    # Generate unique SKU
-                    prefix = description[:3].upper().replace(' ', '')
-                    if len(prefix) < 3:
-                        prefix = 'PRO'
-                    sku = f"{prefix}-{''.join(random.choices(string.digits, k=6))}"
-                    while Product.objects.filter(sku=sku).exists():
-                        sku = f"{prefix}-{''.join(random.choices(string.digits, k=6))}"
-                    
-                    product = Product.objects.create(
-                        business=business,
-                        name=description,
-                        sku=sku,
-                        description=description,
-                        unit_price=po_item.unit_price,
-                        cost_price=po_item.unit_price,
-                        quantity_in_stock=0,
-                        is_active=True,
-                    )
-                    # Update the PO item to link to the new product
-                    po_item.product = product
-                    po_item.save()
-                
-                # Add to inventory
-                Inventory.objects.create(
-                    product=product,
-                    quantity=int(item.quantity_received),
-                    unit_cost=po_item.unit_price,
-                    total_cost=po_item.unit_price * item.quantity_received,
-                    transaction_type='PURCHASE',
-                    reference=f'GRN {grn.grn_number}',
-                    notes=f'Received from Purchase Order {po_item.purchase_order.po_number}'
-                )
-                # Update product stock
-                product.quantity_in_stock = F('quantity_in_stock') + int(item.quantity_received)
-                product.save(update_fields=['quantity_in_stock'])
+        with transaction.atomic():
+            grn = serializer.save(received_by=self.request.user, business=self.request.user.business)
+            service = GRNReceiptService(grn)
+            lines = self.request.data.get('items') or []
+            if lines:
+                service.add_items(lines)
+            service.post()
     
     @action(detail=True, methods=['post'])
     def create_bill(self, request, pk=None):
@@ -512,42 +602,24 @@ class GoodsReceivedNoteViewSet(viewsets.ModelViewSet):
             created_by=request.user,
         )
         
-        # Create bill items from GRN items
+        # Create bill items from GRN items; totals are written once after the bulk insert
         from decimal import Decimal
-        subtotal = Decimal('0')
-        tax_total = Decimal('0')
-        for grn_item in grn.items.all():
+        items = []
+        for grn_item in grn.items.select_related('po_item'):
             po_item = grn_item.po_item
             if not po_item:
                 continue
-                
-            quantity = grn_item.quantity_accepted or grn_item.quantity_received
-            unit_price = po_item.unit_price
-            tax_rate = po_item.tax_rate or Decimal('0')
-            total_price = quantity * unit_price
-            tax_amount = total_price * (tax_rate / Decimal('100'))
-            
-            VendorBillItem.objects.create(
-                vendor_bill=bill,
+            items.append(VendorBillItem(
                 grn_item=grn_item,
                 po_item=po_item,
-                product=po_item.product,
+                product_id=po_item.product_id,
                 description=po_item.description or '',
-                quantity=quantity,
-                unit_price=unit_price,
-                tax_rate=tax_rate,
+                quantity=grn_item.quantity_accepted or grn_item.quantity_received,
+                unit_price=po_item.unit_price,
+                tax_rate=po_item.tax_rate or Decimal('0'),
                 unit_of_measure=po_item.unit_of_measure or 'Units',
-            )
-            
-            subtotal += total_price
-            tax_total += tax_amount
-        
-        # Update bill totals (the save method on VendorBillItem will also update these, but we set them here for consistency)
-        bill.subtotal = subtotal
-        bill.tax_amount = tax_total
-        bill.total_amount = subtotal + tax_total
-        bill.balance = bill.total_amount - bill.paid_amount
-        bill.save()
+            ))
+        bill.add_items(items)
         
         # Update GRN payment status
         grn.total_amount = bill.total_amount
@@ -561,14 +633,7 @@ class GoodsReceivedNoteViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def process_payment(self, request, pk=None):
         """Process payment for GRN - supports multiple payment methods"""
-        from .models_extended import PurchaseOrderPayment, VendorBill
-        from .models import CashTill, MobileMoneyAccount, BankAccount, MobileMoneyTransaction, BankTransaction
-        from django.db.models import F
-        from django.db import transaction
-        from decimal import Decimal
-        import logging
-        
-        logger = logging.getLogger(__name__)
+        from .services.procurement_service import GRNSettlementService, SettlementError
         
         grn = self.get_object()
         payments_data = request.data.get('payments', [])  # List of {method: 'CASH', amount: 100, account_id: 1}
@@ -576,179 +641,38 @@ class GoodsReceivedNoteViewSet(viewsets.ModelViewSet):
         if not payments_data:
             return Response({'error': 'No payment methods provided'}, status=status.HTTP_400_BAD_REQUEST)
         
-        total_payment = Decimal('0')
-        for payment_data in payments_data:
-            amount = Decimal(str(payment_data.get('amount', 0)))
-            if amount <= 0:
-                continue
-            total_payment += amount
-        
-        if total_payment <= 0:
-            return Response({'error': 'Invalid payment amount'}, status=status.HTTP_400_BAD_REQUEST)
+        legs = [dict(payment_data, grn=grn.id) for payment_data in payments_data]
+        try:
+            GRNSettlementService(request.user).settle([grn], legs)
+        except SettlementError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Check if payment exceeds total amount
-        if total_payment > grn.total_amount:
-            return Response({'error': f'Payment amount (${total_payment}) exceeds total amount (${grn.total_amount})'}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer(grn)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+    
+    @action(detail=False, methods=['post'])
+    def payment_run(self, request):
+        """Settle a supplier payment run across many GRNs in one transaction"""
+        from .services.procurement_service import GRNSettlementService, SettlementError
         
-        # Get store from purchase order (if available)
-        store = None
-        if hasattr(grn.purchase_order, 'store'):
-            store = grn.purchase_order.store
-        elif hasattr(grn.business, 'stores'):
-            store = grn.business.stores.first()
+        payments_data = request.data.get('payments', [])  # List of {grn: 1, method: 'BANK', amount: 100, account_id: 1}
+        if not payments_data:
+            return Response({'error': 'No payments provided'}, status=status.HTTP_400_BAD_REQUEST)
         
-        with transaction.atomic():
-            # Process each payment method
-            for payment_data in payments_data:
-                payment_method = payment_data.get('method', '').upper()
-                amount = Decimal(str(payment_data.get('amount', 0)))
-                account_id = payment_data.get('account_id')
-                
-                if amount <= 0:
-                    continue
-                
-                if payment_method == 'CASH':
-                    # Deduct from cash till
-                    if account_id:
-                        cash_till = CashTill.objects.filter(id=account_id, is_active=True).first()
-                    else:
-                        cash_till = CashTill.objects.filter(store=store, is_active=True).first() if store else CashTill.objects.filter(business=grn.business, is_active=True).first()
-                    
-                    if not cash_till:
-                        return Response({'error': 'No cash till found'}, status=status.HTTP_400_BAD_REQUEST)
-                    
-                    if cash_till.current_balance < amount:
-                        return Response({'error': f'Insufficient cash balance. Available: ${cash_till.current_balance}, Required: ${amount}'}, status=status.HTTP_400_BAD_REQUEST)
-                    
-                    # Deduct from cash till
-                    CashTill.objects.filter(id=cash_till.id).update(current_balance=F('current_balance') - amount)
-                    
-                    # Create payment record
-                    PurchaseOrderPayment.objects.create(
-                        grn=grn,
-                        payment_method='CASH',
-                        amount=amount,
-                        cash_till=cash_till,
-                        created_by=request.user,
-                        notes=f'Payment for GRN {grn.grn_number}'
-                    )
-                    
-                elif payment_method == 'MOBILE_MONEY':
-                    # Deduct from mobile money account
-                    if account_id:
-                        mobile_account = MobileMoneyAccount.objects.filter(id=account_id, is_active=True).first()
-                    else:
-                        mobile_account = MobileMoneyAccount.objects.filter(store=store, is_active=True).first() if store else MobileMoneyAccount.objects.filter(business=grn.business, is_active=True).first()
-                    
-                    if not mobile_account:
-                        return Response({'error': 'No mobile money account found'}, status=status.HTTP_400_BAD_REQUEST)
-                    
-                    if mobile_account.current_balance < amount:
-                        return Response({'error': f'Insufficient mobile money balance. Available: ${mobile_account.current_balance}, Required: ${amount}'}, status=status.HTTP_400_BAD_REQUEST)
-                    
-                    # Create transaction and deduct
-                    MobileMoneyTransaction.objects.create(
-                        mobile_account=mobile_account,
-                        transaction_type='PAYMENT',
-                        amount=amount,
-                        reference=f'GRN {grn.grn_number}',
-                        description=f'Payment for Purchase Order {grn.purchase_order.po_number}',
-                        transaction_date=timezone.now().date(),
-                        value_date=timezone.now().date(),
-                        status='COMPLETED',
-                        created_by=request.user
-                    )
-                    MobileMoneyAccount.objects.filter(id=mobile_account.id).update(current_balance=F('current_balance') - amount)
-                    
-                    # Create payment record
-                    PurchaseOrderPayment.objects.create(
-                        grn=grn,
-                        payment_method='MOBILE_MONEY',
-                        amount=amount,
-                        mobile_money_account=mobile_account,
-                        created_by=request.user,
-                        notes=f'Payment for GRN {grn.grn_number}'
-                    )
-                    
-                elif payment_method == 'BANK':
-                    # Deduct from bank account
-                    if account_id:
-                        bank_account = BankAccount.objects.filter(id=account_id, is_active=True).first()
-                    else:
-                        bank_account = BankAccount.objects.filter(store=store, is_active=True).first() if store else BankAccount.objects.filter(business=grn.business, is_active=True).first()
-                    
-                    if not bank_account:
-                        return Response({'error': 'No bank account found'}, status=status.HTTP_400_BAD_REQUEST)
-                    
-                    if bank_account.current_balance < amount:
-                        return Response({'error': f'Insufficient bank balance. Available: ${bank_account.current_balance}, Required: ${amount}'}, status=status.HTTP_400_BAD_REQUEST)
-                    
-                    # Create transaction and deduct
-                    BankTransaction.objects.create(
-                        bank_account=bank_account,
-                        transaction_type='PAYMENT',
-                        amount=amount,
-                        reference=f'GRN {grn.grn_number}',
-                        description=f'Payment for Purchase Order {grn.purchase_order.po_number}',
-                        transaction_date=timezone.now().date(),
-                        value_date=timezone.now().date(),
-                        status='COMPLETED',
-                        created_by=request.user
-                    )
-                    BankAccount.objects.filter(id=bank_account.id).update(current_balance=F('current_balance') - amount)
-                    
-                    # Create payment record
-                    PurchaseOrderPayment.objects.create(
-                        grn=grn,
-                        payment_method='BANK',
-                        amount=amount,
-                        bank_account=bank_account,
-                        created_by=request.user,
-                        notes=f'Payment for GRN {grn.grn_number}'
-                    )
-            
-            # Update GRN payment status
-            grn.refresh_from_db()
-            new_paid_amount = grn.paid_amount + total_payment
-            grn.paid_amount = new_paid_amount
-            grn.save(update_fields=['paid_amount'])
-            grn.refresh_from_db()
-            
-            # Update payment status
-            if grn.paid_amount >= grn.total_amount:
-                grn.payment_status = 'PAID'
-            elif grn.paid_amount > 0:
-                grn.payment_status = 'PARTIAL'
-            else:
-                grn.payment_status = 'PENDING'
-            grn.save(update_fields=['payment_status'])
-            
-            # Update vendor bill payment status if bill exists for this GRN
-            vendor_bill = VendorBill.objects.filter(grn=grn).first()
-            if vendor_bill:
-                vendor_bill.paid_amount = grn.paid_amount
-                vendor_bill.balance = vendor_bill.total_amount - vendor_bill.paid_amount
-                
-                # Update payment status
-                if vendor_bill.balance <= 0 and vendor_bill.paid_amount > 0:
-                    vendor_bill.payment_status = 'PAID'
-                    vendor_bill.status = 'PAID'
-                elif vendor_bill.paid_amount > 0:
-                    vendor_bill.payment_status = 'PARTIAL'
-                else:
-                    vendor_bill.payment_status = 'UNPAID'
-                
-                vendor_bill.save(update_fields=['paid_amount', 'balance', 'payment_status', 'status', 'updated_at'])
-            
-            # Update purchase order status if fully paid
-            if grn.payment_status == 'PAID':
-                po = grn.purchase_order
-                if po.status != 'COMPLETED':
-                    po.status = 'BILLED'
-                    po.save(update_fields=['status'])
+        grn_ids = {payment_data.get('grn') for payment_data in payments_data}
+        grns = self.get_queryset().select_related('purchase_order').filter(id__in=grn_ids)
+        try:
+            settled = GRNSettlementService(request.user).settle(grns, payments_data)
+        except SettlementError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        serializer = self.get_serializer(grn)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response({
+            'grns_settled': len(settled),
+            'grns': [
+                {'id': grn.id, 'grn_number': grn.grn_number, 'paid_amount': str(grn.paid_amount), 'payment_status': grn.payment_status}
+                for grn in settled
+            ],
+        })
 
 
 # ==================== CRM VIEWSETS ====================
@@ -941,6 +865,30 @@ class FixedAssetViewSet(viewsets.ModelViewSet):
             'by_status': queryset.values('status').annotate(count=Count('id')),
             'by_category': queryset.values('category__name').annotate(count=Count('id'))
         })
+    
+    @action(detail=False, methods=['post'])
+    def run_depreciation(self, request):
+        """Depreciate every active asset for a month and post one journal entry per category"""
+        from .services.asset_service import DepreciationRun
+        from .services.ledger_service import LedgerError
+        
+        today = timezone.now().date()
+        try:
+            year = int(request.data.get('year', today.year))
+            month = int(request.data.get('month', today.month))
+            if not 1 <= month <= 12:
+                raise ValueError
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid year or month'}, status=status.HTTP_400_BAD_REQUEST)
+        if not request.user.business:
+            return Response({'error': 'Business is required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        dry_run = str(request.data.get('dry_run', '')).lower() in ['true', '1', 'yes']
+        try:
+            summary = DepreciationRun(request.user.business, request.user, year, month).run(dry_run=dry_run)
+        except LedgerError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(summary)
 
 
 class AssetDepreciationViewSet(viewsets.ModelViewSet):
@@ -982,6 +930,59 @@ class LeaveTypeViewSet(viewsets.ModelViewSet):
         return LeaveType.objects.filter(business=user.business)
 
 
+class LeaveAllocationViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = LeaveAllocation.objects.all()
+    serializer_class = LeaveAllocationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_fields = ['employee', 'leave_type', 'year', 'employee__department']
+    ordering_fields = ['year', 'balance_days']
+    
+    def get_queryset(self):
+        user = self.request.user
+        queryset = LeaveAllocation.objects.select_related('employee', 'leave_type')
+        if user.role == 'superadmin':
+            return queryset
+        return queryset.filter(employee__business=user.business)
+    
+    @action(detail=False, methods=['post'])
+    def allocate_year(self, request):
+        """Allocate a year's leave to all active employees, carrying forward balances"""
+        from .services.leave_service import LeaveLedgerService
+        
+        try:
+            year = int(request.data.get('year', timezone.now().year))
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid year'}, status=status.HTTP_400_BAD_REQUEST)
+        if not request.user.business:
+            return Response({'error': 'Business is required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        summary = LeaveLedgerService(request.user).allocate_year(
+            request.user.business, year, leave_type_ids=request.data.get('leave_types')
+        )
+        return Response(summary)
+    
+    @action(detail=False, methods=['get'])
+    def balances(self, request):
+        """Leave balances per department and leave type for a year"""
+        from .services.leave_service import department_balances
+        
+        try:
+            year = int(request.query_params.get('year', timezone.now().year))
+        except ValueError:
+            return Response({'error': 'Invalid year'}, status=status.HTTP_400_BAD_REQUEST)
+        allocations = self.get_queryset().filter(year=year)
+        if request.query_params.get('department'):
+            allocations = allocations.filter(employee__department_id=request.query_params.get('department'))
+        return Response({'year': year, 'balances': department_balances(allocations)})
+    
+    @action(detail=True, methods=['get'])
+    def ledger(self, request, pk=None):
+        """Ledger entries behind an allocation's balance"""
+        allocation = self.get_object()
+        return Response(LeaveLedgerEntrySerializer(allocation.ledger_entries.all(), many=True).data)
+
+
 class LeaveApplicationViewSet(viewsets.ModelViewSet):
     queryset = LeaveApplication.objects.all()
     serializer_class = LeaveApplicationSerializer
@@ -1004,11 +1005,42 @@ class LeaveApplicationViewSet(viewsets.ModelViewSet):
         return LeaveApplication.objects.filter(employee__business=user.business)
     
     def perform_create(self, serializer):
-        serializer.save(created_by=self.request.user)
+        from .services.approval_service import open_leave
+        
+        application = serializer.save(created_by=self.request.user)
+        if application.status == 'PENDING':
+            open_leave(application)
+    
+    def perform_update(self, serializer):
+        from .services.approval_service import close_resolved
+        
+        close_resolved('LEAVE', serializer.save(), self.request.user)
+    
+    @action(detail=True, methods=['post'])
+    def submit(self, request, pk=None):
+        """Submit a draft leave application for approval"""
+        from .services.approval_service import open_leave
+        
+        application = self.get_object()
+        if application.status != 'DRAFT':
+            return Response(
+                {'error': 'Only draft applications can be submitted'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        application.status = 'PENDING'
+        application.save()
+        open_leave(application)
+        
+        return Response(LeaveApplicationSerializer(application).data)
     
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
         """Approve leave application"""
+        from django.db import transaction
+        from .services.approval_service import close_requests
+        from .services.leave_service import LeaveLedgerService, LeaveBalanceError
+        
         application = self.get_object()
         if application.status != 'PENDING':
             return Response(
@@ -1016,32 +1048,46 @@ class LeaveApplicationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        application.status = 'APPROVED'
-        application.approved_by = request.user
-        application.approved_at = timezone.now()
-        application.save()
-        
-        # Update leave allocation
-        allocation = LeaveAllocation.objects.get(
-            employee=application.employee,
-            leave_type=application.leave_type,
-            year=application.from_date.year
-        )
-        allocation.used_days += application.number_of_days
-        allocation.balance_days -= application.number_of_days
-        allocation.save()
+        try:
+            with transaction.atomic():
+                # claim the application first so two approvers cannot both debit it
+                claimed = LeaveApplication.objects.filter(id=application.id, status='PENDING').update(
+                    status='APPROVED', approved_by=request.user, approved_at=timezone.now(), updated_at=timezone.now()
+                )
+                if not claimed:
+                    return Response(
+                        {'error': 'Only pending applications can be approved'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                LeaveLedgerService(request.user).apply_usage(application)
+                close_requests('LEAVE', application.id, 'APPROVED', request.user)
+        except LeaveBalanceError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
+        application.refresh_from_db()
         return Response(LeaveApplicationSerializer(application).data)
     
     @action(detail=True, methods=['post'])
     def reject(self, request, pk=None):
         """Reject leave application"""
+        from django.db import transaction
+        from .services.approval_service import close_requests
+        from .services.leave_service import LeaveLedgerService, LeaveBalanceError
+        
         application = self.get_object()
         reason = request.data.get('reason', '')
         
-        application.status = 'REJECTED'
-        application.rejection_reason = reason
-        application.save()
+        try:
+            with transaction.atomic():
+                # an approved application being rejected gives its days back
+                if LeaveApplication.objects.filter(id=application.id, status='APPROVED').update(status='REJECTED'):
+                    LeaveLedgerService(request.user).reverse_usage(application)
+                application.status = 'REJECTED'
+                application.rejection_reason = reason
+                application.save()
+                close_requests('LEAVE', application.id, 'REJECTED', request.user)
+        except LeaveBalanceError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
         return Response(LeaveApplicationSerializer(application).data)
 
@@ -1068,19 +1114,46 @@ class AttendanceRecordViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
     
+    def _attendance_importer(self, request):
+        from functools import partial
+        from .services.attendance_service import AttendanceImporter
+        
+        shift = {}
+        for field in ('shift_start', 'shift_end'):
+            if request.data.get(field):
+                shift[field] = AttendanceImporter.parse_time(str(request.data.get(field)), field)
+        return partial(AttendanceImporter, **shift)
+    
     @action(detail=False, methods=['post'])
     def bulk_create(self, request):
-        """Bulk create attendance records"""
+        """Bulk upsert attendance records on (employee, date)"""
         records = request.data.get('records', [])
-        created_records = []
+        if not isinstance(records, list):
+            return Response({'error': 'records must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+        business = request.user.business
+        if request.user.role == 'superadmin' and request.data.get('business'):
+            business = Business.objects.filter(id=request.data.get('business')).first()
+        if not business:
+            return Response({'error': 'Business is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            importer_class = self._attendance_importer(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        for record_data in records:
-            serializer = self.get_serializer(data=record_data)
-            if serializer.is_valid():
-                serializer.save(created_by=request.user)
-                created_records.append(serializer.data)
+        dry_run = str(request.data.get('dry_run', '')).lower() in ['true', '1', 'yes']
+        importer = importer_class(business, user=request.user, dry_run=dry_run)
+        return Response(importer.import_records(records))
+    
+    @action(detail=False, methods=['post'])
+    def import_clock_file(self, request):
+        """Import a CSV/XLSX attendance sheet or clock-device punch log"""
+        from .views import _run_bulk_import
         
-        return Response(created_records)
+        try:
+            importer_class = self._attendance_importer(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return _run_bulk_import(request, importer_class)
 
 
 class PerformanceReviewViewSet(viewsets.ModelViewSet):
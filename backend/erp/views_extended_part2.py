@@ -5,9 +5,10 @@ Document Management, Fiscalization, E-commerce, Payments, Workflows
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db.models import Q, Sum, Count
+from django.db.models import Q, F, Sum, Count
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.pagination import CursorPagination
 from django.utils import timezone
 
 from .models_extended_part2 import *
@@ -41,53 +42,138 @@ class DocumentViewSet(viewsets.ModelViewSet):
     ordering_fields = ['created_at', 'title']
     
     def get_queryset(self):
+        from .services.document_service import accessible_documents
+        
         user = self.request.user
         if user.role == 'superadmin':
             return Document.objects.all()
         
-        # Return documents that user has access to
-        queryset = Document.objects.filter(
-            Q(business=user.business) & 
-            (
-                Q(is_public=True) |
-                Q(allowed_users=user) |
-                Q(allowed_departments__users=user)
-            )
-        ).distinct()
-        return queryset
+        # Public documents plus those on the user's precomputed access list
+        return accessible_documents(user)
+    
+    def _blob_fields(self, serializer):
+        from rest_framework.exceptions import ValidationError
+        from .services.document_service import DocumentStoreError, blob_fields, source_blob
+        
+        upload_id = serializer.validated_data.pop('upload_id', None)
+        file = serializer.validated_data.pop('file', None)
+        if file is None and upload_id is None:
+            return {}
+        try:
+            blob = source_blob(self.request.user, file, upload_id)
+        except DocumentStoreError as e:
+            raise ValidationError({'error': str(e)})
+        return blob_fields(blob, serializer.validated_data.get('file_type'))
     
     def perform_create(self, serializer):
-        serializer.save(created_by=self.request.user, business=self.request.user.business)
+        serializer.save(
+            created_by=self.request.user, business=self.request.user.business, **self._blob_fields(serializer)
+        )
+    
+    def perform_update(self, serializer):
+        serializer.save(**self._blob_fields(serializer))
     
     @action(detail=True, methods=['post'])
     def create_version(self, request, pk=None):
-        """Create a new version of document"""
-        document = self.get_object()
+        """Create a new version of document from a file or a completed chunked upload"""
+        from .services.document_service import DocumentStoreError, create_version, source_blob
         
-        # Mark current as not latest
-        document.is_latest_version = False
-        document.save()
-        
-        # Create new version
-        new_version = Document.objects.create(
-            business=document.business,
-            document_number=document.document_number,
-            title=document.title,
-            description=request.data.get('description', document.description),
-            category=document.category,
-            file=request.FILES['file'],
-            file_size=request.FILES['file'].size,
-            file_type=request.FILES['file'].content_type,
-            version=request.data.get('version', '2.0'),
-            previous_version=document,
-            is_latest_version=True,
-            is_public=document.is_public,
-            created_by=request.user
-        )
+        document = self.get_object()
+        try:
+            blob = source_blob(request.user, request.FILES.get('file'), request.data.get('upload_id'))
+            new_version = create_version(
+                document, blob, request.user,
+                description=request.data.get('description'),
+                version=request.data.get('version'),
+                file_type=request.data.get('file_type', ''),
+            )
+        except DocumentStoreError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
         return Response(DocumentSerializer(new_version).data)
 
 
+class DocumentUploadViewSet(viewsets.ModelViewSet):
+    """Resumable chunked uploads: start, send chunks at the received offset, then complete"""
+    queryset = DocumentUpload.objects.all()
+    serializer_class = DocumentUploadSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    lookup_field = 'upload_id'
+    http_method_names = ['get', 'post', 'head', 'options']
+    
+    def get_queryset(self):
+        user = self.request.user
+        if user.role == 'superadmin':
+            return DocumentUpload.objects.all()
+        return DocumentUpload.objects.filter(created_by=user)
+    
+    def perform_create(self, serializer):
+        from django.db import transaction
+        from rest_framework.exceptions import ValidationError
+        from .services.document_service import DocumentStoreError, prepare_upload
+        
+        try:
+            with transaction.atomic():
+                prepare_upload(serializer.save(created_by=self.request.user, business=self.request.user.business))
+        except DocumentStoreError as e:
+            raise ValidationError({'error': str(e)})
+    
+    @action(detail=True, methods=['post'])
+    def chunk(self, request, upload_id=None):
+        """Append a chunk sent as multipart 'chunk' at byte 'offset'"""
+        from .services.document_service import DocumentStoreError, append_chunk
+        
+        upload = self.get_object()
+        chunk = request.FILES.get('chunk')
+        try:
+            offset = int(request.data.get('offset', -1))
+        except (TypeError, ValueError):
+            offset = -1
+        if chunk is None or offset < 0:
+            return Response(
+                {'error': 'chunk and offset are required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            upload = append_chunk(upload, offset, chunk)
+        except DocumentStoreError as e:
+            upload.refresh_from_db()
+            return Response(
+                {'error': str(e), 'received_size': upload.received_size},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response(self.get_serializer(upload).data)
+    
+    @action(detail=True, methods=['post'])
+    def complete(self, request, upload_id=None):
+        """Assemble the upload into a content-addressed blob"""
+        from .services.document_service import DocumentStoreError, complete_upload
+        
+        upload = self.get_object()
+        try:
+            complete_upload(upload)
+        except DocumentStoreError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        upload.refresh_from_db()
+        return Response(self.get_serializer(upload).data)
+    
+    @action(detail=True, methods=['post'])
+    def abort(self, request, upload_id=None):
+        """Abandon an upload and discard the received bytes"""
+        from .services.document_service import abort_upload
+        
+        upload = self.get_object()
+        if upload.status != 'UPLOADING':
+            return Response(
+                {'error': 'Only uploads in progress can be aborted'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response(self.get_serializer(abort_upload(upload)).data)
+
+
 class DocumentTemplateViewSet(viewsets.ModelViewSet):
     queryset = DocumentTemplate.objects.all()
     serializer_class = DocumentTemplateSerializer
@@ -219,6 +305,44 @@ class CostCenterViewSet(viewsets.ModelViewSet):
         if user.role == 'superadmin':
             return CostCenter.objects.all()
         return CostCenter.objects.filter(business=user.business)
+    
+    def _report_params(self, request):
+        from datetime import datetime
+        
+        business_id = request.user.business_id
+        if request.user.role == 'superadmin' and request.query_params.get('business'):
+            business_id = request.query_params['business']
+        dates = {}
+        for name in ('start_date', 'end_date'):
+            value = request.query_params.get(name)
+            dates[name] = datetime.strptime(value, '%Y-%m-%d').date() if value else None
+        return business_id, dates
+    
+    @action(detail=False, methods=['get'])
+    def profit_and_loss(self, request):
+        """Departmental P&L per cost center from the monthly ledger summary"""
+        from .services.ledger_service import cost_center_profit_and_loss
+        
+        try:
+            business_id, dates = self._report_params(request)
+        except ValueError:
+            return Response({'error': 'Dates must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(cost_center_profit_and_loss(business_id, **dates))
+    
+    @action(detail=False, methods=['get'])
+    def cost_allocation(self, request):
+        """Allocate expenses posted without a cost center across cost centers"""
+        from .services.ledger_service import allocate_shared_costs, LedgerError
+        
+        try:
+            business_id, dates = self._report_params(request)
+        except ValueError:
+            return Response({'error': 'Dates must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            report = allocate_shared_costs(business_id, basis=request.query_params.get('basis', 'expenses'), **dates)
+        except LedgerError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report)
 
 
 class BudgetPeriodViewSet(viewsets.ModelViewSet):
@@ -238,6 +362,14 @@ class BudgetPeriodViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user, business=self.request.user.business)
+    
+    @action(detail=True, methods=['post'])
+    def recompute_actuals(self, request, pk=None):
+        """Recompute stored actuals and variances for every budget in the period"""
+        from .services.budget_service import recompute_period
+        
+        period = self.get_object()
+        return Response(recompute_period(period))
 
 
 class BudgetViewSet(viewsets.ModelViewSet):
@@ -251,16 +383,42 @@ class BudgetViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         user = self.request.user
+        queryset = Budget.objects.select_related('period')
         if user.role == 'superadmin':
-            return Budget.objects.all()
-        return Budget.objects.filter(business=user.business)
+            return queryset
+        return queryset.filter(business=user.business)
     
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user, business=self.request.user.business)
     
+    def perform_update(self, serializer):
+        from .services.approval_service import close_resolved
+        
+        close_resolved('BUDGET', serializer.save(), self.request.user)
+    
+    @action(detail=True, methods=['post'])
+    def submit(self, request, pk=None):
+        """Submit a draft budget for approval"""
+        from .services.approval_service import open_budget
+        
+        budget = self.get_object()
+        if budget.status != 'DRAFT':
+            return Response(
+                {'error': 'Only draft budgets can be submitted'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        budget.status = 'SUBMITTED'
+        budget.save()
+        open_budget(budget, request.user.id)
+        
+        return Response(BudgetSerializer(budget).data)
+    
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
         """Approve budget"""
+        from .services.approval_service import close_requests
+        
         budget = self.get_object()
         if budget.status != 'SUBMITTED':
             return Response(
@@ -272,23 +430,36 @@ class BudgetViewSet(viewsets.ModelViewSet):
         budget.approved_by = request.user
         budget.approved_at = timezone.now()
         budget.save()
+        close_requests('BUDGET', budget.id, 'APPROVED', request.user)
+        
+        return Response(BudgetSerializer(budget).data)
+    
+    @action(detail=True, methods=['post'])
+    def reject(self, request, pk=None):
+        """Send a submitted budget back as rejected"""
+        from .services.approval_service import close_requests
+        
+        budget = self.get_object()
+        if budget.status != 'SUBMITTED':
+            return Response(
+                {'error': 'Only submitted budgets can be rejected'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        budget.status = 'REJECTED'
+        budget.save()
+        close_requests('BUDGET', budget.id, 'REJECTED', request.user)
         
         return Response(BudgetSerializer(budget).data)
     
     @action(detail=True, methods=['get'])
     def variance_analysis(self, request, pk=None):
-        """Get budget variance analysis"""
-        budget = self.get_object()
-        lines = budget.lines.all()
+        """Get budget variance analysis against posted ledger actuals"""
+        from .services.budget_service import variance_report
         
-        return Response({
-            'budget_number': budget.budget_number,
-            'total_budgeted': budget.total_budget_amount,
-            'total_actual': budget.total_actual_amount,
-            'total_variance': budget.variance_amount,
-            'variance_percent': budget.variance_percent,
-            'lines': BudgetLineSerializer(lines, many=True).data
-        })
+        budget = self.get_object()
+        monthly = request.query_params.get('monthly', '').lower() in ['true', '1', 'yes']
+        return Response(variance_report(budget, monthly=monthly))
 
 
 # ==================== E-COMMERCE VIEWSETS ====================
@@ -328,11 +499,102 @@ class WebsiteProductViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['post'])
     def increment_views(self, request, pk=None):
-        """Increment product views"""
+        """Record a product view in the buffered view counter"""
+        from .services.counter_service import counters
+        
         product = self.get_object()
-        product.views_count += 1
-        product.save()
-        return Response({'views_count': product.views_count})
+        views = counters['website_product.views']
+        views.increment(product.id)
+        return Response({'views_count': views.live_count(product)})
+    
+    @action(detail=False, methods=['get'])
+    def live_counts(self, request):
+        """Approximate view and order counts including increments not flushed yet"""
+        from .services.counter_service import counters
+        
+        products = list(self.filter_queryset(self.get_queryset()).values('id', 'views_count', 'orders_count')[:500])
+        ids = [p['id'] for p in products]
+        views = counters['website_product.views'].pending_many(ids)
+        orders = counters['website_product.orders'].pending_many(ids)
+        return Response([
+            {
+                'id': p['id'],
+                'views_count': p['views_count'] + views.get(p['id'], 0),
+                'orders_count': p['orders_count'] + orders.get(p['id'], 0),
+            }
+            for p in products
+        ])
+
+
+class StorefrontViewSet(viewsets.ViewSet):
+    """
+    Public, cacheable catalog for published websites.
+    Pages and product details come from the storefront cache and carry
+    ETag / Last-Modified validators, so browsers and edge caches can
+    revalidate with a 304 instead of downloading the page again.
+    """
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+    
+    MAX_AGE = 60
+    
+    def _cached_response(self, request, website_id, etag_parts, load):
+        from django.utils.http import http_date, parse_http_date_safe
+        from .services.storefront_service import storefront_catalog
+        
+        data = load()
+        if data is None:
+            return Response({'error': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+        last_modified = int(data['last_modified'].timestamp())
+        # the build time is part of the ETag, so a worker whose cache lags cannot confirm a stale copy
+        etag = storefront_catalog.etag(website_id, *etag_parts, last_modified)
+        if_none_match = request.headers.get('If-None-Match')
+        since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        if if_none_match:
+            not_modified = if_none_match == etag
+        else:
+            not_modified = since is not None and last_modified <= since
+        if not_modified:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = f'public, max-age={self.MAX_AGE}, stale-while-revalidate={self.MAX_AGE * 5}'
+        return response
+    
+    @action(detail=True, methods=['get'])
+    def catalog(self, request, pk=None):
+        """Published listings of a website, one page at a time"""
+        from .services.storefront_service import storefront_catalog
+        
+        try:
+            website_id = int(pk)
+            page = int(request.query_params.get('page', 1))
+            page_size = int(request.query_params.get('page_size', storefront_catalog.DEFAULT_PAGE_SIZE))
+        except ValueError:
+            return Response({'error': 'website, page and page_size must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        featured = request.query_params.get('featured', '').lower() in ['true', '1', 'yes']
+        return self._cached_response(
+            request, website_id, (int(featured), page_size, page),
+            lambda: storefront_catalog.listing_page(website_id, page, page_size, featured)
+        )
+    
+    @action(detail=True, methods=['get'], url_path=r'products/(?P<slug>[-\w]+)')
+    def product(self, request, pk=None, slug=None):
+        """A published listing with its images; counts a buffered view"""
+        from .services.storefront_service import storefront_catalog, view_counter
+        
+        try:
+            website_id = int(pk)
+        except ValueError:
+            return Response({'error': 'website must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        response = self._cached_response(
+            request, website_id, (slug,), lambda: storefront_catalog.product_detail(website_id, slug)
+        )
+        if response.status_code == status.HTTP_200_OK:
+            view_counter.increment(response.data['id'])
+        return response
 
 
 class ProductReviewViewSet(viewsets.ModelViewSet):
@@ -347,16 +609,16 @@ class ProductReviewViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def mark_helpful(self, request, pk=None):
         """Mark review as helpful"""
+        from .services.counter_service import counters
+        
         review = self.get_object()
         is_helpful = request.data.get('is_helpful', True)
         
-        if is_helpful:
-            review.helpful_count += 1
-        else:
-            review.not_helpful_count += 1
-        review.save()
-        
-        return Response(ProductReviewSerializer(review).data)
+        counters['review.helpful' if is_helpful else 'review.not_helpful'].increment(review.id)
+        data = ProductReviewSerializer(review).data
+        data['helpful_count'] = counters['review.helpful'].live_count(review)
+        data['not_helpful_count'] = counters['review.not_helpful'].live_count(review)
+        return Response(data)
 
 
 class OnlineOrderViewSet(viewsets.ModelViewSet):
@@ -376,7 +638,11 @@ class OnlineOrderViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['post'])
     def process_payment(self, request, pk=None):
-        """Process order payment"""
+        """Process order payment, converting its stock holds into stock movements"""
+        from django.db import transaction
+        from .services.counter_service import counters
+        from .services.reservation_service import ReservationService, ReservationError
+        
         order = self.get_object()
         
         if order.payment_status == 'COMPLETED':
@@ -385,13 +651,76 @@ class OnlineOrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # TODO: Implement actual payment processing
-        order.payment_status = 'COMPLETED'
-        order.paid_at = timezone.now()
-        order.status = 'PROCESSING'
-        order.save()
+        service = ReservationService(request.user)
+        try:
+            with transaction.atomic():
+                service.reserve_order(order)
+                service.convert_order(order)
+                # TODO: Implement actual payment processing
+                order.payment_status = 'COMPLETED'
+                order.paid_at = timezone.now()
+                order.status = 'PROCESSING'
+                order.save()
+        except ReservationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        orders = counters['website_product.orders']
+        for website_product_id in set(order.items.values_list('website_product_id', flat=True)):
+            orders.increment(website_product_id)
         
         return Response(OnlineOrderSerializer(order).data)
+    
+    @action(detail=True, methods=['post'])
+    def reserve_stock(self, request, pk=None):
+        """Hold stock for the order's items, taking over the holds of a cart"""
+        from .services.reservation_service import ReservationService, ReservationError
+        
+        order = self.get_object()
+        if order.status != 'PENDING':
+            return Response({'error': 'Only pending orders can reserve stock'}, status=status.HTTP_400_BAD_REQUEST)
+        cart = None
+        if request.data.get('cart'):
+            cart = ShoppingCart.objects.filter(id=request.data['cart'], website=order.website).first()
+            if cart is None:
+                return Response({'error': 'Cart not found'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            holds = ReservationService(request.user).reserve_order(order, cart=cart)
+        except ReservationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(StockReservationSerializer(holds.select_related('website_product', 'stock_record'), many=True).data)
+    
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """Cancel an unpaid order, release its stock holds and give back its promo code use"""
+        from django.db import transaction
+        from .services.reservation_service import ReservationService
+        from .services.promo_service import release_for_order
+        
+        order = self.get_object()
+        if order.payment_status == 'COMPLETED':
+            return Response({'error': 'Paid orders cannot be cancelled'}, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            released = ReservationService(request.user).release(order.reservations.all())
+            release_for_order(order)
+            order.status = 'CANCELLED'
+            order.save()
+        return Response({'status': order.status, 'released_holds': released})
+
+    @action(detail=False, methods=['post'])
+    def fulfil(self, request):
+        """Create sales orders, delivery notes and stock movements for the business's paid orders"""
+        from .services.fulfilment_service import OnlineOrderFulfilment
+
+        if request.user.business is None:
+            return Response({'error': 'No business associated with user'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.data['limit']) if request.data.get('limit') else None
+        except (TypeError, ValueError):
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        summary = OnlineOrderFulfilment(request.user.business, request.user).run(
+            dry_run=bool(request.data.get('dry_run')), limit=limit
+        )
+        return Response(summary)
 
 
 class ShoppingCartViewSet(viewsets.ModelViewSet):
@@ -403,10 +732,17 @@ class ShoppingCartViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['post'])
     def add_item(self, request, pk=None):
-        """Add item to cart"""
+        """Add item to cart, holding its stock for the cart's TTL"""
+        from decimal import Decimal, InvalidOperation
+        from django.db import transaction
+        from .services.reservation_service import ReservationService, ReservationError
+        
         cart = self.get_object()
         product_id = request.data.get('product_id')
-        quantity = request.data.get('quantity', 1)
+        try:
+            quantity = Decimal(str(request.data.get('quantity', 1)))
+        except InvalidOperation:
+            return Response({'error': 'quantity must be a number'}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
             website_product = WebsiteProduct.objects.get(id=product_id)
@@ -416,32 +752,42 @@ class ShoppingCartViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        cart_item, created = ShoppingCartItem.objects.get_or_create(
-            cart=cart,
-            website_product=website_product,
-            defaults={'quantity': quantity}
-        )
-        
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+        try:
+            with transaction.atomic():
+                ReservationService().hold_cart_item(cart, website_product, quantity)
+                cart_item, created = ShoppingCartItem.objects.get_or_create(
+                    cart=cart,
+                    website_product=website_product,
+                    defaults={'quantity': quantity}
+                )
+                if not created:
+                    ShoppingCartItem.objects.filter(id=cart_item.id).update(
+                        quantity=F('quantity') + quantity, updated_at=timezone.now()
+                    )
+        except ReservationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
         return Response(ShoppingCartSerializer(cart).data)
     
     @action(detail=True, methods=['post'])
     def remove_item(self, request, pk=None):
-        """Remove item from cart"""
+        """Remove item from cart and return its held stock"""
+        from django.db import transaction
+        from .services.reservation_service import ReservationService
+        
         cart = self.get_object()
         item_id = request.data.get('item_id')
         
         try:
             item = ShoppingCartItem.objects.get(id=item_id, cart=cart)
-            item.delete()
         except ShoppingCartItem.DoesNotExist:
             return Response(
                 {'error': 'Item not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
+        with transaction.atomic():
+            item.delete()
+            ReservationService().release(cart.reservations.filter(website_product_id=item.website_product_id))
         
         return Response(ShoppingCartSerializer(cart).data)
 
@@ -463,56 +809,97 @@ class PromoCodeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
     
+    def _website_id(self, request, code=None):
+        """Website a promo request applies to, scoped to the user's business"""
+        websites = Website.objects.all()
+        if request.user.role != 'superadmin':
+            websites = websites.filter(business=request.user.business)
+        website_id = request.data.get('website')
+        if website_id:
+            return websites.filter(id=website_id).values_list('id', flat=True).first()
+        if code:
+            # older clients send only the code; find the website it belongs to
+            return PromoCode.objects.filter(code=code, website__in=websites).values_list('website_id', flat=True).first()
+        return None
+    
     @action(detail=False, methods=['post'])
     def validate_code(self, request):
-        """Validate a promo code"""
-        code = request.data.get('code')
-        order_amount = request.data.get('order_amount', 0)
+        """Validate a promo code against the website's in-memory code index"""
+        from .services.promo_service import promo_index, PromoError
         
-        try:
-            promo = PromoCode.objects.get(code=code, is_active=True)
-        except PromoCode.DoesNotExist:
+        code = request.data.get('code')
+        website_id = self._website_id(request, code)
+        if website_id is None:
             return Response(
                 {'valid': False, 'error': 'Invalid promo code'},
                 status=status.HTTP_404_NOT_FOUND
             )
-        
-        # Check validity period
-        now = timezone.now()
-        if now < promo.valid_from or now > promo.valid_until:
-            return Response(
-                {'valid': False, 'error': 'Promo code has expired'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Check minimum order amount
-        if order_amount < promo.min_order_amount:
+        try:
+            result = promo_index.evaluate(website_id, code, request.data.get('order_amount', 0))
+        except PromoError as e:
+            return Response({'valid': False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not result['valid']:
+            not_found = result['error'] == 'Invalid promo code'
             return Response(
-                {'valid': False, 'error': f'Minimum order amount is {promo.min_order_amount}'},
-                status=status.HTTP_400_BAD_REQUEST
+                result,
+                status=status.HTTP_404_NOT_FOUND if not_found else status.HTTP_400_BAD_REQUEST
             )
+        return Response(result)
+    
+    @action(detail=False, methods=['post'])
+    def validate_codes(self, request):
+        """Evaluate several codes against an order amount or a cart at once"""
+        from .services.promo_service import promo_index, PromoError
+        from .services.storefront_service import storefront_catalog
         
-        # Check usage limit
-        if promo.usage_limit and promo.current_usage >= promo.usage_limit:
-            return Response(
-                {'valid': False, 'error': 'Promo code usage limit reached'},
-                status=status.HTTP_400_BAD_REQUEST
+        website_id = self._website_id(request)
+        if website_id is None:
+            return Response({'error': 'website is required'}, status=status.HTTP_400_BAD_REQUEST)
+        codes = request.data.get('codes') or []
+        if not isinstance(codes, list):
+            return Response({'error': 'codes must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+        order_amount = request.data.get('order_amount', 0)
+        if request.data.get('cart'):
+            items = ShoppingCartItem.objects.filter(
+                cart_id=request.data['cart'], cart__website_id=website_id
+            ).values_list('quantity', 'website_product__online_price', 'website_product__product__unit_price', 'website_product__discount_percent')
+            order_amount = sum(
+                (quantity * storefront_catalog.effective_price(online, unit, discount) for quantity, online, unit, discount in items),
+                0
             )
+        try:
+            return Response(promo_index.evaluate_many(website_id, codes, order_amount))
+        except PromoError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    @action(detail=False, methods=['post'])
+    def redeem(self, request):
+        """
+        Consume one use of a promo code; fails once its usage limit is reached.
+        With `order`, the discount is applied to that pending order and the use
+        is given back if the order is cancelled.
+        """
+        from .services.promo_service import redeem, redeem_for_order, PromoError
         
-        # Calculate discount
-        if promo.discount_type == 'PERCENTAGE':
-            discount = (order_amount * promo.discount_value) / 100
-            if promo.max_discount_amount:
-                discount = min(discount, promo.max_discount_amount)
-        else:
-            discount = promo.discount_value
-        
-        return Response({
-            'valid': True,
-            'discount_amount': discount,
-            'discount_type': promo.discount_type,
-            'discount_value': promo.discount_value
-        })
+        code = request.data.get('code')
+        if request.data.get('order'):
+            orders = OnlineOrder.objects.all()
+            if request.user.role != 'superadmin':
+                orders = orders.filter(website__business=request.user.business)
+            order = orders.filter(id=request.data['order']).first()
+            if order is None:
+                return Response({'valid': False, 'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
+            try:
+                return Response(redeem_for_order(order, code))
+            except PromoError as e:
+                return Response({'valid': False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        website_id = self._website_id(request, code)
+        if website_id is None:
+            return Response({'valid': False, 'error': 'Invalid promo code'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            return Response(redeem(website_id, code, request.data.get('order_amount', 0)))
+        except PromoError as e:
+            return Response({'valid': False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
 # ==================== WORKFLOW VIEWSETS ====================
@@ -560,6 +947,8 @@ class WorkflowStepExecutionViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
         """Approve workflow step"""
+        from .services.approval_service import close_requests
+        
         execution = self.get_object()
         
         if execution.status != 'PENDING':
@@ -573,6 +962,7 @@ class WorkflowStepExecutionViewSet(viewsets.ModelViewSet):
         execution.action_comments = request.data.get('comments', '')
         execution.completed_at = timezone.now()
         execution.save()
+        close_requests('WORKFLOW', execution.id, 'APPROVED', request.user)
         
         # Move workflow to next step
         # TODO: Implement workflow progression logic
@@ -582,6 +972,8 @@ class WorkflowStepExecutionViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def reject(self, request, pk=None):
         """Reject workflow step"""
+        from .services.approval_service import reject_workflow_step
+        
         execution = self.get_object()
         
         execution.status = 'REJECTED'
@@ -589,6 +981,7 @@ class WorkflowStepExecutionViewSet(viewsets.ModelViewSet):
         execution.action_comments = request.data.get('comments', '')
         execution.completed_at = timezone.now()
         execution.save()
+        reject_workflow_step(execution, request.user)
         
         # Update workflow instance
         execution.instance.status = 'REJECTED'
@@ -598,6 +991,36 @@ class WorkflowStepExecutionViewSet(viewsets.ModelViewSet):
         return Response(WorkflowStepExecutionSerializer(execution).data)
 
 
+class ApprovalInboxPagination(CursorPagination):
+    page_size = 25
+    ordering = '-created_at'
+
+
+class ApprovalInboxViewSet(viewsets.ReadOnlyModelViewSet):
+    """Everything waiting on the current user's approval, across modules"""
+    serializer_class = ApprovalRequestSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ApprovalInboxPagination
+    
+    def get_queryset(self):
+        # served by the (assignee, status, created_at) index, without joining the source tables
+        queryset = ApprovalRequest.objects.filter(
+            assignee=self.request.user,
+            status=self.request.query_params.get('status', 'PENDING'),
+        )
+        source_type = self.request.query_params.get('source_type')
+        if source_type:
+            queryset = queryset.filter(source_type=source_type)
+        return queryset
+    
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """Pending approvals per module for the landing page badges"""
+        counts = dict(ApprovalRequest.objects.filter(assignee=request.user, status='PENDING').values(
+            'source_type'
+        ).annotate(total=Count('id')).values_list('source_type', 'total'))
+        return Response({'total': sum(counts.values()), 'by_source': counts})
+
 # ==================== PAYMENT VIEWSETS ====================
 
 class PaymentGatewayViewSet(viewsets.ModelViewSet):
@@ -686,24 +1109,81 @@ class NotificationViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         user = self.request.user
         # Users can only see their own notifications
-        return Notification.objects.filter(recipient=user)
-    
+        return Notification.objects.filter(recipient=user).select_related('recipient', 'template')
+
+    def list(self, request, *args, **kwargs):
+        from .services.notification_service import unread_counter
+
+        response = super().list(request, *args, **kwargs)
+        if isinstance(response.data, dict):
+            response.data['unread_count'] = unread_counter.count(request.user.id)
+        return response
+
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
         """Mark notification as read"""
+        from .services.notification_service import UNREAD_STATUSES, removed_on_commit
+
         notification = self.get_object()
-        notification.status = 'READ'
-        notification.read_at = timezone.now()
-        notification.save()
+        # a conditional update keeps the unread counter exact when the same notification is read twice
+        if Notification.objects.filter(id=notification.id, status__in=UNREAD_STATUSES).update(
+            status='READ', read_at=timezone.now()
+        ):
+            removed_on_commit(request.user.id)
+            notification.refresh_from_db()
         return Response(NotificationSerializer(notification).data)
-    
+
     @action(detail=False, methods=['post'])
     def mark_all_read(self, request):
         """Mark all notifications as read"""
-        Notification.objects.filter(
+        from .services.notification_service import UNREAD_STATUSES, removed_on_commit
+
+        updated = Notification.objects.filter(
             recipient=request.user,
-            status__in=['PENDING', 'SENT']
+            status__in=UNREAD_STATUSES
         ).update(status='READ', read_at=timezone.now())
-        
-        return Response({'status': 'success'})
+        removed_on_commit(request.user.id, updated)
+
+        return Response({'status': 'success', 'marked_read': updated})
+
+    @action(detail=False, methods=['get'], url_path='unread-count')
+    def unread_count(self, request):
+        """Unread notification count for badges, answered from the cache"""
+        from .services.notification_service import unread_counter
+
+        return Response({'unread_count': unread_counter.count(request.user.id)})
+
+    @action(detail=False, methods=['get'])
+    def poll(self, request):
+        """
+        Poll for notifications newer than `after`, waiting up to `timeout`
+        seconds, capped by settings.NOTIFICATION_POLL_MAX_WAIT (0 answers at once)
+        """
+        import math
+        from django.conf import settings
+        from .services.notification_service import unread_counter
+
+        max_wait = getattr(settings, 'NOTIFICATION_POLL_MAX_WAIT', 0)
+        try:
+            after = int(request.query_params.get('after', 0))
+            timeout = float(request.query_params.get('timeout', max_wait))
+            if not math.isfinite(timeout):
+                raise ValueError(timeout)
+        except ValueError:
+            return Response({'error': 'after and timeout must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+        timeout = min(max(timeout, 0), max_wait)
+
+        latest = unread_counter.wait_for(request.user.id, after, timeout)
+        results = []
+        if latest > after:
+            results = NotificationSerializer(
+                self.get_queryset().filter(id__gt=after).order_by('id')[:50], many=True
+            ).data
+            # the client passes this back as `after`, so a long backlog is paged through
+            latest = results[-1]['id'] if results else latest
+        return Response({
+            'latest': latest,
+            'unread_count': unread_counter.count(request.user.id),
+            'results': results,
+        })
 